@@ -18,12 +18,40 @@ from calendar import monthrange
 
 st.set_page_config(page_title="Simulador de Tarifários Eletricidade 2026: Poupe na Fatura | Tiago Felícia", page_icon="🔌", layout="wide",initial_sidebar_state="collapsed")
 
-# --- Carregar ficheiro Excel do Hugging Face ---
+# --- Carregar dados (snapshot CSV local em data/csv, com o Excel do Hugging Face como alternativa) ---
 
 url_excel = "https://huggingface.co/spaces/tiagofelicia/simulador-tarifarios-eletricidade/resolve/main/Tarifarios_%F0%9F%94%8C_Eletricidade_Tiago_Felicia.xlsx"
 
 
-tarifarios_fixos, tarifarios_indexados, OMIE_PERDAS_CICLOS, CONSTANTES = proc_dados.carregar_dados_excel_elec(url_excel)
+# Conjunto partilhado por todo o processo (só de leitura); as variáveis abaixo são vistas sem cópia dos dados.
+# O atualizador renova os dados em segundo plano e serve sempre o último snapshot válido.
+atualizador_dados_elec = proc_dados.obter_atualizador_elec(url_excel)
+dados_elec = atualizador_dados_elec.obter()
+# A carga pode ter corrido na thread do atualizador, sem contexto do script: os avisos são mostrados aqui
+for nivel_aviso_dados, mensagem_aviso_dados in atualizador_dados_elec.avisos:
+    getattr(st, nivel_aviso_dados)(mensagem_aviso_dados)
+if dados_elec is None:
+    # Primeira carga do processo falhou: não há versão anterior a que recorrer
+    st.error(f"Não foi possível carregar os dados dos tarifários ({atualizador_dados_elec.ultimo_erro}). Tente novamente dentro de alguns minutos.")
+    st.stop()
+if atualizador_dados_elec.ultimo_erro:
+    st.warning(f"Não foi possível atualizar os dados ({atualizador_dados_elec.ultimo_erro}). A usar a versão anterior.")
+tarifarios_fixos, tarifarios_indexados, OMIE_PERDAS_CICLOS, CONSTANTES = dados_elec.vistas()
+# Somas acumuladas de OMIE/Perdas por ciclo (construídas uma vez por versão dos dados): médias de qualquer período sem filtrar a tabela
+INDICE_MERCADO = dados_elec.indice_mercado
+# Constantes já convertidas para pesquisa direta (uma vez por versão): é o que se passa ao motor de cálculo
+INDICE_CONSTANTES = dados_elec.indice_constantes
+# Resultados intermédios da simulação guardados na sessão: entre reruns só se recalculam os nós cujas entradas mudaram (ver calc.GrafoCalculo)
+GRAFO_CALCULO = st.session_state.setdefault('grafo_calculo', calc.GrafoCalculo())
+GRAFO_CALCULO.fixar_versao(dados_elec.versao)
+
+# O motor de cálculo (calculos.py) não usa o Streamlit: os seus erros/avisos (calc.Aviso) são mostrados aqui, onde surgem
+def mostrar_aviso_calculo(aviso):
+    (st.error if aviso.nivel == 'erro' else st.warning)(aviso.mensagem)
+    if aviso.detalhe:
+        st.text(aviso.detalhe)
+
+calc.definir_destino_avisos(mostrar_aviso_calculo)
 
 potencias_validas = [1.15, 2.3, 3.45, 4.6, 5.75, 6.9, 10.35, 13.8, 17.25, 20.7, 27.6, 34.5, 41.4]
 opcoes_horarias_existentes = list(tarifarios_fixos['opcao_horaria_e_ciclo'].dropna().unique())
@@ -487,6 +515,40 @@ def criar_tabela_analise_completa_html(consumos_agregados, omie_agregados):
     html += "</tbody></table>"
     return html
 
+def criar_tabela_otimizador_potencia_html(resumo_potencias, potencia_atual, potencia_recomendada):
+    """
+    Tabela HTML do otimizador de potência: uma linha por potência, com a potência atual e a recomendada destacadas.
+    """
+    is_dark_theme = st.get_option('theme.base') == 'dark'
+    border_color = '#3E414B' if is_dark_theme else '#999'
+    cor_atual = '#3E4C6D' if is_dark_theme else '#D9E1F2'
+    cor_recomendada = '#384E30' if is_dark_theme else '#C6E0B4'
+    cor_excede = '#FF6B6B' if is_dark_theme else '#C00000'
+
+    html = "<style>"
+    html += ".otimizador-table { width: 100%; border-collapse: collapse; margin: 10px 0 20px 0; font-size: 13px; font-family: sans-serif; text-align: center; }"
+    html += f".otimizador-table th, .otimizador-table td {{ padding: 6px 8px; border: 1px solid {border_color}; }}"
+    html += ".otimizador-table thead th { font-weight: bold; }"
+    html += f".otimizador-table .atual {{ background-color: {cor_atual}; }}"
+    html += f".otimizador-table .recomendada {{ background-color: {cor_recomendada}; font-weight: bold; }}"
+    html += f".otimizador-table .excede {{ color: {cor_excede}; }}"
+    html += "</style>"
+
+    html += "<table class='otimizador-table'><thead><tr>"
+    html += "<th>Potência (kVA)</th><th>Quartos de hora acima da potência</th><th>Tarifários avaliados</th><th>Custo mínimo (€)</th><th>Tarifário mais barato</th>"
+    html += "</tr></thead><tbody>"
+    for linha in resumo_potencias.itertuples(index=False):
+        pot, excedencias, n_tarifarios, custo, nome, comercializador = linha
+        classe = "recomendada" if pot == potencia_recomendada else ("atual" if pot == potencia_atual else "")
+        sufixo = " (atual)" if pot == potencia_atual else ""
+        custo_str = f"{custo:.2f}" if pd.notna(custo) else "-"
+        nome_str = f"{nome} ({comercializador})" if pd.notna(nome) else "-"
+        html += f"<tr class='{classe}'><td>{pot:g}{sufixo}</td>"
+        html += f"<td class='{'excede' if excedencias > 0 else ''}'>{excedencias}</td>"
+        html += f"<td>{n_tarifarios}</td><td>{custo_str}</td><td>{nome_str}</td></tr>"
+    html += "</tbody></table>"
+    return html
+
 # --- Função para REINICIAR o simulador para os valores padrão ---
 def reiniciar_simulador():
     """
@@ -512,6 +574,7 @@ def reiniciar_simulador():
         # Chaves de OMIE manual e estado de edição
         'omie_s_input_field', 'omie_v_input_field', 'omie_f_input_field', 
         'omie_c_input_field', 'omie_p_input_field', 'omie_foi_editado_manualmente',
+        'omie_sensibilidade_delta',
         'last_omie_dependency_key_for_inputs',
 
         # Chaves do "Meu Tarifário"
@@ -562,10 +625,10 @@ def reiniciar_simulador():
 
 
 # --- Obter valor constante do Financiamento TSE ---
-FINANCIAMENTO_TSE_VAL = calc.obter_constante("Financiamento_TSE", CONSTANTES)
+FINANCIAMENTO_TSE_VAL = calc.obter_constante("Financiamento_TSE", INDICE_CONSTANTES)
 
 # --- Obter valor constante da Quota ACP ---
-VALOR_QUOTA_ACP_MENSAL = calc.obter_constante("Quota_ACP", CONSTANTES)
+VALOR_QUOTA_ACP_MENSAL = calc.obter_constante("Quota_ACP", INDICE_CONSTANTES)
 
 def preparar_dados_para_graficos(df_consumos_filtrado, df_omie_filtrado, opcao_horaria_selecionada, dias_periodo):
     """
@@ -631,7 +694,7 @@ def preparar_dados_para_graficos(df_consumos_filtrado, df_omie_filtrado, opcao_h
         ]
         series_horario.append({"name": "Consumo por hora (kWh)", "type": "column", "data": data_points_horario, "yAxis": 0, "color": "#BFBFBF"})
     else:
-        agg_total_horario_periodo = df_horario.groupby(['HoraParaAgrupar', ciclo_a_usar])['Consumo (kWh)'].sum().unstack(fill_value=0)
+        agg_total_horario_periodo = df_horario.groupby(['HoraParaAgrupar', ciclo_a_usar], observed=True)['Consumo (kWh)'].sum().unstack(fill_value=0)
         agg_media_horario_periodo = agg_total_horario_periodo / num_dias
         
         for p in reversed(periodos_ciclo):
@@ -663,7 +726,7 @@ def preparar_dados_para_graficos(df_consumos_filtrado, df_omie_filtrado, opcao_h
     })
     
     if ciclo_a_usar:
-        agg_omie_horario_periodos = df_horario.groupby(['HoraParaAgrupar', ciclo_a_usar])['OMIE'].mean().unstack()
+        agg_omie_horario_periodos = df_horario.groupby(['HoraParaAgrupar', ciclo_a_usar], observed=True)['OMIE'].mean().unstack()
         for p in periodos_ciclo:
             if p in agg_omie_horario_periodos.columns:
                 dados_omie_p = agg_omie_horario_periodos[p].reindex(range(24))
@@ -696,7 +759,7 @@ def preparar_dados_para_graficos(df_consumos_filtrado, df_omie_filtrado, opcao_h
     if not ciclo_a_usar:
         series_diario.insert(0, {"name": "Consumo por dia (kWh)", "type": "column", "data": agg_diario_base['Consumo_kWh'].round(2).where(pd.notna, None).tolist(), "yAxis": 0, "color": "#BFBFBF"})
     else:
-        agg_consumo_periodos = df_diario.groupby(['data_dia', ciclo_a_usar])['Consumo (kWh)'].sum().unstack(fill_value=0)
+        agg_consumo_periodos = df_diario.groupby(['data_dia', ciclo_a_usar], observed=True)['Consumo (kWh)'].sum().unstack(fill_value=0)
         agg_consumo_periodos = agg_consumo_periodos.reindex(agg_diario_base.index)
         for p in periodos_ciclo:
             if p in agg_consumo_periodos.columns:
@@ -716,7 +779,7 @@ def preparar_dados_para_graficos(df_consumos_filtrado, df_omie_filtrado, opcao_h
     series_diario.append({"name": "Média diária OMIE (€/MWh)", "type": "line", "data": dados_omie_diario_simples_final, "yAxis": 1, "color": cores_omie.get('S')})
     
     if ciclo_a_usar:
-        agg_omie_periodos = df_diario.groupby(['data_dia', ciclo_a_usar])['OMIE'].mean().unstack()
+        agg_omie_periodos = df_diario.groupby(['data_dia', ciclo_a_usar], observed=True)['OMIE'].mean().unstack()
         agg_omie_periodos = agg_omie_periodos.reindex(agg_diario_base.index)
         for p in periodos_ciclo:
             if p in agg_omie_periodos.columns:
@@ -863,7 +926,7 @@ def preparar_dados_dia_semana(df_merged):
     cores_omie = {'S': '#FF0000', 'V': '#000000', 'F': '#FFC000', 'C': '#2F5597', 'P': '#00B050'}
 
     if ciclo_a_usar and ciclo_a_usar in df_semana.columns:
-        consumo_total_periodo = df_semana.groupby(['dia_da_semana', ciclo_a_usar])['Consumo (kWh)'].sum().unstack(fill_value=0)
+        consumo_total_periodo = df_semana.groupby(['dia_da_semana', ciclo_a_usar], observed=True)['Consumo (kWh)'].sum().unstack(fill_value=0)
         
         for p in reversed(periodos_ciclo):
             if p in consumo_total_periodo.columns:
@@ -891,7 +954,7 @@ def preparar_dados_dia_semana(df_merged):
     })
     
     if ciclo_a_usar and ciclo_a_usar in df_semana.columns:
-        agg_omie_semana_periodos = df_semana.groupby(['dia_da_semana', ciclo_a_usar])['OMIE'].mean().unstack()
+        agg_omie_semana_periodos = df_semana.groupby(['dia_da_semana', ciclo_a_usar], observed=True)['OMIE'].mean().unstack()
         for p in periodos_ciclo:
             if p in agg_omie_semana_periodos.columns:
                 dados_omie_p = agg_omie_semana_periodos[p].reindex(range(7))
@@ -910,6 +973,21 @@ def preparar_dados_dia_semana(df_merged):
         'series': series_grafico
     }
 
+def obter_diagrama_alinhado(df_consumos):
+    """
+    Devolve o diagrama de carga já cruzado com OMIE, Perdas e ciclos (calc.DiagramaAlinhado).
+    Fica guardado na sessão, por conteúdo dos consumos e versão dos dados, para que todos os
+    tarifários e opções horárias em modo diagrama reutilizem o mesmo merge entre reruns.
+    """
+    chave = (dados_elec.versao, calc.chave_diagrama_consumos(df_consumos))
+    diagramas = st.session_state.setdefault('diagramas_alinhados', {})
+    if chave not in diagramas:
+        # Só interessam os diagramas atuais (bruto e líquido); descartar os de ficheiros/períodos anteriores
+        while len(diagramas) >= 2:
+            diagramas.pop(next(iter(diagramas)))
+        diagramas[chave] = calc.alinhar_diagrama_consumos(df_consumos, OMIE_PERDAS_CICLOS, chave=chave)
+    return diagramas[chave]
+
 def extrair_nome_base_tarifario(nome_completo):
     """
     Extrai o nome base de um tarifário, removendo sufixos e textos em parênteses.
@@ -1192,55 +1270,71 @@ with col2:
 st.subheader("⚡ Período e Consumos")
 # --- 2. LÓGICA DE UPLOAD E DETERMINAÇÃO DO MODO DE SIMULAÇÃO ---
 with st.expander("📂 Carregar Diagrama de Carga da E-Redes (opcional)"):
-    # Mensagem informativa para o utilizador
-    st.warning("⚠️ O carregamento de ficheiros da E-Redes encontra-se temporariamente indisponível para manutenção.")
-    
-    # Forçar a variável a None para que o resto do código assuma que não há ficheiro
-    uploaded_files = None
-    
-    # Código original comentado para não ser executado:
-    # uploaded_files = st.file_uploader(
-    # "Selecione um ou mais ficheiros da E-Redes (apenas do ano atual - outros datas serão ignoradas)", 
-    # type=['xlsx'], 
-    # key="consumos_uploader",
-    # accept_multiple_files=True
-    # )
+    uploaded_files = st.file_uploader(
+    f"Selecione um ou mais ficheiros da E-Redes (apenas do ano atual - outros datas serão ignoradas; máx. {proc_dados.TAMANHO_MAXIMO_FICHEIRO_MB} MB por ficheiro)", 
+    type=['xlsx'], 
+    key="consumos_uploader",
+    accept_multiple_files=True
+    )
 # Lógica para determinar o modo e processar o ficheiro
 # Se foram carregados novos ficheiros
-if uploaded_files:
-    # Criamos uma chave única baseada nos nomes e tamanhos dos ficheiros para saber se mudaram
-    chave_ficheiros_atuais = "".join([f.name + str(f.size) for f in uploaded_files])
+@st.fragment(run_every=1)
+def aguardar_ingestao_diagrama(future_ingestao):
+    """Marcador de progresso enquanto os ficheiros são processados; volta a correr a app quando terminam."""
+    if future_ingestao.done():
+        st.rerun()
+    st.info("⏳ A processar e validar ficheiros...")
 
-    if st.session_state.get('chave_ficheiros_processados') != chave_ficheiros_atuais:
-        with st.spinner("A processar e validar ficheiros..."):
+if uploaded_files:
+    # Os ficheiros são lidos fora da thread do script, por um pipeline limitado e partilhado,
+    # que guarda o resultado em cache pela chave do conteúdo (e não pelo nome + tamanho).
+    # O future fica na sessão e é verificado em cada execução, sem bloquear o script.
+    identificador_upload = tuple(getattr(f, 'file_id', None) or (f.name, f.size) for f in uploaded_files)
+    ingestao = st.session_state.get('ingestao_diagrama')
+
+    if ingestao is None or ingestao['upload'] != identificador_upload:
+        chave_ingestao, future_ingestao = proc_dados.obter_pipeline_ingestao_diagramas().submeter(uploaded_files)
+        ingestao = {'upload': identificador_upload, 'chave': chave_ingestao, 'future': future_ingestao, 'tratada': False}
+        st.session_state.ingestao_diagrama = ingestao
+        if chave_ingestao is None or st.session_state.get('chave_ficheiros_processados') != chave_ingestao:
+            # Enquanto os novos ficheiros são processados não se usam os dados anteriores
+            st.session_state.dados_completos_ficheiro = None
+            st.session_state.chave_ficheiros_processados = None
+        else:
+            ingestao['tratada'] = True
+
+    if not ingestao['future'].done():
+        aguardar_ingestao_diagrama(ingestao['future'])
+    elif not ingestao['tratada']:
+        ingestao['tratada'] = True
+        # Renomear a variável 'erro' para 'mensagem' para maior clareza
+        df_combinado, mensagem = ingestao['future'].result()
+
+        # A verificação principal passa a ser sobre o DataFrame
+        if df_combinado is None:
+            # Se o DataFrame é None, a mensagem é um erro fatal
+            st.error(mensagem)
+            st.session_state.dados_completos_ficheiro = None
+        else:
+            # Se o DataFrame existe, o processo foi um sucesso
+            st.success("Ficheiros validados e carregados com sucesso!")
             
-            # Renomear a variável 'erro' para 'mensagem' para maior clareza
-            df_combinado, mensagem = proc_dados.validar_e_juntar_ficheiros(uploaded_files)
-
-            # A verificação principal passa a ser sobre o DataFrame
-            if df_combinado is None:
-                # Se o DataFrame é None, a mensagem é um erro fatal
-                st.error(mensagem)
-                st.session_state.dados_completos_ficheiro = None
-            else:
-                # Se o DataFrame existe, o processo foi um sucesso
-                st.success("Ficheiros validados e carregados com sucesso!")
-                
-                # Verificar se há uma mensagem de AVISO para mostrar
-                if mensagem:
-                    st.warning(mensagem) # Mostra o aviso de que dados antigos foram ignorados
-
-                # Lógica de sucesso
-                st.session_state.dados_completos_ficheiro = df_combinado
-                st.session_state.chave_ficheiros_processados = chave_ficheiros_atuais
-                st.session_state.nomes_ficheiros_processados = ", ".join([f.name for f in uploaded_files])
-                
-                # Limpar os parâmetros do URL ao entrar em modo diagrama
-                st.query_params.clear()
+            # Verificar se há uma mensagem de AVISO para mostrar
+            if mensagem:
+                st.warning(mensagem) # Mostra o aviso de que dados antigos foram ignorados
+
+            # Lógica de sucesso (cópia própria da sessão; o resultado em cache é partilhado)
+            st.session_state.dados_completos_ficheiro = df_combinado.copy()
+            st.session_state.chave_ficheiros_processados = ingestao['chave']
+            st.session_state.nomes_ficheiros_processados = ", ".join([f.name for f in uploaded_files])
+            
+            # Limpar os parâmetros do URL ao entrar em modo diagrama
+            st.query_params.clear()
 
 # Se não há ficheiros, mas havia antes, limpar o estado
 elif not uploaded_files and 'dados_completos_ficheiro' in st.session_state:
      del st.session_state.dados_completos_ficheiro
+     st.session_state.pop('ingestao_diagrama', None)
      if 'chave_ficheiros_processados' in st.session_state:
          del st.session_state.chave_ficheiros_processados
      if 'nomes_ficheiros_processados' in st.session_state:
@@ -1281,12 +1375,14 @@ if is_diagram_mode:
     mes = meses_lista[mes_num - 1]
     
     df_consumos_bruto_filtrado = df_consumos_total[(df_consumos_total['DataHora'].dt.date >= data_inicio) & (df_consumos_total['DataHora'].dt.date <= data_fim)].copy()
-    df_omie_filtrado_para_analise = OMIE_PERDAS_CICLOS[(OMIE_PERDAS_CICLOS['DataHora'] >= pd.to_datetime(data_inicio)) & (OMIE_PERDAS_CICLOS['DataHora'] <= pd.to_datetime(data_fim) + pd.Timedelta(hours=23, minutes=59))].copy()
+    # Recorte por posição (searchsorted no IndiceMercado), sem máscara nem cópia da tabela partilhada
+    inicio_omie_analise, fim_omie_analise = INDICE_MERCADO.posicoes(pd.to_datetime(data_inicio), pd.to_datetime(data_fim) + pd.Timedelta(hours=23, minutes=59))
+    df_omie_filtrado_para_analise = OMIE_PERDAS_CICLOS.iloc[inicio_omie_analise:fim_omie_analise]
 
     # --- PASSO 2: ANÁLISE DO CONSUMO BRUTO (ANTES DO AUTOCONSUMO) ---
     st.markdown("##### Análise de Consumos e Médias OMIE (do(s) ficheiro(s))")
     consumos_agregados_brutos = proc_dados.agregar_consumos_por_periodo(df_consumos_bruto_filtrado, OMIE_PERDAS_CICLOS)
-    omie_medios_para_tabela_bruta = proc_dados.calcular_medias_omie_para_todos_ciclos(df_consumos_bruto_filtrado, OMIE_PERDAS_CICLOS)
+    omie_medios_para_tabela_bruta = proc_dados.calcular_medias_omie_para_todos_ciclos(df_consumos_bruto_filtrado, OMIE_PERDAS_CICLOS, INDICE_MERCADO)
     tabela_analise_html_bruta = criar_tabela_analise_completa_html(consumos_agregados_brutos, omie_medios_para_tabela_bruta)
     st.markdown(tabela_analise_html_bruta, unsafe_allow_html=True)
 
@@ -1334,15 +1430,53 @@ if is_diagram_mode:
                     orientacao_str=st.session_state.solar_orientacao
                 )
                 df_consumos_final_para_calculos = df_com_solar
+
+                # --- BATERIA (OPCIONAL): guarda o excedente e descarrega-o para reduzir o consumo da rede ---
+                usar_bateria = st.checkbox("Adicionar bateria", key="chk_bateria_ativa")
+                if usar_bateria and not df_com_solar.empty:
+                    col_bat1, col_bat2, col_bat3 = st.columns(3)
+                    with col_bat1:
+                        st.number_input("Capacidade útil (kWh)", min_value=0.5, value=5.0, step=0.5, format="%.1f", key="bateria_capacidade")
+                    with col_bat2:
+                        st.number_input("Potência máx. carga/descarga (kW)", min_value=0.5, value=2.5, step=0.5, format="%.1f", key="bateria_potencia")
+                    with col_bat3:
+                        st.number_input("Eficiência ida e volta (%)", min_value=50, max_value=100, value=90, step=1, key="bateria_eficiencia")
+                    # O 'Consumo_Rede_kWh' passa a ser o consumo depois da bateria, e é esse que segue para os custos
+                    df_consumos_final_para_calculos = calc.simular_bateria(
+                        df_com_solar, st.session_state.bateria_capacidade, st.session_state.bateria_potencia,
+                        st.session_state.bateria_eficiencia / 100.0
+                    )
             
                 st.write("##### Resumo da Simulação Solar (para o período selecionado)")
-                res_col1, res_col2, res_col3 = st.columns(3)
-                with res_col1:
+                com_bateria = 'Descarga_Bateria_kWh' in df_consumos_final_para_calculos.columns
+                res_cols = st.columns(4 if com_bateria else 3)
+                with res_cols[0]:
                     gfx.exibir_metrica_personalizada("Produção Solar", f"{df_consumos_final_para_calculos['Producao_Solar_kWh'].sum():.0f} kWh")
-                with res_col2:
+                with res_cols[1]:
                     gfx.exibir_metrica_personalizada("Autoconsumo", f"{df_consumos_final_para_calculos['Autoconsumo_kWh'].sum():.0f} kWh")
-                with res_col3:
+                with res_cols[2]:
                     gfx.exibir_metrica_personalizada("Excedente", f"{df_consumos_final_para_calculos['Excedente_kWh'].sum():.0f} kWh")
+                if com_bateria:
+                    with res_cols[3]:
+                        gfx.exibir_metrica_personalizada("Descarga da Bateria", f"{df_consumos_final_para_calculos['Descarga_Bateria_kWh'].sum():.0f} kWh")
+
+                    if st.button("Comparar capacidades de bateria (0 a 20 kWh)", key="btn_comparar_baterias", use_container_width=True):
+                        df_capacidades = calc.comparar_capacidades_bateria(
+                            df_com_solar, [float(capacidade) for capacidade in range(0, 21)],
+                            st.session_state.bateria_potencia, st.session_state.bateria_eficiencia / 100.0
+                        )
+                        dados_grafico_baterias = {
+                            'titulo': 'Consumo da Rede e Excedente por Capacidade da Bateria',
+                            'categorias': [f"{capacidade:g}" for capacidade in df_capacidades['Capacidade (kWh)']],
+                            'rotulo_x': 'Capacidade (kWh)', 'unidade': 'kWh',
+                            'series': [
+                                {"name": "Consumo da Rede (kWh)", "data": df_capacidades['Consumo da Rede (kWh)'].round(1).tolist(), "color": "#2E75B6"},
+                                {"name": "Excedente (kWh)", "data": df_capacidades['Excedente (kWh)'].round(1).tolist(), "color": "#92D050"},
+                                {"name": "Descarga da Bateria (kWh)", "data": df_capacidades['Descarga (kWh)'].round(1).tolist(), "color": "#7030A0"},
+                            ]
+                        }
+                        st.components.v1.html(gfx.gerar_grafico_solar('grafico_capacidades_bateria', dados_grafico_baterias), height=420)
+                        st.dataframe(df_capacidades.round(2), hide_index=True, use_container_width=True)
 
                 # <<< GRÁFICO DE AUTOCONSUMO COM HIGHCHARTS >>>
                 if not df_consumos_final_para_calculos.empty and df_consumos_final_para_calculos['Producao_Solar_kWh'].sum() > 0:
@@ -1394,7 +1528,7 @@ if is_diagram_mode:
             df_para_tabela_liquida = df_consumos_final_para_calculos.copy()
             df_para_tabela_liquida['Consumo (kWh)'] = df_para_tabela_liquida['Consumo_Rede_kWh']
             consumos_agregados_liquidos = proc_dados.agregar_consumos_por_periodo(df_para_tabela_liquida, OMIE_PERDAS_CICLOS)
-            omie_medios_para_tabela_liquida = proc_dados.calcular_medias_omie_para_todos_ciclos(df_para_tabela_liquida, OMIE_PERDAS_CICLOS)
+            omie_medios_para_tabela_liquida = proc_dados.calcular_medias_omie_para_todos_ciclos(df_para_tabela_liquida, OMIE_PERDAS_CICLOS, INDICE_MERCADO)
             tabela_analise_html_liquida = criar_tabela_analise_completa_html(consumos_agregados_liquidos, omie_medios_para_tabela_liquida)
             st.markdown(tabela_analise_html_liquida, unsafe_allow_html=True)
 
@@ -1574,68 +1708,13 @@ df_consumos_filtrado = pd.DataFrame()
 data_valores_omie_dt = pd.to_datetime(CONSTANTES.loc[CONSTANTES['constante'] == 'Data_Valores_OMIE', 'valor_unitário'].iloc[0]).date()
 nota_omie = " (Média Final)" if data_fim <= data_valores_omie_dt else " (Média com Futuros)"
 
-# Cálculos de OMIE e Perdas para o período de simulação ATIVO
-df_omie_no_periodo_selecionado = OMIE_PERDAS_CICLOS[
-    (OMIE_PERDAS_CICLOS['DataHora'] >= pd.to_datetime(data_inicio)) &
-    (OMIE_PERDAS_CICLOS['DataHora'] <= pd.to_datetime(data_fim) + pd.Timedelta(hours=23, minutes=59, seconds=59))
-].copy()
+# Limites do período de simulação ATIVO (as médias de OMIE e Perdas saem do INDICE_MERCADO)
+inicio_periodo_omie = pd.to_datetime(data_inicio)
+fim_periodo_omie = pd.to_datetime(data_fim) + pd.Timedelta(hours=23, minutes=59, seconds=59)
+medias_omie_periodo = INDICE_MERCADO.medias_por_ciclo('OMIE', inicio_periodo_omie, fim_periodo_omie)
 
-if df_omie_no_periodo_selecionado.empty:
+if not medias_omie_periodo:
     st.error(f"Não foram encontrados dados de mercado OMIE para o período selecionado ({data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}). Os resultados para tarifários indexados estarão incorretos.")
-    omie_medios_calculados_para_todos_ciclos = {}
-    perdas_medias = {}
-    df_omie_ajustado = pd.DataFrame()
-    omie_medio_simples_real_kwh = 0.0
-    omie_medios_calculados = {}
-else:
-    # Mantenha aqui toda a sua lógica detalhada de cálculo de médias, copiada do ficheiro original
-    omie_medios_calculados_para_todos_ciclos = {'S': df_omie_no_periodo_selecionado['OMIE'].mean()}
-    for ciclo in ['BD', 'BS', 'TD', 'TS']:
-        if ciclo in df_omie_no_periodo_selecionado.columns:
-            agrupado = df_omie_no_periodo_selecionado.groupby(ciclo)['OMIE'].mean()
-            for periodo, media in agrupado.items():
-                omie_medios_calculados_para_todos_ciclos[f"{ciclo}_{periodo}"] = media if pd.notna(media) else 0.0
-    
-    perdas_medias = {}
-    perdas_medias['Perdas_M_S'] = df_omie_no_periodo_selecionado['Perdas'].mean()
-    for ciclo_base_curto in ['BD', 'BS', 'TD', 'TS']:
-        periodos_ciclo = ('V', 'F') if ciclo_base_curto in ['BD', 'BS'] else ('V', 'C', 'P')
-        for periodo_perda in periodos_ciclo:
-            if ciclo_base_curto in df_omie_no_periodo_selecionado.columns:
-                perdas_ciclo_periodo = df_omie_no_periodo_selecionado.groupby(ciclo_base_curto)['Perdas'].mean()
-                perdas_medias[f'Perdas_M_{ciclo_base_curto}_{periodo_perda}'] = perdas_ciclo_periodo.get(periodo_perda, 1.0)
-            else:
-                perdas_medias[f'Perdas_M_{ciclo_base_curto}_{periodo_perda}'] = perdas_medias.get('Perdas_M_S', 1.0)
-    
-    df_omie_ano_completo_pm = OMIE_PERDAS_CICLOS[OMIE_PERDAS_CICLOS['DataHora'].dt.year == ano_atual].copy()
-    if not df_omie_ano_completo_pm.empty:
-        perdas_medias['Perdas_Anual_S'] = df_omie_ano_completo_pm['Perdas'].mean()
-        for ciclo_anual in ['BD', 'BS', 'TD', 'TS']:
-            periodos_ciclo = ('V', 'F') if ciclo_anual in ['BD', 'BS'] else ('V', 'C', 'P')
-            for periodo_anual in periodos_ciclo:
-                if ciclo_anual in df_omie_ano_completo_pm.columns:
-                    perdas_ciclo_anual = df_omie_ano_completo_pm.groupby(ciclo_anual)['Perdas'].mean()
-                    perdas_medias[f'Perdas_Anual_{ciclo_anual}_{periodo_anual}'] = perdas_ciclo_anual.get(periodo_anual, 1.0)
-                else:
-                    perdas_medias[f'Perdas_Anual_{ciclo_anual}_{periodo_anual}'] = perdas_medias.get('Perdas_Anual_S', 1.0)
-    
-    # Lógica de inputs manuais de OMIE
-    omie_medios_calculados = {}
-    if 'OMIE' in df_omie_no_periodo_selecionado.columns:
-        omie_medios_calculados['S'] = df_omie_no_periodo_selecionado.groupby(pd.Grouper(key='DataHora', freq='D'))['OMIE'].mean().mean()
-        if opcao_horaria.lower().startswith("bi"):
-            ciclo_col = 'BD' if "diário" in opcao_horaria.lower() else 'BS'
-            if ciclo_col in df_omie_no_periodo_selecionado:
-                omie_bi = df_omie_no_periodo_selecionado.groupby(ciclo_col)['OMIE'].mean()
-                omie_medios_calculados['V'] = omie_bi.get('V', 0.0)
-                omie_medios_calculados['F'] = omie_bi.get('F', 0.0)
-        elif opcao_horaria.lower().startswith("tri"):
-            ciclo_col = 'TD' if "diário" in opcao_horaria.lower() else 'TS'
-            if ciclo_col in df_omie_no_periodo_selecionado:
-                omie_tri = df_omie_no_periodo_selecionado.groupby(ciclo_col)['OMIE'].mean()
-                omie_medios_calculados['V'] = omie_tri.get('V', 0.0)
-                omie_medios_calculados['C'] = omie_tri.get('C', 0.0)
-                omie_medios_calculados['P'] = omie_tri.get('P', 0.0)
 
 # Ler e Processar a Constante Data_Valores_OMIE
 data_valores_omie_dt = None
@@ -1691,30 +1770,24 @@ if st.session_state.get('last_omie_dependency_key_for_inputs') != current_omie_d
 # Estes são os valores CALCULADOS da tabela, antes de qualquer input manual
 df_omie_no_periodo_selecionado = pd.DataFrame()
 if 'DataHora' in OMIE_PERDAS_CICLOS.columns:
-    df_omie_no_periodo_selecionado = OMIE_PERDAS_CICLOS[
-        (OMIE_PERDAS_CICLOS['DataHora'] >= pd.to_datetime(data_inicio)) & # Usar data_inicio
-        (OMIE_PERDAS_CICLOS['DataHora'] <= pd.to_datetime(data_fim) + pd.Timedelta(hours=23, minutes=59, seconds=59)) # Usar data_fim
-    ].copy()
+    # Recorte por posição (searchsorted no IndiceMercado), sem máscara nem cópia da tabela partilhada
+    inicio_omie_periodo, fim_omie_periodo = INDICE_MERCADO.posicoes(inicio_periodo_omie, fim_periodo_omie)
+    df_omie_no_periodo_selecionado = OMIE_PERDAS_CICLOS.iloc[inicio_omie_periodo:fim_omie_periodo]
 else:
     st.warning("Coluna 'DataHora' não encontrada nos dados OMIE. Não é possível calcular médias OMIE.")
 
 omie_medios_calculados = {'S': 0.0, 'V': 0.0, 'F': 0.0, 'C': 0.0, 'P': 0.0}
 
 if not df_omie_no_periodo_selecionado.empty:
-    omie_medios_calculados['S'] = df_omie_no_periodo_selecionado['OMIE'].mean()
+    omie_medios_calculados['S'] = medias_omie_periodo.get('S', 0.0)
 
     if pd.isna(omie_medios_calculados['S']): omie_medios_calculados['S'] = 0.0
     ciclo_bi_col = 'BD' if "Diário" in opcao_horaria else 'BS'
     ciclo_tri_col = 'TD' if "Diário" in opcao_horaria else 'TS'
-    if ciclo_bi_col in df_omie_no_periodo_selecionado.columns:
-        omie_bi_calculado = df_omie_no_periodo_selecionado.groupby(ciclo_bi_col)['OMIE'].mean()
-        omie_medios_calculados['V'] = omie_bi_calculado.get('V', omie_medios_calculados.get('V', 0.0))
-        omie_medios_calculados['F'] = omie_bi_calculado.get('F', omie_medios_calculados.get('F', 0.0))
-    if ciclo_tri_col in df_omie_no_periodo_selecionado.columns:
-        omie_tri_calculado = df_omie_no_periodo_selecionado.groupby(ciclo_tri_col)['OMIE'].mean()
-        omie_medios_calculados['V'] = omie_tri_calculado.get('V', omie_medios_calculados.get('V',0.0))
-        omie_medios_calculados['C'] = omie_tri_calculado.get('C', omie_medios_calculados.get('C',0.0))
-        omie_medios_calculados['P'] = omie_tri_calculado.get('P', omie_medios_calculados.get('P',0.0))
+    for periodo_bi in ['V', 'F']:
+        omie_medios_calculados[periodo_bi] = medias_omie_periodo.get(f"{ciclo_bi_col}_{periodo_bi}", omie_medios_calculados.get(periodo_bi, 0.0))
+    for periodo_tri in ['V', 'C', 'P']:
+        omie_medios_calculados[periodo_tri] = medias_omie_periodo.get(f"{ciclo_tri_col}_{periodo_tri}", omie_medios_calculados.get(periodo_tri, 0.0))
 
 else:
     st.warning("Não existem dados OMIE para o período selecionado. As médias OMIE serão zero.")
@@ -1724,7 +1797,7 @@ else:
 omie_medios_calculados_para_todos_ciclos = {'S': 0.0} # Inicializar com Simples
 
 if not df_omie_no_periodo_selecionado.empty and 'OMIE' in df_omie_no_periodo_selecionado.columns:
-    omie_medios_calculados_para_todos_ciclos['S'] = df_omie_no_periodo_selecionado['OMIE'].mean()
+    omie_medios_calculados_para_todos_ciclos['S'] = medias_omie_periodo.get('S', 0.0)
     if pd.isna(omie_medios_calculados_para_todos_ciclos['S']):
         omie_medios_calculados_para_todos_ciclos['S'] = 0.0
 
@@ -1734,10 +1807,9 @@ if not df_omie_no_periodo_selecionado.empty and 'OMIE' in df_omie_no_periodo_sel
     }
     for ciclo_curto, periodos_ciclo in ciclos_a_processar.items():
         if ciclo_curto in df_omie_no_periodo_selecionado.columns:
-            omie_ciclo_calculado = df_omie_no_periodo_selecionado.groupby(ciclo_curto)['OMIE'].mean()
             for p_ciclo in periodos_ciclo:
                 chave_completa = f"{ciclo_curto}_{p_ciclo}"
-                omie_medios_calculados_para_todos_ciclos[chave_completa] = omie_ciclo_calculado.get(p_ciclo, 0.0)
+                omie_medios_calculados_para_todos_ciclos[chave_completa] = medias_omie_periodo.get(chave_completa, 0.0)
                 if pd.isna(omie_medios_calculados_para_todos_ciclos[chave_completa]):
                      omie_medios_calculados_para_todos_ciclos[chave_completa] = 0.0
         else: # Fallback se a coluna do ciclo não existir
@@ -1764,23 +1836,19 @@ st.session_state.omie_foi_editado_manualmente = st.session_state.get('omie_foi_e
 omie_medios_calculados = {'S': 0.0, 'V': 0.0, 'F': 0.0, 'C': 0.0, 'P': 0.0} # Recalcular aqui com base em df_omie_no_periodo_selecionado
 
 if not df_omie_no_periodo_selecionado.empty:
-    omie_medios_calculados['S'] = df_omie_no_periodo_selecionado['OMIE'].mean()
+    omie_medios_calculados['S'] = medias_omie_periodo.get('S', 0.0)
     if pd.isna(omie_medios_calculados['S']): omie_medios_calculados['S'] = 0.0
     ciclo_bi_col = 'BD' if "Diário" in opcao_horaria else 'BS'
     ciclo_tri_col = 'TD' if "Diário" in opcao_horaria else 'TS'
-    if ciclo_bi_col in df_omie_no_periodo_selecionado.columns:
-        omie_bi_calculado = df_omie_no_periodo_selecionado.groupby(ciclo_bi_col)['OMIE'].mean()
-        omie_medios_calculados['V'] = omie_bi_calculado.get('V', omie_medios_calculados.get('V', 0.0))
-        omie_medios_calculados['F'] = omie_bi_calculado.get('F', omie_medios_calculados.get('F', 0.0))
-    if ciclo_tri_col in df_omie_no_periodo_selecionado.columns:
-        omie_tri_calculado = df_omie_no_periodo_selecionado.groupby(ciclo_tri_col)['OMIE'].mean()
-        omie_medios_calculados['V'] = omie_tri_calculado.get('V', omie_medios_calculados.get('V',0.0))
-        omie_medios_calculados['C'] = omie_tri_calculado.get('C', omie_medios_calculados.get('C',0.0))
-        omie_medios_calculados['P'] = omie_tri_calculado.get('P', omie_medios_calculados.get('P',0.0))
+    for periodo_bi in ['V', 'F']:
+        omie_medios_calculados[periodo_bi] = medias_omie_periodo.get(f"{ciclo_bi_col}_{periodo_bi}", omie_medios_calculados.get(periodo_bi, 0.0))
+    for periodo_tri in ['V', 'C', 'P']:
+        omie_medios_calculados[periodo_tri] = medias_omie_periodo.get(f"{ciclo_tri_col}_{periodo_tri}", omie_medios_calculados.get(periodo_tri, 0.0))
 else:
     st.warning("Não existem dados OMIE para o período selecionado. As médias OMIE serão zero.")
 
 # --- 5. LÓGICA DE INPUTS E APRESENTAÇÃO POR MODO ---
+container_otimizador_potencia = None
 consumo_total_final = 0
 consumos_repartidos_finais = {}
 
@@ -1848,6 +1916,9 @@ if is_diagram_mode:
 
         col_p3.metric("Utilização da Potência Máxima", f"{percentagem_uso:.1f} %")
         st.markdown(recomendacao)
+
+        # O otimizador precisa dos filtros e das opções adicionais, definidos mais abaixo; é preenchido depois
+        container_otimizador_potencia = st.container()
             
     elif not df_consumos_filtrado.empty:
         st.warning("Não foi possível realizar a análise de potência. Verifique o conteúdo do ficheiro Excel.")
@@ -2077,48 +2148,45 @@ else:
             'P': consumo_ponta
         }
 
-# --- Preparar df_omie_ajustado ---
-# Começa com os OMIEs HORÁRIOS ORIGINAIS da tabela para o período selecionado
-df_omie_ajustado = df_omie_no_periodo_selecionado.copy()
-if not df_omie_ajustado.empty:
-    if opcao_horaria.lower() == "simples":
-        if st.session_state.omie_foi_editado_manualmente.get('S'):
-            df_omie_ajustado['OMIE'] = st.session_state.omie_s_input_field
+# --- Sensibilidade ao OMIE (tarifários indexados de todas as tabelas) ---
+with st.expander("🎚️ Sensibilidade ao preço OMIE"):
+    delta_omie_sensibilidade = st.slider(
+        "Variação do OMIE (€/MWh)", min_value=-100.0, max_value=100.0, value=0.0, step=5.0,
+        key="omie_sensibilidade_delta",
+        help="Soma este valor a todos os OMIE (horários ou manuais) nos tarifários indexados da tabela detalhada, "
+             "da tabela comparativa e da análise de poupança com autoconsumo. "
+             "Os preços saem de coeficientes já calculados para o período, sem voltar a percorrer os dados OMIE."
+    )
+    if delta_omie_sensibilidade:
+        st.caption(f"As tabelas usam o OMIE {delta_omie_sensibilidade:+.0f} €/MWh nos tarifários indexados.")
 
-    elif opcao_horaria.lower().startswith("bi"):
-        ciclo_col = 'BD' if "Diário" in opcao_horaria else 'BS'
-        if ciclo_col in df_omie_ajustado.columns:
-            def substituir_bi_se_manual(row):
-                omie_original_hora = row['OMIE']
-                if row[ciclo_col] == 'V' and st.session_state.omie_foi_editado_manualmente.get('V'):
-                    return st.session_state.omie_v_input_field
-                elif row[ciclo_col] == 'F' and st.session_state.omie_foi_editado_manualmente.get('F'):
-                    return st.session_state.omie_f_input_field
-                return omie_original_hora
-            if st.session_state.omie_foi_editado_manualmente.get('V') or st.session_state.omie_foi_editado_manualmente.get('F'):
-                 df_omie_ajustado['OMIE'] = df_omie_ajustado.apply(substituir_bi_se_manual, axis=1)
+# --- Preparar df_omie_ajustado ---
+# Começa com os OMIEs HORÁRIOS ORIGINAIS da tabela para o período selecionado e substitui os períodos editados
+if opcao_horaria.lower() == "simples":
+    periodos_omie_opcao, coluna_ciclo_omie = ['S'], None
+elif opcao_horaria.lower().startswith("bi"):
+    periodos_omie_opcao, coluna_ciclo_omie = ['V', 'F'], 'BD' if "Diário" in opcao_horaria else 'BS'
+else:
+    periodos_omie_opcao, coluna_ciclo_omie = ['V', 'C', 'P'], 'TD' if "Diário" in opcao_horaria else 'TS'
+omie_manuais = {
+    p_key: st.session_state[f"omie_{p_key.lower()}_input_field"]
+    for p_key in periodos_omie_opcao
+    if st.session_state.omie_foi_editado_manualmente.get(p_key) and f"omie_{p_key.lower()}_input_field" in st.session_state
+}
 
-    elif opcao_horaria.lower().startswith("tri"):
-        ciclo_col = 'TD' if "Diário" in opcao_horaria else 'TS'
-        if ciclo_col in df_omie_ajustado.columns:
-            def substituir_tri_se_manual(row):
-                omie_original_hora = row['OMIE']
-                if row[ciclo_col] == 'V' and st.session_state.omie_foi_editado_manualmente.get('V'):
-                    return st.session_state.omie_v_input_field
-                elif row[ciclo_col] == 'C' and st.session_state.omie_foi_editado_manualmente.get('C'):
-                    return st.session_state.omie_c_input_field
-                elif row[ciclo_col] == 'P' and st.session_state.omie_foi_editado_manualmente.get('P'):
-                    return st.session_state.omie_p_input_field
-                return omie_original_hora
-            if st.session_state.omie_foi_editado_manualmente.get('V') or \
-               st.session_state.omie_foi_editado_manualmente.get('C') or \
-               st.session_state.omie_foi_editado_manualmente.get('P'):
-                df_omie_ajustado['OMIE'] = df_omie_ajustado.apply(substituir_tri_se_manual, axis=1)
-        else:
-            st.warning(f"Coluna de ciclo '{ciclo_col}' não encontrada nos dados OMIE. Não é possível aplicar OMIE manual por período horário.")
+if not df_omie_no_periodo_selecionado.empty:
+    if coluna_ciclo_omie and coluna_ciclo_omie not in df_omie_no_periodo_selecionado.columns and opcao_horaria.lower().startswith("tri"):
+        st.warning(f"Coluna de ciclo '{coluna_ciclo_omie}' não encontrada nos dados OMIE. Não é possível aplicar OMIE manual por período horário.")
+    df_omie_ajustado = calc.aplicar_omie_manual(df_omie_no_periodo_selecionado, coluna_ciclo_omie, omie_manuais)
 else: # df_omie_ajustado está vazio porque df_omie_no_periodo_selecionado estava vazio
+    df_omie_ajustado = df_omie_no_periodo_selecionado
     st.warning("DataFrame OMIE ajustado está vazio pois não há dados OMIE para o período.")
 
+# Conteúdo de df_omie_ajustado (período, opção e OMIE manuais): entrada do nó 'precos_btn' do GRAFO_CALCULO
+chave_omie_ajustado = (inicio_periodo_omie, fim_periodo_omie, opcao_horaria, tuple(sorted(omie_manuais.items())))
+# Só o período e a opção: entrada do nó 'coeficientes_omie_btn', que não depende dos OMIE manuais
+chave_omie_periodo = (inicio_periodo_omie, fim_periodo_omie, opcao_horaria)
+
 # --- Recalcular omie_medio_simples_real_kwh com base nos OMIE ajustados ---
 # Este valor é usado por alguns tarifários de MÉDIA (ex: LuziGás)
 if not df_omie_ajustado.empty and 'OMIE' in df_omie_ajustado.columns:
@@ -2144,52 +2212,29 @@ elif opcao_horaria.lower().startswith("tri"):
 perdas_medias = {}
 if not df_omie_no_periodo_selecionado.empty and 'Perdas' in df_omie_no_periodo_selecionado.columns:
     # Médias para o período selecionado
-    perdas_medias['Perdas_M_S'] = df_omie_no_periodo_selecionado['Perdas'].mean()
+    medias_perdas_periodo = INDICE_MERCADO.medias_por_ciclo('Perdas', inicio_periodo_omie, fim_periodo_omie)
+    perdas_medias['Perdas_M_S'] = medias_perdas_periodo.get('S', float('nan'))
     
-    for ciclo_base_curto in ['BD', 'BS']: # Bi-Diário, Bi-Semanal
-        if ciclo_base_curto in df_omie_no_periodo_selecionado.columns:
-            perdas_ciclo_periodo = df_omie_no_periodo_selecionado.groupby(ciclo_base_curto)['Perdas'].mean()
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_V'] = perdas_ciclo_periodo.get('V', 1.0)
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_F'] = perdas_ciclo_periodo.get('F', 1.0)
-        else: # Fallback se coluna de ciclo não existir para o período selecionado
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_V'] = perdas_medias['Perdas_M_S'] # Usa média simples como fallback
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_F'] = perdas_medias['Perdas_M_S']
-
-    for ciclo_base_curto in ['TD', 'TS']: # Tri-Diário, Tri-Semanal
-        if ciclo_base_curto in df_omie_no_periodo_selecionado.columns:
-            perdas_ciclo_periodo = df_omie_no_periodo_selecionado.groupby(ciclo_base_curto)['Perdas'].mean()
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_V'] = perdas_ciclo_periodo.get('V', 1.0)
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_C'] = perdas_ciclo_periodo.get('C', 1.0)
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_P'] = perdas_ciclo_periodo.get('P', 1.0)
-        else: # Fallback
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_V'] = perdas_medias['Perdas_M_S']
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_C'] = perdas_medias['Perdas_M_S']
-            perdas_medias[f'Perdas_M_{ciclo_base_curto}_P'] = perdas_medias['Perdas_M_S']
+    for ciclo_base_curto, periodos_ciclo in proc_dados.PERIODOS_CICLOS_OMIE.items(): # BD, BS (V, F); TD, TS (V, C, P)
+        for periodo_perda in periodos_ciclo:
+            if ciclo_base_curto in df_omie_no_periodo_selecionado.columns:
+                perdas_medias[f'Perdas_M_{ciclo_base_curto}_{periodo_perda}'] = medias_perdas_periodo.get(f'{ciclo_base_curto}_{periodo_perda}', 1.0)
+            else: # Fallback se coluna de ciclo não existir para o período selecionado
+                perdas_medias[f'Perdas_M_{ciclo_base_curto}_{periodo_perda}'] = perdas_medias['Perdas_M_S'] # Usa média simples como fallback
 
     # Médias para o ano completo
-    df_omie_ano_completo_pm = OMIE_PERDAS_CICLOS[OMIE_PERDAS_CICLOS['DataHora'].dt.year == ano_atual].copy()
-    if not df_omie_ano_completo_pm.empty and 'Perdas' in df_omie_ano_completo_pm.columns:
-        perdas_medias['Perdas_Anual_S'] = df_omie_ano_completo_pm['Perdas'].mean()
-
-        for ciclo_base_curto_anual in ['BD', 'BS']:
-            if ciclo_base_curto_anual in df_omie_ano_completo_pm.columns:
-                perdas_ciclo_anual = df_omie_ano_completo_pm.groupby(ciclo_base_curto_anual)['Perdas'].mean()
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_V'] = perdas_ciclo_anual.get('V', 1.0)
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_F'] = perdas_ciclo_anual.get('F', 1.0)
-            else: # Fallback
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_V'] = perdas_medias.get('Perdas_Anual_S', 1.0)
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_F'] = perdas_medias.get('Perdas_Anual_S', 1.0)
-
-        for ciclo_base_curto_anual in ['TD', 'TS']:
-            if ciclo_base_curto_anual in df_omie_ano_completo_pm.columns:
-                perdas_ciclo_anual = df_omie_ano_completo_pm.groupby(ciclo_base_curto_anual)['Perdas'].mean()
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_V'] = perdas_ciclo_anual.get('V', 1.0)
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_C'] = perdas_ciclo_anual.get('C', 1.0)
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_P'] = perdas_ciclo_anual.get('P', 1.0)
-            else: # Fallback
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_V'] = perdas_medias.get('Perdas_Anual_S', 1.0)
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_C'] = perdas_medias.get('Perdas_Anual_S', 1.0)
-                perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_P'] = perdas_medias.get('Perdas_Anual_S', 1.0)
+    medias_perdas_ano = INDICE_MERCADO.medias_por_ciclo(
+        'Perdas', pd.Timestamp(year=ano_atual, month=1, day=1), pd.Timestamp(year=ano_atual + 1, month=1, day=1) - pd.Timedelta(1)
+    )
+    if medias_perdas_ano:
+        perdas_medias['Perdas_Anual_S'] = medias_perdas_ano['S']
+
+        for ciclo_base_curto_anual, periodos_ciclo in proc_dados.PERIODOS_CICLOS_OMIE.items():
+            for periodo_anual in periodos_ciclo:
+                if ciclo_base_curto_anual in OMIE_PERDAS_CICLOS.columns:
+                    perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_{periodo_anual}'] = medias_perdas_ano.get(f'{ciclo_base_curto_anual}_{periodo_anual}', 1.0)
+                else: # Fallback
+                    perdas_medias[f'Perdas_Anual_{ciclo_base_curto_anual}_{periodo_anual}'] = perdas_medias.get('Perdas_Anual_S', 1.0)
     else:
         st.warning("Não existem dados OMIE para o ano completo. Algumas médias de perdas anuais podem não ser calculadas.")
 else:
@@ -2497,7 +2542,7 @@ if meu_tarifario_ativo:
     # ENERGIA (por período p)
         tar_energia_regulada_periodo_meu = {} # TAR da energia por período (€/kWh)
         for p_key in preco_energia_input_meu.keys(): # S, V, F, C, P
-            tar_energia_regulada_periodo_meu[p_key] = calc.obter_tar_energia_periodo(opcao_horaria, p_key, potencia, CONSTANTES)
+            tar_energia_regulada_periodo_meu[p_key] = calc.obter_tar_energia_periodo(opcao_horaria, p_key, potencia, INDICE_CONSTANTES)
 
         energia_meu_periodo_comercializador_base = {} # Componente do comercializador para energia (€/kWh)
         for p_key, preco_input_val in preco_energia_input_meu.items():
@@ -2512,7 +2557,7 @@ if meu_tarifario_ativo:
         financiamento_tse_a_somar_base = FINANCIAMENTO_TSE_VAL if adicionar_financiamento_tse_meu else 0.0
 
         # POTÊNCIA (€/dia)
-        tar_potencia_regulada_meu_base = calc.obter_tar_dia(potencia, CONSTANTES) # TAR da potência
+        tar_potencia_regulada_meu_base = calc.obter_tar_dia(potencia, INDICE_CONSTANTES) # TAR da potência
         preco_potencia_input_meu_float = float(preco_potencia_input_meu or 0.0)
         if tar_incluida_potencia_meu:
             potencia_meu_comercializador_base = preco_potencia_input_meu_float - tar_potencia_regulada_meu_base
@@ -2525,7 +2570,7 @@ if meu_tarifario_ativo:
         preco_energia_final_unitario_sem_iva = {} # Dicionário para {período: preço_final_unitario}
         desconto_monetario_ts_energia = 0.0 # Valor do desconto TS para energia em €/kWh
         if tarifa_social: # Flag global de TS
-            desconto_monetario_ts_energia = calc.obter_constante('Desconto TS Energia', CONSTANTES)
+            desconto_monetario_ts_energia = calc.obter_constante('Desconto TS Energia', INDICE_CONSTANTES)
 
         for p_key in energia_meu_periodo_comercializador_base.keys():
             # Base para o desconto percentual da energia (Comercializador + TAR + TSE)
@@ -2547,7 +2592,7 @@ if meu_tarifario_ativo:
         # Preço unitário final da Potência (€/dia, sem IVA)
         desconto_monetario_ts_potencia = 0.0 # Valor do desconto TS para potência em €/dia
         if tarifa_social:
-            desconto_monetario_ts_potencia = calc.obter_constante(f'Desconto TS Potencia {potencia}', CONSTANTES)
+            desconto_monetario_ts_potencia = calc.obter_desconto_ts_potencia(potencia, INDICE_CONSTANTES)
 
         # Base para o desconto percentual da potência (Comercializador + TAR)
         preco_total_potencia_antes_desc_perc = potencia_meu_comercializador_base + tar_potencia_regulada_meu_base
@@ -2563,7 +2608,7 @@ if meu_tarifario_ativo:
 
         desconto_ts_potencia_valor_aplicado_meu = 0.0
         if tarifa_social:
-             desconto_ts_potencia_dia_bruto_meu = calc.obter_constante(f'Desconto TS Potencia {potencia}', CONSTANTES)
+             desconto_ts_potencia_dia_bruto_meu = calc.obter_desconto_ts_potencia(potencia, INDICE_CONSTANTES)
              # O desconto efetivamente aplicado à TAR para o meu tarifário.
              # tar_potencia_regulada_meu_base é a TAR bruta.
              desconto_ts_potencia_valor_aplicado_meu = min(tar_potencia_regulada_meu_base, desconto_ts_potencia_dia_bruto_meu)
@@ -2689,7 +2734,7 @@ if meu_tarifario_ativo:
         # Desconto bruto da Tarifa Social para energia (se TS global estiver ativa)
         desconto_ts_energia_bruto = 0.0
         if tarifa_social: # tarifa_social é a flag global do checkbox
-            desconto_ts_energia_bruto = calc.obter_constante('Desconto TS Energia', CONSTANTES)
+            desconto_ts_energia_bruto = calc.obter_constante('Desconto TS Energia', INDICE_CONSTANTES)
 
 
         for p_key_tooltip in preco_energia_input_meu.keys():
@@ -3035,6 +3080,42 @@ if selected_pagamento_user != "Todos":
     tf_processar = tf_processar[tf_processar['pagamento'].astype(str).str.strip().isin(pagamento_para_filtrar)]
     ti_processar = ti_processar[ti_processar['pagamento'].astype(str).str.strip().isin(pagamento_para_filtrar)]
 
+# --- Otimizador da Potência Contratada (secção "Análise da Potência Contratada") ---
+if container_otimizador_potencia is not None:
+    with container_otimizador_potencia:
+        st.markdown("##### 🔎 Otimizador de Potência Contratada")
+        if opcao_horaria.lower() == "simples":
+            consumos_otimizador = {'S': consumo_simples}
+        elif opcao_horaria.lower().startswith("bi"):
+            consumos_otimizador = {'V': consumo_vazio, 'F': consumo_fora_vazio}
+        else:
+            consumos_otimizador = {'V': consumo_vazio, 'C': consumo_cheias, 'P': consumo_ponta}
+
+        resumo_potencias, _, potencia_recomendada = calc.otimizar_potencia_contratada(
+            tf_processar, opcao_horaria, consumos_otimizador, potencias_validas,
+            df_consumos_filtrado[coluna_potencia_analise], dias, tarifa_social, familia_numerosa,
+            valor_dgeg_user, valor_cav_user, incluir_quota_acp, desconto_continente,
+            INDICE_CONSTANTES, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL
+        )
+
+        if resumo_potencias['Custo mínimo (€)'].notna().any():
+            custos_por_potencia = resumo_potencias.set_index('Potência (kVA)')['Custo mínimo (€)']
+            if potencia_recomendada is None:
+                st.warning("Nenhuma potência disponível cobre a Potência Máxima Registada em todos os quartos de hora.")
+            elif potencia_recomendada == potencia:
+                st.markdown(f"✅ A potência atual (**{potencia} kVA**) é a mais barata sem ultrapassagens no período.")
+            else:
+                custo_atual = custos_por_potencia.get(potencia)
+                texto_poupanca = f", menos {custo_atual - custos_por_potencia[potencia_recomendada]:.2f} € que em {potencia} kVA" if pd.notna(custo_atual) else ""
+                st.markdown(
+                    f"💡 A potência mais barata sem ultrapassagens no período é **{potencia_recomendada} kVA** "
+                    f"({custos_por_potencia[potencia_recomendada]:.2f} €{texto_poupanca})."
+                )
+            st.markdown(criar_tabela_otimizador_potencia_html(resumo_potencias, potencia, potencia_recomendada), unsafe_allow_html=True)
+            st.caption(f"Custos dos tarifários fixos com os filtros atuais na opção {opcao_horaria}, para {dias} dias. Os quartos de hora acima consideram 1 kVA ≈ 1 kW.")
+        else:
+            st.info("Não há tarifários fixos com os filtros atuais para comparar potências.")
+
 
 #st.markdown("---")
 # FIM Seletor de Modo de Visualização - NORMAL OU OPÇÃO HORÁRIA
@@ -3422,7 +3503,25 @@ if modo_de_comparacao_ativo:
                 'P': st.session_state.get('omie_p_input_field', round(omie_medios_calculados.get('P', 0), 2))
             }
 
-            # --- 4. Loop principal para calcular os custos e construir a tabela ---
+            # --- 4. Custos de todos os tarifários fixos (todas as opções de destino) numa só passagem ---
+            consumos_lote_comp = {
+                oh: consumos_oh for oh, consumos_oh in consumos_repartidos_finais_por_oh_comp.items()
+                if consumos_oh and sum(v for v in consumos_oh.values() if v is not None) != 0
+            }
+            custos_fixos_lote_comp = calc.calcular_custos_fixos_em_lote(
+                tarifarios_fixos[tarifarios_fixos['potencia_kva'] == potencia], consumos_lote_comp,
+                dias, tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user,
+                incluir_quota_acp, desconto_continente, INDICE_CONSTANTES, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL,
+                grafo=GRAFO_CALCULO
+            )
+            # Primeira linha de cada (nome, comercializador, opção), como o df_match.iloc[0] de antes
+            posicoes_fixos_lote_comp = {}
+            for posicao, chave in enumerate(zip(custos_fixos_lote_comp['nome'], custos_fixos_lote_comp['comercializador'], custos_fixos_lote_comp['opcao_horaria_e_ciclo'])):
+                posicoes_fixos_lote_comp.setdefault(chave, posicao)
+            totais_fixos_lote_comp = custos_fixos_lote_comp['Total (€)'].to_numpy(dtype=float)
+            tooltips_fixos_lote_comp = calc.tooltips_custo_total_lote(custos_fixos_lote_comp)
+
+            # --- 5. Loop principal para construir a tabela ---
             resultados_comparacao_list = []
             nomes_tarifarios_unicos_para_comparacao = []
             if not tf_processar.empty: # USAR tf_processar
@@ -3500,17 +3599,16 @@ if modo_de_comparacao_ativo:
 
                     # Lógica para tarifários do Excel
                     if tipo_t_comp == "Fixo":
-                        df_match = tarifarios_fixos[
-                            (tarifarios_fixos['nome'] == nome_t_comp) &
-                            (tarifarios_fixos['comercializador'] == comerc_t_comp) &
-                            (tarifarios_fixos['opcao_horaria_e_ciclo'] == oh_destino_db_nome) &
-                            (tarifarios_fixos['potencia_kva'] == potencia)
-                        ]
-                        
-                        if not df_match.empty:
-                            dados_tarifario_especifico_para_calculo = df_match.iloc[0]
-                    
-                    elif tipo_t_comp.startswith("Indexado"):
+                        # Já calculado no lote (custo e tooltip)
+                        posicao_lote = posicoes_fixos_lote_comp.get((nome_t_comp, comerc_t_comp, oh_destino_db_nome))
+                        if posicao_lote is not None:
+                            if pd.notna(totais_fixos_lote_comp[posicao_lote]):
+                                linha_para_aggrid[nome_coluna_aggrid_para_este_oh] = totais_fixos_lote_comp[posicao_lote]
+                                linha_para_aggrid[f'Tooltip_{nome_coluna_aggrid_para_este_oh}'] = tooltips_fixos_lote_comp[posicao_lote]
+                                teve_pelo_menos_um_calculo_nesta_linha = True
+                        continue
+
+                    if tipo_t_comp.startswith("Indexado"):
                         df_match_idx = tarifarios_indexados[
                             (tarifarios_indexados['nome'] == nome_t_comp) &
                             (tarifarios_indexados['comercializador'] == comerc_t_comp) &
@@ -3523,24 +3621,20 @@ if modo_de_comparacao_ativo:
 
                     if dados_tarifario_especifico_para_calculo is not None:
                         resultado_celula = None
-                        if tipo_t_comp == "Fixo":
-                            resultado_celula = calc.calcular_detalhes_custo_tarifario_fixo(
-                                dados_tarifario_especifico_para_calculo, oh_destino_db_nome,
-                                consumos_para_calculo_nesta_oh, potencia, dias, tarifa_social, familia_numerosa,
-                                valor_dgeg_user, valor_cav_user, incluir_quota_acp, desconto_continente,
-                                CONSTANTES, dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL
-                            )
-                        elif tipo_t_comp.startswith("Indexado"):
+                        if tipo_t_comp.startswith("Indexado"):
                             resultado_celula = calc.calcular_detalhes_custo_tarifario_indexado(
                                 dados_tarifario_especifico_para_calculo, oh_destino_db_nome, opcao_horaria,
                                 consumos_para_calculo_nesta_oh, potencia, dias, tarifa_social, familia_numerosa,
-                                valor_dgeg_user, valor_cav_user, CONSTANTES,
+                                valor_dgeg_user, valor_cav_user, INDICE_CONSTANTES,
                                 df_omie_ajustado,
                                 perdas_medias,
                                 todos_omie_inputs_utilizador_comp_comparacao,
                                 omie_medios_calculados_para_todos_ciclos,
                                 omie_medio_simples_real_kwh, # OMIE real simples para Luzigas
-                                dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL
+                                dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL,
+                                grafo=GRAFO_CALCULO, chave_omie=chave_omie_ajustado,
+                                omie_editado_manualmente=st.session_state.omie_foi_editado_manualmente,
+                                delta_omie=delta_omie_sensibilidade
                             )
                         
                         if resultado_celula and pd.notna(resultado_celula.get('Total (€)')):
@@ -3582,7 +3676,7 @@ if modo_de_comparacao_ativo:
                 # Calcular o custo para esta célula se houver preços definidos
                 if preco_potencia_pers > 0 or any(p > 0 for p in precos_energia_pers.values()):
                     resultado_celula = calc.calcular_custo_personalizado(
-                        precos_energia_pers, preco_potencia_pers, consumos_desta_coluna, dados_pers['flags'], CONSTANTES, FINANCIAMENTO_TSE_VAL,
+                        precos_energia_pers, preco_potencia_pers, consumos_desta_coluna, dados_pers['flags'], INDICE_CONSTANTES, FINANCIAMENTO_TSE_VAL,
                         dias=dias, potencia=potencia, tarifa_social=tarifa_social, familia_numerosa=familia_numerosa,
                         valor_dgeg_user=valor_dgeg_user, valor_cav_user=valor_cav_user, opcao_horaria_ref=oh_destino, 
                     )
@@ -3601,6 +3695,9 @@ if modo_de_comparacao_ativo:
                 (ti_processar['potencia_kva'] == potencia)
             ].copy()
 
+            # Merge consumos x OMIE feito uma única vez para todos os tarifários de diagrama
+            diagrama_alinhado = obter_diagrama_alinhado(df_consumos_a_utilizar)
+
             # Agrupar por nome do tarifário para fazer um único cálculo por tarifário
             for nome_tarifario_agrupado, grupo in tarifarios_para_calculo_real.groupby('nome'):
             
@@ -3629,9 +3726,9 @@ if modo_de_comparacao_ativo:
                     
                         resultado_real_dict = calc.calcular_custo_completo_diagrama_carga(
                             tarifario_real_especifico, 
-                            df_consumos_a_utilizar,
+                            diagrama_alinhado,
                             OMIE_PERDAS_CICLOS,
-                            CONSTANTES,
+                            INDICE_CONSTANTES,
                             dias, 
                             potencia, 
                             familia_numerosa, 
@@ -3643,7 +3740,9 @@ if modo_de_comparacao_ativo:
                             incluir_quota_acp, 
                             desconto_continente,
                             FINANCIAMENTO_TSE_VAL, 
-                            VALOR_QUOTA_ACP_MENSAL
+                            VALOR_QUOTA_ACP_MENSAL,
+                            grafo=GRAFO_CALCULO,
+                            delta_omie=delta_omie_sensibilidade
                         )
 
                         if resultado_real_dict:
@@ -4423,9 +4522,9 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                 # --- Passo 1: Identificar Componentes Base (Sem IVA, Sem TS) ---
                 tar_energia_regulada_tf = {}
                 for periodo in preco_energia_input_tf.keys():
-                    tar_energia_regulada_tf[periodo] = calc.obter_tar_energia_periodo(opcao_horaria, periodo, potencia, CONSTANTES)
+                    tar_energia_regulada_tf[periodo] = calc.obter_tar_energia_periodo(opcao_horaria, periodo, potencia, INDICE_CONSTANTES)
 
-                tar_potencia_regulada_tf = calc.obter_tar_dia(potencia, CONSTANTES)
+                tar_potencia_regulada_tf = calc.obter_tar_dia(potencia, INDICE_CONSTANTES)
 
                 preco_comercializador_energia_tf = {}
                 for periodo, preco_in in preco_energia_input_tf.items():
@@ -4449,8 +4548,8 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                 tar_potencia_final_dia_tf = tar_potencia_regulada_tf
 
                 if tarifa_social: # Flag global
-                    desconto_ts_energia = calc.obter_constante('Desconto TS Energia', CONSTANTES)
-                    desconto_ts_potencia_dia = calc.obter_constante(f'Desconto TS Potencia {potencia}', CONSTANTES)
+                    desconto_ts_energia = calc.obter_constante('Desconto TS Energia', INDICE_CONSTANTES)
+                    desconto_ts_potencia_dia = calc.obter_desconto_ts_potencia(potencia, INDICE_CONSTANTES)
                     for periodo, tar_reg in tar_energia_regulada_tf.items():
                         tar_energia_final_tf[periodo] = tar_reg - desconto_ts_energia
                     tar_potencia_final_dia_tf = max(0.0, tar_potencia_regulada_tf - desconto_ts_potencia_dia)
@@ -4478,7 +4577,7 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                     ts_aplicada_energia_flag_para_tooltip_tf = ts_global_ativa
                     desconto_ts_energia_unitario_para_tooltip_tf = 0.0
                     if ts_global_ativa:
-                        desconto_ts_energia_unitario_para_tooltip_tf = calc.obter_constante('Desconto TS Energia', CONSTANTES)
+                        desconto_ts_energia_unitario_para_tooltip_tf = calc.obter_constante('Desconto TS Energia', INDICE_CONSTANTES)
 
                     # Usar os nomes EXATOS que o JavaScript espera
                     componentes_tooltip_energia_dict_tf[f'tooltip_energia_{periodo_key_tf}_comerc_sem_tar'] = comp_comerc_energia_base_tf
@@ -4490,7 +4589,7 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
             
                 desconto_ts_potencia_valor_aplicado = 0.0
                 if tarifa_social: # Flag global
-                    desconto_ts_potencia_dia_bruto = calc.obter_constante(f'Desconto TS Potencia {potencia}', CONSTANTES)
+                    desconto_ts_potencia_dia_bruto = calc.obter_desconto_ts_potencia(potencia, INDICE_CONSTANTES)
                     # O desconto efetivamente aplicado é o mínimo entre o desconto e a própria TAR
                     desconto_ts_potencia_valor_aplicado = min(tar_potencia_regulada_tf, desconto_ts_potencia_dia_bruto)
 
@@ -4824,6 +4923,46 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                 (ti_processar['potencia_kva'] == potencia)
             ].copy()
 
+            constantes = dict(zip(CONSTANTES["constante"], CONSTANTES["valor_unitário"]))
+
+            # --- Preços base dos indexados quarto-horários (BTN e Luzboa) numa só passagem pelos dados OMIE ---
+            perfil_coluna_btn = f"BTN_{calc.obter_perfil(consumo, dias, potencia).split('_')[1].upper()}"
+            coluna_ciclo_btn = None
+            if opcao_horaria.lower().startswith("bi"):
+                coluna_ciclo_btn = 'BD' if "Diário" in opcao_horaria else 'BS'
+            elif opcao_horaria.lower().startswith("tri"):
+                coluna_ciclo_btn = 'TD' if "Diário" in opcao_horaria else 'TS'
+            formulas_indexados = (
+                tarifarios_filtrados_indexados['formula_calculo'].astype(str) if 'formula_calculo' in tarifarios_filtrados_indexados.columns
+                else pd.Series('', index=tarifarios_filtrados_indexados.index)
+            )
+            formulas_indexados_btn = {
+                nome_btn: formula_btn for nome_btn, formula_btn in zip(tarifarios_filtrados_indexados['nome'], formulas_indexados)
+                if 'BTN' in formula_btn or nome_btn == calc.NOME_LUZBOA_BTN
+            }
+            # Coeficientes afins no OMIE calculados uma vez por período: os OMIE manuais e a sensibilidade
+            # são aplicados sobre eles, sem nova passagem pelos dados OMIE
+            coeficientes_omie_btn = calc.obter_coeficientes_omie_indexados_btn(
+                GRAFO_CALCULO, chave_omie_periodo, df_omie_no_periodo_selecionado, formulas_indexados_btn, constantes, perfil_coluna_btn, coluna_ciclo_btn
+            )
+            precos_indexados_btn = coeficientes_omie_btn.precos(omie_manuais, delta_omie_sensibilidade)
+            if coeficientes_omie_btn.nao_afins and (omie_manuais or delta_omie_sensibilidade):
+                # Fórmulas que não são afins no OMIE: cálculo completo com os OMIE ajustados
+                precos_indexados_btn.update(calc.calcular_precos_indexados_btn(
+                    calc.aplicar_omie_manual(df_omie_no_periodo_selecionado, coluna_ciclo_btn, omie_manuais, delta_omie_sensibilidade),
+                    {nome_btn: formulas_indexados_btn[nome_btn] for nome_btn in coeficientes_omie_btn.nao_afins},
+                    constantes, perfil_coluna_btn, coluna_ciclo_btn
+                ))
+
+            # Tarifários de média: o OMIE médio de cada período desloca-se o mesmo valor
+            omie_para_tarifarios_media_tabela = {p_key: valor + delta_omie_sensibilidade for p_key, valor in omie_para_tarifarios_media.items()}
+            omie_medio_simples_tabela_kwh = omie_medio_simples_real_kwh + delta_omie_sensibilidade / 1000.0
+
+            # Diagrama de carga alinhado com o OMIE (um único merge para todos os tarifários quarto-horários)
+            diagrama_alinhado_indexados = None
+            if st.session_state.get('dados_completos_ficheiro') is not None:
+                diagrama_alinhado_indexados = obter_diagrama_alinhado(df_consumos_a_utilizar)
+
             # Usar a estrutura simplificada do if/else
             if not tarifarios_filtrados_indexados.empty:
                 for index, tarifario_indexado in tarifarios_filtrados_indexados.iterrows():
@@ -4839,8 +4978,6 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                     formula_energia = str(tarifario_indexado.get('formula_calculo', ''))
                     preco_potencia_dia = tarifario_indexado['preco_potencia_dia']
 
-                    constantes = dict(zip(CONSTANTES["constante"], CONSTANTES["valor_unitário"]))
-
                     # Inicializar variáveis de preço
                     preco_energia_simples_indexado = None
                     preco_energia_vazio_indexado = None
@@ -4852,158 +4989,55 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                         # --- BLOCO 1: Cálculo para Indexados Quarto-Horários (BTN ou Luzboa "BTN SPOTDEF") ---
                         # Assume que 'BTN' em formula_energia ou o nome Luzboa identifica corretamente estes tarifários
                     if 'BTN' in formula_energia or nome_tarifario == "Luzboa | BTN SPOTDEF":
+                        precos_btn = precos_indexados_btn[nome_tarifario]
 
                         # --- Tratamento especial para Luzboa | BTN SPOTDEF ---
                         if nome_tarifario == "Luzboa | BTN SPOTDEF":
-                            # [LÓGICA Luzboa | Mantida como estava na versão anterior que funcionava]
-                            soma_luzboa_simples, count_luzboa_simples = 0.0, 0
-                            soma_luzboa_vazio, count_luzboa_vazio = 0.0, 0
-                            soma_luzboa_fv, count_luzboa_fv = 0.0, 0
-                            soma_luzboa_cheias, count_luzboa_cheias = 0.0, 0
-                            soma_luzboa_ponta, count_luzboa_ponta = 0.0, 0
-
-                            coluna_ciclo_luzboa = None
-                            if opcao_horaria.lower().startswith("bi"):
-                                coluna_ciclo_luzboa = 'BD' if "Diário" in opcao_horaria else 'BS'
-                            elif opcao_horaria.lower().startswith("tri"):
-                                coluna_ciclo_luzboa = 'TD' if "Diário" in opcao_horaria else 'TS'
-
-                            if coluna_ciclo_luzboa and coluna_ciclo_luzboa not in df_omie_ajustado.columns and not opcao_horaria.lower() == "simples":
-                                st.warning(f"Coluna de ciclo '{coluna_ciclo_luzboa}' não encontrada para Luzboa. Energia será zero.")
+                            # Média simples (não ponderada pelo perfil), calculada em calc.calcular_precos_indexados_btn
+                            if coluna_ciclo_btn and coluna_ciclo_btn not in df_omie_ajustado.columns and not opcao_horaria.lower() == "simples":
+                                st.warning(f"Coluna de ciclo '{coluna_ciclo_btn}' não encontrada para Luzboa. Energia será zero.")
                                 if opcao_horaria.lower() == "simples": preco_energia_simples_indexado = 0.0
                                 else: preco_energia_vazio_indexado, preco_energia_fora_vazio_indexado, preco_energia_cheias_indexado, preco_energia_ponta_indexado = 0.0, 0.0, 0.0, 0.0
-                            else: # Calcular apenas se coluna de ciclo existe (ou se for simples)
-                                for _, row_omie in df_omie_ajustado.iterrows():
-                                    if not all(k in row_omie and pd.notna(row_omie[k]) for k in ['OMIE', 'Perdas']): continue
-                                    omie_val = row_omie['OMIE'] / 1000; perdas_val = row_omie['Perdas']
-                                    cgs_luzboa = constantes.get('Luzboa_CGS', 0.0); fa_luzboa = constantes.get('Luzboa_FA', 1.0); kp_luzboa = constantes.get('Luzboa_Kp', 0.0)
-                                    valor_hora_luzboa = (omie_val + cgs_luzboa) * perdas_val * fa_luzboa + kp_luzboa
-                                    if opcao_horaria.lower() == "simples": soma_luzboa_simples += valor_hora_luzboa; count_luzboa_simples += 1
-                                    elif coluna_ciclo_luzboa and coluna_ciclo_luzboa in row_omie and pd.notna(row_omie[coluna_ciclo_luzboa]):
-                                        ciclo_hora = row_omie[coluna_ciclo_luzboa]
-                                        if opcao_horaria.lower().startswith("bi"):
-                                            if ciclo_hora == 'V': soma_luzboa_vazio += valor_hora_luzboa; count_luzboa_vazio += 1
-                                            elif ciclo_hora == 'F': soma_luzboa_fv += valor_hora_luzboa; count_luzboa_fv += 1
-                                        elif opcao_horaria.lower().startswith("tri"):
-                                            if ciclo_hora == 'V': soma_luzboa_vazio += valor_hora_luzboa; count_luzboa_vazio += 1
-                                            elif ciclo_hora == 'C': soma_luzboa_cheias += valor_hora_luzboa; count_luzboa_cheias += 1
-                                            elif ciclo_hora == 'P': soma_luzboa_ponta += valor_hora_luzboa; count_luzboa_ponta += 1
-                                prec = 4
-                                if opcao_horaria.lower() == "simples": preco_energia_simples_indexado = round(soma_luzboa_simples / count_luzboa_simples, 4) if count_luzboa_simples > 0 else 0.0
-                                elif opcao_horaria.lower().startswith("bi"):
-                                    preco_energia_vazio_indexado = round(soma_luzboa_vazio / count_luzboa_vazio, prec) if count_luzboa_vazio > 0 else 0.0
-                                    preco_energia_fora_vazio_indexado = round(soma_luzboa_fv / count_luzboa_fv, prec) if count_luzboa_fv > 0 else 0.0
-                                elif opcao_horaria.lower().startswith("tri"):
-                                    preco_energia_vazio_indexado = round(soma_luzboa_vazio / count_luzboa_vazio, prec) if count_luzboa_vazio > 0 else 0.0
-                                    preco_energia_cheias_indexado = round(soma_luzboa_cheias / count_luzboa_cheias, prec) if count_luzboa_cheias > 0 else 0.0
-                                    preco_energia_ponta_indexado = round(soma_luzboa_ponta / count_luzboa_ponta, prec) if count_luzboa_ponta > 0 else 0.0
+                            elif opcao_horaria.lower() == "simples":
+                                preco_energia_simples_indexado = precos_btn['S']
+                            elif opcao_horaria.lower().startswith("bi"):
+                                preco_energia_vazio_indexado, preco_energia_fora_vazio_indexado = precos_btn['V'], precos_btn['F']
+                            elif opcao_horaria.lower().startswith("tri"):
+                                preco_energia_vazio_indexado, preco_energia_cheias_indexado, preco_energia_ponta_indexado = precos_btn['V'], precos_btn['C'], precos_btn['P']
                             # --- FIM LÓGICA LUZBOA ---
 
                         else: # Outros Tarifários Quarto-Horários (Coopernico, Repsol, Galp, etc.)
                             # [LÓGICA PARA OUTROS BTN COM PERFIL - INCLUI AJUSTE REPSOL]
-                            perfil_coluna = f"BTN_{calc.obter_perfil(consumo, dias, potencia).split('_')[1].upper()}"
                             # Verifica se coluna de perfil existe
-                            if perfil_coluna not in df_omie_ajustado.columns:
-                                st.warning(f"Coluna de perfil '{perfil_coluna}' não encontrada para '{nome_tarifario}'. Energia será zero.")
+                            if perfil_coluna_btn not in df_omie_ajustado.columns:
+                                st.warning(f"Coluna de perfil '{perfil_coluna_btn}' não encontrada para '{nome_tarifario}'. Energia será zero.")
                                 if opcao_horaria.lower() == "simples": preco_energia_simples_indexado = 0.0
                                 else: preco_energia_vazio_indexado, preco_energia_fora_vazio_indexado, preco_energia_cheias_indexado, preco_energia_ponta_indexado = 0.0, 0.0, 0.0, 0.0
-                            else: # Coluna de perfil existe, prosseguir com cálculos
-                                soma_calculo_simples, soma_perfil_simples = 0.0, 0.0; soma_calculo_vazio, soma_perfil_vazio = 0.0, 0.0; soma_calculo_fv, soma_perfil_fv = 0.0, 0.0; soma_calculo_cheias, soma_perfil_cheias = 0.0, 0.0; soma_calculo_ponta, soma_perfil_ponta = 0.0, 0.0
-                                coluna_ciclo = None
-                                cycle_column_ok = True # Assumir que está OK por defeito
-
-                                if not opcao_horaria.lower() == "simples":
-                                    if opcao_horaria.lower().startswith("bi"): coluna_ciclo = 'BD' if "Diário" in opcao_horaria else 'BS'
-                                    elif opcao_horaria.lower().startswith("tri"): coluna_ciclo = 'TD' if "Diário" in opcao_horaria else 'TS'
-                                    
-                                    if coluna_ciclo and coluna_ciclo not in df_omie_ajustado.columns:
-                                        st.warning(f"Coluna de ciclo '{coluna_ciclo}' não encontrada para '{nome_tarifario}' com '{opcao_horaria}'. Preços específicos V/F/C/P podem ser zero.")
-                                        cycle_column_ok = False
-                                        # Definir preços específicos a zero, mas o simples ainda pode ser calculado
-                                        preco_energia_vazio_indexado, preco_energia_fora_vazio_indexado, preco_energia_cheias_indexado, preco_energia_ponta_indexado = 0.0, 0.0, 0.0, 0.0
-
-                                # Loop sobre os dados OMIE do período já filtrado (df_omie_ajustado)
-                                for _, row_omie in df_omie_ajustado.iterrows():
-                                    required_cols_check = ['OMIE', 'Perdas', perfil_coluna]
-                                    if not all(k in row_omie and pd.notna(row_omie[k]) for k in required_cols_check): continue
-                                    omie = row_omie['OMIE'] / 1000; perdas = row_omie['Perdas']; perfil = row_omie[perfil_coluna]
-                                    if perfil <= 0: continue
-
-                                    calculo_instantaneo_sem_perfil = 0.0
-                                    # --- Fórmulas específicas BTN ---
-                                    if nome_tarifario == "Coopérnico | Base": calculo_instantaneo_sem_perfil = (omie + constantes.get('Coop_CS_CR', 0.0) + constantes.get('Coop_K', 0.0)) * perdas
-                                    elif nome_tarifario == "Coopérnico | GO": calculo_instantaneo_sem_perfil = (omie + constantes.get('Coop_CS_CR', 0.0) + constantes.get('Coop_K', 0.0)) * perdas + constantes.get('Coop_GO', 0.0)
-                                    elif nome_tarifario == "Repsol | Leve Sem Mais": calculo_instantaneo_sem_perfil = (omie * perdas * constantes.get('Repsol_FA', 0.0) + constantes.get('Repsol_Q_Tarifa', 0.0))
-                                    elif nome_tarifario == "Repsol | Leve PRO Sem Mais": calculo_instantaneo_sem_perfil = (omie * perdas * constantes.get('Repsol_FA', 0.0) + constantes.get('Repsol_Q_Tarifa_Pro', 0.0))
-                                    elif nome_tarifario == "Galp | Plano Flexível / Dinâmico": calculo_instantaneo_sem_perfil = (omie + constantes.get('Galp_Ci', 0.0)) * perdas
-                                    elif nome_tarifario == "Alfa Energia | ALFA POWER INDEX BTN": calculo_instantaneo_sem_perfil = ((omie + constantes.get('Alfa_CGS', 0.0)) * perdas + constantes.get('Alfa_K', 0.0))
-                                    elif nome_tarifario == "Plenitude | Tendência": calculo_instantaneo_sem_perfil = (((omie + constantes.get('Plenitude_CGS', 0.0) + constantes.get('Plenitude_GDOs', 0.0))) * perdas + constantes.get('Plenitude_Fee', 0.0))
-                                    elif nome_tarifario == "Meo Energia | Tarifa Dinâmica": calculo_instantaneo_sem_perfil = (omie + constantes.get('Meo_K', 0.0)) * perdas
-                                    elif nome_tarifario == "EDP | Eletricidade Indexada Horária": calculo_instantaneo_sem_perfil = (omie * perdas * constantes.get('EDP_H_K1', 1.0) + constantes.get('EDP_H_K2', 0.0))
-                                    elif nome_tarifario == "EZU | Indexada": calculo_instantaneo_sem_perfil = (omie + constantes.get('EZU_K', 0.0) + constantes.get('EZU_CGS', 0.0)) * perdas
-                                    elif nome_tarifario == "G9 | Smart Dynamic": calculo_instantaneo_sem_perfil = (omie * constantes.get('G9_FA', 0.0) * perdas + constantes.get('G9_CGS', 0.0) + constantes.get('G9_AC', 0.0))
-                                    elif nome_tarifario == "G9 | Smart Dynamic (Empresarial)": calculo_instantaneo_sem_perfil = (omie * constantes.get('G9_FA', 0.0) * perdas + constantes.get('G9_CGS', 0.0) + constantes.get('G9_AC', 0.0))
-                                    elif nome_tarifario == "Iberdrola | Simples Indexado Dinâmico": calculo_instantaneo_sem_perfil = (omie * perdas + constantes.get("Iberdrola_Dinamico_Q", 0.0) + constantes.get('Iberdrola_mFRR', 0.0))
-
-
-                                    else: calculo_instantaneo_sem_perfil = omie * perdas # Fallback genérico
-                                    # --- Fim Fórmulas ---
-
-                                    # --- Acumular Somas ---
-                                    # Acumula SEMPRE nas somas simples (gerais ponderadas pelo perfil)
-                                    soma_calculo_simples += calculo_instantaneo_sem_perfil * perfil
-                                    soma_perfil_simples += perfil
-
-                                    # Acumula nas somas específicas do período SE aplicável e coluna de ciclo OK
-                                    if cycle_column_ok and coluna_ciclo and coluna_ciclo in row_omie and pd.notna(row_omie[coluna_ciclo]):
-                                        ciclo_hora = row_omie[coluna_ciclo]
-                                        if opcao_horaria.lower().startswith("bi"):
-                                            if ciclo_hora == 'V': soma_calculo_vazio += calculo_instantaneo_sem_perfil * perfil; soma_perfil_vazio += perfil
-                                            elif ciclo_hora == 'F': soma_calculo_fv += calculo_instantaneo_sem_perfil * perfil; soma_perfil_fv += perfil
-                                        elif opcao_horaria.lower().startswith("tri"):
-                                            if ciclo_hora == 'V': soma_calculo_vazio += calculo_instantaneo_sem_perfil * perfil; soma_perfil_vazio += perfil
-                                            elif ciclo_hora == 'C': soma_calculo_cheias += calculo_instantaneo_sem_perfil * perfil; soma_perfil_cheias += perfil
-                                            elif ciclo_hora == 'P': soma_calculo_ponta += calculo_instantaneo_sem_perfil * perfil; soma_perfil_ponta += perfil
-                                # --- Fim loop horas ---
-                                    
-                                prec = 4
+                            else: # Coluna de perfil existe, usar as médias ponderadas pelo perfil
+                                if coluna_ciclo_btn and coluna_ciclo_btn not in df_omie_ajustado.columns:
+                                    # Sem coluna de ciclo os preços V/F/C/P vêm a zero; o simples ainda é calculado
+                                    st.warning(f"Coluna de ciclo '{coluna_ciclo_btn}' não encontrada para '{nome_tarifario}' com '{opcao_horaria}'. Preços específicos V/F/C/P podem ser zero.")
+
                                 # --- Cálculo de preços FINAIS para BTN ---
-                                if nome_tarifario == "Repsol - Leve Sem Mais":
+                                if nome_tarifario in ("Repsol - Leve Sem Mais", "Repsol - Leve PRO Sem Mais"):
                                     # Repsol usa sempre o preço calculado como se fosse Simples
-                                    preco_simples_repsol = round(soma_calculo_simples / soma_perfil_simples, prec) if soma_perfil_simples > 0 else 0.0
-                                    preco_energia_simples_indexado = preco_simples_repsol
-                                    preco_energia_vazio_indexado = preco_simples_repsol
-                                    preco_energia_fora_vazio_indexado = preco_simples_repsol
-                                    preco_energia_cheias_indexado = preco_simples_repsol
-                                    preco_energia_ponta_indexado = preco_simples_repsol
-                                elif nome_tarifario == "Repsol - Leve PRO Sem Mais":
-                                    # Repsol usa sempre o preço calculado como se fosse Simples
-                                    preco_simples_repsol_pro = round(soma_calculo_simples / soma_perfil_simples, prec) if soma_perfil_simples > 0 else 0.0
-                                    preco_energia_simples_indexado = preco_simples_repsol_pro
-                                    preco_energia_vazio_indexado = preco_simples_repsol_pro
-                                    preco_energia_fora_vazio_indexado = preco_simples_repsol_pro
-                                    preco_energia_cheias_indexado = preco_simples_repsol_pro
-                                    preco_energia_ponta_indexado = preco_simples_repsol_pro                            
-                                else:
-                                    # Cálculo normal para os outros BTN
-                                    if opcao_horaria.lower() == "simples":
-                                        preco_energia_simples_indexado = round(soma_calculo_simples / soma_perfil_simples, prec) if soma_perfil_simples > 0 else 0.0
-                                    elif opcao_horaria.lower().startswith("bi"):
-                                        preco_energia_vazio_indexado = round(soma_calculo_vazio / soma_perfil_vazio, prec) if soma_perfil_vazio > 0 else 0.0
-                                        preco_energia_fora_vazio_indexado = round(soma_calculo_fv / soma_perfil_fv, prec) if soma_perfil_fv > 0 else 0.0
-                                    elif opcao_horaria.lower().startswith("tri"):
-                                        preco_energia_vazio_indexado = round(soma_calculo_vazio / soma_perfil_vazio, prec) if soma_perfil_vazio > 0 else 0.0
-                                        preco_energia_cheias_indexado = round(soma_calculo_cheias / soma_perfil_cheias, prec) if soma_perfil_cheias > 0 else 0.0
-                                        preco_energia_ponta_indexado = round(soma_calculo_ponta / soma_perfil_ponta, prec) if soma_perfil_ponta > 0 else 0.0
+                                    preco_energia_simples_indexado = preco_energia_vazio_indexado = preco_energia_fora_vazio_indexado = precos_btn['S']
+                                    preco_energia_cheias_indexado = preco_energia_ponta_indexado = precos_btn['S']
+                                elif opcao_horaria.lower() == "simples":
+                                    preco_energia_simples_indexado = precos_btn['S']
+                                elif opcao_horaria.lower().startswith("bi"):
+                                    preco_energia_vazio_indexado, preco_energia_fora_vazio_indexado = precos_btn['V'], precos_btn['F']
+                                elif opcao_horaria.lower().startswith("tri"):
+                                    preco_energia_vazio_indexado, preco_energia_cheias_indexado, preco_energia_ponta_indexado = precos_btn['V'], precos_btn['C'], precos_btn['P']
                         # --- FIM LÓGICA OUTROS BTN ---
 
                     # --- BLOCO 2: Cálculo para Indexados Média ---
                     else: # Se não for Quarto-Horário (BTN ou Luzboa)
                         # --- INÍCIO LÓGICA MÉDIA CORRIGIDA ---
                         omie_medio_simples_input_kwh = None; omie_medio_vazio_kwh = None; omie_medio_fv_kwh = None; omie_medio_cheias_kwh = None; omie_medio_ponta_kwh = None
-                        if opcao_horaria.lower() == "simples": omie_medio_simples_input_kwh = omie_para_tarifarios_media.get('S', 0.0) / 1000.0
-                        elif opcao_horaria.lower().startswith("bi"): omie_medio_vazio_kwh = omie_para_tarifarios_media.get('V', 0.0) / 1000.0; omie_medio_fv_kwh = omie_para_tarifarios_media.get('F', 0.0) / 1000.0
-                        elif opcao_horaria.lower().startswith("tri"): omie_medio_vazio_kwh = omie_para_tarifarios_media.get('V', 0.0) / 1000.0; omie_medio_cheias_kwh = omie_para_tarifarios_media.get('C', 0.0) / 1000.0; omie_medio_ponta_kwh = omie_para_tarifarios_media.get('P', 0.0) / 1000.0
+                        if opcao_horaria.lower() == "simples": omie_medio_simples_input_kwh = omie_para_tarifarios_media_tabela.get('S', 0.0) / 1000.0
+                        elif opcao_horaria.lower().startswith("bi"): omie_medio_vazio_kwh = omie_para_tarifarios_media_tabela.get('V', 0.0) / 1000.0; omie_medio_fv_kwh = omie_para_tarifarios_media_tabela.get('F', 0.0) / 1000.0
+                        elif opcao_horaria.lower().startswith("tri"): omie_medio_vazio_kwh = omie_para_tarifarios_media_tabela.get('V', 0.0) / 1000.0; omie_medio_cheias_kwh = omie_para_tarifarios_media_tabela.get('C', 0.0) / 1000.0; omie_medio_ponta_kwh = omie_para_tarifarios_media_tabela.get('P', 0.0) / 1000.0
                         prec = 4
 
                         if opcao_horaria.lower() == "simples":
@@ -5026,8 +5060,8 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                             ciclo_bi = 'BD' if "Diário" in opcao_horaria else 'BS'
                             perdas_v_anual = perdas_medias.get(f'Perdas_Anual_{ciclo_bi}_V', 1.0); perdas_f_anual = perdas_medias.get(f'Perdas_Anual_{ciclo_bi}_F', 1.0)
                             omie_v_a_usar = omie_medio_vazio_kwh if omie_medio_vazio_kwh is not None else 0.0; omie_f_a_usar = omie_medio_fv_kwh if omie_medio_fv_kwh is not None else 0.0
-                            if nome_tarifario == "LUZiGÁS | Energy 8.8": k_luzigas = constantes.get('Luzigas_8_8_K', 0.0); cgs_luzigas = constantes.get('Luzigas_CGS', 0.0); calc_base = omie_medio_simples_real_kwh + k_luzigas + cgs_luzigas; preco_energia_vazio_indexado = round(calc_base * perdas_v_anual, prec); preco_energia_fora_vazio_indexado = round(calc_base * perdas_f_anual, prec)
-                            elif nome_tarifario == "LUZiGÁS | Super Lig Index": k_luzigas = constantes.get('Luzigas_K', 0.0); cgs_luzigas = constantes.get('Luzigas_CGS', 0.0); calc_base = omie_medio_simples_real_kwh + k_luzigas + cgs_luzigas; preco_energia_vazio_indexado = round(calc_base * perdas_v_anual, prec); preco_energia_fora_vazio_indexado = round(calc_base * perdas_f_anual, prec)
+                            if nome_tarifario == "LUZiGÁS | Energy 8.8": k_luzigas = constantes.get('Luzigas_8_8_K', 0.0); cgs_luzigas = constantes.get('Luzigas_CGS', 0.0); calc_base = omie_medio_simples_tabela_kwh + k_luzigas + cgs_luzigas; preco_energia_vazio_indexado = round(calc_base * perdas_v_anual, prec); preco_energia_fora_vazio_indexado = round(calc_base * perdas_f_anual, prec)
+                            elif nome_tarifario == "LUZiGÁS | Super Lig Index": k_luzigas = constantes.get('Luzigas_K', 0.0); cgs_luzigas = constantes.get('Luzigas_CGS', 0.0); calc_base = omie_medio_simples_tabela_kwh + k_luzigas + cgs_luzigas; preco_energia_vazio_indexado = round(calc_base * perdas_v_anual, prec); preco_energia_fora_vazio_indexado = round(calc_base * perdas_f_anual, prec)
                             elif nome_tarifario == "Endesa | Tarifa Indexada": preco_energia_vazio_indexado = round(omie_v_a_usar + constantes.get('Endesa_A_V', 0.0), prec); preco_energia_fora_vazio_indexado = round(omie_f_a_usar + constantes.get('Endesa_A_FV', 0.0), prec)
                             elif nome_tarifario == "Ibelectra | Solução Família": cs_ib = constantes.get('Ibelectra_CS', 0.0); k_ib = constantes.get('Ibelectra_K', 0.0); preco_energia_vazio_indexado = round((omie_v_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0) + k_ib, prec); preco_energia_fora_vazio_indexado = round((omie_f_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0) + k_ib, prec)                    
                             elif nome_tarifario == "Ibelectra | Solução Amigo": cs_ib = constantes.get('Ibelectra_CS', 0.0); k_ib = constantes.get('Ibelectra_K_a', 0.0); preco_energia_vazio_indexado = round((omie_v_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0) + k_ib, prec); preco_energia_fora_vazio_indexado = round((omie_f_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0) + k_ib, prec)                    
@@ -5038,8 +5072,8 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                         elif opcao_horaria.lower().startswith("tri"):
                             ciclo_tri = 'TD' if "Diário" in opcao_horaria else 'TS'; perdas_v_anual = perdas_medias.get(f'Perdas_Anual_{ciclo_tri}_V', 1.0); perdas_c_anual = perdas_medias.get(f'Perdas_Anual_{ciclo_tri}_C', 1.0); perdas_p_anual = perdas_medias.get(f'Perdas_Anual_{ciclo_tri}_P', 1.0)
                             omie_v_a_usar = omie_medio_vazio_kwh if omie_medio_vazio_kwh is not None else 0.0; omie_c_a_usar = omie_medio_cheias_kwh if omie_medio_cheias_kwh is not None else 0.0; omie_p_a_usar = omie_medio_ponta_kwh if omie_medio_ponta_kwh is not None else 0.0
-                            if nome_tarifario == "LUZiGÁS | Energy 8.8": k_luzigas = constantes.get('Luzigas_8_8_K', 0.0); cgs_luzigas = constantes.get('Luzigas_CGS', 0.0); calc_base = omie_medio_simples_real_kwh + k_luzigas + cgs_luzigas; preco_energia_vazio_indexado = round(calc_base * perdas_v_anual, prec); preco_energia_cheias_indexado = round(calc_base * perdas_c_anual, prec); preco_energia_ponta_indexado = round(calc_base * perdas_p_anual, prec)
-                            elif nome_tarifario == "LUZiGÁS | Super Lig Index": k_luzigas = constantes.get('Luzigas_K', 0.0); cgs_luzigas = constantes.get('Luzigas_CGS', 0.0); calc_base = omie_medio_simples_real_kwh + k_luzigas + cgs_luzigas; preco_energia_vazio_indexado = round(calc_base * perdas_v_anual, prec); preco_energia_cheias_indexado = round(calc_base * perdas_c_anual, prec); preco_energia_ponta_indexado = round(calc_base * perdas_p_anual, prec)
+                            if nome_tarifario == "LUZiGÁS | Energy 8.8": k_luzigas = constantes.get('Luzigas_8_8_K', 0.0); cgs_luzigas = constantes.get('Luzigas_CGS', 0.0); calc_base = omie_medio_simples_tabela_kwh + k_luzigas + cgs_luzigas; preco_energia_vazio_indexado = round(calc_base * perdas_v_anual, prec); preco_energia_cheias_indexado = round(calc_base * perdas_c_anual, prec); preco_energia_ponta_indexado = round(calc_base * perdas_p_anual, prec)
+                            elif nome_tarifario == "LUZiGÁS | Super Lig Index": k_luzigas = constantes.get('Luzigas_K', 0.0); cgs_luzigas = constantes.get('Luzigas_CGS', 0.0); calc_base = omie_medio_simples_tabela_kwh + k_luzigas + cgs_luzigas; preco_energia_vazio_indexado = round(calc_base * perdas_v_anual, prec); preco_energia_cheias_indexado = round(calc_base * perdas_c_anual, prec); preco_energia_ponta_indexado = round(calc_base * perdas_p_anual, prec)
                             elif nome_tarifario == "Ibelectra | Solução Família": cs_ib = constantes.get('Ibelectra_CS', 0.0); k_ib = constantes.get('Ibelectra_K', 0.0); preco_energia_vazio_indexado = round((omie_v_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0) + k_ib, prec); preco_energia_cheias_indexado = round((omie_c_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0) + k_ib, prec); preco_energia_ponta_indexado = round((omie_p_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0)+ k_ib, prec)
                             elif nome_tarifario == "Ibelectra | Solução Amigo": cs_ib = constantes.get('Ibelectra_CS', 0.0); k_ib = constantes.get('Ibelectra_K_a', 0.0); preco_energia_vazio_indexado = round((omie_v_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0) + k_ib, prec); preco_energia_cheias_indexado = round((omie_c_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0) + k_ib, prec); preco_energia_ponta_indexado = round((omie_p_a_usar + cs_ib) * constantes.get('Ibelectra_Perdas', 0.0) + k_ib, prec)
                             elif nome_tarifario == "G9 | Smart Index": preco_energia_vazio_indexado = round((omie_v_a_usar * constantes.get('G9_FA', 1.02) * perdas_medias.get(f'Perdas_M_{ciclo_tri}_V', 1.16)) + constantes.get('G9_CGS', 0.01) + constantes.get('G9_AC', 0.0055), prec); preco_energia_cheias_indexado = round((omie_c_a_usar * constantes.get('G9_FA', 1.02) * perdas_medias.get(f'Perdas_M_{ciclo_tri}_C', 1.16)) + constantes.get('G9_CGS', 0.01) + constantes.get('G9_AC', 0.0055), prec); preco_energia_ponta_indexado = round((omie_p_a_usar * constantes.get('G9_FA', 1.02) * perdas_medias.get(f'Perdas_M_{ciclo_tri}_P', 1.16)) + constantes.get('G9_CGS', 0.01) + constantes.get('G9_AC', 0.0055), prec) 
@@ -5051,19 +5085,19 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                     # SE FOR QUARTO-HORÁRIO E HOUVER FICHEIRO, CALCULA O CUSTO REAL
                     if 'BTN' in formula_energia and "Luzboa | BTN SPOTDEF" not in nome_tarifario and st.session_state.get('dados_completos_ficheiro') is not None:
                 
-                        df_consumos_reais = df_consumos_a_utilizar
-                
                         resultado_real = calc.calcular_custo_completo_diagrama_carga(
                             tarifario_indexado, 
-                            df_consumos_reais,
+                            diagrama_alinhado_indexados,
                             OMIE_PERDAS_CICLOS,
-                            CONSTANTES,
+                            INDICE_CONSTANTES,
                             dias, potencia, familia_numerosa, tarifa_social,
                             valor_dgeg_user, valor_cav_user, mes, ano_atual,
                             incluir_quota_acp,
                             desconto_continente,
                             FINANCIAMENTO_TSE_VAL, 
-                            VALOR_QUOTA_ACP_MENSAL
+                            VALOR_QUOTA_ACP_MENSAL,
+                            grafo=GRAFO_CALCULO,
+                            delta_omie=delta_omie_sensibilidade
                         )
                 
                         if resultado_real:
@@ -5118,9 +5152,9 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                     # --- Passo 1: Identificar Componentes Base (Sem IVA, Sem TS) ---
                     tar_energia_regulada_idx = {}
                     for periodo in preco_energia_input_idx.keys():
-                        tar_energia_regulada_idx[periodo] = calc.obter_tar_energia_periodo(opcao_horaria, periodo, potencia, CONSTANTES)
+                        tar_energia_regulada_idx[periodo] = calc.obter_tar_energia_periodo(opcao_horaria, periodo, potencia, INDICE_CONSTANTES)
 
-                    tar_potencia_regulada_idx = calc.obter_tar_dia(potencia, CONSTANTES)
+                    tar_potencia_regulada_idx = calc.obter_tar_dia(potencia, INDICE_CONSTANTES)
 
                     preco_comercializador_energia_idx = {}
                     for periodo, preco_in in preco_energia_input_idx.items():
@@ -5143,8 +5177,8 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                     tar_potencia_final_dia_idx = tar_potencia_regulada_idx
 
                     if tarifa_social: # Flag global
-                        desconto_ts_energia = calc.obter_constante('Desconto TS Energia', CONSTANTES)
-                        desconto_ts_potencia_dia = calc.obter_constante(f'Desconto TS Potencia {potencia}', CONSTANTES)
+                        desconto_ts_energia = calc.obter_constante('Desconto TS Energia', INDICE_CONSTANTES)
+                        desconto_ts_potencia_dia = calc.obter_desconto_ts_potencia(potencia, INDICE_CONSTANTES)
                         for periodo, tar_reg in tar_energia_regulada_idx.items():
                             tar_energia_final_idx[periodo] = tar_reg - desconto_ts_energia
                         tar_potencia_final_dia_idx = max(0.0, tar_potencia_regulada_idx - desconto_ts_potencia_dia)
@@ -5153,7 +5187,7 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
 
                     desconto_ts_potencia_valor_aplicado = 0.0
                     if tarifa_social: # Flag global
-                        desconto_ts_potencia_dia_bruto = calc.obter_constante(f'Desconto TS Potencia {potencia}', CONSTANTES)
+                        desconto_ts_potencia_dia_bruto = calc.obter_desconto_ts_potencia(potencia, INDICE_CONSTANTES)
                         # O desconto efetivamente aplicado é o mínimo entre o desconto e a própria TAR
                         desconto_ts_potencia_valor_aplicado = min(tar_potencia_regulada_idx, desconto_ts_potencia_dia_bruto)
 
@@ -5252,7 +5286,7 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                         ts_aplicada_energia_flag_para_tooltip_idx = ts_global_ativa_idx
                         desconto_ts_energia_unitario_para_tooltip_idx = 0.0
                         if ts_global_ativa_idx:
-                            desconto_ts_energia_unitario_para_tooltip_idx = calc.obter_constante('Desconto TS Energia', CONSTANTES)
+                            desconto_ts_energia_unitario_para_tooltip_idx = calc.obter_constante('Desconto TS Energia', INDICE_CONSTANTES)
 
                         componentes_tooltip_energia_dict_idx[f'tooltip_energia_{periodo_key_idx}_comerc_sem_tar'] = comp_comerc_energia_base_idx
                         componentes_tooltip_energia_dict_idx[f'tooltip_energia_{periodo_key_idx}_tar_bruta'] = tar_bruta_energia_periodo_idx
@@ -5264,7 +5298,7 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
 
                     desconto_ts_potencia_valor_aplicado_idx = 0.0
                     if ts_global_ativa_idx:
-                        desconto_ts_potencia_dia_bruto_idx = calc.obter_constante(f'Desconto TS Potencia {potencia}', CONSTANTES)
+                        desconto_ts_potencia_dia_bruto_idx = calc.obter_desconto_ts_potencia(potencia, INDICE_CONSTANTES)
                         # tar_potencia_regulada_idx é a TAR bruta para este tarifário indexado
                         desconto_ts_potencia_valor_aplicado_idx = min(tar_potencia_regulada_idx, desconto_ts_potencia_dia_bruto_idx)
 
@@ -5435,7 +5469,7 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
             if preco_potencia_a_usar > 0 or any(p > 0 for p in precos_energia_a_usar.values()):
                 resultado_pers = calc.calcular_custo_personalizado(
                     precos_energia_a_usar, preco_potencia_a_usar, consumos_a_usar, dados_pers['flags'],
-                    CONSTANTES,
+                    INDICE_CONSTANTES,
                     FINANCIAMENTO_TSE_VAL,
                     dias=dias, potencia=potencia, tarifa_social=tarifa_social, familia_numerosa=familia_numerosa,
                     valor_dgeg_user=valor_dgeg_user, valor_cav_user=valor_cav_user, opcao_horaria_ref=opcao_horaria
@@ -7242,6 +7276,21 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
             
             st.info("Clique no botão para calcular e comparar o custo de cada tarifário (disponível para a sua Opção Horária selecionada) com e sem a produção dos seus painéis solares fotovoltaicos.")
 
+            # --- VENDA DO EXCEDENTE (contratos indexados ao OMIE quarto-horário) ---
+            NOME_CONTRATO_VENDA_PERSONALIZADO = "Personalizado (OMIE x fator - taxa)"
+            col_venda1, col_venda2, col_venda3 = st.columns([2, 1, 1])
+            with col_venda1:
+                contrato_venda_excedente = st.selectbox(
+                    "Venda do excedente", ["Sem venda", *calc.CONTRATOS_VENDA_EXCEDENTE, NOME_CONTRATO_VENDA_PERSONALIZADO],
+                    key="venda_excedente_contrato", help="O excedente de cada quarto de hora é vendido ao preço do contrato nesse intervalo (OMIE em €/MWh)."
+                )
+            # O fator e a taxa só existem no contrato personalizado (os predefinidos têm a fórmula fixa)
+            if contrato_venda_excedente == NOME_CONTRATO_VENDA_PERSONALIZADO:
+                with col_venda2:
+                    st.number_input("Fator OMIE", min_value=0.0, max_value=2.0, value=0.90, step=0.01, format="%.2f", key="venda_excedente_fator")
+                with col_venda3:
+                    st.number_input("Taxa (€/MWh)", min_value=0.0, value=0.0, step=1.0, format="%.2f", key="venda_excedente_taxa")
+
             if st.button("Calcular Tabela de Poupança", key="btn_calcular_poupanca_solar", use_container_width=True):
                 with st.spinner("A calcular a poupança para os tarifários aplicáveis..."):
                                     
@@ -7281,11 +7330,11 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                         res_bruto, res_liquido = None, None
 
                         if tipo_de_tarifario == 'Fixo':
-                            res_bruto = calc.calcular_detalhes_custo_tarifario_fixo(tarifario_linha, opcao_horaria, consumos_brutos_repartidos, potencia, dias, tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user, incluir_quota_acp, desconto_continente, CONSTANTES, dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL)
-                            res_liquido = calc.calcular_detalhes_custo_tarifario_fixo(tarifario_linha, opcao_horaria, consumos_liquidos_repartidos, potencia, dias, tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user, incluir_quota_acp, desconto_continente, CONSTANTES, dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL)
+                            res_bruto = calc.calcular_detalhes_custo_tarifario_fixo(tarifario_linha, opcao_horaria, consumos_brutos_repartidos, potencia, dias, tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user, incluir_quota_acp, desconto_continente, INDICE_CONSTANTES, dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL)
+                            res_liquido = calc.calcular_detalhes_custo_tarifario_fixo(tarifario_linha, opcao_horaria, consumos_liquidos_repartidos, potencia, dias, tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user, incluir_quota_acp, desconto_continente, INDICE_CONSTANTES, dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL)
                         elif tipo_de_tarifario.startswith('Indexado'):
-                            res_bruto = calc.calcular_detalhes_custo_tarifario_indexado(tarifario_linha, opcao_horaria, opcao_horaria, consumos_brutos_repartidos, potencia, dias, tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user, CONSTANTES, df_omie_ajustado, perdas_medias, todos_omie_inputs_utilizador_comp, omie_medios_calculados_para_todos_ciclos, omie_medio_simples_real_kwh, dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL)
-                            res_liquido = calc.calcular_detalhes_custo_tarifario_indexado(tarifario_linha, opcao_horaria, opcao_horaria, consumos_liquidos_repartidos, potencia, dias, tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user, CONSTANTES, df_omie_ajustado, perdas_medias, todos_omie_inputs_utilizador_comp, omie_medios_calculados_para_todos_ciclos, omie_medio_simples_real_kwh, dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL)
+                            res_bruto = calc.calcular_detalhes_custo_tarifario_indexado(tarifario_linha, opcao_horaria, opcao_horaria, consumos_brutos_repartidos, potencia, dias, tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user, INDICE_CONSTANTES, df_omie_ajustado, perdas_medias, todos_omie_inputs_utilizador_comp, omie_medios_calculados_para_todos_ciclos, omie_medio_simples_real_kwh, dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL, grafo=GRAFO_CALCULO, chave_omie=chave_omie_ajustado, omie_editado_manualmente=st.session_state.omie_foi_editado_manualmente, delta_omie=delta_omie_sensibilidade)
+                            res_liquido = calc.calcular_detalhes_custo_tarifario_indexado(tarifario_linha, opcao_horaria, opcao_horaria, consumos_liquidos_repartidos, potencia, dias, tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user, INDICE_CONSTANTES, df_omie_ajustado, perdas_medias, todos_omie_inputs_utilizador_comp, omie_medios_calculados_para_todos_ciclos, omie_medio_simples_real_kwh, dias_mes, mes, ano_atual, data_inicio, data_fim, FINANCIAMENTO_TSE_VAL, grafo=GRAFO_CALCULO, chave_omie=chave_omie_ajustado, omie_editado_manualmente=st.session_state.omie_foi_editado_manualmente, delta_omie=delta_omie_sensibilidade)
                         
                         if res_bruto: custo_sem_pv = res_bruto.get('Total (€)')
                         if res_liquido: custo_com_pv = res_liquido.get('Total (€)')
@@ -7312,11 +7361,13 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                         (ti_processar['potencia_kva'] == potencia) &
                         (ti_processar['formula_calculo'].str.contains('BTN', na=False))
                     ]
+                    diagrama_bruto = obter_diagrama_alinhado(df_consumos_bruto_filtrado)
+                    diagrama_liquido = obter_diagrama_alinhado(df_consumos_a_utilizar)
                     for _, tarifario_linha in tarifarios_diagrama_filtrados.iterrows():
                         custo_sem_pv, custo_com_pv = None, None
-                        res_bruto_diag = calc.calcular_custo_completo_diagrama_carga(tarifario_linha, df_consumos_bruto_filtrado, OMIE_PERDAS_CICLOS, CONSTANTES, dias, potencia, familia_numerosa, tarifa_social, valor_dgeg_user, valor_cav_user, mes, ano_atual, incluir_quota_acp, desconto_continente, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL)
+                        res_bruto_diag = calc.calcular_custo_completo_diagrama_carga(tarifario_linha, diagrama_bruto, OMIE_PERDAS_CICLOS, INDICE_CONSTANTES, dias, potencia, familia_numerosa, tarifa_social, valor_dgeg_user, valor_cav_user, mes, ano_atual, incluir_quota_acp, desconto_continente, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL, grafo=GRAFO_CALCULO, delta_omie=delta_omie_sensibilidade)
                         if res_bruto_diag: custo_sem_pv = res_bruto_diag.get('Total (€)')
-                        res_liquido_diag = calc.calcular_custo_completo_diagrama_carga(tarifario_linha, df_consumos_a_utilizar, OMIE_PERDAS_CICLOS, CONSTANTES, dias, potencia, familia_numerosa, tarifa_social, valor_dgeg_user, valor_cav_user, mes, ano_atual, incluir_quota_acp, desconto_continente, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL)
+                        res_liquido_diag = calc.calcular_custo_completo_diagrama_carga(tarifario_linha, diagrama_liquido, OMIE_PERDAS_CICLOS, INDICE_CONSTANTES, dias, potencia, familia_numerosa, tarifa_social, valor_dgeg_user, valor_cav_user, mes, ano_atual, incluir_quota_acp, desconto_continente, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL, grafo=GRAFO_CALCULO, delta_omie=delta_omie_sensibilidade)
                         if res_liquido_diag: custo_com_pv = res_liquido_diag.get('Total (€)')
 
                         if custo_sem_pv is not None and custo_com_pv is not None:
@@ -7335,14 +7386,15 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                     if meu_tarifario_ativo:
                         
                         # CÁLCULO 1: SEM PV (USA DADOS BRUTOS)
+                        entradas_meu_tarifario = calc.EntradasMeuTarifario.a_partir_de_estado(st.session_state)
                         resultado_bruto = calc.calcular_detalhes_custo_meu_tarifario(
-                            st.session_state, opcao_horaria, consumos_brutos_repartidos, potencia, dias, tarifa_social, familia_numerosa,
-                            valor_dgeg_user, valor_cav_user, CONSTANTES, FINANCIAMENTO_TSE_VAL
+                            entradas_meu_tarifario, opcao_horaria, consumos_brutos_repartidos, potencia, dias, tarifa_social, familia_numerosa,
+                            valor_dgeg_user, valor_cav_user, INDICE_CONSTANTES, FINANCIAMENTO_TSE_VAL
                         )
                         # CÁLCULO 2: COM PV (USA DADOS LÍQUIDOS)
                         resultado_liquido = calc.calcular_detalhes_custo_meu_tarifario(
-                            st.session_state, opcao_horaria, consumos_liquidos_repartidos, potencia, dias, tarifa_social, familia_numerosa,
-                            valor_dgeg_user, valor_cav_user, CONSTANTES, FINANCIAMENTO_TSE_VAL
+                            entradas_meu_tarifario, opcao_horaria, consumos_liquidos_repartidos, potencia, dias, tarifa_social, familia_numerosa,
+                            valor_dgeg_user, valor_cav_user, INDICE_CONSTANTES, FINANCIAMENTO_TSE_VAL
                         )
 
                         custo_sem_pv = resultado_bruto.get('Total (€)') if resultado_bruto else None
@@ -7377,8 +7429,8 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                             preco_potencia_pers = dados_pers['precos_tri']['potencia']
 
                         if preco_potencia_pers > 0 or any(p > 0 for p in precos_energia_pers.values()):
-                            resultado_bruto = calc.calcular_custo_personalizado(precos_energia_pers, preco_potencia_pers, consumos_brutos_repartidos, dados_pers['flags'], CONSTANTES, FINANCIAMENTO_TSE_VAL, dias=dias, potencia=potencia, tarifa_social=tarifa_social, familia_numerosa=familia_numerosa, valor_dgeg_user=valor_dgeg_user, valor_cav_user=valor_cav_user, opcao_horaria_ref=opcao_horaria)
-                            resultado_liquido = calc.calcular_custo_personalizado(precos_energia_pers, preco_potencia_pers, consumos_liquidos_repartidos, dados_pers['flags'], CONSTANTES, FINANCIAMENTO_TSE_VAL, dias=dias, potencia=potencia, tarifa_social=tarifa_social, familia_numerosa=familia_numerosa, valor_dgeg_user=valor_dgeg_user, valor_cav_user=valor_cav_user, opcao_horaria_ref=opcao_horaria)
+                            resultado_bruto = calc.calcular_custo_personalizado(precos_energia_pers, preco_potencia_pers, consumos_brutos_repartidos, dados_pers['flags'], INDICE_CONSTANTES, FINANCIAMENTO_TSE_VAL, dias=dias, potencia=potencia, tarifa_social=tarifa_social, familia_numerosa=familia_numerosa, valor_dgeg_user=valor_dgeg_user, valor_cav_user=valor_cav_user, opcao_horaria_ref=opcao_horaria)
+                            resultado_liquido = calc.calcular_custo_personalizado(precos_energia_pers, preco_potencia_pers, consumos_liquidos_repartidos, dados_pers['flags'], INDICE_CONSTANTES, FINANCIAMENTO_TSE_VAL, dias=dias, potencia=potencia, tarifa_social=tarifa_social, familia_numerosa=familia_numerosa, valor_dgeg_user=valor_dgeg_user, valor_cav_user=valor_cav_user, opcao_horaria_ref=opcao_horaria)
                             
                             custo_sem_pv = resultado_bruto.get('Total (€)')
                             custo_com_pv = resultado_liquido.get('Total (€)')
@@ -7398,6 +7450,26 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                     # --- PASSO 7: RENDERIZAR A TABELA ---
                     if lista_poupanca:
                         df_poupanca = pd.DataFrame(lista_poupanca).sort_values(by="Custo Com PV (€)", ascending=True).reset_index(drop=True)
+
+                        # Receita da venda do excedente: todos os contratos numa só passagem; o escolhido entra no custo líquido
+                        if contrato_venda_excedente != "Sem venda":
+                            contratos_venda = dict(calc.CONTRATOS_VENDA_EXCEDENTE)
+                            if contrato_venda_excedente == NOME_CONTRATO_VENDA_PERSONALIZADO:
+                                contratos_venda[NOME_CONTRATO_VENDA_PERSONALIZADO] = calc.formula_venda_excedente(
+                                    st.session_state.venda_excedente_fator, st.session_state.venda_excedente_taxa
+                                )
+                            receitas_venda = calc.calcular_receitas_venda_excedente(
+                                df_consumos_final_para_calculos, OMIE_PERDAS_CICLOS, contratos_venda,
+                                dict(zip(CONSTANTES["constante"], CONSTANTES["valor_unitário"]))
+                            )
+                            if receitas_venda:
+                                st.caption("Receita da venda do excedente no período: " + " | ".join(f"**{nome}**: {receita:.2f} €" for nome, receita in receitas_venda.items()))
+                            receita_venda = receitas_venda.get(contrato_venda_excedente, 0.0)
+                            df_poupanca["Venda Excedente (€)"] = receita_venda
+                            df_poupanca["Custo Líquido Com PV (€)"] = df_poupanca["Custo Com PV (€)"] - receita_venda
+                            # Com venda, a poupança conta com a receita do excedente (custo sem PV vs custo líquido)
+                            df_poupanca["Poupança (€)"] = df_poupanca["Custo Sem PV (€)"] - df_poupanca["Custo Líquido Com PV (€)"]
+                            df_poupanca["Poupança (%)"] = (df_poupanca["Poupança (€)"] / df_poupanca["Custo Sem PV (€)"] * 100).where(df_poupanca["Custo Sem PV (€)"] > 0, 0)
                         
                         # --- Configuração do AgGrid para a nova tabela ---
                         gb_poupanca = GridOptionsBuilder.from_dataframe(df_poupanca)
@@ -7462,6 +7534,9 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                         
                         gb_poupanca.configure_column("Custo Sem PV (€)", type=["numericColumn"], valueFormatter=formatter_eur_js, minWidth=150, flex=1, cellStyle={'textAlign': 'center'})
                         gb_poupanca.configure_column("Custo Com PV (€)", type=["numericColumn"], valueFormatter=formatter_eur_js, minWidth=150, flex=1, cellStyle={'textAlign': 'center'})
+                        if "Venda Excedente (€)" in df_poupanca.columns:
+                            gb_poupanca.configure_column("Venda Excedente (€)", type=["numericColumn"], valueFormatter=formatter_eur_js, minWidth=130, flex=1, cellStyle={'textAlign': 'center'})
+                            gb_poupanca.configure_column("Custo Líquido Com PV (€)", type=["numericColumn"], valueFormatter=formatter_eur_js, minWidth=150, flex=1, cellStyle={'textAlign': 'center', 'fontWeight': 'bold'})
                         
                         cell_style_poupanca_eur_js = JsCode("""
                             function(params) {
@@ -7488,7 +7563,8 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                             # PASSO 1: Preparar o DataFrame para exportação (arredondar para 2 casas decimais)
                             df_para_exportar = df_poupanca.copy()
                             colunas_para_arredondar = [
-                                "Custo Sem PV (€)", "Custo Com PV (€)", "Poupança (€)", "Poupança (%)"
+                                "Custo Sem PV (€)", "Custo Com PV (€)", "Poupança (€)", "Poupança (%)",
+                                "Venda Excedente (€)", "Custo Líquido Com PV (€)"
                             ]
                             for col in colunas_para_arredondar:
                                 if col in df_para_exportar.columns:
@@ -7514,6 +7590,66 @@ else: # --- INÍCIO DO BLOCO PARA TABELA DETALHADA (Tiago Felícia - Tarifários
                     else:
                         st.warning("Não foi possível calcular os dados de poupança para os tarifários selecionados.")
 
+            # --- DIMENSIONAMENTO: CURVAS PARA UMA GAMA DE POTÊNCIAS (kWp) ---
+            st.markdown("---")
+            st.markdown("##### Dimensionamento: Autoconsumo e Fatura por Potência Instalada")
+            col_gama, col_passo = st.columns([3, 1])
+            with col_gama:
+                gama_kwp = st.slider("Gama de potências a comparar (kWp)", min_value=0.5, max_value=20.0, value=(0.5, 10.0), step=0.5, key="solar_gama_kwp")
+            with col_passo:
+                passo_kwp = st.selectbox("Passo (kWp)", [0.1, 0.25, 0.5, 1.0], index=0, key="solar_passo_kwp")
+
+            if st.button("Calcular Curvas de Dimensionamento", key="btn_calcular_dimensionamento_solar", use_container_width=True):
+                with st.spinner("A simular todas as potências..."):
+                    # A potência 0 (sem painéis) serve de referência para a poupança
+                    # Arredondado para baixo: nunca passa do máximo, mesmo que a gama não seja múltipla do passo
+                    num_passos_kwp = int((gama_kwp[1] - gama_kwp[0]) / passo_kwp + 1e-9)
+                    potencias_kwp = [0.0] + [min(round(gama_kwp[0] + i * passo_kwp, 2), gama_kwp[1]) for i in range(num_passos_kwp + 1)]
+                    curvas_pv = calc.simular_dimensionamento_pv(
+                        df_consumos_bruto_filtrado, potencias_kwp, st.session_state.solar_distrito,
+                        st.session_state.solar_inclinacao, st.session_state.solar_orientacao, OMIE_PERDAS_CICLOS
+                    )
+                    df_curvas_pv = None
+                    if curvas_pv is not None:
+                        df_curvas_pv = calc.custos_dimensionamento_pv(
+                            curvas_pv, tf_processar[tf_processar['potencia_kva'] == potencia], opcao_horaria, dias,
+                            tarifa_social, familia_numerosa, valor_dgeg_user, valor_cav_user, incluir_quota_acp,
+                            desconto_continente, INDICE_CONSTANTES, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL
+                        )
+
+                if df_curvas_pv is None or df_curvas_pv.empty:
+                    st.warning("Não foi possível simular as curvas de dimensionamento para os dados selecionados.")
+                else:
+                    df_curvas_com_pv = df_curvas_pv.iloc[1:]
+                    categorias_kwp = [f"{kwp:g}" for kwp in df_curvas_com_pv['Potência (kWp)']]
+                    dados_curvas_energia = {
+                        'titulo': 'Energia por Potência Instalada (no período selecionado)',
+                        'categorias': categorias_kwp, 'rotulo_x': 'kWp', 'unidade': 'kWh',
+                        'series': [
+                            {"name": "Autoconsumo (kWh)", "data": df_curvas_com_pv['Autoconsumo (kWh)'].round(1).tolist(), "color": "#FFA500"},
+                            {"name": "Excedente (kWh)", "data": df_curvas_com_pv['Excedente (kWh)'].round(1).tolist(), "color": "#92D050"},
+                            {"name": "Consumo da Rede (kWh)", "data": df_curvas_com_pv['Consumo da Rede (kWh)'].round(1).tolist(), "color": "#2E75B6"},
+                        ]
+                    }
+                    st.components.v1.html(gfx.gerar_grafico_solar('grafico_dimensionamento_energia', dados_curvas_energia), height=420)
+
+                    if 'Custo Melhor Fixo (€)' in df_curvas_pv.columns:
+                        custo_sem_pv_dimensionamento = df_curvas_pv['Custo Melhor Fixo (€)'].iloc[0]
+                        df_curvas_com_pv = df_curvas_com_pv.assign(**{'Poupança (€)': custo_sem_pv_dimensionamento - df_curvas_com_pv['Custo Melhor Fixo (€)']})
+                        # Colunas a seguir a 'Custo Melhor Fixo (€)': os tarifários mais baratos sem painéis
+                        colunas_custo = list(df_curvas_pv.columns[df_curvas_pv.columns.get_loc('Custo Melhor Fixo (€)') + 1:])
+                        dados_curvas_custo = {
+                            'titulo': f'Fatura por Potência Instalada, Tarifários Fixos ({opcao_horaria}, {potencia} kVA; sem painéis: {custo_sem_pv_dimensionamento:.2f} €)',
+                            'categorias': categorias_kwp, 'rotulo_x': 'kWp', 'unidade': '€',
+                            'series': [{"name": "Melhor tarifário fixo", "data": df_curvas_com_pv['Custo Melhor Fixo (€)'].round(2).tolist(), "color": "#C00000"}] + [
+                                {"name": nome_tarifario, "data": df_curvas_com_pv[nome_tarifario].round(2).tolist()} for nome_tarifario in colunas_custo
+                            ]
+                        }
+                        st.components.v1.html(gfx.gerar_grafico_solar('grafico_dimensionamento_custo', dados_curvas_custo), height=420)
+                        st.caption(f"Custos dos tarifários fixos com os filtros atuais na opção {opcao_horaria}, para {dias} dias. Os tarifários indexados não entram nesta comparação.")
+
+                    st.dataframe(df_curvas_com_pv.round(2), hide_index=True, use_container_width=True)
+
     # ##################################################################
     # --- FIM: SECÇÃO ANÁLISE DE POUPANÇA COM AUTOCONSUMO ---
     # ##################################################################
@@ -7847,6 +7983,13 @@ if not constante_omip_df_row.empty:
 # Se a constante 'Data_Valores_OMIP' não for encontrada, data_omip_formatada_str permanece "Não disponível"
 
 st.markdown(f"**Valores OMIP (Futuros) atualizados em** {data_omip_formatada_str}")
+
+estado_atualizador_elec = atualizador_dados_elec.estado()
+if estado_atualizador_elec['ultima_atualizacao']:
+    st.caption(
+        f"Dados carregados em {estado_atualizador_elec['ultima_atualizacao']:%d/%m/%Y %H:%M:%S} "
+        f"(em {estado_atualizador_elec['duracao_ultima_atualizacao_s']:.2f} s)"
+    )
 # --- FIM DA SECÇÃO ---
 
 # --- INÍCIO DA SECÇÃO DE APOIO ---
@@ -1,11 +1,70 @@
-import streamlit as st
 import pandas as pd
 import re
-import requests
+import ast
+import functools
+import contextlib
+import contextvars
+import logging
+import traceback
 import numpy as np
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
 from io import StringIO
 
-# Importar as constantes e funções que são necessárias dentro deste módulo
+try:
+    from numba import njit
+except ImportError:  # numba é opcional: sem ele o despacho da bateria corre em Python puro
+    njit = None
+
+# Este módulo é o motor de cálculo: não depende do Streamlit e pode ser usado em processos de trabalho
+# ou em scripts. Erros e avisos saem como objetos Aviso (ver abaixo); a app decide como os mostrar.
+
+# --- Avisos estruturados ---
+@dataclass(frozen=True)
+class Aviso:
+    nivel: str          # 'erro' ou 'aviso'
+    mensagem: str
+    origem: str = ""    # função do motor que o emitiu
+    detalhe: str = ""   # ex: traceback completo
+
+_logger = logging.getLogger(__name__)
+_avisos_recolhidos = contextvars.ContextVar('avisos_recolhidos', default=None)
+
+def _registar_aviso_no_log(aviso):
+    _logger.log(logging.ERROR if aviso.nivel == 'erro' else logging.WARNING, "%s%s", aviso.mensagem, f"\n{aviso.detalhe}" if aviso.detalhe else "")
+
+_destino_avisos = _registar_aviso_no_log
+
+def definir_destino_avisos(destino):
+    """
+    Define a função que recebe cada Aviso emitido fora de recolher_avisos() (por omissão vai para o logging).
+    A app usa-a para mostrar os avisos com st.error/st.warning no sítio onde surgem.
+    """
+    global _destino_avisos
+    _destino_avisos = destino or _registar_aviso_no_log
+
+@contextlib.contextmanager
+def recolher_avisos():
+    """Dentro do bloco, os Avisos são acumulados na lista devolvida em vez de irem para o destino."""
+    avisos = []
+    token = _avisos_recolhidos.set(avisos)
+    try:
+        yield avisos
+    finally:
+        _avisos_recolhidos.reset(token)
+
+def emitir_aviso(nivel, mensagem, origem="", detalhe=""):
+    aviso = Aviso(nivel, mensagem, origem, detalhe)
+    avisos = _avisos_recolhidos.get()
+    if avisos is not None:
+        avisos.append(aviso)
+    else:
+        _destino_avisos(aviso)
+    return aviso
+
 
 IDENTIFICADORES_COMERCIALIZADORES_CAV_FIXA = [
     "CUR",
@@ -20,47 +79,111 @@ IDENTIFICADORES_COMERCIALIZADORES_CAV_FIXA = [
     # Adicionar outros identificadores conforme necessário
 ]
 
-# --- Função para obter valores da aba Constantes ---
-def obter_constante(nome_constante, constantes_df):
-    constante_row = constantes_df[constantes_df['constante'] == nome_constante]
-    if not constante_row.empty:
-        valor = constante_row['valor_unitário'].iloc[0]
+# --- Índice das Constantes (pesquisas O(1) em vez de varrer o DataFrame) ---
+# Nome da constante da TAR de energia por (opção, período, tri-horário > 20.7 kVA)
+NOMES_TAR_ENERGIA = {
+    ('simples', 'S', False): "TAR_Energia_Simples",
+    ('bi', 'V', False): "TAR_Energia_Bi_Vazio",
+    ('bi', 'F', False): "TAR_Energia_Bi_ForaVazio",
+    ('tri', 'V', False): "TAR_Energia_Tri_Vazio",
+    ('tri', 'C', False): "TAR_Energia_Tri_Cheias",
+    ('tri', 'P', False): "TAR_Energia_Tri_Ponta",
+    ('tri', 'V', True): "TAR_Energia_Tri_27.6_Vazio",
+    ('tri', 'C', True): "TAR_Energia_Tri_27.6_Cheias",
+    ('tri', 'P', True): "TAR_Energia_Tri_27.6_Ponta",
+}
+PREFIXO_TAR_POTENCIA = "TAR_Potencia "
+PREFIXO_DESCONTO_TS_POTENCIA = "Desconto TS Potencia "
+
+def _familia_opcao_tar(opcao_horaria_str):
+    """'simples', 'bi' ou 'tri' conforme a opção horária (None se não for reconhecida)."""
+    opcao_lower = str(opcao_horaria_str).lower()
+    if opcao_lower == "simples": return 'simples'
+    if opcao_lower.startswith("bi"): return 'bi'
+    if opcao_lower.startswith("tri"): return 'tri'
+    return None
+
+@dataclass(frozen=True)
+class IndiceConstantes:
+    """
+    Constantes já convertidas para float e organizadas para pesquisa direta.
+    valores: nome -> float (só constantes numéricas; em nomes repetidos prevalece a primeira linha)
+    tar_energia: (opção, período, tri > 20.7 kVA) -> TAR de energia (€/kWh)
+    tar_potencia / desconto_ts_potencia: potência (kVA) -> €/dia
+    """
+    valores: Mapping
+    tar_energia: Mapping
+    tar_potencia: Mapping
+    desconto_ts_potencia: Mapping
+
+    def tar_energia_periodos(self, opcao_horaria_str, potencia_kva):
+        """Devolve {período: TAR de energia} para a opção horária e potência indicadas."""
+        familia = _familia_opcao_tar(opcao_horaria_str)
+        if familia is None:
+            return {}
+        acima_20_7 = familia == 'tri' and not potencia_kva <= 20.7
+        return {periodo: valor for (fam, periodo, acima), valor in self.tar_energia.items() if fam == familia and acima == acima_20_7}
+
+    def tar_energia_periodo(self, opcao_horaria_str, periodo_str, potencia_kva):
+        tar_periodos = self.tar_energia_periodos(opcao_horaria_str, potencia_kva)
+        if 'S' in tar_periodos: # No Simples a TAR não depende do período
+            return tar_periodos['S']
+        return tar_periodos.get(str(periodo_str).upper(), 0.0)
+
+def construir_indice_constantes(constantes_df):
+    """Constrói o IndiceConstantes a partir do DataFrame 'Constantes' (colunas 'constante' e 'valor_unitário')."""
+    valores, vistos = {}, set()
+    for nome, valor in zip(constantes_df['constante'], constantes_df['valor_unitário']):
+        if not isinstance(nome, str) or nome in vistos: # Linhas sem nome nunca eram encontradas
+            continue
+        vistos.add(nome)
         try:
-            return float(valor)
+            valores[nome] = float(valor)
         except (ValueError, TypeError):
-            return 0.0
-    else:
-        return 0.0
+            pass # Constantes não numéricas (ex: datas) ficam fora do índice, tal como obter_constante devolvia 0.0
+
+    def _por_potencia(prefixo):
+        tabela = {}
+        for nome, valor in valores.items():
+            if nome.startswith(prefixo):
+                try:
+                    tabela[float(nome[len(prefixo):])] = valor
+                except ValueError:
+                    continue
+        return MappingProxyType(tabela)
+
+    return IndiceConstantes(
+        valores=MappingProxyType(valores),
+        tar_energia=MappingProxyType({chave: valores.get(nome, 0.0) for chave, nome in NOMES_TAR_ENERGIA.items()}),
+        tar_potencia=_por_potencia(PREFIXO_TAR_POTENCIA),
+        desconto_ts_potencia=_por_potencia(PREFIXO_DESCONTO_TS_POTENCIA),
+    )
+
+def obter_indice_constantes(constantes):
+    """
+    Devolve o IndiceConstantes de 'constantes', que pode ser o próprio índice ou o DataFrame 'Constantes'.
+    Um DataFrame é indexado de novo em cada chamada (sem cache): quem faz muitas consultas deve passar o
+    índice já construído, como o do conjunto partilhado (processamento_dados.DadosElecPartilhados.indice_constantes).
+    """
+    if isinstance(constantes, IndiceConstantes):
+        return constantes
+    return construir_indice_constantes(constantes)
+
+# --- Função para obter valores da aba Constantes ---
+def obter_constante(nome_constante, constantes_df):
+    return obter_indice_constantes(constantes_df).valores.get(nome_constante, 0.0)
 
 # --- Função para obter valor da TAR energia por período ---
 def obter_tar_energia_periodo(opcao_horaria_str, periodo_str, potencia_kva, constantes_df):
-    nome_constante = ""
-    opcao_lower = str(opcao_horaria_str).lower()
-    periodo_upper = str(periodo_str).upper()
-
-    if opcao_lower == "simples": nome_constante = "TAR_Energia_Simples"
-    elif opcao_lower.startswith("bi"):
-        if periodo_upper == 'V': nome_constante = "TAR_Energia_Bi_Vazio"
-        elif periodo_upper == 'F': nome_constante = "TAR_Energia_Bi_ForaVazio"
-    elif opcao_lower.startswith("tri"):
-        if potencia_kva <= 20.7:
-            if periodo_upper == 'V': nome_constante = "TAR_Energia_Tri_Vazio"
-            elif periodo_upper == 'C': nome_constante = "TAR_Energia_Tri_Cheias"
-            elif periodo_upper == 'P': nome_constante = "TAR_Energia_Tri_Ponta"
-        else: # > 20.7 kVA
-            if periodo_upper == 'V': nome_constante = "TAR_Energia_Tri_27.6_Vazio"
-            elif periodo_upper == 'C': nome_constante = "TAR_Energia_Tri_27.6_Cheias"
-            elif periodo_upper == 'P': nome_constante = "TAR_Energia_Tri_27.6_Ponta"
-
-    if nome_constante:
-        return obter_constante(nome_constante, constantes_df)
-    return 0.0
+    return obter_indice_constantes(constantes_df).tar_energia_periodo(opcao_horaria_str, periodo_str, potencia_kva)
 
 # --- Função: Obter valor da TAR potência para a potência contratada ---
 def obter_tar_dia(potencia_kva, constantes_df):
-    potencia_str = str(float(potencia_kva)) # Formato consistente
-    constante_potencia = f'TAR_Potencia {potencia_str}'
-    return obter_constante(constante_potencia, constantes_df)
+    return obter_indice_constantes(constantes_df).tar_potencia.get(float(potencia_kva), 0.0)
+
+# --- Função: Obter desconto diário da Tarifa Social na potência ---
+def obter_desconto_ts_potencia(potencia_kva, constantes_df):
+    return obter_indice_constantes(constantes_df).desconto_ts_potencia.get(float(potencia_kva), 0.0)
 
 # --- Função: Determinar o perfil BTN ---
 def obter_perfil(consumo_total_kwh, dias, potencia_kva):
@@ -69,6 +192,335 @@ def obter_perfil(consumo_total_kwh, dias, potencia_kva):
     elif consumo_anual_estimado > 7140: return 'perfil_B'
     else: return 'perfil_C'
 
+# --- Compilador das fórmulas 'formula_calculo' dos tarifários indexados ---
+NOME_LUZBOA_BTN = "Luzboa | BTN SPOTDEF"
+PERIODOS_INDEXADOS = ['S', 'V', 'F', 'C', 'P']
+
+# Variáveis disponíveis nas fórmulas. OMIE em €/MWh (as fórmulas dividem por 1000) e PERDAS do intervalo.
+# Perfil_BTN vale 1.0: a ponderação pelo perfil é feita por calcular_precos_indexados_btn.
+VARIAVEIS_FORMULA_INDEXADO = ('OMIE', 'PERDAS', 'Perfil_BTN')
+
+# Fórmulas aplicadas em vez da 'formula_calculo' do ficheiro, quando esta não reflete o cálculo em vigor
+FORMULAS_CALCULO_SUBSTITUTAS = {
+    "Coopérnico | GO": "(OMIE/1000+Coop_CS_CR+Coop_K)*PERDAS+Coop_GO",
+    "Iberdrola | Simples Indexado Dinâmico": "OMIE/1000*PERDAS+Iberdrola_Dinamico_Q+Iberdrola_mFRR",
+}
+
+_NOS_FORMULA_PERMITIDOS = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd,
+)
+
+@functools.lru_cache(maxsize=256)
+def compilar_formula_indexado(formula_str):
+    """
+    Compila uma 'formula_calculo' (ex: '((OMIE/1000+Alfa_CGS)*PERDAS+Alfa_K)*Perfil_BTN') uma única vez.
+    Só são aceites números, nomes, parênteses e + - * /; qualquer outra coisa (texto livre,
+    chamadas, atributos) levanta ValueError. Devolve (codigo_compilado, nomes_usados).
+    """
+    texto = str(formula_str).strip()
+    try:
+        arvore = ast.parse(texto, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Fórmula não reconhecida: '{texto}'") from e
+
+    for no in ast.walk(arvore):
+        if not isinstance(no, _NOS_FORMULA_PERMITIDOS):
+            raise ValueError(f"Elemento '{type(no).__name__}' não permitido na fórmula '{texto}'")
+        if isinstance(no, ast.Constant) and (isinstance(no.value, bool) or not isinstance(no.value, (int, float))):
+            raise ValueError(f"Valor '{no.value!r}' não permitido na fórmula '{texto}'")
+
+    nomes_usados = tuple(sorted({no.id for no in ast.walk(arvore) if isinstance(no, ast.Name)}))
+    if 'OMIE' not in nomes_usados:
+        raise ValueError(f"A fórmula '{texto}' não depende do OMIE")
+    return compile(arvore, '<formula_calculo>', 'eval'), nomes_usados
+
+def constantes_em_falta_formula(formula_str, constantes_dict):
+    """Nomes de constantes usados pela fórmula (já compilável) que não existem em constantes_dict."""
+    _, nomes_usados = compilar_formula_indexado(formula_str)
+    constantes_minusculas = {str(nome).lower() for nome in constantes_dict}
+    return [
+        nome for nome in nomes_usados
+        if nome not in VARIAVEIS_FORMULA_INDEXADO and nome not in constantes_dict and nome.lower() not in constantes_minusculas
+    ]
+
+def ligar_formula_indexado(formula_str, constantes_dict, constantes_em_falta_a_zero=False):
+    """
+    Associa as constantes a uma fórmula compilada e devolve kernel(omie, perdas), que aceita escalares ou arrays NumPy.
+    Os nomes das constantes são procurados primeiro tal como estão e depois sem distinguir maiúsculas
+    (ex: 'REPSOL_FA' -> 'Repsol_FA'). Levanta ValueError se faltar alguma constante, exceto com
+    'constantes_em_falta_a_zero', em que valem 0.0 (como o .get(nome, 0.0) das fórmulas escritas à mão).
+    """
+    codigo, nomes_usados = compilar_formula_indexado(formula_str)
+    constantes_minusculas = {str(nome).lower(): valor for nome, valor in constantes_dict.items()}
+    valores = {'Perfil_BTN': 1.0}
+    for nome in nomes_usados:
+        if nome in VARIAVEIS_FORMULA_INDEXADO:
+            continue
+        valor = constantes_dict.get(nome, constantes_minusculas.get(nome.lower()))
+        if valor is None:
+            if not constantes_em_falta_a_zero:
+                raise ValueError(f"Constante '{nome}' não encontrada")
+            valor = 0.0
+        valores[nome] = float(valor)
+
+    def kernel(omie, perdas):
+        return eval(codigo, {'__builtins__': {}}, {**valores, 'OMIE': omie, 'PERDAS': perdas})
+    return kernel
+
+def obter_kernel_indexado(nome_tarifario, formula_calculo, constantes_dict):
+    """
+    Devolve o kernel(omie, perdas) do preço instantâneo do comercializador (€/kWh, sem perfil) de um tarifário.
+    Constantes em falta valem 0.0 e uma fórmula que não pode ser compilada passa ao fallback genérico
+    OMIE/1000 * PERDAS; em ambos os casos é emitido um aviso com o tarifário.
+    """
+    formula = FORMULAS_CALCULO_SUBSTITUTAS.get(nome_tarifario, formula_calculo)
+    try:
+        em_falta = constantes_em_falta_formula(formula, constantes_dict)
+    except ValueError as e:
+        emitir_aviso('aviso', f"Tarifário '{nome_tarifario}': {e}. Preço calculado só com OMIE x Perdas (sem margens).", 'obter_kernel_indexado')
+        return lambda omie, perdas: omie / 1000.0 * perdas
+    if em_falta:
+        emitir_aviso(
+            'aviso',
+            f"Tarifário '{nome_tarifario}': constante(s) {', '.join(em_falta)} não encontrada(s) nas Constantes; contam como 0.",
+            'obter_kernel_indexado'
+        )
+    return ligar_formula_indexado(formula, constantes_dict, constantes_em_falta_a_zero=True)
+
+# --- Motor vetorizado dos tarifários indexados quarto-horários (BTN) ---
+def _medias_por_periodo(somas, pesos, prec):
+    """Converte somas e pesos por período em preços médios arredondados (0.0 quando o período não tem dados)."""
+    return {
+        p_key: round(float(soma) / float(peso), prec) if peso > 0 else 0.0
+        for p_key, soma, peso in zip(PERIODOS_INDEXADOS, somas, pesos)
+    }
+
+def calcular_precos_indexados_btn(df_omie, formulas_tarifarios, constantes_dict, perfil_coluna, coluna_ciclo=None, prec=4):
+    """
+    Calcula numa só passagem os preços médios de energia (€/kWh) de vários tarifários indexados quarto-horários.
+
+    'formulas_tarifarios' é um dicionário {nome: formula_calculo}; cada fórmula é compilada num kernel vetorizado.
+    Os arrays OMIE, Perdas, perfil e ciclo são extraídos uma vez; os preços instantâneos de todos os tarifários
+    formam uma matriz (tarifários x intervalos) que é reduzida por período com um produto matricial.
+    Regras idênticas às do cálculo linha a linha:
+      - Ignoram-se intervalos sem OMIE/Perdas e, fora da Luzboa, sem perfil ou com perfil <= 0.
+      - Os tarifários BTN usam a média ponderada pelo perfil; a Luzboa usa a média simples.
+      - Sem coluna de perfil, os tarifários BTN (exceto Luzboa) ficam a 0.0.
+      - V/F/C/P só são calculados se 'coluna_ciclo' existir; caso contrário ficam a 0.0.
+
+    Devolve {nome: {'S': .., 'V': .., 'F': .., 'C': .., 'P': ..}} com valores arredondados a 'prec' casas.
+    """
+    resultado = {nome: dict.fromkeys(PERIODOS_INDEXADOS, 0.0) for nome in formulas_tarifarios}
+    if not resultado or df_omie is None or df_omie.empty or not {'OMIE', 'Perdas'}.issubset(df_omie.columns):
+        return resultado
+
+    omie = df_omie['OMIE'].to_numpy(dtype=np.float64, na_value=np.nan)
+    perdas = df_omie['Perdas'].to_numpy(dtype=np.float64, na_value=np.nan)
+    linhas_validas = ~(np.isnan(omie) | np.isnan(perdas))
+
+    # Máscara intervalos x períodos: 'S' abrange todos os intervalos, V/F/C/P vêm da coluna de ciclo
+    mascara_periodos = np.zeros((len(df_omie), len(PERIODOS_INDEXADOS)), dtype=bool)
+    mascara_periodos[:, 0] = True
+    if coluna_ciclo and coluna_ciclo in df_omie.columns:
+        ciclos = df_omie[coluna_ciclo].astype(object).to_numpy()
+        for j, p_key in enumerate(PERIODOS_INDEXADOS[1:], start=1):
+            mascara_periodos[:, j] = ciclos == p_key
+
+    # Luzboa: média simples (não ponderada pelo perfil)
+    if NOME_LUZBOA_BTN in resultado:
+        pesos_luzboa = (mascara_periodos & linhas_validas[:, None]).astype(np.float64)
+        kernel_luzboa = obter_kernel_indexado(NOME_LUZBOA_BTN, formulas_tarifarios[NOME_LUZBOA_BTN], constantes_dict)
+        valor_luzboa = np.where(linhas_validas, kernel_luzboa(omie, perdas), 0.0)
+        resultado[NOME_LUZBOA_BTN] = _medias_por_periodo(valor_luzboa @ pesos_luzboa, pesos_luzboa.sum(axis=0), prec)
+
+    nomes_btn = [nome for nome in resultado if nome != NOME_LUZBOA_BTN]
+    if not nomes_btn or perfil_coluna not in df_omie.columns:
+        return resultado
+
+    perfil = df_omie[perfil_coluna].to_numpy(dtype=np.float64, na_value=np.nan)
+    linhas_validas_btn = linhas_validas & ~np.isnan(perfil)
+    linhas_validas_btn[linhas_validas_btn] = perfil[linhas_validas_btn] > 0
+    pesos_btn = np.where(mascara_periodos & linhas_validas_btn[:, None], perfil[:, None], 0.0)
+
+    precos_instantaneos = np.empty((len(nomes_btn), len(df_omie)), dtype=np.float64)
+    for i, nome in enumerate(nomes_btn):
+        precos_instantaneos[i] = obter_kernel_indexado(nome, formulas_tarifarios[nome], constantes_dict)(omie, perdas)
+    precos_instantaneos[:, ~linhas_validas_btn] = 0.0
+
+    somas_btn = precos_instantaneos @ pesos_btn
+    soma_perfis = pesos_btn.sum(axis=0)
+    for i, nome in enumerate(nomes_btn):
+        resultado[nome] = _medias_por_periodo(somas_btn[i], soma_perfis, prec)
+    return resultado
+
+def obter_precos_indexados_btn(grafo, chave_omie, df_omie, formulas_tarifarios, constantes_dict, perfil_coluna, coluna_ciclo=None, delta_omie=0.0):
+    """
+    calcular_precos_indexados_btn como nó do GrafoCalculo (nó 'precos_btn').
+    'chave_omie' identifica o conteúdo de df_omie (período e OMIE manuais); a versão dos dados e das
+    constantes fica a cargo do grafo. Sem grafo ou sem chave, calcula sempre.
+    Com 'delta_omie' (€/MWh, sensibilidade), os preços saem dos CoeficientesOmieBTN de df_omie: mover o delta
+    não volta a percorrer os dados (só as fórmulas não afins no OMIE são recalculadas).
+    """
+    if delta_omie:
+        coeficientes = obter_coeficientes_omie_indexados_btn(grafo, chave_omie, df_omie, formulas_tarifarios, constantes_dict, perfil_coluna, coluna_ciclo)
+        precos = coeficientes.precos(delta=delta_omie)
+        if coeficientes.nao_afins:
+            precos.update(calcular_precos_indexados_btn(
+                aplicar_omie_manual(df_omie, coluna_ciclo, None, delta_omie),
+                {nome: formulas_tarifarios[nome] for nome in coeficientes.nao_afins}, constantes_dict, perfil_coluna, coluna_ciclo
+            ))
+        return precos
+
+    def calcular():
+        return calcular_precos_indexados_btn(df_omie, formulas_tarifarios, constantes_dict, perfil_coluna, coluna_ciclo)
+    if grafo is None or chave_omie is None:
+        return calcular()
+    nome_no = ('precos_btn', perfil_coluna, coluna_ciclo, tuple(formulas_tarifarios.items()))
+    return grafo.no(nome_no, (chave_omie,), calcular)
+
+# --- Coeficientes lineares dos preços BTN no OMIE (OMIE manual e sensibilidade sem nova passagem pelos dados) ---
+# Períodos de origem do OMIE: V/F/C/P da coluna de ciclo e '-' para os intervalos sem período (ou sem coluna de ciclo)
+PERIODOS_FONTE_OMIE = (*PERIODOS_INDEXADOS[1:], '-')
+
+@dataclass(frozen=True)
+class CoeficientesOmieBTN:
+    """
+    Preços dos indexados quarto-horários escritos como funções afins do OMIE, por tarifário e período de origem.
+    Linhas: tarifários ('nomes'); colunas: PERIODOS_FONTE_OMIE. Para cada célula, e com os mesmos pesos
+    de calcular_precos_indexados_btn (perfil BTN ou média simples na Luzboa):
+      somas / declives / pesos: soma ponderada dos preços com os OMIE horários, a sua variação por €/MWh
+        e a soma dos pesos
+      declives_manual / ordenadas_manual / pesos_manual: o mesmo quando todo o período usa um só OMIE (€/MWh),
+        soma ponderada = declives_manual * OMIE + ordenadas_manual; aqui contam também os intervalos sem OMIE
+    nao_afins: tarifários cuja fórmula não é afim no OMIE; os seus preços só são válidos sem OMIE manual nem delta.
+    """
+    nomes: tuple
+    somas: np.ndarray
+    declives: np.ndarray
+    pesos: np.ndarray
+    declives_manual: np.ndarray
+    ordenadas_manual: np.ndarray
+    pesos_manual: np.ndarray
+    nao_afins: tuple = ()
+
+    def precos(self, omie_manual=None, delta=0.0, prec=4):
+        """
+        Preços médios por período ({nome: {'S': .., 'V': .., ...}}, como calcular_precos_indexados_btn) com:
+          - omie_manual: {período: OMIE (€/MWh)} aplicado a todos os intervalos desse período ('S' = todos)
+          - delta: deslocamento (€/MWh) somado a todos os OMIE, horários ou manuais
+        """
+        somas = self.somas + self.declives * delta
+        pesos = self.pesos.copy()
+        for p_key, valor in (omie_manual or {}).items():
+            colunas = slice(None) if p_key == 'S' else [PERIODOS_FONTE_OMIE.index(p_key)]
+            somas[:, colunas] = self.declives_manual[:, colunas] * (float(valor) + delta) + self.ordenadas_manual[:, colunas]
+            pesos[:, colunas] = self.pesos_manual[:, colunas]
+        somas_periodos = np.column_stack([somas.sum(axis=1), somas[:, :-1]])
+        pesos_periodos = np.column_stack([pesos.sum(axis=1), pesos[:, :-1]])
+        return {
+            nome: _medias_por_periodo(somas_periodos[i], pesos_periodos[i], prec)
+            for i, nome in enumerate(self.nomes)
+        }
+
+def calcular_coeficientes_omie_indexados_btn(df_omie, formulas_tarifarios, constantes_dict, perfil_coluna, coluna_ciclo=None):
+    """
+    Pré-calcula os CoeficientesOmieBTN de vários tarifários indexados quarto-horários numa só passagem pelos dados.
+    Cada kernel é avaliado nos OMIE horários, com OMIE = 0 e com OMIE = 1000 €/MWh: como o preço é afim no OMIE
+    ((OMIE/1000 + k) * PERDAS * fa + q), o declive e a ordenada de cada intervalo saem destas duas avaliações.
+    Os intervalos válidos e os pesos seguem as regras de calcular_precos_indexados_btn.
+    """
+    nomes = tuple(formulas_tarifarios)
+    vazio = np.zeros((len(nomes), len(PERIODOS_FONTE_OMIE)))
+    if not nomes or df_omie is None or df_omie.empty or not {'OMIE', 'Perdas'}.issubset(df_omie.columns):
+        return CoeficientesOmieBTN(nomes, vazio, vazio, vazio, vazio, vazio, vazio)
+
+    omie = df_omie['OMIE'].to_numpy(dtype=np.float64, na_value=np.nan)
+    perdas = df_omie['Perdas'].to_numpy(dtype=np.float64, na_value=np.nan)
+    # Com OMIE manual, os intervalos sem OMIE passam a ter o valor manual: só as Perdas decidem
+    linhas_validas_manual = ~np.isnan(perdas)
+    linhas_validas = linhas_validas_manual & ~np.isnan(omie)
+
+    # Máscara intervalos x períodos de origem
+    fonte = np.full(len(df_omie), len(PERIODOS_FONTE_OMIE) - 1)
+    if coluna_ciclo and coluna_ciclo in df_omie.columns:
+        ciclos = df_omie[coluna_ciclo].astype(object).to_numpy()
+        for j, p_key in enumerate(PERIODOS_FONTE_OMIE[:-1]):
+            fonte[ciclos == p_key] = j
+    mascara_fontes = (fonte[:, None] == np.arange(len(PERIODOS_FONTE_OMIE))).astype(np.float64)
+
+    perfil = df_omie[perfil_coluna].to_numpy(dtype=np.float64, na_value=np.nan) if perfil_coluna in df_omie.columns else None
+    pesos_btn_manual = np.zeros(len(df_omie))
+    if perfil is not None:
+        linhas_validas_btn = linhas_validas_manual & ~np.isnan(perfil)
+        linhas_validas_btn[linhas_validas_btn] = perfil[linhas_validas_btn] > 0
+        pesos_btn_manual[linhas_validas_btn] = perfil[linhas_validas_btn]
+
+    pesos_manual = np.empty((len(nomes), len(df_omie)))
+    precos_omie = np.empty_like(pesos_manual)
+    precos_zero = np.empty_like(pesos_manual)
+    precos_mil = np.empty_like(pesos_manual)
+    omie_zero, omie_mil = np.zeros_like(omie), np.full_like(omie, 1000.0)
+    for i, nome in enumerate(nomes):
+        kernel = obter_kernel_indexado(nome, formulas_tarifarios[nome], constantes_dict)
+        pesos_manual[i] = linhas_validas_manual if nome == NOME_LUZBOA_BTN else pesos_btn_manual
+        precos_omie[i] = kernel(omie, perdas)
+        precos_zero[i] = kernel(omie_zero, perdas)
+        precos_mil[i] = kernel(omie_mil, perdas)
+    pesos = np.where(linhas_validas, pesos_manual, 0.0)
+    for precos, pesos_precos in ((precos_omie, pesos), (precos_zero, pesos_manual), (precos_mil, pesos_manual)):
+        precos[pesos_precos <= 0] = 0.0
+    declives_intervalo = (precos_mil - precos_zero) / 1000.0
+
+    # Confirmação da forma afim nos OMIE horários; as fórmulas que não a têm ficam assinaladas
+    reconstruido = precos_zero + declives_intervalo * np.where(linhas_validas, omie, 0.0)
+    afins = np.isclose(reconstruido, precos_omie, rtol=1e-9, atol=1e-12) | (pesos <= 0)
+    nao_afins = tuple(nome for nome, afim in zip(nomes, afins.all(axis=1)) if not afim)
+
+    return CoeficientesOmieBTN(
+        nomes=nomes,
+        somas=(pesos * precos_omie) @ mascara_fontes,
+        declives=(pesos * declives_intervalo) @ mascara_fontes,
+        pesos=pesos @ mascara_fontes,
+        declives_manual=(pesos_manual * declives_intervalo) @ mascara_fontes,
+        ordenadas_manual=(pesos_manual * precos_zero) @ mascara_fontes,
+        pesos_manual=pesos_manual @ mascara_fontes,
+        nao_afins=nao_afins,
+    )
+
+def obter_coeficientes_omie_indexados_btn(grafo, chave_periodo, df_omie, formulas_tarifarios, constantes_dict, perfil_coluna, coluna_ciclo=None):
+    """
+    calcular_coeficientes_omie_indexados_btn como nó do GrafoCalculo (nó 'coeficientes_omie_btn').
+    'chave_periodo' identifica df_omie SEM OMIE manuais: os coeficientes não dependem deles, pelo que editar
+    o OMIE ou mover a sensibilidade não volta a percorrer os dados. Sem grafo ou sem chave, calcula sempre.
+    """
+    def calcular():
+        return calcular_coeficientes_omie_indexados_btn(df_omie, formulas_tarifarios, constantes_dict, perfil_coluna, coluna_ciclo)
+    if grafo is None or chave_periodo is None:
+        return calcular()
+    nome_no = ('coeficientes_omie_btn', perfil_coluna, coluna_ciclo, tuple(formulas_tarifarios.items()))
+    return grafo.no(nome_no, (chave_periodo,), calcular)
+
+def aplicar_omie_manual(df_omie, coluna_ciclo, omie_manual, delta=0.0):
+    """
+    Devolve uma cópia de df_omie com o OMIE (€/MWh) de cada período editado substituído pelo valor manual
+    ({'S': ..} substitui todos os intervalos; {'V': .., 'F': ..} usa a coluna de ciclo) e deslocado 'delta'.
+    Versão vetorizada da substituição linha a linha; sem edições nem delta devolve df_omie sem cópia.
+    """
+    omie_manual = omie_manual or {}
+    if df_omie.empty or (not omie_manual and not delta):
+        return df_omie
+    df_ajustado = df_omie.copy()
+    omie = df_ajustado['OMIE'].to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+    if 'S' in omie_manual:
+        omie[:] = float(omie_manual['S'])
+    elif coluna_ciclo and coluna_ciclo in df_ajustado.columns:
+        ciclos = df_ajustado[coluna_ciclo].astype(object).to_numpy()
+        for p_key, valor in omie_manual.items():
+            omie[ciclos == p_key] = float(valor)
+    df_ajustado['OMIE'] = omie + delta
+    return df_ajustado
+
 # Função para calcular a expressão de consumo (apenas para somas, resultado inteiro)
 def calcular_expressao_matematica_simples(expressao_str, periodo_label=""):
     """
@@ -175,132 +627,186 @@ def calcular_expressao_matematica_simples(expressao_str, periodo_label=""):
     
     return total_arredondado, None # Retorna o valor inteiro arredondado e nenhum erro
 
+def _arredondar_como_round(valores, casas=4):
+    """
+    np.round com o mesmo resultado que o round() do Python, valor a valor.
+    np.round escala por 10**casas e pode divergir só nos casos quase a meio; esses são refeitos com round().
+    """
+    valores = np.asarray(valores, dtype=float)
+    escalados = valores * 10.0 ** casas
+    resultado = np.round(escalados) / 10.0 ** casas
+    quase_meio = np.abs(escalados - np.floor(escalados) - 0.5) < np.maximum(1e-6, np.abs(escalados) * 1e-12)
+    for i in np.flatnonzero(quase_meio):
+        resultado.flat[i] = round(float(valores.flat[i]), casas)
+    return resultado
+
+CHAVES_DECOMPOSICAO_IVA = ('custo_com_iva', 'custo_sem_iva', 'valor_iva_6', 'valor_iva_23')
+
+# Operações que servem tanto para escalares (float) como para arrays NumPy: o mesmo núcleo de IVA
+# calcula um tarifário (à velocidade do Python puro) ou N tarifários de uma vez, com os mesmos valores.
+def _onde(condicao, se_sim, se_nao):
+    return np.where(condicao, se_sim, se_nao) if isinstance(condicao, np.ndarray) else (se_sim if condicao else se_nao)
+
+def _minimo(a, b):
+    return np.minimum(a, b) if isinstance(a, np.ndarray) or isinstance(b, np.ndarray) else min(a, b)
+
+def _maximo(a, b):
+    return np.maximum(a, b) if isinstance(a, np.ndarray) or isinstance(b, np.ndarray) else max(a, b)
+
+def _todos(condicao):
+    return bool(condicao.all()) if isinstance(condicao, np.ndarray) else bool(condicao)
+
+def _nucleo_custo_energia_com_iva(consumos, precos, simples, potencias, dias_calculo, familia_numerosa_bool, zero):
+    """
+    Núcleo de calcular_custo_energia_com_iva(_em_lote): consumos e precos são {período: valor}, com valores e
+    potencias todos float ou todos arrays de N ('zero' é 0.0 ou np.zeros(N)). Devolve (com IVA, sem IVA, IVA 6%, IVA 23%)
+    sem arredondar, acumulados pela ordem de consumos.
+    """
+    iva_normal_perc = 0.23
+    iva_reduzido_perc = 0.06
+
+    # Custo total sem IVA
+    if simples:
+        consumo_s = consumos.get('S', zero)
+        preco_s = precos.get('S', zero)
+        custo_sem_iva = consumo_s * preco_s
+    else: # Bi ou Tri
+        custo_sem_iva = zero
+        for periodo, consumo_p in consumos.items():
+            custo_sem_iva = custo_sem_iva + consumo_p * precos.get(periodo, zero)
+
+    # Limite para IVA reduzido (só até 6.9 kVA)
+    limite_kwh = zero
+    if dias_calculo > 0:
+        limite_kwh = _onde(potencias <= 6.9, (300 if familia_numerosa_bool else 200) * dias_calculo / 30.0, 0.0)
+    sem_limite = limite_kwh == 0.0
+    iva_23_normal = custo_sem_iva * iva_normal_perc
+    if _todos(sem_limite): # Sem IVA reduzido: tudo a 23%
+        return custo_sem_iva + iva_23_normal, custo_sem_iva, zero, iva_23_normal
+
+    iva_6, iva_23, custo_com_iva = zero, zero, zero
+    if simples:
+        consumo_iva_reduzido = _minimo(consumo_s, limite_kwh)
+        consumo_iva_normal = _maximo(0.0, consumo_s - limite_kwh)
+        base_iva_6 = consumo_iva_reduzido * preco_s
+        base_iva_23 = consumo_iva_normal * preco_s
+        iva_6 = base_iva_6 * iva_reduzido_perc
+        iva_23 = base_iva_23 * iva_normal_perc
+        custo_com_iva = base_iva_6 + iva_6 + base_iva_23 + iva_23
+    else: # Bi ou Tri: limite rateado pelo peso de cada período no consumo
+        consumo_total = sum(consumos.values(), zero)
+        com_consumo = consumo_total > 0
+        divisor = _onde(com_consumo, consumo_total, 1.0)
+        for periodo, consumo_p in consumos.items():
+            preco_p = precos.get(periodo, zero)
+            limite_p = limite_kwh * (consumo_p / divisor)
+            base_iva_6 = _minimo(consumo_p, limite_p) * preco_p
+            base_iva_23 = _maximo(0.0, consumo_p - limite_p) * preco_p
+            iva_6_p = base_iva_6 * iva_reduzido_perc
+            iva_23_p = base_iva_23 * iva_normal_perc
+            iva_6 = iva_6 + iva_6_p
+            iva_23 = iva_23 + iva_23_p
+            custo_com_iva = custo_com_iva + (base_iva_6 + iva_6_p + base_iva_23 + iva_23_p)
+        if not _todos(com_consumo): # Sem consumo, tudo é zero
+            iva_6 = _onde(com_consumo, iva_6, 0.0)
+            iva_23 = _onde(com_consumo, iva_23, 0.0)
+            custo_com_iva = _onde(com_consumo, custo_com_iva, 0.0)
+
+    # Linhas sem IVA reduzido (limite 0): tudo a 23%
+    if isinstance(sem_limite, np.ndarray) and sem_limite.any():
+        iva_6 = np.where(sem_limite, 0.0, iva_6)
+        iva_23 = np.where(sem_limite, iva_23_normal, iva_23)
+        custo_com_iva = np.where(sem_limite, custo_sem_iva + iva_23_normal, custo_com_iva)
+    return custo_com_iva, custo_sem_iva, iva_6, iva_23
+
+def _nucleo_custo_potencia_com_iva(preco_comercializador_dia, tar_potencia_dia, dias, potencias):
+    """Núcleo de calcular_custo_potencia_com_iva_final(_em_lote), para floats ou arrays de N; dias > 0."""
+    iva_normal_perc = 0.23
+    iva_reduzido_perc = 0.06
+    custo_comerc = preco_comercializador_dia * dias
+    custo_tar = tar_potencia_dia * dias # Esta TAR já tem TS, se aplicável
+    custo_sem_iva = custo_comerc + custo_tar
+    # Até 3.45 kVA o IVA é separado: 23% no comercializador, 6% na TAR final; acima, 23% sobre tudo
+    iva_separado = potencias <= 3.45
+    iva_23 = _onde(iva_separado, custo_comerc * iva_normal_perc, custo_sem_iva * iva_normal_perc)
+    iva_6 = _onde(iva_separado, custo_tar * iva_reduzido_perc, 0.0)
+    custo_com_iva = _onde(iva_separado, (custo_comerc + iva_23) + (custo_tar + iva_6), custo_sem_iva + iva_23)
+    return custo_com_iva, custo_sem_iva, iva_6, iva_23
+
+def _decomposicao_iva_arredondada(custo_com_iva, custo_sem_iva, valor_iva_6, valor_iva_23):
+    """Arredonda as quatro componentes (arrays de N) numa só passagem, como o round(x, 4) das funções escalares."""
+    arredondado = _arredondar_como_round(np.stack([custo_com_iva, custo_sem_iva, valor_iva_6, valor_iva_23]))
+    return dict(zip(CHAVES_DECOMPOSICAO_IVA, arredondado))
+
+# --- Função: Custo de energia com IVA para N tarifários (limite 200 ou 300 kWh/30 dias apenas <= 6.9 kVA)
+def calcular_custo_energia_com_iva_em_lote(consumos_horarios, precos_sem_iva, opcao_horaria_str, potencias_kva, dias_calculo, familia_numerosa_bool):
+    """
+    calcular_custo_energia_com_iva para N tarifários de uma vez (mesma opção horária e mesmos dias).
+    consumos_horarios: {período: kWh}, cada valor escalar (comum a todos) ou array de N.
+    precos_sem_iva: {período: preço s/IVA, escalar ou array de N} ('S' no Simples); períodos sem preço contam a 0.
+    potencias_kva: array de N, que define quem tem limite de IVA reduzido.
+    Devolve {'custo_com_iva', 'custo_sem_iva', 'valor_iva_6', 'valor_iva_23'} em arrays de N, com exatamente os
+    valores (arredondados a 4 casas) da função escalar.
+    """
+    potencias = np.atleast_1d(np.asarray(potencias_kva, dtype=float))
+    zeros = np.zeros(len(potencias))
+    if not isinstance(opcao_horaria_str, str):
+        return {chave: zeros.copy() for chave in CHAVES_DECOMPOSICAO_IVA}
+    consumos = {p: zeros + (0.0 if c is None else np.asarray(c, dtype=float)) for p, c in consumos_horarios.items()}
+    precos = {p: zeros + np.asarray(v, dtype=float) for p, v in precos_sem_iva.items() if v is not None}
+    return _decomposicao_iva_arredondada(*_nucleo_custo_energia_com_iva(
+        consumos, precos, opcao_horaria_str.lower() == "simples", potencias, dias_calculo, familia_numerosa_bool, zeros
+    ))
+
 # --- Função: Calcular custo de energia com IVA (limite 200 ou 300 kWh/30 dias apenas <= 6.9 kVA), para diferentes opções horárias
 def calcular_custo_energia_com_iva(
     consumo_kwh_total_periodo, preco_energia_final_sem_iva_simples,
     precos_energia_final_sem_iva_horario, dias_calculo, potencia_kva,
     opcao_horaria_str, consumos_horarios, familia_numerosa_bool
 ):
+    """Um só tarifário; mesmo núcleo que calcular_custo_energia_com_iva_em_lote."""
     if not isinstance(opcao_horaria_str, str):
         return {'custo_com_iva': 0.0, 'custo_sem_iva': 0.0, 'valor_iva_6': 0.0, 'valor_iva_23': 0.0}
 
-    opcao_horaria_lower = opcao_horaria_str.lower()
-    iva_normal_perc = 0.23
-    iva_reduzido_perc = 0.06
-    
-    custo_total_com_iva = 0.0
-    custo_total_sem_iva = 0.0
-    total_iva_6_energia = 0.0
-    total_iva_23_energia = 0.0
-
+    simples = opcao_horaria_str.lower() == "simples"
     precos_horarios = precos_energia_final_sem_iva_horario if isinstance(precos_energia_final_sem_iva_horario, dict) else {}
     consumos_periodos = consumos_horarios if isinstance(consumos_horarios, dict) else {}
-
-    # Calcular custo total sem IVA primeiro
-    if opcao_horaria_lower == "simples":
-        consumo_s = float(consumos_periodos.get('S', 0.0) or 0.0)
-        preco_s = float(preco_energia_final_sem_iva_simples or 0.0)
-        custo_total_sem_iva = consumo_s * preco_s
+    if simples:
+        precos = {'S': float(preco_energia_final_sem_iva_simples or 0.0)}
     else: # Bi ou Tri
-        for periodo, consumo_p in consumos_periodos.items():
-            consumo_p_float = float(consumo_p or 0.0)
-            preco_h = float(precos_horarios.get(periodo, 0.0) or 0.0)
-            custo_total_sem_iva += consumo_p_float * preco_h
-            
-    # Determinar limite para IVA reduzido
-    limite_kwh_periodo_global = 0.0
-    if potencia_kva <= 6.9:
-        limite_kwh_mensal = 300 if familia_numerosa_bool else 200
-        limite_kwh_periodo_global = (limite_kwh_mensal * dias_calculo / 30.0) if dias_calculo > 0 else 0.0
-
-    if limite_kwh_periodo_global == 0.0: # Sem IVA reduzido, tudo a 23%
-        total_iva_23_energia = custo_total_sem_iva * iva_normal_perc
-        custo_total_com_iva = custo_total_sem_iva + total_iva_23_energia
-    else: # Com IVA reduzido/Normal
-        if opcao_horaria_lower == "simples":
-            consumo_s = float(consumos_periodos.get('S', 0.0) or 0.0)
-            preco_s = float(preco_energia_final_sem_iva_simples or 0.0)
-            
-            consumo_para_iva_reduzido = min(consumo_s, limite_kwh_periodo_global)
-            consumo_para_iva_normal = max(0.0, consumo_s - limite_kwh_periodo_global)
-            
-            base_iva_6 = consumo_para_iva_reduzido * preco_s
-            base_iva_23 = consumo_para_iva_normal * preco_s
-            
-            total_iva_6_energia = base_iva_6 * iva_reduzido_perc
-            total_iva_23_energia = base_iva_23 * iva_normal_perc
-            custo_total_com_iva = base_iva_6 + total_iva_6_energia + base_iva_23 + total_iva_23_energia
-        else: # Bi ou Tri rateado
-            consumo_total_real_periodos = sum(float(v or 0.0) for v in consumos_periodos.values())
-            if consumo_total_real_periodos > 0:
-                for periodo, consumo_periodo in consumos_periodos.items():
-                    consumo_periodo_float = float(consumo_periodo or 0.0)
-                    preco_periodo = float(precos_horarios.get(periodo, 0.0) or 0.0)
-                    
-                    fracao_consumo_periodo = consumo_periodo_float / consumo_total_real_periodos
-                    limite_para_este_periodo_rateado = limite_kwh_periodo_global * fracao_consumo_periodo
-                    
-                    consumo_periodo_iva_reduzido = min(consumo_periodo_float, limite_para_este_periodo_rateado)
-                    consumo_periodo_iva_normal = max(0.0, consumo_periodo_float - limite_para_este_periodo_rateado)
-                    
-                    base_periodo_iva_6 = consumo_periodo_iva_reduzido * preco_periodo
-                    base_periodo_iva_23 = consumo_periodo_iva_normal * preco_periodo
-                    
-                    iva_6_este_periodo = base_periodo_iva_6 * iva_reduzido_perc
-                    iva_23_este_periodo = base_periodo_iva_23 * iva_normal_perc
-                    
-                    total_iva_6_energia += iva_6_este_periodo
-                    total_iva_23_energia += iva_23_este_periodo
-                    custo_total_com_iva += base_periodo_iva_6 + iva_6_este_periodo + base_periodo_iva_23 + iva_23_este_periodo
-            else: # Se consumo_total_real_periodos for 0, tudo é zero
-                 custo_total_com_iva = 0.0
-                 # total_iva_6_energia e total_iva_23_energia permanecem 0.0
+        precos = {periodo: float(preco or 0.0) for periodo, preco in precos_horarios.items()}
+    consumos = {periodo: float(consumo or 0.0) for periodo, consumo in consumos_periodos.items()}
 
-    return {
-        'custo_com_iva': round(custo_total_com_iva, 4),
-        'custo_sem_iva': round(custo_total_sem_iva, 4),
-        'valor_iva_6': round(total_iva_6_energia, 4),
-        'valor_iva_23': round(total_iva_23_energia, 4)
-    }
+    componentes = _nucleo_custo_energia_com_iva(consumos, precos, simples, potencia_kva, dias_calculo, familia_numerosa_bool, 0.0)
+    return {chave: round(valor, 4) for chave, valor in zip(CHAVES_DECOMPOSICAO_IVA, componentes)}
+
+# --- Função: Custo da potência com IVA para N tarifários ---
+def calcular_custo_potencia_com_iva_em_lote(precos_comercializador_dia_sem_iva, tar_potencia_final_dia_sem_iva, dias, potencias_kva):
+    """
+    calcular_custo_potencia_com_iva_final para N tarifários de uma vez: preços e TAR (escalares ou arrays de N)
+    e potencias_kva (array de N). Devolve arrays de N com os mesmos valores arredondados da função escalar.
+    """
+    potencias = np.atleast_1d(np.asarray(potencias_kva, dtype=float))
+    zeros = np.zeros(len(potencias))
+    dias = int(dias or 0)
+    if dias <= 0:
+        return {chave: zeros.copy() for chave in CHAVES_DECOMPOSICAO_IVA}
+    return _decomposicao_iva_arredondada(*_nucleo_custo_potencia_com_iva(
+        zeros + np.asarray(precos_comercializador_dia_sem_iva, dtype=float),
+        zeros + np.asarray(tar_potencia_final_dia_sem_iva, dtype=float),
+        dias, potencias
+    ))
 
 # --- Função: Calcular custo da potência com IVA ---
 def calcular_custo_potencia_com_iva_final(preco_comercializador_dia_sem_iva, tar_potencia_final_dia_sem_iva, dias, potencia_kva):
-    iva_normal_perc = 0.23
-    iva_reduzido_perc = 0.06
-    
-    preco_comercializador_dia_sem_iva = float(preco_comercializador_dia_sem_iva or 0.0)
-    tar_potencia_final_dia_sem_iva = float(tar_potencia_final_dia_sem_iva or 0.0) # Esta TAR já tem TS, se aplicável
+    """Um só tarifário; mesmo núcleo que calcular_custo_potencia_com_iva_em_lote."""
     dias = int(dias or 0)
-
     if dias <= 0:
         return {'custo_com_iva': 0.0, 'custo_sem_iva': 0.0, 'valor_iva_6': 0.0, 'valor_iva_23': 0.0}
-
-    custo_comerc_siva_periodo = preco_comercializador_dia_sem_iva * dias
-    custo_tar_siva_periodo = tar_potencia_final_dia_sem_iva * dias
-    custo_total_potencia_siva = custo_comerc_siva_periodo + custo_tar_siva_periodo
-
-    iva_6_pot = 0.0
-    iva_23_pot = 0.0
-    custo_total_com_iva = 0.0
-
-    # Aplicar IVA separado: 23% no comercializador, 6% na TAR final
-    if potencia_kva <= 3.45:
-        iva_23_pot = custo_comerc_siva_periodo * iva_normal_perc
-        iva_6_pot = custo_tar_siva_periodo * iva_reduzido_perc
-        custo_total_com_iva = (custo_comerc_siva_periodo + iva_23_pot) + (custo_tar_siva_periodo + iva_6_pot)
-    else: # potencia_kva > 3.45
-    # Aplicar IVA normal (23%) à soma das componentes finais
-        iva_23_pot = custo_total_potencia_siva * iva_normal_perc
-        custo_total_com_iva = custo_total_potencia_siva + iva_23_pot
-        # iva_6_pot permanece 0.0
-
-    return {
-        'custo_com_iva': round(custo_total_com_iva, 4),
-        'custo_sem_iva': round(custo_total_potencia_siva, 4),
-        'valor_iva_6': round(iva_6_pot, 4),
-        'valor_iva_23': round(iva_23_pot, 4)
-    }
-    return round(custo_total_com_iva, 4)
+    componentes = _nucleo_custo_potencia_com_iva(
+        float(preco_comercializador_dia_sem_iva or 0.0), float(tar_potencia_final_dia_sem_iva or 0.0), dias, potencia_kva
+    )
+    return {chave: round(valor, 4) for chave, valor in zip(CHAVES_DECOMPOSICAO_IVA, componentes)}
 
 # --- Função: Calcular taxas adicionais ---
 def calcular_taxas_adicionais(
@@ -379,54 +885,142 @@ def calcular_taxas_adicionais(
         'valor_iva_23': round(total_iva_23_calculado, 4)
     }
 
-def calcular_custo_completo_diagrama_carga(tarifario_idx, df_consumos_reais, df_omie_ciclos, constantes_df, dias, potencia, familia_numerosa, tarifa_social, valor_dgeg_user, valor_cav_user, mes, ano_atual, incluir_quota_acp, desconto_continente, FINANCIAMENTO_TSE_VAL,VALOR_QUOTA_ACP_MENSAL):
+# --- Grafo de cálculo incremental (entre reruns só se recalcula o que mudou) ---
+MAX_NOS_GRAFO_CALCULO = 512
+
+class GrafoCalculo:
+    """
+    Resultados intermédios da simulação, guardados na sessão em nós com entradas explícitas.
+    Cada nó só é recalculado quando as suas entradas mudam; os nós caros são:
+      - 'precos_btn': preços de energia por período dos indexados quarto-horários (OMIE do período, perfil, ciclo)
+      - 'coeficientes_omie_btn': os mesmos preços em forma afim no OMIE (OMIE manual e sensibilidade instantâneos)
+      - 'custo_comercializador_diagrama': custo do comercializador por período em modo diagrama
+      - 'fixos_energia_potencia': preços finais e energia/potência com IVA dos tarifários fixos
+    Taxas (calcular_taxas_adicionais), separação do IVA das taxas e descontos específicos são baratos e
+    são sempre somados por cima: mudar a DGEG, a CAV, a quota ACP ou o desconto Continente não volta a
+    calcular nenhum dos nós acima. Cada nó guarda só o último resultado (que não deve ser alterado);
+    mudar a versão dos dados limpa o grafo.
+    """
+    def __init__(self):
+        self.versao = None
+        self._nos = OrderedDict()
+
+    def fixar_versao(self, versao):
+        """Esquece todos os nós se os dados (tarifários, OMIE, constantes) mudaram de versão."""
+        if versao != self.versao:
+            self._nos.clear()
+            self.versao = versao
+
+    def no(self, nome, entradas, calcular):
+        """Devolve o resultado do nó 'nome' para 'entradas' (tuplo comparável), chamando calcular() só se mudaram."""
+        guardado = self._nos.get(nome)
+        if guardado is not None and guardado[0] == entradas:
+            self._nos.move_to_end(nome)
+            return guardado[1]
+        resultado = calcular()
+        self._nos[nome] = (entradas, resultado)
+        self._nos.move_to_end(nome)
+        while len(self._nos) > MAX_NOS_GRAFO_CALCULO:
+            self._nos.popitem(last=False)
+        return resultado
+
+# --- Diagrama de carga alinhado com OMIE, perdas e ciclos ---
+COLUNAS_CICLOS_DIAGRAMA = ['BD', 'BS', 'TD', 'TS']
+
+@dataclass(frozen=True)
+class DiagramaAlinhado:
+    """
+    Consumos do diagrama de carga cruzados uma única vez com OMIE, Perdas e ciclos horários.
+    Serve todos os cálculos em modo diagrama (todos os tarifários e opções horárias) sem repetir o merge.
+    df: merge por 'DataHora', sem intervalos sem OMIE/Perdas (não deve ser alterado)
+    consumo_total: soma dos consumos originais (inclui intervalos sem OMIE)
+    consumo / omie / perdas: arrays float64 alinhados com df
+    posicoes_periodos: {coluna de ciclo: {período: posições em df}}
+    consumos_por_ciclo: {coluna de ciclo: {período: consumo (kWh)}}
+    chave: identifica os consumos e a versão dos dados (ver GrafoCalculo); vazia se desconhecida
+    """
+    df: pd.DataFrame
+    consumo_total: float
+    consumo: np.ndarray
+    omie: np.ndarray
+    perdas: np.ndarray
+    posicoes_periodos: Mapping
+    consumos_por_ciclo: Mapping
+    chave: tuple = ()
+
+    @property
+    def vazio(self):
+        return self.df.empty
+
+def alinhar_diagrama_consumos(df_consumos, df_omie_ciclos, chave=()):
+    """Faz o merge consumos x OMIE/Perdas/ciclos e pré-calcula os arrays e agregações por ciclo."""
+    df_merged = pd.merge(df_consumos, df_omie_ciclos, on='DataHora', how='left')
+    df_merged.dropna(subset=['OMIE', 'Perdas'], inplace=True)
+
+    posicoes_periodos, consumos_por_ciclo = {}, {}
+    for coluna_ciclo in COLUNAS_CICLOS_DIAGRAMA:
+        if coluna_ciclo not in df_merged.columns:
+            continue
+        agrupado = df_merged.groupby(coluna_ciclo, observed=True)
+        consumos_por_ciclo[coluna_ciclo] = MappingProxyType(agrupado['Consumo (kWh)'].sum().to_dict())
+        posicoes_periodos[coluna_ciclo] = MappingProxyType(dict(agrupado.indices))
+
+    consumo = df_merged['Consumo (kWh)'].to_numpy(dtype=np.float64)
+    omie = df_merged['OMIE'].to_numpy(dtype=np.float64)
+    perdas = df_merged['Perdas'].to_numpy(dtype=np.float64)
+    for array in (consumo, omie, perdas):
+        array.setflags(write=False)
+    return DiagramaAlinhado(
+        df=df_merged,
+        consumo_total=df_consumos['Consumo (kWh)'].sum(),
+        consumo=consumo, omie=omie, perdas=perdas,
+        posicoes_periodos=MappingProxyType(posicoes_periodos),
+        consumos_por_ciclo=MappingProxyType(consumos_por_ciclo),
+        chave=tuple(chave),
+    )
+
+def chave_diagrama_consumos(df_consumos):
+    """Impressão digital (sha256) de DataHora + Consumo, para reutilizar o DiagramaAlinhado entre reruns."""
+    hashes = pd.util.hash_pandas_object(df_consumos[['DataHora', 'Consumo (kWh)']], index=False)
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
+
+def _somas_comercializador_diagrama(diagrama, kernel_comercializador, coluna_ciclo):
+    """
+    Custo do comercializador (€, s/ TAR) no total ('S') e em cada período da coluna de ciclo, e a sua
+    variação por €/MWh de OMIE (kernel afim: diferença entre OMIE + 1000 e OMIE, a dividir por 1000).
+    """
+    custo_intervalo = kernel_comercializador(diagrama.omie, diagrama.perdas) * diagrama.consumo
+    declive_intervalo = (kernel_comercializador(diagrama.omie + 1000.0, diagrama.perdas) * diagrama.consumo - custo_intervalo) / 1000.0
+    somas, declives = {'S': np.nansum(custo_intervalo)}, {'S': np.nansum(declive_intervalo)}
+    for periodo, posicoes in diagrama.posicoes_periodos.get(coluna_ciclo, {}).items():
+        somas[periodo] = np.nansum(custo_intervalo[posicoes])
+        declives[periodo] = np.nansum(declive_intervalo[posicoes])
+    return somas, declives
+
+def calcular_custo_completo_diagrama_carga(tarifario_idx, df_consumos_reais, df_omie_ciclos, constantes_df, dias, potencia, familia_numerosa, tarifa_social, valor_dgeg_user, valor_cav_user, mes, ano_atual, incluir_quota_acp, desconto_continente, FINANCIAMENTO_TSE_VAL,VALOR_QUOTA_ACP_MENSAL, grafo=None, delta_omie=0.0):
     """
     Calcula o custo COMPLETO de um tarifário quarto-horário usando os consumos reais,
     incluindo a decomposição detalhada para os tooltips e todos os descontos específicos.
     Devolve um dicionário plano com todos os dados para a tabela detalhada e para os tooltips.
+    'df_consumos_reais' pode ser um DiagramaAlinhado (merge já feito) ou o DataFrame de consumos.
+    Com 'grafo' (GrafoCalculo) e um diagrama com chave, o custo do comercializador por período fica
+    guardado no nó 'custo_comercializador_diagrama' e não é recalculado quando só mudam taxas ou descontos.
+    'delta_omie' (€/MWh) desloca todos os OMIE horários, a partir do declive guardado no mesmo nó.
     """
     try:
         # --- Inicializar dicionários para os componentes dos tooltips ---
         componentes_tooltip_energia_dict = {}
         componentes_tooltip_potencia_dict = {}
 
-        # 1. Cruzamento de Dados e Cálculo de Componentes Base
-        df_merged = pd.merge(df_consumos_reais, df_omie_ciclos, on='DataHora', how='left')
-        df_merged.dropna(subset=['OMIE', 'Perdas'], inplace=True)
-        if df_merged.empty: return None
+        # 1. Cruzamento de Dados (feito uma vez por diagrama, ver DiagramaAlinhado) e Cálculo de Componentes Base
+        diagrama = df_consumos_reais if isinstance(df_consumos_reais, DiagramaAlinhado) else alinhar_diagrama_consumos(df_consumos_reais, df_omie_ciclos)
+        if diagrama.vazio: return None
+        df_merged = diagrama.df
 
         nome_tarifario = tarifario_idx['nome']
-        constantes_dict = dict(zip(constantes_df["constante"], constantes_df["valor_unitário"]))
-
-        def calcular_preco_comercializador_intervalo(row):
-            omie_kwh = row['OMIE'] / 1000.0; perdas = row['Perdas']
-            if nome_tarifario == "Coopérnico | Base": return (omie_kwh + constantes_dict.get('Coop_CS_CR', 0.0) + constantes_dict.get('Coop_K', 0.0)) * perdas
-            elif nome_tarifario == "Coopérnico | GO": return (omie_kwh + constantes_dict.get('Coop_CS_CR', 0.0) + constantes_dict.get('Coop_K', 0.0)) * perdas + constantes_dict.get('Coop_GO', 0.0)
-            elif "Repsol | Leve PRO Sem Mais" in nome_tarifario: return (omie_kwh * perdas * constantes_dict.get('Repsol_FA', 0.0) + constantes_dict.get('Repsol_Q_Tarifa_Pro', 0.0))
-            elif "Repsol | Leve Sem Mais" in nome_tarifario: return (omie_kwh * perdas * constantes_dict.get('Repsol_FA', 0.0) + constantes_dict.get('Repsol_Q_Tarifa', 0.0))
-            elif "Galp | Plano Flexível / Dinâmico" in nome_tarifario: return (omie_kwh + constantes_dict.get('Galp_Ci', 0.0)) * perdas
-            elif "Alfa Energia | ALFA POWER INDEX BTN" in nome_tarifario: return ((omie_kwh + constantes_dict.get('Alfa_CGS', 0.0)) * perdas + constantes_dict.get('Alfa_K', 0.0))
-            elif "Plenitude | Tendência" in nome_tarifario: return (((omie_kwh + constantes_dict.get('Plenitude_CGS', 0.0) + constantes_dict.get('Plenitude_GDOs', 0.0))) * perdas + constantes_dict.get('Plenitude_Fee', 0.0))
-            elif "Meo Energia | Tarifa Dinâmica" in nome_tarifario: return (omie_kwh + constantes_dict.get('Meo_K', 0.0)) * perdas
-            elif "EDP | Eletricidade Indexada Horária" in nome_tarifario: return (omie_kwh * perdas * constantes_dict.get('EDP_H_K1', 1.0) + constantes_dict.get('EDP_H_K2', 0.0))
-            elif "EZU | Indexada" in nome_tarifario: return (omie_kwh + constantes_dict.get('EZU_K', 0.0) + constantes_dict.get('EZU_CGS', 0.0)) * perdas
-            elif "G9 | Smart Dynamic" in nome_tarifario: return (omie_kwh * constantes_dict.get('G9_FA', 0.0) * perdas + constantes_dict.get('G9_CGS', 0.0) + constantes_dict.get('G9_AC', 0.0))
-            elif "G9 | Smart Dynamic (Empresarial)" in nome_tarifario: return (omie_kwh * constantes_dict.get('G9_FA', 0.0) * perdas + constantes_dict.get('G9_CGS', 0.0) + constantes_dict.get('G9_AC', 0.0))
-            elif "Iberdrola | Simples Indexado Dinâmico" in nome_tarifario: return (omie_kwh * perdas + constantes_dict.get("Iberdrola_Dinamico_Q", 0.0) + constantes_dict.get('Iberdrola_mFRR', 0.0))
-            elif "Luzboa | BTN SPOTDEF" in nome_tarifario: return (omie_kwh + constantes_dict.get('Luzboa_CGS', 0.0)) * perdas * constantes_dict.get('Luzboa_FA', 1.0) + constantes_dict.get('Luzboa_Kp', 0.0)
-            return omie_kwh * perdas
-
-        df_merged['PrecoComercializadorIntervalo_sIVA'] = df_merged.apply(calcular_preco_comercializador_intervalo, axis=1)
-        df_merged['CustoComercializadorIntervalo_sIVA'] = df_merged['PrecoComercializadorIntervalo_sIVA'] * df_merged['Consumo (kWh)']
+        constantes_dict = obter_indice_constantes(constantes_df).valores
 
-        # 2. Agregação e Cálculo de Preços Médios Finais
-        precos_medios_finais_siva = {}
         opcao_horaria_idx = tarifario_idx['opcao_horaria_e_ciclo']
-        consumo_total_real = df_consumos_reais['Consumo (kWh)'].sum()
-
-        financiamento_tse_unitario = obter_constante('Financiamento_TSE', constantes_df) if not tarifario_idx.get('financiamento_tse_incluido', False) else 0.0
-        desconto_ts_energia_unitario = obter_constante('Desconto TS Energia', constantes_df) if tarifa_social else 0.0
-
         ciclo_col_idx = None
         opcao_lower_str = str(opcao_horaria_idx).lower()
         if opcao_lower_str.startswith("bi-horário"):
@@ -434,13 +1028,36 @@ def calcular_custo_completo_diagrama_carga(tarifario_idx, df_consumos_reais, df_
         elif opcao_lower_str.startswith("tri-horário"):
             ciclo_col_idx = 'TD' if "diário" in opcao_lower_str else 'TS'
 
+        # Custo do comercializador por intervalo, a partir da 'formula_calculo' compilada do tarifário, somado por período
+        formula_calculo = str(tarifario_idx.get('formula_calculo', ''))
+        def calcular_somas_comercializador():
+            kernel_comercializador = obter_kernel_indexado(nome_tarifario, formula_calculo, constantes_dict)
+            return _somas_comercializador_diagrama(diagrama, kernel_comercializador, ciclo_col_idx)
+        if grafo is not None and diagrama.chave:
+            # Um nó por diagrama: o bruto e o líquido (autoconsumo) alternam sem se invalidarem
+            nome_no = ('custo_comercializador_diagrama', diagrama.chave, nome_tarifario, formula_calculo, ciclo_col_idx)
+            somas_comercializador, declives_comercializador = grafo.no(nome_no, (), calcular_somas_comercializador)
+        else:
+            somas_comercializador, declives_comercializador = calcular_somas_comercializador()
+        if delta_omie:
+            somas_comercializador = {
+                periodo: soma + declives_comercializador[periodo] * delta_omie for periodo, soma in somas_comercializador.items()
+            }
+
+        # 2. Agregação e Cálculo de Preços Médios Finais
+        precos_medios_finais_siva = {}
+        consumo_total_real = diagrama.consumo_total
+
+        financiamento_tse_unitario = obter_constante('Financiamento_TSE', constantes_df) if not tarifario_idx.get('financiamento_tse_incluido', False) else 0.0
+        desconto_ts_energia_unitario = obter_constante('Desconto TS Energia', constantes_df) if tarifa_social else 0.0
+
         consumos_repartidos_reais = {'S': consumo_total_real}
-        if ciclo_col_idx and ciclo_col_idx in df_merged.columns:
-            consumos_repartidos_reais = df_merged.groupby(ciclo_col_idx)['Consumo (kWh)'].sum().to_dict()
-            for periodo, group in df_merged.groupby(ciclo_col_idx):
-                consumo_p = group['Consumo (kWh)'].sum()
+        if ciclo_col_idx and ciclo_col_idx in diagrama.consumos_por_ciclo:
+            consumos_repartidos_reais = dict(diagrama.consumos_por_ciclo[ciclo_col_idx])
+            for periodo, posicoes in diagrama.posicoes_periodos[ciclo_col_idx].items():
+                consumo_p = np.nansum(diagrama.consumo[posicoes])
                 if consumo_p > 0:
-                    comerc_preco_medio = group['CustoComercializadorIntervalo_sIVA'].sum() / consumo_p
+                    comerc_preco_medio = somas_comercializador[periodo] / consumo_p
                     tar_unitaria = obter_tar_energia_periodo(opcao_horaria_idx, periodo, potencia, constantes_df)
                     precos_medios_finais_siva[periodo] = comerc_preco_medio + tar_unitaria + financiamento_tse_unitario - desconto_ts_energia_unitario
                     componentes_tooltip_energia_dict[f'tooltip_energia_{periodo}_comerc_sem_tar'] = comerc_preco_medio
@@ -450,8 +1067,16 @@ def calcular_custo_completo_diagrama_carga(tarifario_idx, df_consumos_reais, df_
                     componentes_tooltip_energia_dict[f'tooltip_energia_{periodo}_ts_aplicada_flag'] = tarifa_social
                     componentes_tooltip_energia_dict[f'tooltip_energia_{periodo}_ts_desconto_valor'] = desconto_ts_energia_unitario
 
-        comerc_preco_medio_simples = df_merged['CustoComercializadorIntervalo_sIVA'].sum() / consumo_total_real if consumo_total_real > 0 else 0
-        tar_media_ponderada = (df_merged.apply(lambda row: obter_tar_energia_periodo(opcao_horaria_idx, row.get(ciclo_col_idx, 'S'), potencia, constantes_df) * row['Consumo (kWh)'], axis=1).sum()) / consumo_total_real if consumo_total_real > 0 else 0
+        comerc_preco_medio_simples = somas_comercializador['S'] / consumo_total_real if consumo_total_real > 0 else 0
+        # TAR de energia de cada intervalo, por pesquisa direta no índice das constantes (período sem TAR -> 0.0)
+        tar_energia_periodos = obter_indice_constantes(constantes_df).tar_energia_periodos(opcao_horaria_idx, potencia)
+        if 'S' in tar_energia_periodos:
+            tar_intervalo = np.full(len(df_merged), tar_energia_periodos['S'])
+        elif ciclo_col_idx in df_merged.columns:
+            tar_intervalo = df_merged[ciclo_col_idx].astype(object).map(tar_energia_periodos).fillna(0.0).to_numpy(dtype=np.float64)
+        else:
+            tar_intervalo = np.zeros(len(df_merged))
+        tar_media_ponderada = np.nansum(tar_intervalo * diagrama.consumo) / consumo_total_real if consumo_total_real > 0 else 0
         precos_medios_finais_siva['S'] = comerc_preco_medio_simples + tar_media_ponderada + financiamento_tse_unitario - desconto_ts_energia_unitario
         componentes_tooltip_energia_dict['tooltip_energia_S_comerc_sem_tar'] = comerc_preco_medio_simples
         componentes_tooltip_energia_dict['tooltip_energia_S_tar_bruta'] = tar_media_ponderada
@@ -463,10 +1088,10 @@ def calcular_custo_completo_diagrama_carga(tarifario_idx, df_consumos_reais, df_
         # 3. Decomposição e Cálculo do Custo Total da Fatura (Componentes Base)
         decomposicao_custo_energia = calcular_custo_energia_com_iva(consumo_total_real, precos_medios_finais_siva.get('S'), {p:v for p,v in precos_medios_finais_siva.items() if p != 'S'}, dias, potencia, opcao_horaria_idx, consumos_repartidos_reais, familia_numerosa)
 
-        tar_potencia_regulada = obter_constante(f'TAR_Potencia {str(float(potencia))}', constantes_df)
+        tar_potencia_regulada = obter_tar_dia(potencia, constantes_df)
         preco_pot_comercializador = float(tarifario_idx.get('preco_potencia_dia', 0.0))
         if tarifario_idx.get('tar_incluida_potencia', True): preco_pot_comercializador -= tar_potencia_regulada
-        desconto_ts_pot_bruto = obter_constante(f'Desconto TS Potencia {potencia}', constantes_df) if tarifa_social else 0
+        desconto_ts_pot_bruto = obter_desconto_ts_potencia(potencia, constantes_df) if tarifa_social else 0
         desconto_ts_pot_aplicado = min(tar_potencia_regulada, desconto_ts_pot_bruto)
         tar_potencia_final_siva = tar_potencia_regulada - desconto_ts_pot_aplicado
         decomposicao_custo_potencia = calcular_custo_potencia_com_iva_final(preco_pot_comercializador, tar_potencia_final_siva, dias, potencia)
@@ -602,7 +1227,7 @@ def calcular_custo_completo_diagrama_carga(tarifario_idx, df_consumos_reais, df_
         # --- FIM DA ALTERAÇÃO ---
 
     except Exception as e:
-        st.error(f"Erro em `calcular_custo_completo_diagrama_carga` para {tarifario_idx.get('nome', 'desconhecido')}: {e}")
+        emitir_aviso('erro', f"Erro em `calcular_custo_completo_diagrama_carga` para {tarifario_idx.get('nome', 'desconhecido')}: {e}", 'calcular_custo_completo_diagrama_carga')
         return None
     
 ### NOVO: Função de cálculo dedicada para o Tarifário Personalizado ###
@@ -635,7 +1260,7 @@ def calcular_custo_personalizado(precos_energia_pers, preco_potencia_pers, consu
     for p, comp_comerc in comerc_energia.items():
         preco_final_siva[p] = comp_comerc + tar_energia_reg.get(p, 0) - desconto_ts_energia + financiamento_tse_a_somar
 
-    desconto_ts_potencia_bruto = obter_constante(f'Desconto TS Potencia {potencia}', CONSTANTES) if tarifa_social else 0
+    desconto_ts_potencia_bruto = obter_desconto_ts_potencia(potencia, CONSTANTES) if tarifa_social else 0
     desconto_ts_potencia_aplicado = min(tar_potencia_reg, desconto_ts_potencia_bruto) if tarifa_social else 0.0
     preco_potencia_final_siva = comerc_potencia + tar_potencia_reg - desconto_ts_potencia_aplicado
 
@@ -788,7 +1413,7 @@ def calcular_detalhes_custo_tarifario_fixo(
 
         if tarifa_social_ativa:
             desconto_ts_energia_bruto = obter_constante('Desconto TS Energia', CONSTANTES_df)
-            desconto_ts_potencia_dia_bruto = obter_constante(f'Desconto TS Potencia {potencia_contratada_kva}', CONSTANTES_df)
+            desconto_ts_potencia_dia_bruto = obter_desconto_ts_potencia(potencia_contratada_kva, CONSTANTES_df)
             for periodo_calc, tar_reg_val in tar_energia_regulada_tf.items():
                 tar_energia_final_tf[periodo_calc] = tar_reg_val - desconto_ts_energia_bruto
             desconto_ts_energia_aplicado_val = desconto_ts_energia_bruto # Para tooltip
@@ -998,10 +1623,351 @@ def calcular_detalhes_custo_tarifario_fixo(
         }
     
     except Exception as e:
-        st.error(f"!!! ERRO DENTRO de `calcular_detalhes_custo_tarifario_fixo` para '{dados_tarifario_linha.get('nome', 'Desconhecido')}' na opção '{opcao_horaria_para_calculo}':")
-        st.exception(e) # Isto vai imprimir o traceback completo do erro
+        emitir_aviso(
+            'erro', f"!!! ERRO DENTRO de `calcular_detalhes_custo_tarifario_fixo` para '{dados_tarifario_linha.get('nome', 'Desconhecido')}' na opção '{opcao_horaria_para_calculo}': {e}",
+            'calcular_detalhes_custo_tarifario_fixo', traceback.format_exc() # Traceback completo do erro
+        )
         return None
     
+# --- Cálculo em lote dos tarifários fixos (todas as linhas tarifário/opção/potência de uma vez) ---
+# Coluna de preço de energia por (família da opção, período)
+COLUNAS_PRECO_ENERGIA_FIXO = {
+    ('simples', 'S'): 'preco_energia_simples',
+    ('bi', 'V'): 'preco_energia_vazio_bi',
+    ('bi', 'F'): 'preco_energia_fora_vazio',
+    ('tri', 'V'): 'preco_energia_vazio_tri',
+    ('tri', 'C'): 'preco_energia_cheias',
+    ('tri', 'P'): 'preco_energia_ponta',
+}
+DESCONTO_MEO_MENSAL = {'simples': 2.95, 'bi': 3.50, 'tri': 6.27}
+COLUNAS_TOOLTIP_CUSTO_TOTAL = [
+    'tt_cte_energia_siva', 'tt_cte_potencia_siva', 'tt_cte_iec_siva', 'tt_cte_dgeg_siva', 'tt_cte_cav_siva',
+    'tt_cte_total_siva', 'tt_cte_valor_iva_6_total', 'tt_cte_valor_iva_23_total', 'tt_cte_subtotal_civa',
+    'tt_cte_desc_finais_valor', 'tt_cte_acres_finais_valor',
+]
+
+def _flag_tarifario(df, coluna):
+    """Flags do Excel como o .get(coluna, True) do cálculo individual (vazio conta como verdadeiro)."""
+    if coluna not in df.columns:
+        return np.ones(len(df), dtype=bool)
+    return np.array([bool(v) for v in df[coluna].to_numpy()], dtype=bool)
+
+def _energia_potencia_fixos_lote(df, opcao, familia, periodos_preco, consumos_dict, dias_calculo, tarifa_social_ativa, familia_numerosa_ativa, indice, FINANCIAMENTO_TSE_VAL):
+    """
+    Passos 1 a 6 de calcular_custos_fixos_em_lote para as linhas de uma opção horária: TAR, preços do
+    comercializador e finais s/IVA, energia e potência com IVA. Não depende de DGEG, CAV nem descontos.
+    """
+    desconto_ts_energia = indice.valores.get('Desconto TS Energia', 0.0)
+    n = len(df)
+    potencias = df['potencia_kva'].to_numpy(dtype=float)
+    tar_incluida_energia = _flag_tarifario(df, 'tar_incluida_energia')
+    tar_incluida_potencia = _flag_tarifario(df, 'tar_incluida_potencia')
+    tse_incluido = _flag_tarifario(df, 'financiamento_tse_incluido')
+
+    # Passo 1: TAR reguladas (pesquisadas uma vez por potência distinta) e preços do comercializador
+    potencias_unicas, posicoes = np.unique(potencias, return_inverse=True)
+    tar_energia_regulada = {
+        periodo: np.array([indice.tar_energia_periodo(opcao, periodo, pot) for pot in potencias_unicas])[posicoes]
+        for periodo in consumos_dict
+    }
+    tar_potencia_regulada = np.array([indice.tar_potencia.get(float(pot), 0.0) for pot in potencias_unicas])[posicoes]
+
+    preco_comercializador_energia = {}
+    for periodo in periodos_preco:
+        if periodo not in consumos_dict:
+            continue
+        preco = df[COLUNAS_PRECO_ENERGIA_FIXO[(familia, periodo)]].to_numpy(dtype=float)
+        preco_comercializador_energia[periodo] = np.where(tar_incluida_energia, preco - tar_energia_regulada[periodo], preco)
+
+    preco_potencia = df['preco_potencia_dia'].to_numpy(dtype=float) if 'preco_potencia_dia' in df.columns else np.zeros(n)
+    preco_comercializador_potencia = np.where(tar_incluida_potencia, preco_potencia - tar_potencia_regulada, preco_potencia)
+    preco_comercializador_potencia = np.where(preco_comercializador_potencia > 0.0, preco_comercializador_potencia, 0.0) # max(0, x), NaN -> 0
+    tse_a_adicionar = np.where(tse_incluido, 0.0, FINANCIAMENTO_TSE_VAL)
+
+    # Passo 2: TAR finais (desconto da Tarifa Social)
+    if tarifa_social_ativa:
+        desconto_ts_potencia = np.array([indice.desconto_ts_potencia.get(float(pot), 0.0) for pot in potencias_unicas])[posicoes]
+        tar_energia_final = {p: tar - desconto_ts_energia for p, tar in tar_energia_regulada.items()}
+        tar_potencia_final = np.maximum(0.0, tar_potencia_regulada - desconto_ts_potencia)
+    else:
+        tar_energia_final = tar_energia_regulada
+        tar_potencia_final = tar_potencia_regulada
+
+    # Passo 3: preço final da energia s/IVA, só nos períodos com consumo e preço (pela ordem dos consumos)
+    preco_energia_final = {
+        p: preco_comercializador_energia[p] + tar_energia_final[p] + tse_a_adicionar
+        for p in consumos_dict if p in preco_comercializador_energia
+    }
+
+    # Passos 5 e 6: energia e potência com IVA
+    energia = calcular_custo_energia_com_iva_em_lote(consumos_dict, preco_energia_final, opcao, potencias, dias_calculo, familia_numerosa_ativa)
+    potencia = calcular_custo_potencia_com_iva_em_lote(preco_comercializador_potencia, tar_potencia_final, dias_calculo, potencias)
+    return {
+        'preco_comercializador_energia': preco_comercializador_energia,
+        'tar_energia_regulada': tar_energia_regulada,
+        'tse_a_adicionar': tse_a_adicionar,
+        'preco_comercializador_potencia': preco_comercializador_potencia,
+        'tar_potencia_regulada': tar_potencia_regulada,
+        'tar_potencia_final': tar_potencia_final,
+        'preco_energia_final': preco_energia_final,
+        'energia': energia,
+        'potencia': potencia,
+    }
+
+def calcular_custos_fixos_em_lote(
+    tarifarios_fixos_df,
+    consumos_por_opcao,
+    dias_calculo,
+    tarifa_social_ativa,
+    familia_numerosa_ativa,
+    valor_dgeg_user_input,
+    valor_cav_user_input,
+    incluir_quota_acp_input,
+    desconto_continente_input,
+    CONSTANTES_df,
+    FINANCIAMENTO_TSE_VAL,
+    VALOR_QUOTA_ACP_MENSAL,
+    grafo=None
+):
+    """
+    Custo de todas as linhas de tarifarios_fixos_df (tarifário x opção horária x potência) numa só passagem.
+    consumos_por_opcao: {opcao_horaria_e_ciclo: {período: kWh}}; linhas de opções fora deste dicionário,
+    ou sem os preços da sua opção, ficam de fora (o cálculo individual devolvia None).
+    Cada kWh pode ser escalar (comum a todas as linhas da opção) ou um array com um valor por linha da opção em
+    tarifarios_fixos_df (ex: o mesmo tarifário repetido para vários consumos, ver custos_dimensionamento_pv).
+
+    Devolve um DataFrame "tidy", com o índice de tarifarios_fixos_df, com 'Total (€)' e as componentes
+    usadas nos tooltips (colunas tt_*) e nos descontos. Os mesmos valores que calcular_detalhes_custo_tarifario_fixo;
+    os dicionários de tooltip são montados à parte, por colunas, com tooltips_custo_total_lote.
+    Com 'grafo' (GrafoCalculo), a energia e a potência de cada opção ficam no nó 'fixos_energia_potencia':
+    mudar só DGEG, CAV, quota ACP ou desconto Continente refaz apenas taxas e descontos.
+    """
+    indice = obter_indice_constantes(CONSTANTES_df)
+    dias_int = int(dias_calculo or 0)
+    is_billing_month = 28 <= dias_calculo <= 31
+    blocos = []
+
+    for opcao, consumos_dict in consumos_por_opcao.items():
+        familia = _familia_opcao_tar(opcao)
+        if familia is None or not consumos_dict:
+            continue
+        df = tarifarios_fixos_df[tarifarios_fixos_df['opcao_horaria_e_ciclo'] == opcao]
+        periodos_preco = [p for (fam, p) in COLUNAS_PRECO_ENERGIA_FIXO if fam == familia]
+        tem_precos = np.ones(len(df), dtype=bool)
+        for periodo in periodos_preco:
+            tem_precos &= df[COLUNAS_PRECO_ENERGIA_FIXO[(familia, periodo)]].notna().to_numpy()
+        df = df[tem_precos]
+        if df.empty:
+            continue
+        consumos_dict = {p: c if np.ndim(c) == 0 else np.asarray(c, dtype=float)[tem_precos] for p, c in consumos_dict.items()}
+
+        n = len(df)
+        potencias = df['potencia_kva'].to_numpy(dtype=float)
+        nomes = df['nome'].astype(str)
+        comercializadores = df['comercializador'].astype(str) if 'comercializador' in df.columns else pd.Series('Desconhecido', index=df.index)
+        consumo_total = sum(float(v or 0) if np.ndim(v) == 0 else np.asarray(v, dtype=float) for v in consumos_dict.values())
+
+        # Passos 1 a 6: preços finais, energia e potência com IVA (nó 'fixos_energia_potencia' do grafo)
+        def calcular_energia_potencia():
+            return _energia_potencia_fixos_lote(
+                df, opcao, familia, periodos_preco, consumos_dict, dias_calculo,
+                tarifa_social_ativa, familia_numerosa_ativa, indice, FINANCIAMENTO_TSE_VAL
+            )
+        if grafo is None:
+            componentes = calcular_energia_potencia()
+        else:
+            entradas = (tuple(df.index), tuple((p, c if np.ndim(c) == 0 else c.tobytes()) for p, c in consumos_dict.items()), dias_calculo, bool(tarifa_social_ativa), bool(familia_numerosa_ativa), FINANCIAMENTO_TSE_VAL)
+            componentes = grafo.no(('fixos_energia_potencia', opcao), entradas, calcular_energia_potencia)
+        energia, potencia = componentes['energia'], componentes['potencia']
+        preco_energia_final = componentes['preco_energia_final']
+
+        # Passo 7: taxas com IVA
+        cav_fixa = np.zeros(n, dtype=bool)
+        if is_billing_month:
+            mapa_cav_fixa = {
+                c: any(i.lower() in c.lower() for i in IDENTIFICADORES_COMERCIALIZADORES_CAV_FIXA)
+                for c in comercializadores.unique()
+            }
+            cav_fixa = comercializadores.map(mapa_cav_fixa).to_numpy(dtype=bool)
+        # (uma chamada por consumo total distinto: uma só com consumos escalares)
+        consumos_totais_unicos, posicoes_consumo = np.unique(np.broadcast_to(consumo_total, (n,)), return_inverse=True)
+        def taxas_por_linha(nome_comercializador, aplica_taxa_fixa_mensal):
+            por_consumo = [
+                calcular_taxas_adicionais(float(c), dias_calculo, tarifa_social_ativa, valor_dgeg_user_input, valor_cav_user_input, nome_comercializador, aplica_taxa_fixa_mensal)
+                for c in consumos_totais_unicos
+            ]
+            return {chave: np.array([t[chave] for t in por_consumo])[posicoes_consumo] for chave in por_consumo[0]}
+        taxas = taxas_por_linha(None, False)
+        if cav_fixa.any() and dias_int > 0:
+            taxas_cav_fixa = taxas_por_linha(IDENTIFICADORES_COMERCIALIZADORES_CAV_FIXA[0], True)
+            for chave, valor in taxas_cav_fixa.items():
+                taxas[chave] = np.where(cav_fixa, valor, taxas[chave])
+
+        # Passo 8: total e descontos específicos
+        subtotal = energia['custo_com_iva'] + potencia['custo_com_iva'] + taxas['custo_com_iva']
+
+        desconto_mes = df['desconto_fatura_mes'].to_numpy(dtype=float) if 'desconto_fatura_mes' in df.columns else np.zeros(n)
+        limite_meses = df['desconto_meses_limite'].to_numpy(dtype=float) if 'desconto_meses_limite' in df.columns else np.zeros(n)
+        with np.errstate(invalid='ignore'):
+            dias_efetivos = np.where(limite_meses > 0, np.minimum(dias_calculo, limite_meses * 30.0), dias_calculo)
+            desconto_mes_completo = is_billing_month & ((limite_meses == 0) | (limite_meses >= 1))
+            desconto_fatura = np.where(
+                desconto_mes > 0,
+                np.where(desconto_mes_completo, desconto_mes, (desconto_mes / 30.0) * dias_efetivos),
+                0.0
+            )
+        custo = subtotal - desconto_fatura
+
+        quota_acp = np.zeros(n)
+        if incluir_quota_acp_input:
+            quota_periodo = VALOR_QUOTA_ACP_MENSAL if is_billing_month else (VALOR_QUOTA_ACP_MENSAL / 30.0) * dias_calculo
+            quota_acp = np.where(nomes.str.startswith("Goldenergy | ACP").to_numpy(), quota_periodo, 0.0)
+            custo = custo + quota_acp
+
+        desconto_meo = np.zeros(n)
+        consumo_mensal = consumo_total / dias_calculo * 30.0 if dias_calculo > 0 else 0
+        if dias_calculo > 0 and np.any(consumo_mensal >= 216):
+            e_meo = nomes.str.lower().str.contains("meo energia - tarifa fixa - clientes meo", regex=False).to_numpy() & (consumo_mensal >= 216)
+            desconto_meo = np.where(e_meo, (DESCONTO_MEO_MENSAL[familia] / 30.0) * dias_calculo, 0.0)
+            custo = custo - desconto_meo
+
+        desconto_continente = np.zeros(n)
+        if desconto_continente_input:
+            percentagem = np.where(nomes.str.startswith("Galp & Continente (-10% DD)").to_numpy(), 0.10,
+                           np.where(nomes.str.startswith("Galp & Continente (-7% s/DD)").to_numpy(), 0.07, 0.0))
+            if percentagem.any():
+                # Base do desconto: energia e potência com IVA, sem o desconto da Tarifa Social
+                preco_energia_bruto = {
+                    p: componentes['preco_comercializador_energia'][p] + componentes['tar_energia_regulada'][p] + componentes['tse_a_adicionar']
+                    for p in consumos_dict if p in componentes['preco_comercializador_energia']
+                }
+                energia_bruta = calcular_custo_energia_com_iva_em_lote(consumos_dict, preco_energia_bruto, opcao, potencias, dias_calculo, familia_numerosa_ativa)
+                potencia_bruta = calcular_custo_potencia_com_iva_em_lote(componentes['preco_comercializador_potencia'], componentes['tar_potencia_regulada'], dias_int, potencias)
+                desconto_continente = (energia_bruta['custo_com_iva'] + potencia_bruta['custo_com_iva']) * percentagem
+                custo = custo - desconto_continente
+
+        bloco = pd.DataFrame({
+            'nome': df['nome'].to_numpy(),
+            'comercializador': comercializadores.to_numpy(),
+            'opcao_horaria_e_ciclo': opcao,
+            'potencia_kva': potencias,
+            'Total (€)': custo,
+            'tt_cte_energia_siva': energia['custo_sem_iva'],
+            'tt_cte_potencia_siva': potencia['custo_sem_iva'],
+            'tt_cte_iec_siva': taxas['iec_sem_iva'],
+            'tt_cte_dgeg_siva': taxas['dgeg_sem_iva'],
+            'tt_cte_cav_siva': taxas['cav_sem_iva'],
+            'tt_cte_total_siva': energia['custo_sem_iva'] + potencia['custo_sem_iva'] + taxas['custo_sem_iva'],
+            'tt_cte_valor_iva_6_total': energia['valor_iva_6'] + potencia['valor_iva_6'] + taxas['valor_iva_6'],
+            'tt_cte_valor_iva_23_total': energia['valor_iva_23'] + potencia['valor_iva_23'] + taxas['valor_iva_23'],
+            'tt_cte_subtotal_civa': subtotal,
+            'tt_cte_desc_finais_valor': desconto_fatura + desconto_meo + desconto_continente,
+            'tt_cte_acres_finais_valor': quota_acp,
+            **{f"tt_preco_unit_energia_{p}_siva": v for p, v in preco_energia_final.items()},
+            'tt_preco_unit_potencia_siva': componentes['preco_comercializador_potencia'] + componentes['tar_potencia_final'],
+            'desconto_fatura_periodo': desconto_fatura,
+            'quota_acp_periodo': quota_acp,
+            'desconto_meo_periodo': desconto_meo,
+            'desconto_continente_periodo': desconto_continente,
+        }, index=df.index)
+        blocos.append(bloco)
+
+    if not blocos:
+        return pd.DataFrame(columns=['nome', 'comercializador', 'opcao_horaria_e_ciclo', 'potencia_kva', 'Total (€)'] + COLUNAS_TOOLTIP_CUSTO_TOTAL)
+    return pd.concat(blocos)
+
+def tooltips_custo_total_lote(resultado_lote):
+    """
+    Dicionários de tooltip do custo total (como no cálculo individual) de todas as linhas do lote, por posição.
+    São montados por colunas: um to_dict('records') por conjunto de períodos com preço (um por opção horária).
+    """
+    if resultado_lote.empty:
+        return []
+    colunas_energia = [c for c in (f"tt_preco_unit_energia_{p}_siva" for p in PERIODOS_INDEXADOS) if c in resultado_lote.columns]
+    colunas_base = COLUNAS_TOOLTIP_CUSTO_TOTAL + ['tt_preco_unit_potencia_siva']
+    tooltips = [None] * len(resultado_lote)
+    presentes = resultado_lote[colunas_energia].notna().to_numpy()
+    padroes, grupos = np.unique(presentes, axis=0, return_inverse=True)
+    for g, padrao in enumerate(padroes):
+        posicoes = np.flatnonzero(grupos.ravel() == g)
+        colunas = colunas_base + [c for c, presente in zip(colunas_energia, padrao) if presente]
+        registos = resultado_lote.iloc[posicoes][colunas].astype(float).to_dict('records')
+        for posicao, registo in zip(posicoes, registos):
+            tooltips[posicao] = registo
+    return tooltips
+
+# --- Otimizador da Potência Contratada (todas as potências numa só passagem) ---
+def contar_excedencias_potencia(serie_potencia_kw, potencias_kva):
+    """Número de quartos de hora com potência registada (kW) acima de cada potência (kVA, com fator de potência 1)."""
+    picos = np.sort(pd.to_numeric(pd.Series(serie_potencia_kw), errors='coerce').dropna().to_numpy(dtype=float))
+    potencias = np.asarray(potencias_kva, dtype=float)
+    return len(picos) - np.searchsorted(picos, potencias, side='right')
+
+def otimizar_potencia_contratada(
+    tarifarios_fixos_df,
+    opcao_horaria,
+    consumos_dict,
+    potencias_kva,
+    serie_potencia_kw,
+    dias_calculo,
+    tarifa_social_ativa,
+    familia_numerosa_ativa,
+    valor_dgeg_user_input,
+    valor_cav_user_input,
+    incluir_quota_acp_input,
+    desconto_continente_input,
+    CONSTANTES_df,
+    FINANCIAMENTO_TSE_VAL,
+    VALOR_QUOTA_ACP_MENSAL
+):
+    """
+    Avalia todas as potências_kva de uma vez para os tarifários fixos elegíveis na opção horária indicada.
+    Só o termo de potência (TAR, desconto TS, IVA <= 3.45 kVA) e o limite de IVA da energia (<= 6.9 kVA)
+    mudam com a potência, por isso o custo de todas as linhas tarifário x potência sai de um único
+    calcular_custos_fixos_em_lote.
+
+    Devolve (resumo_df, custos_df, potencia_recomendada):
+      - resumo_df: por potência, os quartos de hora acima dessa potência e o tarifário mais barato;
+      - custos_df: o resultado do lote (total de cada tarifário em cada potência);
+      - potencia_recomendada: a potência sem excedências com o menor custo (None se nenhuma for segura).
+    """
+    potencias = sorted({float(p) for p in potencias_kva})
+    # No Tri-horário, as potências acima de 20.7 kVA têm uma opção própria com o mesmo ciclo
+    consumos_por_opcao = {opcao_horaria: consumos_dict}
+    if _familia_opcao_tar(opcao_horaria) == 'tri':
+        normal, acima_20_7 = "Tri-horário - ", "Tri-horário > 20.7 kVA - "
+        outra_opcao = opcao_horaria.replace(normal, acima_20_7) if normal in opcao_horaria else opcao_horaria.replace(acima_20_7, normal)
+        consumos_por_opcao[outra_opcao] = consumos_dict
+    tabela = tarifarios_fixos_df[
+        tarifarios_fixos_df['opcao_horaria_e_ciclo'].isin(list(consumos_por_opcao)) &
+        tarifarios_fixos_df['potencia_kva'].isin(potencias)
+    ]
+    custos_df = calcular_custos_fixos_em_lote(
+        tabela, consumos_por_opcao, dias_calculo, tarifa_social_ativa, familia_numerosa_ativa,
+        valor_dgeg_user_input, valor_cav_user_input, incluir_quota_acp_input, desconto_continente_input,
+        CONSTANTES_df, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL
+    )
+
+    resumo_df = pd.DataFrame({
+        'Potência (kVA)': potencias,
+        'Quartos de hora acima': contar_excedencias_potencia(serie_potencia_kw, potencias),
+    })
+    mais_baratos = (
+        custos_df.sort_values('Total (€)', kind='stable')
+        .drop_duplicates(subset=['potencia_kva'], keep='first')
+        .set_index('potencia_kva')
+    )
+    resumo_df['Tarifários avaliados'] = resumo_df['Potência (kVA)'].map(custos_df['potencia_kva'].value_counts()).fillna(0).astype(int)
+    resumo_df['Custo mínimo (€)'] = resumo_df['Potência (kVA)'].map(mais_baratos['Total (€)'])
+    resumo_df['Tarifário mais barato'] = resumo_df['Potência (kVA)'].map(mais_baratos['nome'])
+    resumo_df['Comercializador'] = resumo_df['Potência (kVA)'].map(mais_baratos['comercializador'])
+
+    candidatas = resumo_df[(resumo_df['Quartos de hora acima'] == 0) & resumo_df['Custo mínimo (€)'].notna()]
+    potencia_recomendada = None
+    if not candidatas.empty:
+        potencia_recomendada = float(candidatas.sort_values('Custo mínimo (€)', kind='stable').iloc[0]['Potência (kVA)'])
+    return resumo_df, custos_df, potencia_recomendada
+
 #Função Tarifário Indexado para comparação
 def calcular_detalhes_custo_tarifario_indexado(
     dados_tarifario_indexado_linha,
@@ -1025,8 +1991,17 @@ def calcular_detalhes_custo_tarifario_indexado(
     ano_atual_calculo,
     data_inicio_periodo_obj,
     data_fim_periodo_obj,
-    FINANCIAMENTO_TSE_VAL
+    FINANCIAMENTO_TSE_VAL,
+    grafo=None,
+    chave_omie=None,
+    omie_editado_manualmente=None,
+    delta_omie=0.0
 ):
+    # omie_editado_manualmente: {período: bool} dos OMIE introduzidos à mão para a opção principal (na app,
+    # st.session_state.omie_foi_editado_manualmente); só esses usam o valor de todos_omie_inputs_user_global.
+    # Com 'grafo' (GrafoCalculo) e 'chave_omie' (conteúdo de df_omie_ajustado_para_calculo), os preços dos
+    # quarto-horários vêm do nó 'precos_btn' e não voltam a ser calculados quando só mudam taxas ou descontos.
+    # delta_omie (€/MWh): sensibilidade somada a todos os OMIE, horários, médios ou manuais (como na tabela detalhada).
     try:
         nome_tarifario_original = str(dados_tarifario_indexado_linha['nome'])
         tipo_tarifario_original = str(dados_tarifario_indexado_linha['tipo'])
@@ -1035,7 +2010,7 @@ def calcular_detalhes_custo_tarifario_indexado(
 
         precos_energia_base_kwh_nesta_oh = {} # Preços base calculados para a opcao_horaria_para_calculo
         oh_calc_lower = opcao_horaria_para_calculo.lower() # ex: "simples", "bi-horário - ciclo diário"
-        constantes_dict_local = dict(zip(CONSTANTES_df["constante"], CONSTANTES_df["valor_unitário"]))
+        constantes_dict_local = obter_indice_constantes(CONSTANTES_df).valores
         
         # --- Define se é um mês de faturação completo DENTRO da função ---
         is_billing_month = 28 <= dias_calculo <= 31
@@ -1045,9 +2020,6 @@ def calcular_detalhes_custo_tarifario_indexado(
 
         # --- BLOCO 1: Cálculo para Indexados Quarto-Horários (BTN ou Luzboa "BTN SPOTDEF") ---
         if 'BTN' in formula_energia_str or nome_tarifario_original == "Luzboa | BTN SPOTDEF":
-            soma_calculo_periodo = {p_key: 0.0 for p_key in ['S', 'V', 'F', 'C', 'P']} # Acumuladores para todos os períodos possíveis
-            soma_perfil_periodo = {p_key: 0.0 for p_key in ['S', 'V', 'F', 'C', 'P']}
-
             # Determinar coluna de ciclo e perfil com base na opcao_horaria_para_calculo
             # Nota: opcao_horaria_para_calculo é o nome DB, ex: "Bi-horário - Ciclo Diário"
             coluna_ciclo_qh = None
@@ -1063,108 +2035,41 @@ def calcular_detalhes_custo_tarifario_indexado(
             perfil_coluna_qh = f"BTN_{perfil_nome_str.split('_')[1].upper()}" # BTN_A, BTN_B, BTN_C
 
             if perfil_coluna_qh not in df_omie_ajustado_para_calculo.columns:
-                # st.warning(f"DEBUG COMP: Coluna de perfil '{perfil_coluna_qh}' não encontrada para '{nome_tarifario_original}' em '{opcao_horaria_para_calculo}'. Energia será zero.")
+                # emitir_aviso('aviso', f"DEBUG COMP: Coluna de perfil '{perfil_coluna_qh}' não encontrada para '{nome_tarifario_original}' em '{opcao_horaria_para_calculo}'. Energia será zero.")
                 # Definir preços como zero se o perfil não existir no DF OMIE
                 for p_key_cons in consumos_repartidos_dict.keys(): precos_energia_base_kwh_nesta_oh[p_key_cons] = 0.0
             
-            elif nome_tarifario_original == "Luzboa | BTN SPOTDEF":
+            elif nome_tarifario_original == NOME_LUZBOA_BTN:
                 # Lógica específica Luzboa (usa médias horárias simples, não ponderadas por perfil BTN)
-                soma_luzboa_p = {k: 0.0 for k in ['S', 'V', 'F', 'C', 'P']}
-                count_luzboa_p = {k: 0 for k in ['S', 'V', 'F', 'C', 'P']}
-
-                for _, row_omie in df_omie_ajustado_para_calculo.iterrows():
-                    if not all(k_luzboa in row_omie and pd.notna(row_omie[k_luzboa]) for k_luzboa in ['OMIE', 'Perdas']): continue
-                    omie_val_l = row_omie['OMIE'] / 1000.0
-                    perdas_val_l = row_omie['Perdas']
-                    cgs_luzboa = constantes_dict_local.get('Luzboa_CGS', 0.0)
-                    fa_luzboa = constantes_dict_local.get('Luzboa_FA', 1.0)
-                    kp_luzboa = constantes_dict_local.get('Luzboa_Kp', 0.0)
-                    valor_hora_luzboa = (omie_val_l + cgs_luzboa) * perdas_val_l * fa_luzboa + kp_luzboa
-
-                    soma_luzboa_p['S'] += valor_hora_luzboa; count_luzboa_p['S'] += 1
-                    
-                    if coluna_ciclo_qh and coluna_ciclo_qh in row_omie and pd.notna(row_omie[coluna_ciclo_qh]):
-                        ciclo_hora_l = row_omie[coluna_ciclo_qh] # V, F, C, P
-                        if ciclo_hora_l in soma_luzboa_p: # Para V,F,C,P
-                             soma_luzboa_p[ciclo_hora_l] += valor_hora_luzboa
-                             count_luzboa_p[ciclo_hora_l] += 1
-                
-                prec_luzboa = 4
+                precos_luzboa = obter_precos_indexados_btn(
+                    grafo, chave_omie, df_omie_ajustado_para_calculo, {nome_tarifario_original: formula_energia_str}, constantes_dict_local, perfil_coluna_qh, coluna_ciclo_qh,
+                    delta_omie=delta_omie
+                )[nome_tarifario_original]
                 if oh_calc_lower == "simples":
-                    preco_idx_s = round(soma_luzboa_p['S'] / count_luzboa_p['S'], prec_luzboa) if count_luzboa_p['S'] > 0 else 0.0
+                    preco_idx_s = precos_luzboa['S']
                 elif oh_calc_lower.startswith("bi-horário"):
-                    preco_idx_v = round(soma_luzboa_p['V'] / count_luzboa_p['V'], prec_luzboa) if count_luzboa_p['V'] > 0 else 0.0
-                    preco_idx_f = round(soma_luzboa_p['F'] / count_luzboa_p['F'], prec_luzboa) if count_luzboa_p['F'] > 0 else 0.0
+                    preco_idx_v, preco_idx_f = precos_luzboa['V'], precos_luzboa['F']
                 elif oh_calc_lower.startswith("tri-horário"):
-                    preco_idx_v = round(soma_luzboa_p['V'] / count_luzboa_p['V'], prec_luzboa) if count_luzboa_p['V'] > 0 else 0.0
-                    preco_idx_c = round(soma_luzboa_p['C'] / count_luzboa_p['C'], prec_luzboa) if count_luzboa_p['C'] > 0 else 0.0
-                    preco_idx_p = round(soma_luzboa_p['P'] / count_luzboa_p['P'], prec_luzboa) if count_luzboa_p['P'] > 0 else 0.0
+                    preco_idx_v, preco_idx_c, preco_idx_p = precos_luzboa['V'], precos_luzboa['C'], precos_luzboa['P']
 
             else: # Outros Tarifários Quarto-Horários (Coopernico, Repsol, Galp, etc.)
-                # Precisam da coluna de ciclo para V,F,C,P
-                cycle_column_ok_qh = True
-                if oh_calc_lower != "simples":
-                    if not coluna_ciclo_qh or coluna_ciclo_qh not in df_omie_ajustado_para_calculo.columns:
-                        # st.warning(f"DEBUG COMP: Coluna ciclo '{coluna_ciclo_qh}' em falta para '{nome_tarifario_original}' em '{opcao_horaria_para_calculo}'. Preços V/F/C/P serão 0.")
-                        cycle_column_ok_qh = False
-                        # Se a coluna de ciclo não existe, os preços para V,F,C,P serão zero, Simples ainda pode ser calculado.
-                        preco_idx_v, preco_idx_f, preco_idx_c, preco_idx_p = 0.0, 0.0, 0.0, 0.0
-
-                for _, row_omie in df_omie_ajustado_para_calculo.iterrows():
-                    required_cols_qh = ['OMIE', 'Perdas', perfil_coluna_qh]
-                    if not all(k_qh in row_omie and pd.notna(row_omie[k_qh]) for k_qh in required_cols_qh): continue
-                    
-                    omie_val_qh = row_omie['OMIE'] / 1000.0
-                    perdas_val_qh = row_omie['Perdas']
-                    perfil_val_qh = row_omie[perfil_coluna_qh]
-                    if perfil_val_qh <= 0: continue
-
-                    calculo_instantaneo_sem_perfil_qh = 0.0
-                    # --- Fórmulas específicas BTN (Quarto-Horário) ---
-                    if nome_tarifario_original == "Coopérnico | Base": calculo_instantaneo_sem_perfil_qh = (omie_val_qh + constantes_dict_local.get('Coop_CS_CR', 0.0) + constantes_dict_local.get('Coop_K', 0.0)) * perdas_val_qh
-                    elif nome_tarifario_original == "Coopérnico | GO": calculo_instantaneo_sem_perfil_qh = (omie_val_qh + constantes_dict_local.get('Coop_CS_CR', 0.0) + constantes_dict_local.get('Coop_K', 0.0)) * perdas_val_qh + constantes_dict_local.get('Coop_GO', 0.0)
-                    elif nome_tarifario_original == "Repsol | Leve Sem Mais": calculo_instantaneo_sem_perfil_qh = (omie_val_qh * perdas_val_qh * constantes_dict_local.get('Repsol_FA', 0.0) + constantes_dict_local.get('Repsol_Q_Tarifa', 0.0))
-                    elif nome_tarifario_original == "Repsol | Leve PRO Sem Mais": calculo_instantaneo_sem_perfil_qh = (omie_val_qh * perdas_val_qh * constantes_dict_local.get('Repsol_FA', 0.0) + constantes_dict_local.get('Repsol_Q_Tarifa_Pro', 0.0))
-                    elif nome_tarifario_original == "Galp | Plano Flexível / Dinâmico": calculo_instantaneo_sem_perfil_qh = (omie_val_qh + constantes_dict_local.get('Galp_Ci', 0.0)) * perdas_val_qh
-                    elif nome_tarifario_original == "Alfa Energia | ALFA POWER INDEX BTN": calculo_instantaneo_sem_perfil_qh = ((omie_val_qh + constantes_dict_local.get('Alfa_CGS', 0.0)) * perdas_val_qh + constantes_dict_local.get('Alfa_K', 0.0))
-                    elif nome_tarifario_original == "Plenitude | Tendência": calculo_instantaneo_sem_perfil_qh = ((omie_val_qh + constantes_dict_local.get('Plenitude_CGS', 0.0) + constantes_dict_local.get('Plenitude_GDOs', 0.0)) * perdas_val_qh + constantes_dict_local.get('Plenitude_Fee', 0.0))
-                    elif nome_tarifario_original == "Meo Energia | Tarifa Dinâmica": calculo_instantaneo_sem_perfil_qh = (omie_val_qh + constantes_dict_local.get('Meo_K', 0.0)) * perdas_val_qh
-                    elif nome_tarifario_original == "EDP | Eletricidade Indexada Horária": calculo_instantaneo_sem_perfil_qh = (omie_val_qh * perdas_val_qh * constantes_dict_local.get('EDP_H_K1', 1.0) + constantes_dict_local.get('EDP_H_K2', 0.0))
-                    elif nome_tarifario_original == "EZU | Indexada": calculo_instantaneo_sem_perfil_qh = (omie_val_qh + constantes_dict_local.get('EZU_K', 0.0) + constantes_dict_local.get('EZU_CGS', 0.0)) * perdas_val_qh
-                    elif nome_tarifario_original == "G9 | Smart Dynamic": calculo_instantaneo_sem_perfil_qh = (omie_val_qh * constantes_dict_local.get('G9_FA', 0.0) * perdas_val_qh + constantes_dict_local.get('G9_CGS', 0.0) + constantes_dict_local.get('G9_AC', 0.0))
-                    elif nome_tarifario_original == "G9 | Smart Dynamic (Empresarial)": calculo_instantaneo_sem_perfil_qh = (omie_val_qh * constantes_dict_local.get('G9_FA', 0.0) * perdas_val_qh + constantes_dict_local.get('G9_CGS', 0.0) + constantes_dict_local.get('G9_AC', 0.0))
-                    elif nome_tarifario_original == "Iberdrola | Simples Indexado Dinâmico": calculo_instantaneo_sem_perfil_qh = (omie_val_qh * perdas_val_qh + constantes_dict_local.get("Iberdrola_Dinamico_Q", 0.0) + constantes_dict_local.get('Iberdrola_mFRR', 0.0))
-                    else: calculo_instantaneo_sem_perfil_qh = omie_val_qh * perdas_val_qh # Fallback
-
-                    soma_calculo_periodo['S'] += calculo_instantaneo_sem_perfil_qh * perfil_val_qh
-                    soma_perfil_periodo['S'] += perfil_val_qh
-                    
-                    if cycle_column_ok_qh and coluna_ciclo_qh and coluna_ciclo_qh in row_omie and pd.notna(row_omie[coluna_ciclo_qh]):
-                        ciclo_hora_qh = row_omie[coluna_ciclo_qh] # V, F, C, P
-                        if ciclo_hora_qh in soma_calculo_periodo: # Para V,F,C,P
-                             soma_calculo_periodo[ciclo_hora_qh] += calculo_instantaneo_sem_perfil_qh * perfil_val_qh
-                             soma_perfil_periodo[ciclo_hora_qh] += perfil_val_qh
-                
-                prec_qh = 4 # Aumentar precisão interna para cálculos
+                # Precisam da coluna de ciclo para V,F,C,P; sem ela o motor devolve V/F/C/P a 0.0
+                precos_btn = obter_precos_indexados_btn(
+                    grafo, chave_omie, df_omie_ajustado_para_calculo, {nome_tarifario_original: formula_energia_str}, constantes_dict_local, perfil_coluna_qh, coluna_ciclo_qh,
+                    delta_omie=delta_omie
+                )[nome_tarifario_original]
+
                 # Calcular preços médios ponderados para cada período da opcao_horaria_para_calculo
                 if nome_tarifario_original in ["Repsol | Leve Sem Mais", "Repsol | Leve PRO Sem Mais"]:
                     # Repsol usa sempre o preço calculado como se fosse Simples para todos os períodos
-                    preco_simples_calc_repsol = round(soma_calculo_periodo['S'] / soma_perfil_periodo['S'], prec_qh) if soma_perfil_periodo['S'] > 0 else 0.0
-                    preco_idx_s = preco_simples_calc_repsol
-                    preco_idx_v = preco_simples_calc_repsol
-                    preco_idx_f = preco_simples_calc_repsol
-                    preco_idx_c = preco_simples_calc_repsol
-                    preco_idx_p = preco_simples_calc_repsol
+                    preco_idx_s = preco_idx_v = preco_idx_f = preco_idx_c = preco_idx_p = precos_btn['S']
                 else: # Outros BTN
                     if oh_calc_lower == "simples":
-                        preco_idx_s = round(soma_calculo_periodo['S'] / soma_perfil_periodo['S'], prec_qh) if soma_perfil_periodo['S'] > 0 else 0.0
+                        preco_idx_s = precos_btn['S']
                     elif oh_calc_lower.startswith("bi-horário"):
-                        preco_idx_v = round(soma_calculo_periodo['V'] / soma_perfil_periodo['V'], prec_qh) if soma_perfil_periodo['V'] > 0 else 0.0
-                        preco_idx_f = round(soma_calculo_periodo['F'] / soma_perfil_periodo['F'], prec_qh) if soma_perfil_periodo['F'] > 0 else 0.0
+                        preco_idx_v, preco_idx_f = precos_btn['V'], precos_btn['F']
                     elif oh_calc_lower.startswith("tri-horário"):
-                        preco_idx_v = round(soma_calculo_periodo['V'] / soma_perfil_periodo['V'], prec_qh) if soma_perfil_periodo['V'] > 0 else 0.0
-                        preco_idx_c = round(soma_calculo_periodo['C'] / soma_perfil_periodo['C'], prec_qh) if soma_perfil_periodo['C'] > 0 else 0.0
-                        preco_idx_p = round(soma_calculo_periodo['P'] / soma_perfil_periodo['P'], prec_qh) if soma_perfil_periodo['P'] > 0 else 0.0
+                        preco_idx_v, preco_idx_c, preco_idx_p = precos_btn['V'], precos_btn['C'], precos_btn['P']
 
 # --- BLOCO 2: Cálculo para Indexados Média ---
         else: # Tarifários de Média
@@ -1202,14 +2107,14 @@ def calcular_detalhes_custo_tarifario_indexado(
 
                 # 2. Verificar se OMIE manual da OPÇÃO PRINCIPAL deve sobrepor-se
                 if opcao_horaria_para_calculo == opcao_horaria_principal_global and \
-                   st.session_state.omie_foi_editado_manualmente.get(p_key_destino, False):
+                   (omie_editado_manualmente or {}).get(p_key_destino, False):
                     # Usar o valor do input manual (que corresponde à opção principal)
                     omie_mwh_final_para_formula = todos_omie_inputs_user_global.get(p_key_destino, omie_mwh_base_calculado)
                 else:
                     # Usar o OMIE calculado específico para o ciclo de destino
                     omie_mwh_final_para_formula = omie_mwh_base_calculado
                 
-                omie_kwh_a_usar_na_formula = omie_mwh_final_para_formula / 1000.0
+                omie_kwh_a_usar_na_formula = (omie_mwh_final_para_formula + delta_omie) / 1000.0
                 
                 # Lógica de PERDAS (deve usar perdas_medias_dict_global e o ciclo_real_oh_destino)
                 perdas_a_usar_val_media = 1.0 # Default
@@ -1230,7 +2135,7 @@ def calcular_detalhes_custo_tarifario_indexado(
                 # --- Fórmulas específicas para Tarifários de Média ---
                 temp_preco_calculado = 0.0
                 # OMIE para LuziGás é especial (usa OMIE real simples)
-                omie_para_luzigas_kwh = omie_medio_simples_real_kwh_para_luzigas_idx
+                omie_para_luzigas_kwh = omie_medio_simples_real_kwh_para_luzigas_idx + delta_omie / 1000.0
                 
                 if nome_tarifario_original == "Iberdrola | Simples Indexado":
                     if p_key_destino == 'S': temp_preco_calculado = omie_kwh_a_usar_na_formula * constantes_dict_local.get('Iberdrola_Perdas', 1.0) + constantes_dict_local.get("Iberdrola_Media_Q", 0.0) + constantes_dict_local.get('Iberdrola_mFRR', 0.0)
@@ -1322,7 +2227,7 @@ def calcular_detalhes_custo_tarifario_indexado(
 
         if tarifa_social_ativa:
             desconto_ts_energia_bruto = obter_constante('Desconto TS Energia', CONSTANTES_df)
-            desconto_ts_potencia_dia_bruto = obter_constante(f'Desconto TS Potencia {potencia_contratada_kva}', CONSTANTES_df)
+            desconto_ts_potencia_dia_bruto = obter_desconto_ts_potencia(potencia_contratada_kva, CONSTANTES_df)
             for periodo_calc, tar_reg_val in tar_energia_regulada_idx.items():
                 tar_energia_final_idx[periodo_calc] = tar_reg_val - desconto_ts_energia_bruto 
             desconto_ts_energia_aplicado_val = desconto_ts_energia_bruto
@@ -1459,12 +2364,11 @@ def calcular_detalhes_custo_tarifario_indexado(
         }
 
     except KeyError as ke:
-        # st.error(f"DEBUG COMP ERRO KEY: Erro de chave '{ke}' ao calcular custo para indexado {nome_tarifario_original} na opção {opcao_horaria_para_calculo}.")
+        # emitir_aviso('erro', f"DEBUG COMP ERRO KEY: Erro de chave '{ke}' ao calcular custo para indexado {nome_tarifario_original} na opção {opcao_horaria_para_calculo}.")
         return None
     except Exception as e:
-        # st.error(f"DEBUG COMP ERRO GERAL: Erro ao calcular custo para tarifário indexado {nome_tarifario_original} na opção {opcao_horaria_para_calculo}: {e}")
-        import traceback
-        # st.error(traceback.format_exc()) # Para depuração mais detalhada
+        # emitir_aviso('erro', f"DEBUG COMP ERRO GERAL: Erro ao calcular custo para tarifário indexado {nome_tarifario_original} na opção {opcao_horaria_para_calculo}: {e}")
+        # emitir_aviso('erro', traceback.format_exc()) # Para depuração mais detalhada
         return None
     
 def preparar_consumos_para_cada_opcao_destino(
@@ -1608,6 +2512,337 @@ def determinar_opcoes_horarias_destino_e_ordenacao(
 ###############################################################
 ######################### AUTOCONSUMO #########################
 ###############################################################
+# Fonte: PVGIS PVdata. Produção diária média (kWh) para um sistema de 1 kWp otimizado.
+DADOS_PVGIS_DISTRITO = {
+    'Aveiro': {1:3.55, 2:4.43, 3:4.79, 4:5.34, 5:5.66, 6:5.66, 7:5.97, 8:5.92, 9:5.44, 10:4.31, 11:3.53, 12:3.34},
+    'Beja': {1: 4.09, 2: 4.76, 3: 5.18, 4: 5.46, 5: 5.74, 6: 5.89, 7: 6.29, 8: 6.2, 9: 5.69, 10: 4.8, 11: 4.13, 12: 3.78},
+    'Braga': {1: 3.18, 2: 4.01, 3: 4.45, 4: 4.91, 5: 5.35, 6: 5.43, 7: 5.88, 8: 5.84, 9: 5.25, 10: 3.98, 11: 3.18, 12: 2.95},
+    'Bragança': {1: 3.22, 2: 4.41, 3: 4.89, 4: 5.25, 5: 5.73, 6: 5.92, 7: 6.41, 8: 6.26, 9: 5.62, 10: 4.28, 11: 3.37, 12: 2.88},
+    'Castelo Branco': {1: 3.8, 2: 4.68, 3: 5.06, 4: 5.45, 5: 5.78, 6: 5.94, 7: 6.32, 8: 6.23, 9: 5.64, 10: 4.5, 11: 3.73, 12: 3.48},
+    'Coimbra': {1: 3.27, 2: 4.12, 3: 4.5, 4: 4.92, 5: 5.37, 6: 5.37, 7: 5.9, 8: 5.86, 9: 5.31, 10: 4.13, 11: 3.29, 12: 3.05},
+    'Évora': {1: 4.03, 2: 4.73, 3: 5.13, 4: 5.37, 5: 5.75, 6: 5.88, 7: 6.3, 8: 6.23, 9: 5.66, 10: 4.66, 11: 4.01, 12: 3.73},
+    'Faro': {1: 4.56, 2: 5.11, 3: 5.62, 4: 6.02, 5: 6.26, 6: 6.31, 7: 6.52, 8: 6.42, 9: 6.07, 10: 5.14, 11: 4.51, 12: 4.19},
+    'Guarda': {1: 3.5, 2: 4.4, 3: 4.89, 4: 5.23, 5: 5.68, 6: 5.91, 7: 6.45, 8: 6.33, 9: 5.59, 10: 4.37, 11: 3.45, 12: 3.17},
+    'Leiria': {1: 3.53, 2: 4.32, 3: 4.72, 4: 5.1, 5: 5.5, 6: 5.52, 7: 5.98, 8: 6.0, 9: 5.47, 10: 4.32, 11: 3.53, 12: 3.32},
+    'Lisboa': {1: 3.47, 2: 4.33, 3: 4.96, 4: 5.43, 5: 5.83, 6: 5.93, 7: 6.32, 8: 6.33, 9: 5.77, 10: 4.46, 11: 3.52, 12: 3.23},
+    'Portalegre': {1: 3.83, 2: 4.61, 3: 5.0, 4: 5.31, 5: 5.73, 6: 5.93, 7: 6.39, 8: 6.3, 9: 5.6, 10: 4.54, 11: 3.76, 12: 3.54},
+    'Porto': {1: 3.37, 2: 4.31, 3: 4.71, 4: 5.34, 5: 5.74, 6: 5.77, 7: 6.08, 8: 5.96, 9: 5.51, 10: 4.24, 11: 3.4, 12: 3.18},
+    'Santarém': {1: 3.79, 2: 4.58, 3: 5.09, 4: 5.42, 5: 5.76, 6: 5.87, 7: 6.26, 8: 6.27, 9: 5.71, 10: 4.55, 11: 3.73, 12: 3.54},
+    'Setúbal': {1: 3.9, 2: 4.61, 3: 5.19, 4: 5.58, 5: 5.91, 6: 5.99, 7: 6.31, 8: 6.34, 9: 5.88, 10: 4.7, 11: 3.91, 12: 3.66},
+    'Viana do Castelo': {1: 3.17, 2: 4.15, 3: 4.62, 4: 5.32, 5: 5.71, 6: 5.81, 7: 6.11, 8: 5.96, 9: 5.47, 10: 4.1, 11: 3.28, 12: 2.95},
+    'Vila Real': {1: 3.07, 2: 4.13, 3: 4.66, 4: 5.03, 5: 5.59, 6: 5.76, 7: 6.32, 8: 6.21, 9: 5.57, 10: 4.11, 11: 3.1, 12: 2.76},
+    'Viseu': {1: 3.52, 2: 4.31, 3: 4.74, 4: 5.06, 5: 5.51, 6: 5.61, 7: 6.2, 8: 6.13, 9: 5.46, 10: 4.29, 11: 3.43, 12: 3.35},
+    'Açores (Ponta Delgada)': {1: 2.9, 2: 3.59, 3: 4.23, 4: 4.63, 5: 4.98, 6: 5.03, 7: 5.11, 8: 5.29, 9: 4.81, 10: 3.8, 11: 3.04, 12: 2.52},
+    'Madeira (Funchal)': {1: 3.74, 2: 4.08, 3: 4.8, 4: 4.79, 5: 4.87, 6: 4.64, 7: 5.2, 8: 5.32, 9: 4.48, 10: 4.18, 11: 3.66, 12: 3.49}
+}
+
+COORDENADAS_DISTRITOS = {
+    'Guarda': (40.537, -7.268),
+    'Aveiro': (40.641, -8.654),
+    'Beja': (38.015, -7.863),
+    'Braga': (41.545, -8.427),
+    'Bragança': (41.806, -6.757),
+    'Castelo Branco': (39.822, -7.492),
+    'Coimbra': (40.212, -8.429),
+    'Évora': (38.567, -7.900),
+    'Faro': (37.019, -7.930),
+    'Leiria': (39.744, -8.807),
+    'Lisboa': (38.717, -9.140),
+    'Portalegre': (39.292, -7.429),
+    'Porto': (41.150, -8.611),
+    'Santarém': (39.236, -8.685),
+    'Setúbal': (38.526, -8.890),
+    'Viana do Castelo': (41.692, -8.835),
+    'Vila Real': (41.301, -7.749),
+    'Viseu': (40.657, -7.912),
+    'Açores': (37.741, -25.676),
+    'Madeira': (32.667, -16.924)
+}
+
+# Perfis horários por distrito PVGIS PVdata
+PERFIS_HORARIOS_MENSAIS_POR_DISTRITO = {
+    'Aveiro': {
+        1: {8: 0.0032, 9: 0.0677, 10: 0.1121, 11: 0.1446, 12: 0.1616, 13: 0.1589, 14: 0.1434, 15: 0.1182, 16: 0.0777, 17: 0.0126},
+        2: {8: 0.0206, 9: 0.0703, 10: 0.1083, 11: 0.1357, 12: 0.1479, 13: 0.1497, 14: 0.1344, 15: 0.1152, 16: 0.0814, 17: 0.0364},
+        3: {7: 0.0035, 8: 0.0374, 9: 0.0761, 10: 0.1056, 11: 0.1263, 12: 0.1359, 13: 0.1418, 14: 0.1314, 15: 0.1118, 16: 0.0815, 17: 0.0432, 18: 0.0055},
+        4: {6: 0.0006, 7: 0.0150, 8: 0.0484, 9: 0.0807, 10: 0.1060, 11: 0.1221, 12: 0.1321, 13: 0.1337, 14: 0.1240, 15: 0.1064, 16: 0.0770, 17: 0.0433, 18: 0.0106, 19: 0.0001},
+        5: {6: 0.0044, 7: 0.0207, 8: 0.0512, 9: 0.0794, 10: 0.1016, 11: 0.1190, 12: 0.1302, 13: 0.1294, 14: 0.1209, 15: 0.1050, 16: 0.0782, 17: 0.0448, 18: 0.0133, 19: 0.0019},
+        6: {6: 0.0061, 7: 0.0207, 8: 0.0472, 9: 0.0743, 10: 0.0962, 11: 0.1156, 12: 0.1287, 13: 0.1304, 14: 0.1234, 15: 0.1072, 16: 0.0809, 17: 0.0477, 18: 0.0169, 19: 0.0045},
+        7: {6: 0.0041, 7: 0.0172, 8: 0.0429, 9: 0.0710, 10: 0.0939, 11: 0.1160, 12: 0.1296, 13: 0.1323, 14: 0.1261, 15: 0.1101, 16: 0.0842, 17: 0.0506, 18: 0.0178, 19: 0.0042},
+        8: {6: 0.0010, 7: 0.0142, 8: 0.0420, 9: 0.0714, 10: 0.0983, 11: 0.1202, 12: 0.1334, 13: 0.1365, 14: 0.1278, 15: 0.1096, 16: 0.0832, 17: 0.0476, 18: 0.0137, 19: 0.0011},
+        9: {7: 0.0121, 8: 0.0456, 9: 0.0770, 10: 0.1067, 11: 0.1276, 12: 0.1376, 13: 0.1402, 14: 0.1283, 15: 0.1080, 16: 0.0754, 17: 0.0372, 18: 0.0043},
+        10: {7: 0.0049, 8: 0.0468, 9: 0.0849, 10: 0.1193, 11: 0.1379, 12: 0.1458, 13: 0.1435, 14: 0.1262, 15: 0.1037, 16: 0.0669, 17: 0.0203},
+        11: {8: 0.0352, 9: 0.0859, 10: 0.1252, 11: 0.1508, 12: 0.1586, 13: 0.1541, 14: 0.1291, 15: 0.1032, 16: 0.0576, 17: 0.0005},
+        12: {8: 0.0065, 9: 0.0765, 10: 0.1232, 11: 0.1540, 12: 0.1677, 13: 0.1600, 14: 0.1394, 15: 0.1109, 16: 0.0617}
+    },
+    'Beja': {
+        1: {8: 0.0165, 9: 0.0739, 10: 0.1156, 11: 0.1404, 12: 0.1559, 13: 0.1518, 14: 0.1378, 15: 0.1136, 16: 0.0775, 17: 0.0172},
+        2: {8: 0.0281, 9: 0.0751, 10: 0.1121, 11: 0.1349, 12: 0.1415, 13: 0.1468, 14: 0.1341, 15: 0.1118, 16: 0.0789, 17: 0.0367},
+        3: {7: 0.0045, 8: 0.0407, 9: 0.0794, 10: 0.1091, 11: 0.1296, 12: 0.1357, 13: 0.1391, 14: 0.1263, 15: 0.1098, 16: 0.0797, 17: 0.0411, 18: 0.0050},
+        4: {6: 0.0006, 7: 0.0170, 8: 0.0534, 9: 0.0874, 10: 0.1096, 11: 0.1244, 12: 0.1319, 13: 0.1290, 14: 0.1196, 15: 0.1018, 16: 0.0748, 17: 0.0415, 18: 0.0090},
+        5: {6: 0.0044, 7: 0.0224, 8: 0.0570, 9: 0.0886, 10: 0.1073, 11: 0.1228, 12: 0.1298, 13: 0.1276, 14: 0.1149, 15: 0.0981, 16: 0.0730, 17: 0.0417, 18: 0.0113, 19: 0.0011},
+        6: {6: 0.0057, 7: 0.0214, 8: 0.0544, 9: 0.0837, 10: 0.1054, 11: 0.1193, 12: 0.1273, 13: 0.1262, 14: 0.1176, 15: 0.1013, 16: 0.0760, 17: 0.0448, 18: 0.0134, 19: 0.0035},
+        7: {6: 0.0038, 7: 0.0170, 8: 0.0493, 9: 0.0804, 10: 0.1047, 11: 0.1213, 12: 0.1299, 13: 0.1289, 14: 0.1202, 15: 0.1033, 16: 0.0781, 17: 0.0462, 18: 0.0137, 19: 0.0031},
+        8: {6: 0.0010, 7: 0.0152, 8: 0.0491, 9: 0.0816, 10: 0.1074, 11: 0.1238, 12: 0.1326, 13: 0.1311, 14: 0.1214, 15: 0.1035, 16: 0.0775, 17: 0.0441, 18: 0.0111, 19: 0.0006},
+        9: {7: 0.0147, 8: 0.0525, 9: 0.0858, 10: 0.1144, 11: 0.1303, 12: 0.1360, 13: 0.1353, 14: 0.1205, 15: 0.1016, 16: 0.0714, 17: 0.0343, 18: 0.0033},
+        10: {7: 0.0086, 8: 0.0537, 9: 0.0908, 10: 0.1221, 11: 0.1378, 12: 0.1426, 13: 0.1412, 14: 0.1238, 15: 0.0981, 16: 0.0624, 17: 0.0190},
+        11: {8: 0.0434, 9: 0.0912, 10: 0.1256, 11: 0.1518, 12: 0.1552, 13: 0.1479, 14: 0.1253, 15: 0.1003, 16: 0.0576, 17: 0.0016},
+        12: {8: 0.0219, 9: 0.0803, 10: 0.1199, 11: 0.1500, 12: 0.1581, 13: 0.1562, 14: 0.1364, 15: 0.1122, 16: 0.0650}
+    },
+    'Braga': {
+        1: {8: 0.0002, 9: 0.0705, 10: 0.1186, 11: 0.1497, 12: 0.1644, 13: 0.1509, 14: 0.1422, 15: 0.1171, 16: 0.0762, 17: 0.0102},
+        2: {8: 0.0191, 9: 0.0739, 10: 0.1133, 11: 0.1389, 12: 0.1459, 13: 0.1468, 14: 0.1315, 15: 0.1130, 16: 0.0809, 17: 0.0367},
+        3: {7: 0.0038, 8: 0.0406, 9: 0.0798, 10: 0.1107, 11: 0.1302, 12: 0.1363, 13: 0.1364, 14: 0.1245, 15: 0.1090, 16: 0.0807, 17: 0.0426, 18: 0.0055},
+        4: {6: 0.0008, 7: 0.0173, 8: 0.0528, 9: 0.0859, 10: 0.1079, 11: 0.1229, 12: 0.1315, 13: 0.1298, 14: 0.1171, 15: 0.1032, 16: 0.0767, 17: 0.0431, 18: 0.0109, 19: 0.0001},
+        5: {6: 0.0050, 7: 0.0230, 8: 0.0561, 9: 0.0851, 10: 0.1039, 11: 0.1196, 12: 0.1249, 13: 0.1250, 14: 0.1171, 15: 0.1023, 16: 0.0771, 17: 0.0451, 18: 0.0138, 19: 0.0021},
+        6: {6: 0.0067, 7: 0.0231, 8: 0.0530, 9: 0.0811, 10: 0.1011, 11: 0.1143, 12: 0.1236, 13: 0.1246, 14: 0.1185, 15: 0.1038, 16: 0.0794, 17: 0.0488, 18: 0.0171, 19: 0.0046},
+        7: {6: 0.0046, 7: 0.0187, 8: 0.0482, 9: 0.0764, 10: 0.0977, 11: 0.1156, 12: 0.1254, 13: 0.1265, 14: 0.1220, 15: 0.1078, 16: 0.0833, 17: 0.0513, 18: 0.0181, 19: 0.0043},
+        8: {6: 0.0013, 7: 0.0158, 8: 0.0472, 9: 0.0778, 10: 0.1025, 11: 0.1208, 12: 0.1296, 13: 0.1304, 14: 0.1224, 15: 0.1076, 16: 0.0817, 17: 0.0480, 18: 0.0137, 19: 0.0012},
+        9: {7: 0.0139, 8: 0.0512, 9: 0.0842, 10: 0.1116, 11: 0.1281, 12: 0.1340, 13: 0.1346, 14: 0.1223, 15: 0.1040, 16: 0.0749, 17: 0.0370, 18: 0.0043},
+        10: {7: 0.0044, 8: 0.0514, 9: 0.0897, 10: 0.1242, 11: 0.1385, 12: 0.1434, 13: 0.1418, 14: 0.1240, 15: 0.1006, 16: 0.0634, 17: 0.0188},
+        11: {8: 0.0315, 9: 0.0877, 10: 0.1316, 11: 0.1563, 12: 0.1593, 13: 0.1495, 14: 0.1266, 15: 0.1014, 16: 0.0560, 17: 0.0002},
+        12: {8: 0.0005, 9: 0.0782, 10: 0.1280, 11: 0.1573, 12: 0.1666, 13: 0.1603, 14: 0.1377, 15: 0.1112, 16: 0.0602}
+    },
+    'Bragança': {
+        1: {8: 0.0094, 9: 0.0730, 10: 0.1162, 11: 0.1449, 12: 0.1579, 13: 0.1598, 14: 0.1474, 15: 0.1185, 16: 0.0725, 17: 0.0005},
+        2: {8: 0.0286, 9: 0.0756, 10: 0.1140, 11: 0.1374, 12: 0.1440, 13: 0.1484, 14: 0.1348, 15: 0.1098, 16: 0.0774, 17: 0.0302},
+        3: {7: 0.0062, 8: 0.0446, 9: 0.0827, 10: 0.1120, 11: 0.1326, 12: 0.1373, 13: 0.1392, 14: 0.1241, 15: 0.1054, 16: 0.0762, 17: 0.0377, 18: 0.0021},
+        4: {6: 0.0013, 7: 0.0210, 8: 0.0565, 9: 0.0888, 10: 0.1115, 11: 0.1257, 12: 0.1302, 13: 0.1297, 14: 0.1198, 15: 0.0969, 16: 0.0720, 17: 0.0388, 18: 0.0078},
+        5: {6: 0.0056, 7: 0.0265, 8: 0.0606, 9: 0.0904, 10: 0.1100, 11: 0.1227, 12: 0.1288, 13: 0.1254, 14: 0.1116, 15: 0.0959, 16: 0.0706, 17: 0.0397, 18: 0.0107, 19: 0.0013},
+        6: {5: 0.0001, 6: 0.0070, 7: 0.0263, 8: 0.0594, 9: 0.0881, 10: 0.1077, 11: 0.1196, 12: 0.1255, 13: 0.1235, 14: 0.1133, 15: 0.0982, 16: 0.0726, 17: 0.0417, 18: 0.0134, 19: 0.0036},
+        7: {6: 0.0050, 7: 0.0216, 8: 0.0553, 9: 0.0850, 10: 0.1060, 11: 0.1212, 12: 0.1283, 13: 0.1262, 14: 0.1164, 15: 0.0999, 16: 0.0743, 17: 0.0439, 18: 0.0138, 19: 0.0032},
+        8: {6: 0.0020, 7: 0.0192, 8: 0.0542, 9: 0.0863, 10: 0.1092, 11: 0.1243, 12: 0.1302, 13: 0.1291, 14: 0.1188, 15: 0.1001, 16: 0.0742, 17: 0.0414, 18: 0.0103, 19: 0.0006},
+        9: {7: 0.0179, 8: 0.0563, 9: 0.0890, 10: 0.1165, 11: 0.1318, 12: 0.1362, 13: 0.1329, 14: 0.1182, 15: 0.0996, 16: 0.0682, 17: 0.0310, 18: 0.0024},
+        10: {7: 0.0100, 8: 0.0565, 9: 0.0922, 10: 0.1240, 11: 0.1377, 12: 0.1456, 13: 0.1420, 14: 0.1231, 15: 0.0984, 16: 0.0583, 17: 0.0121},
+        11: {8: 0.0432, 9: 0.0896, 10: 0.1246, 11: 0.1509, 12: 0.1569, 13: 0.1527, 14: 0.1295, 15: 0.1011, 16: 0.0515},
+        12: {8: 0.0126, 9: 0.0806, 10: 0.1185, 11: 0.1516, 12: 0.1632, 13: 0.1598, 14: 0.1416, 15: 0.1142, 16: 0.0578}
+    },
+    'Castelo Branco': {
+        1: {8: 0.0119, 9: 0.0741, 10: 0.1182, 11: 0.1431, 12: 0.1568, 13: 0.1523, 14: 0.1409, 15: 0.1164, 16: 0.0755, 17: 0.0107},
+        2: {8: 0.0273, 9: 0.0744, 10: 0.1099, 11: 0.1378, 12: 0.1447, 13: 0.1445, 14: 0.1342, 15: 0.1132, 16: 0.0794, 17: 0.0346},
+        3: {7: 0.0050, 8: 0.0417, 9: 0.0804, 10: 0.1118, 11: 0.1325, 12: 0.1377, 13: 0.1380, 14: 0.1257, 15: 0.1064, 16: 0.0773, 17: 0.0396, 18: 0.0038},
+        4: {6: 0.0008, 7: 0.0184, 8: 0.0550, 9: 0.0890, 10: 0.1121, 11: 0.1263, 12: 0.1304, 13: 0.1277, 14: 0.1172, 15: 0.1012, 16: 0.0729, 17: 0.0405, 18: 0.0086},
+        5: {6: 0.0048, 7: 0.0241, 8: 0.0595, 9: 0.0905, 10: 0.1116, 11: 0.1241, 12: 0.1273, 13: 0.1220, 14: 0.1136, 15: 0.0975, 16: 0.0716, 17: 0.0410, 18: 0.0112, 19: 0.0013},
+        6: {6: 0.0061, 7: 0.0230, 8: 0.0562, 9: 0.0856, 10: 0.1071, 11: 0.1209, 12: 0.1280, 13: 0.1245, 14: 0.1140, 15: 0.0987, 16: 0.0748, 17: 0.0438, 18: 0.0138, 19: 0.0035},
+        7: {6: 0.0043, 7: 0.0188, 8: 0.0525, 9: 0.0827, 10: 0.1058, 11: 0.1208, 12: 0.1280, 13: 0.1270, 14: 0.1184, 15: 0.1016, 16: 0.0770, 17: 0.0459, 18: 0.0141, 19: 0.0033},
+        8: {6: 0.0014, 7: 0.0168, 8: 0.0520, 9: 0.0844, 10: 0.1088, 11: 0.1241, 12: 0.1306, 13: 0.1296, 14: 0.1199, 15: 0.1021, 16: 0.0759, 17: 0.0430, 18: 0.0109, 19: 0.0007},
+        9: {7: 0.0158, 8: 0.0540, 9: 0.0880, 10: 0.1155, 11: 0.1300, 12: 0.1363, 13: 0.1335, 14: 0.1197, 15: 0.1002, 16: 0.0702, 17: 0.0338, 18: 0.0030},
+        10: {7: 0.0089, 8: 0.0547, 9: 0.0904, 10: 0.1220, 11: 0.1387, 12: 0.1427, 13: 0.1390, 14: 0.1245, 15: 0.0999, 16: 0.0620, 17: 0.0171},
+        11: {8: 0.0437, 9: 0.0912, 10: 0.1278, 11: 0.1493, 12: 0.1552, 13: 0.1481, 14: 0.1281, 15: 0.1009, 16: 0.0556, 17: 0.0002},
+        12: {8: 0.0195, 9: 0.0830, 10: 0.1237, 11: 0.1497, 12: 0.1587, 13: 0.1568, 14: 0.1389, 15: 0.1093, 16: 0.0604}
+    },
+    'Coimbra': {
+        1: {8: 0.0005, 9: 0.0122, 10: 0.1253, 11: 0.1549, 12: 0.1727, 13: 0.1655, 14: 0.1517, 15: 0.1214, 16: 0.0822, 17: 0.0135},
+        2: {8: 0.0047, 9: 0.0646, 10: 0.1153, 11: 0.1395, 12: 0.1526, 13: 0.1522, 14: 0.1361, 15: 0.1137, 16: 0.0832, 17: 0.0380},
+        3: {7: 0.0021, 8: 0.0322, 9: 0.0783, 10: 0.1100, 11: 0.1336, 12: 0.1370, 13: 0.1395, 14: 0.1279, 15: 0.1093, 16: 0.0811, 17: 0.0433, 18: 0.0057},
+        4: {6: 0.0006, 7: 0.0167, 8: 0.0530, 9: 0.0843, 10: 0.1084, 11: 0.1240, 12: 0.1305, 13: 0.1301, 14: 0.1193, 15: 0.1036, 16: 0.0757, 17: 0.0431, 18: 0.0108},
+        5: {6: 0.0049, 7: 0.0222, 8: 0.0537, 9: 0.0839, 10: 0.1041, 11: 0.1224, 12: 0.1286, 13: 0.1264, 14: 0.1166, 15: 0.1014, 16: 0.0757, 17: 0.0449, 18: 0.0132, 19: 0.0019},
+        6: {6: 0.0065, 7: 0.0222, 8: 0.0512, 9: 0.0792, 10: 0.0996, 11: 0.1164, 12: 0.1256, 13: 0.1261, 14: 0.1191, 15: 0.1031, 16: 0.0805, 17: 0.0489, 18: 0.0170, 19: 0.0045},
+        7: {6: 0.0043, 7: 0.0175, 8: 0.0446, 9: 0.0736, 10: 0.0978, 11: 0.1178, 12: 0.1296, 13: 0.1295, 14: 0.1230, 15: 0.1071, 16: 0.0830, 17: 0.0507, 18: 0.0173, 19: 0.0041},
+        8: {6: 0.0011, 7: 0.0147, 8: 0.0435, 9: 0.0747, 10: 0.1018, 11: 0.1217, 12: 0.1314, 13: 0.1327, 14: 0.1244, 15: 0.1093, 16: 0.0825, 17: 0.0478, 18: 0.0135, 19: 0.0010},
+        9: {7: 0.0102, 8: 0.0487, 9: 0.0815, 10: 0.1117, 11: 0.1295, 12: 0.1390, 13: 0.1361, 14: 0.1226, 15: 0.1044, 16: 0.0748, 17: 0.0373, 18: 0.0042},
+        10: {7: 0.0020, 8: 0.0356, 9: 0.0895, 10: 0.1262, 11: 0.1433, 12: 0.1490, 13: 0.1436, 14: 0.1254, 15: 0.1003, 16: 0.0651, 17: 0.0200},
+        11: {8: 0.0074, 9: 0.0786, 10: 0.1338, 11: 0.1588, 12: 0.1641, 13: 0.1602, 14: 0.1328, 15: 0.1042, 16: 0.0596, 17: 0.0004},
+        12: {8: 0.0010, 9: 0.0135, 10: 0.1365, 11: 0.1665, 12: 0.1773, 13: 0.1719, 14: 0.1472, 15: 0.1193, 16: 0.0668}
+    },
+    'Évora': {
+        1: {8: 0.0145, 9: 0.0729, 10: 0.1157, 11: 0.1426, 12: 0.1553, 13: 0.1506, 14: 0.1391, 15: 0.1173, 16: 0.0766, 17: 0.0153},
+        2: {8: 0.0267, 9: 0.0741, 10: 0.1127, 11: 0.1374, 12: 0.1440, 13: 0.1446, 14: 0.1321, 15: 0.1115, 16: 0.0797, 17: 0.0371},
+        3: {7: 0.0044, 8: 0.0406, 9: 0.0805, 10: 0.1101, 11: 0.1312, 12: 0.1375, 13: 0.1376, 14: 0.1265, 15: 0.1085, 16: 0.0769, 17: 0.0412, 18: 0.0048},
+        4: {6: 0.0006, 7: 0.0174, 8: 0.0544, 9: 0.0879, 10: 0.1112, 11: 0.1246, 12: 0.1306, 13: 0.1284, 14: 0.1177, 15: 0.1008, 16: 0.0751, 17: 0.0420, 18: 0.0093},
+        5: {6: 0.0045, 7: 0.0224, 8: 0.0571, 9: 0.0872, 10: 0.1078, 11: 0.1241, 12: 0.1289, 13: 0.1243, 14: 0.1150, 15: 0.1005, 16: 0.0733, 17: 0.0424, 18: 0.0115, 19: 0.0012},
+        6: {6: 0.0058, 7: 0.0217, 8: 0.0546, 9: 0.0831, 10: 0.1050, 11: 0.1195, 12: 0.1277, 13: 0.1264, 14: 0.1163, 15: 0.1002, 16: 0.0768, 17: 0.0452, 18: 0.0140, 19: 0.0036},
+        7: {6: 0.0039, 7: 0.0172, 8: 0.0491, 9: 0.0803, 10: 0.1043, 11: 0.1205, 12: 0.1290, 13: 0.1288, 14: 0.1206, 15: 0.1031, 16: 0.0789, 17: 0.0468, 18: 0.0142, 19: 0.0032},
+        8: {6: 0.0010, 7: 0.0154, 8: 0.0493, 9: 0.0822, 10: 0.1077, 11: 0.1243, 12: 0.1318, 13: 0.1302, 14: 0.1209, 15: 0.1033, 16: 0.0775, 17: 0.0445, 18: 0.0112, 19: 0.0006},
+        9: {7: 0.0145, 8: 0.0520, 9: 0.0867, 10: 0.1144, 11: 0.1302, 12: 0.1370, 13: 0.1341, 14: 0.1193, 15: 0.1020, 16: 0.0721, 17: 0.0344, 18: 0.0034},
+        10: {7: 0.0083, 8: 0.0529, 9: 0.0910, 10: 0.1226, 11: 0.1390, 12: 0.1432, 13: 0.1401, 14: 0.1221, 15: 0.0990, 16: 0.0628, 17: 0.0189},
+        11: {8: 0.0433, 9: 0.0908, 10: 0.1295, 11: 0.1493, 12: 0.1560, 13: 0.1496, 14: 0.1235, 15: 0.1000, 16: 0.0568, 17: 0.0011},
+        12: {8: 0.0200, 9: 0.0810, 10: 0.1238, 11: 0.1487, 12: 0.1603, 13: 0.1550, 14: 0.1356, 15: 0.1104, 16: 0.0652}
+    },
+    'Faro': {
+        1: {8: 0.0184, 9: 0.0738, 10: 0.1156, 11: 0.1449, 12: 0.1557, 13: 0.1475, 14: 0.1375, 15: 0.1123, 16: 0.0749, 17: 0.0194},
+        2: {8: 0.0271, 9: 0.0735, 10: 0.1100, 11: 0.1360, 12: 0.1442, 13: 0.1457, 14: 0.1350, 15: 0.1134, 16: 0.0786, 17: 0.0365},
+        3: {7: 0.0042, 8: 0.0401, 9: 0.0780, 10: 0.1077, 11: 0.1296, 12: 0.1359, 13: 0.1400, 14: 0.1294, 15: 0.1102, 16: 0.0785, 17: 0.0414, 18: 0.0049},
+        4: {6: 0.0004, 7: 0.0148, 8: 0.0491, 9: 0.0823, 10: 0.1071, 11: 0.1264, 12: 0.1333, 13: 0.1346, 14: 0.1223, 15: 0.1050, 16: 0.0761, 17: 0.0403, 18: 0.0083},
+        5: {6: 0.0037, 7: 0.0198, 8: 0.0531, 9: 0.0842, 10: 0.1059, 11: 0.1236, 12: 0.1315, 13: 0.1299, 14: 0.1210, 15: 0.1017, 16: 0.0743, 17: 0.0404, 18: 0.0102, 19: 0.0009,},
+        6: {6: 0.0049, 7: 0.0191, 8: 0.0513, 9: 0.0801, 10: 0.1037, 11: 0.1200, 12: 0.1300, 13: 0.1295, 14: 0.1210, 15: 0.1039, 16: 0.0769, 17: 0.0441, 18: 0.0125, 19: 0.0031},
+        7: {6: 0.0033, 7: 0.0154, 8: 0.0483, 9: 0.0790, 10: 0.1032, 11: 0.1199, 12: 0.1307, 13: 0.1305, 14: 0.1228, 15: 0.1056, 16: 0.0793, 17: 0.0460, 18: 0.0133, 19: 0.0028},
+        8: {6: 0.0008, 7: 0.0140, 8: 0.0477, 9: 0.0801, 10: 0.1052, 11: 0.1222, 12: 0.1326, 13: 0.1328, 14: 0.1236, 15: 0.1065, 16: 0.0791, 17: 0.0440, 18: 0.0108, 19: 0.0005},
+        9: {7: 0.0135, 8: 0.0498, 9: 0.0834, 10: 0.1096, 11: 0.1268, 12: 0.1377, 13: 0.1385, 14: 0.1238, 15: 0.1050, 16: 0.0733, 17: 0.0352, 18: 0.0033},
+        10: {7: 0.0083, 8: 0.0513, 9: 0.0892, 10: 0.1214, 11: 0.1359, 12: 0.1440, 13: 0.1414, 14: 0.1247, 15: 0.1001, 16: 0.0638, 17: 0.0198},
+        11: {8: 0.0434, 9: 0.0902, 10: 0.1275, 11: 0.1504, 12: 0.1548, 13: 0.1465, 14: 0.1262, 15: 0.1013, 16: 0.0570, 17: 0.0028},
+        12: {8: 0.0237, 9: 0.0829, 10: 0.1219, 11: 0.1484, 12: 0.1600, 13: 0.1566, 14: 0.1367, 15: 0.1073, 16: 0.0624, 17: 0.0001}
+    },
+    'Guarda': {
+        1: {8: 0.0100, 9: 0.0755, 10: 0.1165, 11: 0.1434, 12: 0.1616, 13: 0.1549, 14: 0.1424, 15: 0.1164, 16: 0.0744, 17: 0.0047},
+        2: {8: 0.0284, 9: 0.0774, 10: 0.1119, 11: 0.1361, 12: 0.1452, 13: 0.1455, 14: 0.1318, 15: 0.1117, 16: 0.0785, 17: 0.0335},
+        3: {7: 0.0054, 8: 0.0432, 9: 0.0818, 10: 0.1110, 11: 0.1328, 12: 0.1367, 13: 0.1376, 14: 0.1265, 15: 0.1057, 16: 0.0774, 17: 0.0395, 18: 0.0025},
+        4: {6: 0.0010, 7: 0.0192, 8: 0.0558, 9: 0.0879, 10: 0.1112, 11: 0.1276, 12: 0.1320, 13: 0.1276, 14: 0.1148, 15: 0.1008, 16: 0.0734, 17: 0.0403, 18: 0.0085},
+        5: {6: 0.0052, 7: 0.0256, 8: 0.0597, 9: 0.0905, 10: 0.1098, 11: 0.1234, 12: 0.1281, 13: 0.1230, 14: 0.1134, 15: 0.0969, 16: 0.0709, 17: 0.0407, 18: 0.0114, 19: 0.0013},
+        6: {6: 0.0065, 7: 0.0244, 8: 0.0569, 9: 0.0862, 10: 0.1071, 11: 0.1204, 12: 0.1264, 13: 0.1238, 14: 0.1153, 15: 0.0972, 16: 0.0740, 17: 0.0441, 18: 0.0140, 19: 0.0037},
+        7: {6: 0.0045, 7: 0.0197, 8: 0.0532, 9: 0.0835, 10: 0.1066, 11: 0.1218, 12: 0.1298, 13: 0.1258, 14: 0.1162, 15: 0.1010, 16: 0.0756, 17: 0.0449, 18: 0.0141, 19: 0.0033},
+        8: {6: 0.0016, 7: 0.0175, 8: 0.0526, 9: 0.0850, 10: 0.1098, 11: 0.1257, 12: 0.1315, 13: 0.1281, 14: 0.1182, 15: 0.1015, 16: 0.0749, 17: 0.0423, 18: 0.0107, 19: 0.0007},
+        9: {7: 0.0167, 8: 0.0557, 9: 0.0903, 10: 0.1158, 11: 0.1324, 12: 0.1378, 13: 0.1330, 14: 0.1167, 15: 0.0973, 16: 0.0689, 17: 0.0327, 18: 0.0027},
+        10: {7: 0.0093, 8: 0.0551, 9: 0.0907, 10: 0.1242, 11: 0.1394, 12: 0.1452, 13: 0.1408, 14: 0.1209, 15: 0.0990, 16: 0.0612, 17: 0.0142},
+        11: {8: 0.0436, 9: 0.0895, 10: 0.1258, 11: 0.1494, 12: 0.1569, 13: 0.1494, 14: 0.1282, 15: 0.1021, 16: 0.0552, 17: 0.0001},
+        12: {8: 0.0150, 9: 0.0803, 10: 0.1234, 11: 0.1509, 12: 0.1625, 13: 0.1576, 14: 0.1389, 15: 0.1113, 16: 0.0599}
+    },
+    'Leiria': {
+        1: {8: 0.0004, 9: 0.0714, 10: 0.1179, 11: 0.1492, 12: 0.1617, 13: 0.1529, 14: 0.1410, 15: 0.1180, 16: 0.0798, 17: 0.0076},
+        2: {8: 0.0212, 9: 0.0716, 10: 0.1107, 11: 0.1373, 12: 0.1472, 13: 0.1495, 14: 0.1327, 15: 0.1108, 16: 0.0797, 17: 0.0393},
+        3: {7: 0.0029, 8: 0.0372, 9: 0.0756, 10: 0.1060, 11: 0.1294, 12: 0.1365, 13: 0.1419, 14: 0.1272, 15: 0.1105, 16: 0.0827, 17: 0.0442, 18: 0.0059},
+        4: {6: 0.0005, 7: 0.0154, 8: 0.0497, 9: 0.0810, 10: 0.1046, 11: 0.1230, 12: 0.1302, 13: 0.1324, 14: 0.1230, 15: 0.1053, 16: 0.0777, 17: 0.0456, 18: 0.0114, 19: 0.0001},
+        5: {6: 0.0043, 7: 0.0207, 8: 0.0515, 9: 0.0820, 10: 0.1032, 11: 0.1202, 12: 0.1284, 13: 0.1274, 14: 0.1190, 15: 0.1027, 16: 0.0790, 17: 0.0458, 18: 0.0140, 19: 0.0019},
+        6: {6: 0.0060, 7: 0.0209, 8: 0.0483, 9: 0.0756, 10: 0.0975, 11: 0.1150, 12: 0.1277, 13: 0.1267, 14: 0.1214, 15: 0.1082, 16: 0.0820, 17: 0.0491, 18: 0.0174, 19: 0.0044},
+        7: {6: 0.0039, 7: 0.0165, 8: 0.0424, 9: 0.0704, 10: 0.0950, 11: 0.1160, 12: 0.1289, 13: 0.1320, 14: 0.1257, 15: 0.1105, 16: 0.0854, 17: 0.0515, 18: 0.0177, 19: 0.0041},
+        8: {6: 0.0008, 7: 0.0136, 8: 0.0414, 9: 0.0728, 10: 0.0996, 11: 0.1212, 12: 0.1317, 13: 0.1357, 14: 0.1269, 15: 0.1104, 16: 0.0828, 17: 0.0482, 18: 0.0138, 19: 0.0011},
+        9: {7: 0.0117, 8: 0.0450, 9: 0.0781, 10: 0.1089, 11: 0.1284, 12: 0.1380, 13: 0.1366, 14: 0.1245, 15: 0.1081, 16: 0.0774, 17: 0.0387, 18: 0.0046},
+        10: {7: 0.0044, 8: 0.0483, 9: 0.0858, 10: 0.1218, 11: 0.1383, 12: 0.1441, 13: 0.1414, 14: 0.1235, 15: 0.1040, 16: 0.0664, 17: 0.0218},
+        11: {8: 0.0327, 9: 0.0882, 10: 0.1293, 11: 0.1562, 12: 0.1571, 13: 0.1505, 14: 0.1265, 15: 0.0999, 16: 0.0592, 17: 0.0003},
+        12: {8: 0.0010, 9: 0.0777, 10: 0.1250, 11: 0.1547, 12: 0.1678, 13: 0.1585, 14: 0.1391, 15: 0.1112, 16: 0.0650}
+    },
+    'Lisboa': {
+        1: {8: 0.0006, 9: 0.0316, 10: 0.1197, 11: 0.1465, 12: 0.1645, 13: 0.1617, 14: 0.1529, 15: 0.1290, 16: 0.0887, 17: 0.0048},
+        2: {8: 0.0046, 9: 0.0700, 10: 0.1085, 11: 0.1340, 12: 0.1429, 13: 0.1493, 14: 0.1405, 15: 0.1225, 16: 0.0866, 17: 0.0410, 18: 0.0001},
+        3: {7: 0.0016, 8: 0.0327, 9: 0.0752, 10: 0.1055, 11: 0.1284, 12: 0.1370, 13: 0.1415, 14: 0.1315, 15: 0.1127, 16: 0.0838, 17: 0.0453, 18: 0.0047},
+        4: {6: 0.0003, 7: 0.0117, 8: 0.0490, 9: 0.0808, 10: 0.1058, 11: 0.1209, 12: 0.1294, 13: 0.1323, 14: 0.1245, 15: 0.1080, 16: 0.0802, 17: 0.0457, 18: 0.0113},
+        5: {6: 0.0036, 7: 0.0191, 8: 0.0515, 9: 0.0813, 10: 0.1020, 11: 0.1198, 12: 0.1284, 13: 0.1295, 14: 0.1215, 15: 0.1048, 16: 0.0783, 17: 0.0452, 18: 0.0134, 19: 0.0017},
+        6: {6: 0.0050, 7: 0.0189, 8: 0.0497, 9: 0.0768, 10: 0.0998, 11: 0.1167, 12: 0.1272, 13: 0.1278, 14: 0.1218, 15: 0.1064, 16: 0.0808, 17: 0.0488, 18: 0.0162, 19: 0.0042},
+        7: {6: 0.0032, 7: 0.0148, 8: 0.0450, 9: 0.0744, 10: 0.0995, 11: 0.1177, 12: 0.1284, 13: 0.1300, 14: 0.1241, 15: 0.1087, 16: 0.0832, 17: 0.0505, 18: 0.0168, 19: 0.0038},
+        8: {6: 0.0006, 7: 0.0117, 8: 0.0451, 9: 0.0766, 10: 0.1019, 11: 0.1212, 12: 0.1316, 13: 0.1330, 14: 0.1253, 15: 0.1088, 16: 0.0820, 17: 0.0477, 18: 0.0135, 19: 0.0010},
+        9: {7: 0.0051, 8: 0.0472, 9: 0.0826, 10: 0.1093, 11: 0.1272, 12: 0.1365, 13: 0.1389, 14: 0.1268, 15: 0.1075, 16: 0.0760, 17: 0.0385, 18: 0.0044},
+        10: {7: 0.0016, 8: 0.0423, 9: 0.0886, 10: 0.1184, 11: 0.1389, 12: 0.1436, 13: 0.1458, 14: 0.1282, 15: 0.1058, 16: 0.0679, 17: 0.0188},
+        11: {8: 0.0070, 9: 0.0887, 10: 0.1293, 11: 0.1517, 12: 0.1599, 13: 0.1538, 14: 0.1348, 15: 0.1100, 16: 0.0641, 17: 0.0006},
+        12: {8: 0.0012, 9: 0.0362, 10: 0.1257, 11: 0.1570, 12: 0.1718, 13: 0.1681, 14: 0.1489, 15: 0.1200, 16: 0.0708, 17: 0.0001}
+    },
+    'Portalegre': {
+        1: {8: 0.0020, 9: 0.0768, 10: 0.1194, 11: 0.1465, 12: 0.1592, 13: 0.1529, 14: 0.1403, 15: 0.1146, 16: 0.0757, 17: 0.0126},
+        2: {8: 0.0286, 9: 0.0752, 10: 0.1119, 11: 0.1356, 12: 0.1450, 13: 0.1449, 14: 0.1328, 15: 0.1116, 16: 0.0797, 17: 0.0348},
+        3: {7: 0.0038, 8: 0.0417, 9: 0.0811, 10: 0.1113, 11: 0.1297, 12: 0.1377, 13: 0.1385, 14: 0.1266, 15: 0.1067, 16: 0.0790, 17: 0.0399, 18: 0.0041},
+        4: {6: 0.0008, 7: 0.0185, 8: 0.0543, 9: 0.0876, 10: 0.1105, 11: 0.1259, 12: 0.1298, 13: 0.1291, 14: 0.1170, 15: 0.1014, 16: 0.0754, 17: 0.0408, 18: 0.0087},
+        5: {6: 0.0048, 7: 0.0240, 8: 0.0587, 9: 0.0891, 10: 0.1090, 11: 0.1223, 12: 0.1292, 13: 0.1253, 14: 0.1136, 15: 0.0985, 16: 0.0727, 17: 0.0409, 18: 0.0108, 19: 0.0012},
+        6: {6: 0.0062, 7: 0.0229, 8: 0.0553, 9: 0.0850, 10: 0.1063, 11: 0.1199, 12: 0.1275, 13: 0.1250, 14: 0.1152, 15: 0.1002, 16: 0.0756, 17: 0.0439, 18: 0.0136, 19: 0.0034},
+        7: {6: 0.0042, 7: 0.0184, 8: 0.0514, 9: 0.0818, 10: 0.1056, 11: 0.1207, 12: 0.1291, 13: 0.1282, 14: 0.1194, 15: 0.1020, 16: 0.0770, 17: 0.0455, 18: 0.0136, 19: 0.0030},
+        8: {6: 0.0013, 7: 0.0165, 8: 0.0510, 9: 0.0838, 10: 0.1086, 11: 0.1246, 12: 0.1315, 13: 0.1303, 14: 0.1198, 15: 0.1023, 16: 0.0760, 17: 0.0431, 18: 0.0106, 19: 0.0006},
+        9: {7: 0.0161, 8: 0.0543, 9: 0.0891, 10: 0.1155, 11: 0.1295, 12: 0.1354, 13: 0.1327, 14: 0.1185, 15: 0.1003, 16: 0.0714, 17: 0.0343, 18: 0.0030},
+        10: {7: 0.0076, 8: 0.0552, 9: 0.0914, 10: 0.1244, 11: 0.1389, 12: 0.1434, 13: 0.1388, 14: 0.1217, 15: 0.0978, 16: 0.0626, 17: 0.0180},
+        11: {8: 0.0454, 9: 0.0915, 10: 0.1282, 11: 0.1522, 12: 0.1557, 13: 0.1464, 14: 0.1246, 15: 0.0995, 16: 0.0562, 17: 0.0003},
+        12: {8: 0.0120, 9: 0.0856, 10: 0.1254, 11: 0.1535, 12: 0.1631, 13: 0.1565, 14: 0.1368, 15: 0.1068, 16: 0.0603}
+    },
+    'Porto': {
+        1: {8: 0.0021, 9: 0.0677, 10: 0.1154, 11: 0.1460, 12: 0.1668, 13: 0.1576, 14: 0.1439, 15: 0.1180, 16: 0.0775, 17: 0.0050},
+        2: {8: 0.0206, 9: 0.0707, 10: 0.1095, 11: 0.1378, 12: 0.1482, 13: 0.1465, 14: 0.1347, 15: 0.1130, 16: 0.0821, 17: 0.0369},
+        3: {7: 0.0035, 8: 0.0380, 9: 0.0769, 10: 0.1066, 11: 0.1309, 12: 0.1366, 13: 0.1407, 14: 0.1285, 15: 0.1105, 16: 0.0808, 17: 0.0423, 18: 0.0046},
+        4: {6: 0.0006, 7: 0.0152, 8: 0.0488, 9: 0.0802, 10: 0.1039, 11: 0.1229, 12: 0.1335, 13: 0.1352, 14: 0.1236, 15: 0.1057, 16: 0.0772, 17: 0.0427, 18: 0.0105, 19: 0.0001},
+        5: {6: 0.0044, 7: 0.0208, 8: 0.0514, 9: 0.0800, 10: 0.1006, 11: 0.1194, 12: 0.1295, 13: 0.1312, 14: 0.1220, 15: 0.1032, 16: 0.0775, 17: 0.0445, 18: 0.0134, 19: 0.0020},
+        6: {6: 0.0061, 7: 0.0214, 8: 0.0493, 9: 0.0767, 10: 0.0973, 11: 0.1160, 12: 0.1282, 13: 0.1307, 14: 0.1217, 15: 0.1055, 16: 0.0788, 17: 0.0473, 18: 0.0165, 19: 0.0044},
+        7: {6: 0.0043, 7: 0.0175, 8: 0.0457, 9: 0.0733, 10: 0.0956, 11: 0.1151, 12: 0.1279, 13: 0.1315, 14: 0.1247, 15: 0.1089, 16: 0.0832, 17: 0.0504, 18: 0.0178, 19: 0.0043},
+        8: {6: 0.0011, 7: 0.0147, 8: 0.0446, 9: 0.0749, 10: 0.0996, 11: 0.1198, 12: 0.1316, 13: 0.1339, 14: 0.1265, 15: 0.1087, 16: 0.0820, 17: 0.0475, 18: 0.0138, 19: 0.0012},
+        9: {7: 0.0124, 8: 0.0479, 9: 0.0813, 10: 0.1093, 11: 0.1276, 12: 0.1369, 13: 0.1378, 14: 0.1248, 15: 0.1062, 16: 0.0747, 17: 0.0370, 18: 0.0041},
+        10: {7: 0.0051, 8: 0.0479, 9: 0.0863, 10: 0.1213, 11: 0.1393, 12: 0.1462, 13: 0.1440, 14: 0.1265, 15: 0.1011, 16: 0.0647, 17: 0.0174},
+        11: {8: 0.0326, 9: 0.0838, 10: 0.1271, 11: 0.1553, 12: 0.1577, 13: 0.1527, 14: 0.1306, 15: 0.1036, 16: 0.0564, 17: 0.0002},
+        12: {8: 0.0053, 9: 0.0760, 10: 0.1244, 11: 0.1557, 12: 0.1683, 13: 0.1633, 14: 0.1374, 15: 0.1102, 16: 0.0594}
+    },
+    'Santarém': {
+        1: {8: 0.0061, 9: 0.0695, 10: 0.1149, 11: 0.1420, 12: 0.1584, 13: 0.1541, 14: 0.1415, 15: 0.1171, 16: 0.0793, 17: 0.0172},
+        2: {8: 0.0233, 9: 0.0712, 10: 0.1091, 11: 0.1348, 12: 0.1454, 13: 0.1473, 14: 0.1354, 15: 0.1130, 16: 0.0816, 17: 0.0387, 18: 0.0001},
+        3: {7: 0.0034, 8: 0.0378, 9: 0.0771, 10: 0.1081, 11: 0.1287, 12: 0.1340, 13: 0.1408, 14: 0.1307, 15: 0.1085, 16: 0.0813, 17: 0.0436, 18: 0.0061},
+        4: {6: 0.0005, 7: 0.0157, 8: 0.0525, 9: 0.0858, 10: 0.1078, 11: 0.1229, 12: 0.1296, 13: 0.1303, 14: 0.1202, 15: 0.1030, 16: 0.0774, 17: 0.0438, 18: 0.0106},
+        5: {6: 0.0042, 7: 0.0211, 8: 0.0553, 9: 0.0846, 10: 0.1042, 11: 0.1201, 12: 0.1276, 13: 0.1260, 14: 0.1181, 15: 0.1023, 16: 0.0774, 17: 0.0447, 18: 0.0128, 19: 0.0017},
+        6: {6: 0.0056, 7: 0.0208, 8: 0.0525, 9: 0.0813, 10: 0.1013, 11: 0.1169, 12: 0.1260, 13: 0.1267, 14: 0.1189, 15: 0.1034, 16: 0.0791, 17: 0.0475, 18: 0.0158, 19: 0.0042},
+        7: {6: 0.0037, 7: 0.0163, 8: 0.0477, 9: 0.0764, 10: 0.0990, 11: 0.1175, 12: 0.1282, 13: 0.1292, 14: 0.1224, 15: 0.1072, 16: 0.0823, 17: 0.0498, 18: 0.0164, 19: 0.0038},
+        8: {6: 0.0008, 7: 0.0141, 8: 0.0472, 9: 0.0792, 10: 0.1039, 11: 0.1224, 12: 0.1311, 13: 0.1311, 14: 0.1221, 15: 0.1065, 16: 0.0807, 17: 0.0469, 18: 0.0129, 19: 0.0010},
+        9: {7: 0.0126, 8: 0.0495, 9: 0.0833, 10: 0.1118, 11: 0.1280, 12: 0.1371, 13: 0.1364, 14: 0.1209, 15: 0.1041, 16: 0.0747, 17: 0.0373, 18: 0.0043},
+        10: {7: 0.0057, 8: 0.0495, 9: 0.0858, 10: 0.1205, 11: 0.1391, 12: 0.1414, 13: 0.1433, 14: 0.1253, 15: 0.1035, 16: 0.0649, 17: 0.0210},
+        11: {8: 0.0372, 9: 0.0876, 10: 0.1255, 11: 0.1532, 12: 0.1600, 13: 0.1478, 14: 0.1269, 15: 0.1011, 16: 0.0590, 17: 0.0018},
+        12: {8: 0.0114, 9: 0.0790, 10: 0.1204, 11: 0.1504, 12: 0.1613, 13: 0.1603, 14: 0.1408, 15: 0.1116, 16: 0.0648}
+    },
+    'Setúbal': {
+        1: {8: 0.0047, 9: 0.0708, 10: 0.1141, 11: 0.1425, 12: 0.1550, 13: 0.1532, 14: 0.1408, 15: 0.1197, 16: 0.0796, 17: 0.0196},
+        2: {8: 0.0231, 9: 0.0712, 10: 0.1080, 11: 0.1336, 12: 0.1444, 13: 0.1484, 14: 0.1349, 15: 0.1149, 16: 0.0827, 17: 0.0388, 18: 0.0001},
+        3: {7: 0.0030, 8: 0.0365, 9: 0.0746, 10: 0.1058, 11: 0.1283, 12: 0.1381, 13: 0.1420, 14: 0.1311, 15: 0.1103, 16: 0.0808, 17: 0.0432, 18: 0.0064},
+        4: {6: 0.0004, 7: 0.0142, 8: 0.0490, 9: 0.0827, 10: 0.1043, 11: 0.1219, 12: 0.1307, 13: 0.1326, 14: 0.1214, 15: 0.1062, 16: 0.0810, 17: 0.0452, 18: 0.0105},
+        5: {6: 0.0036, 7: 0.0197, 8: 0.0530, 9: 0.0817, 10: 0.1011, 11: 0.1203, 12: 0.1302, 13: 0.1292, 14: 0.1199, 15: 0.1045, 16: 0.0780, 17: 0.0445, 18: 0.0127, 19: 0.0016},
+        6: {6: 0.0050, 7: 0.0190, 8: 0.0492, 9: 0.0786, 10: 0.1003, 11: 0.1176, 12: 0.1280, 13: 0.1272, 14: 0.1212, 15: 0.1060, 16: 0.0806, 17: 0.0479, 18: 0.0155, 19: 0.0040},
+        7: {6: 0.0032, 7: 0.0151, 8: 0.0451, 9: 0.0747, 10: 0.0985, 11: 0.1183, 12: 0.1291, 13: 0.1311, 14: 0.1244, 15: 0.1083, 16: 0.0825, 17: 0.0500, 18: 0.0161, 19: 0.0036},
+        8: {6: 0.0007, 7: 0.0130, 8: 0.0450, 9: 0.0766, 10: 0.1021, 11: 0.1216, 12: 0.1321, 13: 0.1335, 14: 0.1249, 15: 0.1078, 16: 0.0816, 17: 0.0473, 18: 0.0130, 19: 0.0009},
+        9: {7: 0.0116, 8: 0.0465, 9: 0.0815, 10: 0.1082, 11: 0.1257, 12: 0.1365, 13: 0.1391, 14: 0.1257, 15: 0.1074, 16: 0.0761, 17: 0.0372, 18: 0.0044},
+        10: {7: 0.0051, 8: 0.0477, 9: 0.0864, 10: 0.1188, 11: 0.1379, 12: 0.1445, 13: 0.1409, 14: 0.1282, 15: 0.1030, 16: 0.0655, 17: 0.0217},
+        11: {8: 0.0387, 9: 0.0859, 10: 0.1258, 11: 0.1507, 12: 0.1552, 13: 0.1502, 14: 0.1301, 15: 0.1018, 16: 0.0590, 17: 0.0026},
+        12: {8: 0.0103, 9: 0.0762, 10: 0.1206, 11: 0.1526, 12: 0.1617, 13: 0.1601, 14: 0.1398, 15: 0.1137, 16: 0.0649, 17: 0.0001}
+    },
+    'Viana do Castelo': {
+        1: {8: 0.0004, 9: 0.0672, 10: 0.1149, 11: 0.1444, 12: 0.1603, 13: 0.1568, 14: 0.1458, 15: 0.1193, 16: 0.0797, 17: 0.0110},
+        2: {8: 0.0199, 9: 0.0697, 10: 0.1085, 11: 0.1356, 12: 0.1433, 13: 0.1511, 14: 0.1370, 15: 0.1164, 16: 0.0811, 17: 0.0374},
+        3: {7: 0.0032, 8: 0.0369, 9: 0.0768, 10: 0.1057, 11: 0.1282, 12: 0.1360, 13: 0.1391, 14: 0.1311, 15: 0.1121, 16: 0.0817, 17: 0.0434, 18: 0.0059},
+        4: {6: 0.0006, 7: 0.0151, 8: 0.0485, 9: 0.0789, 10: 0.1021, 11: 0.1234, 12: 0.1334, 13: 0.1346, 14: 0.1231, 15: 0.1068, 16: 0.0789, 17: 0.0437, 18: 0.0109, 19: 0.0001},
+        5: {6: 0.0043, 7: 0.0209, 8: 0.0519, 9: 0.0796, 10: 0.1003, 11: 0.1185, 12: 0.1300, 13: 0.1300, 14: 0.1221, 15: 0.1045, 16: 0.0771, 17: 0.0448, 18: 0.0138, 19: 0.0022},
+        6: {6: 0.0060, 7: 0.0210, 8: 0.0498, 9: 0.0771, 10: 0.0971, 11: 0.1162, 12: 0.1272, 13: 0.1299, 14: 0.1215, 15: 0.1051, 16: 0.0798, 17: 0.0476, 18: 0.0170, 19: 0.0045},
+        7: {6: 0.0042, 7: 0.0171, 8: 0.0454, 9: 0.0727, 10: 0.0947, 11: 0.1154, 12: 0.1283, 13: 0.1301, 14: 0.1249, 15: 0.1092, 16: 0.0841, 17: 0.0513, 18: 0.0183, 19: 0.0043},
+        8: {6: 0.0011, 7: 0.0145, 8: 0.0446, 9: 0.0739, 10: 0.0981, 11: 0.1193, 12: 0.1325, 13: 0.1343, 14: 0.1262, 15: 0.1090, 16: 0.0825, 17: 0.0484, 18: 0.0142, 19: 0.0013},
+        9: {7: 0.0122, 8: 0.0473, 9: 0.0800, 10: 0.1076, 11: 0.1260, 12: 0.1371, 13: 0.1379, 14: 0.1260, 15: 0.1082, 16: 0.0759, 17: 0.0372, 18: 0.0046},
+        10: {7: 0.0047, 8: 0.0472, 9: 0.0842, 10: 0.1195, 11: 0.1354, 12: 0.1484, 13: 0.1435, 14: 0.1265, 15: 0.1047, 16: 0.0665, 17: 0.0193},
+        11: {8: 0.0317, 9: 0.0841, 10: 0.1269, 11: 0.1557, 12: 0.1576, 13: 0.1543, 14: 0.1303, 15: 0.1030, 16: 0.0560, 17: 0.0003},
+        12: {8: 0.0041, 9: 0.0748, 10: 0.1239, 11: 0.1558, 12: 0.1670, 13: 0.1623, 14: 0.1399, 15: 0.1112, 16: 0.0609}
+    },
+    'Vila Real': {
+        1: {8: 0.0004, 9: 0.0732, 10: 0.1189, 11: 0.1453, 12: 0.1616, 13: 0.1572, 14: 0.1407, 15: 0.1193, 16: 0.0782, 17: 0.0051},
+        2: {8: 0.0194, 9: 0.0752, 10: 0.1128, 11: 0.1394, 12: 0.1420, 13: 0.1488, 14: 0.1358, 15: 0.1125, 16: 0.0797, 17: 0.0345},
+        3: {7: 0.0038, 8: 0.0419, 9: 0.0816, 10: 0.1119, 11: 0.1319, 12: 0.1345, 13: 0.1389, 14: 0.1247, 15: 0.1083, 16: 0.0780, 17: 0.0406, 18: 0.0039},
+        4: {6: 0.0010, 7: 0.0191, 8: 0.0554, 9: 0.0874, 10: 0.1100, 11: 0.1282, 12: 0.1314, 13: 0.1307, 14: 0.1141, 15: 0.0988, 16: 0.0731, 17: 0.0411, 18: 0.0096},
+        5: {6: 0.0051, 7: 0.0251, 8: 0.0600, 9: 0.0895, 10: 0.1081, 11: 0.1222, 12: 0.1268, 13: 0.1231, 14: 0.1138, 15: 0.0967, 16: 0.0734, 17: 0.0424, 18: 0.0123, 19: 0.0016},
+        6: {6: 0.0066, 7: 0.0245, 8: 0.0565, 9: 0.0849, 10: 0.1047, 11: 0.1198, 12: 0.1267, 13: 0.1238, 14: 0.1143, 15: 0.0996, 16: 0.0746, 17: 0.0447, 18: 0.0153, 19: 0.0040},
+        7: {6: 0.0045, 7: 0.0196, 8: 0.0530, 9: 0.0820, 10: 0.1049, 11: 0.1195, 12: 0.1269, 13: 0.1259, 14: 0.1174, 15: 0.1022, 16: 0.0778, 17: 0.0472, 18: 0.0156, 19: 0.0036},
+        8: {6: 0.0015, 7: 0.0171, 8: 0.0521, 9: 0.0841, 10: 0.1075, 11: 0.1241, 12: 0.1304, 13: 0.1295, 14: 0.1181, 15: 0.1017, 16: 0.0769, 17: 0.0443, 18: 0.0119, 19: 0.0009},
+        9: {7: 0.0157, 8: 0.0535, 9: 0.0875, 10: 0.1154, 11: 0.1314, 12: 0.1383, 13: 0.1339, 14: 0.1187, 15: 0.0992, 16: 0.0689, 17: 0.0341, 18: 0.0032},
+        10: {7: 0.0040, 8: 0.0547, 9: 0.0919, 10: 0.1242, 11: 0.1408, 12: 0.1464, 13: 0.1394, 14: 0.1220, 15: 0.0978, 16: 0.0620, 17: 0.0168},
+        11: {8: 0.0342, 9: 0.0934, 10: 0.1291, 11: 0.1533, 12: 0.1577, 13: 0.1488, 14: 0.1265, 15: 0.1010, 16: 0.0560, 17: 0.0001},
+        12: {8: 0.0009, 9: 0.0785, 10: 0.1228, 11: 0.1526, 12: 0.1643, 13: 0.1610, 14: 0.1410, 15: 0.1158, 16: 0.0632}
+    },
+    'Viseu': {
+        1: {8: 0.0072, 9: 0.0737, 10: 0.1186, 11: 0.1445, 12: 0.1604, 13: 0.1554, 14: 0.1405, 15: 0.1136, 16: 0.0760, 17: 0.0102},
+        2: {8: 0.0254, 9: 0.0746, 10: 0.1117, 11: 0.1375, 12: 0.1458, 13: 0.1471, 14: 0.1333, 15: 0.1111, 16: 0.0784, 17: 0.0350},
+        3: {7: 0.0045, 8: 0.0408, 9: 0.0804, 10: 0.1101, 11: 0.1302, 12: 0.1369, 13: 0.1377, 14: 0.1247, 15: 0.1100, 16: 0.0791, 17: 0.0410, 18: 0.0047},
+        4: {6: 0.0008, 7: 0.0180, 8: 0.0537, 9: 0.0851, 10: 0.1110, 11: 0.1274, 12: 0.1329, 13: 0.1289, 14: 0.1162, 15: 0.1005, 16: 0.0748, 17: 0.0411, 18: 0.0096},
+        5: {6: 0.0050, 7: 0.0237, 8: 0.0575, 9: 0.0876, 10: 0.1078, 11: 0.1237, 12: 0.1289, 13: 0.1248, 14: 0.1129, 15: 0.0976, 16: 0.0736, 17: 0.0429, 18: 0.0124, 19: 0.0017},
+        6: {6: 0.0064, 7: 0.0230, 8: 0.0535, 9: 0.0821, 10: 0.1027, 11: 0.1184, 12: 0.1271, 13: 0.1253, 14: 0.1167, 15: 0.1016, 16: 0.0770, 17: 0.0464, 18: 0.0157, 19: 0.0041},
+        7: {6: 0.0044, 7: 0.0185, 8: 0.0491, 9: 0.0792, 10: 0.1021, 11: 0.1199, 12: 0.1293, 13: 0.1284, 14: 0.1194, 15: 0.1033, 16: 0.0789, 17: 0.0480, 18: 0.0157, 19: 0.0037},
+        8: {6: 0.0013, 7: 0.0160, 8: 0.0486, 9: 0.0813, 10: 0.1064, 11: 0.1236, 12: 0.1317, 13: 0.1311, 14: 0.1211, 15: 0.1036, 16: 0.0774, 17: 0.0451, 18: 0.0121, 19: 0.0009},
+        9: {7: 0.0148, 8: 0.0528, 9: 0.0871, 10: 0.1138, 11: 0.1310, 12: 0.1378, 13: 0.1343, 14: 0.1199, 15: 0.0993, 16: 0.0712, 17: 0.0346, 18: 0.0035},
+        10: {7: 0.0073, 8: 0.0539, 9: 0.0918, 10: 0.1226, 11: 0.1399, 12: 0.1443, 13: 0.1391, 14: 0.1225, 15: 0.0978, 16: 0.0628, 17: 0.0181},
+        11: {8: 0.0403, 9: 0.0908, 10: 0.1293, 11: 0.1517, 12: 0.1565, 13: 0.1477, 14: 0.1285, 15: 0.1001, 16: 0.0548, 17: 0.0001},
+        12: {8: 0.0111, 9: 0.0819, 10: 0.1238, 11: 0.1541, 12: 0.1645, 13: 0.1603, 14: 0.1361, 15: 0.1086, 16: 0.0595}
+    },
+    'Açores (Ponta Delgada)': {
+        1: {8: 0.0015, 9: 0.0515, 10: 0.0973, 11: 0.1393, 12: 0.1565, 13: 0.1617, 14: 0.1575, 15: 0.1278, 16: 0.0812, 17: 0.0259},
+        2: {8: 0.0132, 9: 0.0549, 10: 0.0953, 11: 0.1215, 12: 0.1533, 13: 0.1565, 14: 0.1496, 15: 0.1270, 16: 0.0867, 17: 0.0411, 18: 0.0011},
+        3: {7: 0.0016, 8: 0.0275, 9: 0.0645, 10: 0.0994, 11: 0.1229, 12: 0.1431, 13: 0.1443, 14: 0.1420, 15: 0.1178, 16: 0.0844, 17: 0.0441, 18: 0.0086},
+        4: {6: 0.0001, 7: 0.0112, 8: 0.0402, 9: 0.0716, 10: 0.1025, 11: 0.1225, 12: 0.1351, 13: 0.1355, 14: 0.1301, 15: 0.1112, 16: 0.0815, 17: 0.0462, 18: 0.0122, 19: 0.0001},
+        5: {6: 0.0027, 7: 0.0177, 8: 0.0451, 9: 0.0745, 10: 0.1026, 11: 0.1212, 12: 0.1289, 13: 0.1324, 14: 0.1282, 15: 0.1075, 16: 0.0782, 17: 0.0448, 18: 0.0145, 19: 0.0017},
+        6: {6: 0.0043, 7: 0.0179, 8: 0.0454, 9: 0.0722, 10: 0.0977, 11: 0.1182, 12: 0.1290, 13: 0.1308, 14: 0.1272, 15: 0.1072, 16: 0.0810, 17: 0.0476, 18: 0.0177, 19: 0.0038},
+        7: {6: 0.0025, 7: 0.0150, 8: 0.0426, 9: 0.0688, 10: 0.0964, 11: 0.1163, 12: 0.1285, 13: 0.1319, 14: 0.1282, 15: 0.1111, 16: 0.0840, 17: 0.0511, 18: 0.0197, 19: 0.0039},
+        8: {6: 0.0002, 7: 0.0110, 8: 0.0414, 9: 0.0742, 10: 0.1023, 11: 0.1208, 12: 0.1311, 13: 0.1304, 14: 0.1281, 15: 0.1115, 16: 0.0837, 17: 0.0483, 18: 0.0157, 19: 0.0013},
+        9: {7: 0.0087, 8: 0.0405, 9: 0.0774, 10: 0.1087, 11: 0.1277, 12: 0.1378, 13: 0.1314, 14: 0.1324, 15: 0.1105, 16: 0.0789, 17: 0.0394, 18: 0.0066},
+        10: {7: 0.0023, 8: 0.0367, 9: 0.0797, 10: 0.1120, 11: 0.1367, 12: 0.1527, 13: 0.1465, 14: 0.1358, 15: 0.1064, 16: 0.0675, 17: 0.0237, 18: 0.0001},
+        11: {8: 0.0244, 9: 0.0740, 10: 0.1160, 11: 0.1463, 12: 0.1602, 13: 0.1477, 14: 0.1476, 15: 0.1105, 16: 0.0647, 17: 0.0084},
+        12: {8: 0.0047, 9: 0.0647, 10: 0.1079, 11: 0.1471, 12: 0.1691, 13: 0.1579, 14: 0.1563, 15: 0.1197, 16: 0.0691, 17: 0.0034}
+    },
+    'Madeira (Funchal)': {
+        1: {9: 0.0529, 10: 0.1059, 11: 0.1348, 12: 0.1474, 13: 0.1440, 14: 0.1343, 15: 0.1201, 16: 0.0989, 17: 0.0574, 18: 0.0045},
+        2: {8: 0.0047, 9: 0.0553, 10: 0.1017, 11: 0.1265, 12: 0.1289, 13: 0.1419, 14: 0.1332, 15: 0.1226, 16: 0.0994, 17: 0.0642, 18: 0.0216},
+        3: {8: 0.0198, 9: 0.0638, 10: 0.0997, 11: 0.1212, 12: 0.1263, 13: 0.1356, 14: 0.1296, 15: 0.1179, 16: 0.0945, 17: 0.0645, 18: 0.0270, 19: 0.0001},
+        4: {7: 0.0027, 8: 0.0334, 9: 0.0767, 10: 0.1047, 11: 0.1181, 12: 0.1252, 13: 0.1268, 14: 0.1195, 15: 0.1106, 16: 0.0904, 17: 0.0624, 18: 0.0270, 19: 0.0025},
+        5: {7: 0.0067, 8: 0.0387, 9: 0.0781, 10: 0.0986, 11: 0.1152, 12: 0.1232, 13: 0.1243, 14: 0.1207, 15: 0.1110, 16: 0.0884, 17: 0.0606, 18: 0.0282, 19: 0.0061},
+        6: {7: 0.0092, 8: 0.0381, 9: 0.0789, 10: 0.0981, 11: 0.1131, 12: 0.1233, 13: 0.1201, 14: 0.1162, 15: 0.1091, 16: 0.0901, 17: 0.0628, 18: 0.0315, 19: 0.0094, 20: 0.0001},
+        7: {7: 0.0068, 8: 0.0313, 9: 0.0721, 10: 0.0981, 11: 0.1158, 12: 0.1253, 13: 0.1253, 14: 0.1207, 15: 0.1109, 16: 0.0910, 17: 0.0627, 18: 0.0316, 19: 0.0083, 20: 0.0001},
+        8: {7: 0.0036, 8: 0.0305, 9: 0.0722, 10: 0.0998, 11: 0.1177, 12: 0.1263, 13: 0.1281, 14: 0.1222, 15: 0.1125, 16: 0.0908, 17: 0.0623, 18: 0.0293, 19: 0.0047},
+        9: {7: 0.0009, 8: 0.0368, 9: 0.0820, 10: 0.1120, 11: 0.1245, 12: 0.1278, 13: 0.1263, 14: 0.1177, 15: 0.1075, 16: 0.0861, 17: 0.0568, 18: 0.0213, 19: 0.0003},
+        10: {8: 0.0344, 9: 0.0830, 10: 0.1181, 11: 0.1313, 12: 0.1352, 13: 0.1345, 14: 0.1200, 15: 0.1079, 16: 0.0831, 17: 0.0463, 18: 0.0062},
+        11: {8: 0.0189, 9: 0.0748, 10: 0.1194, 11: 0.1418, 12: 0.1455, 13: 0.1415, 14: 0.1245, 15: 0.1103, 16: 0.0831, 17: 0.0401},
+        12: {8: 0.0001, 9: 0.0616, 10: 0.1121, 11: 0.1408, 12: 0.1477, 13: 0.1508, 14: 0.1310, 15: 0.1210, 16: 0.0899, 17: 0.0450}
+    },
+}
+
 def interpolar_perfis_para_quarto_horario(perfis_horarios):
     """
     Converte perfis horários em quarto-horários usando interpolação linear
@@ -1661,360 +2896,44 @@ def interpolar_perfis_para_quarto_horario(perfis_horarios):
     return perfis_quarto_horarios
 
 
+# --- Tabelas de produção solar (construídas uma vez, na importação do módulo) ---
+# PRODUCAO_DIARIA_PVGIS[d, m]: kWh/dia de 1 kWp no distrito d, mês m+1
+# PERFIS_SOLARES_QUARTO_HORARIOS[d, m, q]: fração da produção diária no quarto-hora q (0 = 00:00-00:15) desse dia
+DISTRITOS_SOLARES = tuple(DADOS_PVGIS_DISTRITO)
+INDICE_DISTRITO_SOLAR = {distrito: i for i, distrito in enumerate(DISTRITOS_SOLARES)}
+
+def _construir_tabelas_solares():
+    producao_diaria = np.array([[DADOS_PVGIS_DISTRITO[d].get(m, 0) for m in range(1, 13)] for d in DISTRITOS_SOLARES], dtype=float)
+    perfis = np.zeros((len(DISTRITOS_SOLARES), 12, 96))
+    perfis_quarto_horarios = interpolar_perfis_para_quarto_horario(PERFIS_HORARIOS_MENSAIS_POR_DISTRITO)
+    for i, distrito in enumerate(DISTRITOS_SOLARES):
+        for mes, perfil_mes in perfis_quarto_horarios.get(distrito, {}).items():
+            for (hora, minuto), fator in perfil_mes.items():
+                perfis[i, mes - 1, hora * 4 + minuto // 15] = fator
+    producao_diaria.setflags(write=False)
+    perfis.setflags(write=False)
+    return producao_diaria, perfis
+
+PRODUCAO_DIARIA_PVGIS, PERFIS_SOLARES_QUARTO_HORARIOS = _construir_tabelas_solares()
+
 def simular_autoconsumo_completo(df_consumos, potencia_kwp, distrito, inclinacao, orientacao_str):
     """
     Função completa e rigorosa para simular a produção solar, usando:
     1. Dados de produção diária média por mês do PVGIS para cada distrito.
     2. Perfis de distribuição horária distintos para cada mês e para cada distrito.
+    Ambos vêm das tabelas PRODUCAO_DIARIA_PVGIS / PERFIS_SOLARES_QUARTO_HORARIOS, já quarto-horárias.
     """
 
-    # Fonte: PVGIS PVdata. Produção diária média (kWh) para um sistema de 1 kWp otimizado.
-    DADOS_PVGIS_DISTRITO = {
-        'Aveiro': {1:3.55, 2:4.43, 3:4.79, 4:5.34, 5:5.66, 6:5.66, 7:5.97, 8:5.92, 9:5.44, 10:4.31, 11:3.53, 12:3.34},
-        'Beja': {1: 4.09, 2: 4.76, 3: 5.18, 4: 5.46, 5: 5.74, 6: 5.89, 7: 6.29, 8: 6.2, 9: 5.69, 10: 4.8, 11: 4.13, 12: 3.78},
-        'Braga': {1: 3.18, 2: 4.01, 3: 4.45, 4: 4.91, 5: 5.35, 6: 5.43, 7: 5.88, 8: 5.84, 9: 5.25, 10: 3.98, 11: 3.18, 12: 2.95},
-        'Bragança': {1: 3.22, 2: 4.41, 3: 4.89, 4: 5.25, 5: 5.73, 6: 5.92, 7: 6.41, 8: 6.26, 9: 5.62, 10: 4.28, 11: 3.37, 12: 2.88},
-        'Castelo Branco': {1: 3.8, 2: 4.68, 3: 5.06, 4: 5.45, 5: 5.78, 6: 5.94, 7: 6.32, 8: 6.23, 9: 5.64, 10: 4.5, 11: 3.73, 12: 3.48},
-        'Coimbra': {1: 3.27, 2: 4.12, 3: 4.5, 4: 4.92, 5: 5.37, 6: 5.37, 7: 5.9, 8: 5.86, 9: 5.31, 10: 4.13, 11: 3.29, 12: 3.05},
-        'Évora': {1: 4.03, 2: 4.73, 3: 5.13, 4: 5.37, 5: 5.75, 6: 5.88, 7: 6.3, 8: 6.23, 9: 5.66, 10: 4.66, 11: 4.01, 12: 3.73},
-        'Faro': {1: 4.56, 2: 5.11, 3: 5.62, 4: 6.02, 5: 6.26, 6: 6.31, 7: 6.52, 8: 6.42, 9: 6.07, 10: 5.14, 11: 4.51, 12: 4.19},
-        'Guarda': {1: 3.5, 2: 4.4, 3: 4.89, 4: 5.23, 5: 5.68, 6: 5.91, 7: 6.45, 8: 6.33, 9: 5.59, 10: 4.37, 11: 3.45, 12: 3.17},
-        'Leiria': {1: 3.53, 2: 4.32, 3: 4.72, 4: 5.1, 5: 5.5, 6: 5.52, 7: 5.98, 8: 6.0, 9: 5.47, 10: 4.32, 11: 3.53, 12: 3.32},
-        'Lisboa': {1: 3.47, 2: 4.33, 3: 4.96, 4: 5.43, 5: 5.83, 6: 5.93, 7: 6.32, 8: 6.33, 9: 5.77, 10: 4.46, 11: 3.52, 12: 3.23},
-        'Portalegre': {1: 3.83, 2: 4.61, 3: 5.0, 4: 5.31, 5: 5.73, 6: 5.93, 7: 6.39, 8: 6.3, 9: 5.6, 10: 4.54, 11: 3.76, 12: 3.54},
-        'Porto': {1: 3.37, 2: 4.31, 3: 4.71, 4: 5.34, 5: 5.74, 6: 5.77, 7: 6.08, 8: 5.96, 9: 5.51, 10: 4.24, 11: 3.4, 12: 3.18},
-        'Santarém': {1: 3.79, 2: 4.58, 3: 5.09, 4: 5.42, 5: 5.76, 6: 5.87, 7: 6.26, 8: 6.27, 9: 5.71, 10: 4.55, 11: 3.73, 12: 3.54},
-        'Setúbal': {1: 3.9, 2: 4.61, 3: 5.19, 4: 5.58, 5: 5.91, 6: 5.99, 7: 6.31, 8: 6.34, 9: 5.88, 10: 4.7, 11: 3.91, 12: 3.66},
-        'Viana do Castelo': {1: 3.17, 2: 4.15, 3: 4.62, 4: 5.32, 5: 5.71, 6: 5.81, 7: 6.11, 8: 5.96, 9: 5.47, 10: 4.1, 11: 3.28, 12: 2.95},
-        'Vila Real': {1: 3.07, 2: 4.13, 3: 4.66, 4: 5.03, 5: 5.59, 6: 5.76, 7: 6.32, 8: 6.21, 9: 5.57, 10: 4.11, 11: 3.1, 12: 2.76},
-        'Viseu': {1: 3.52, 2: 4.31, 3: 4.74, 4: 5.06, 5: 5.51, 6: 5.61, 7: 6.2, 8: 6.13, 9: 5.46, 10: 4.29, 11: 3.43, 12: 3.35},
-        'Açores (Ponta Delgada)': {1: 2.9, 2: 3.59, 3: 4.23, 4: 4.63, 5: 4.98, 6: 5.03, 7: 5.11, 8: 5.29, 9: 4.81, 10: 3.8, 11: 3.04, 12: 2.52},
-        'Madeira (Funchal)': {1: 3.74, 2: 4.08, 3: 4.8, 4: 4.79, 5: 4.87, 6: 4.64, 7: 5.2, 8: 5.32, 9: 4.48, 10: 4.18, 11: 3.66, 12: 3.49}
-    }
-    
-    COORDENADAS_DISTRITOS = {
-        'Guarda': (40.537, -7.268),
-        'Aveiro': (40.641, -8.654),
-        'Beja': (38.015, -7.863),
-        'Braga': (41.545, -8.427),
-        'Bragança': (41.806, -6.757),
-        'Castelo Branco': (39.822, -7.492),
-        'Coimbra': (40.212, -8.429),
-        'Évora': (38.567, -7.900),
-        'Faro': (37.019, -7.930),
-        'Leiria': (39.744, -8.807),
-        'Lisboa': (38.717, -9.140),
-        'Portalegre': (39.292, -7.429),
-        'Porto': (41.150, -8.611),
-        'Santarém': (39.236, -8.685),
-        'Setúbal': (38.526, -8.890),
-        'Viana do Castelo': (41.692, -8.835),
-        'Vila Real': (41.301, -7.749),
-        'Viseu': (40.657, -7.912),
-        'Açores': (37.741, -25.676),
-        'Madeira': (32.667, -16.924)
-    }
-
-    # Perfis horários por distrito PVGIS PVdata
-    PERFIS_HORARIOS_MENSAIS_POR_DISTRITO = {
-        'Aveiro': {
-            1: {8: 0.0032, 9: 0.0677, 10: 0.1121, 11: 0.1446, 12: 0.1616, 13: 0.1589, 14: 0.1434, 15: 0.1182, 16: 0.0777, 17: 0.0126},
-            2: {8: 0.0206, 9: 0.0703, 10: 0.1083, 11: 0.1357, 12: 0.1479, 13: 0.1497, 14: 0.1344, 15: 0.1152, 16: 0.0814, 17: 0.0364},
-            3: {7: 0.0035, 8: 0.0374, 9: 0.0761, 10: 0.1056, 11: 0.1263, 12: 0.1359, 13: 0.1418, 14: 0.1314, 15: 0.1118, 16: 0.0815, 17: 0.0432, 18: 0.0055},
-            4: {6: 0.0006, 7: 0.0150, 8: 0.0484, 9: 0.0807, 10: 0.1060, 11: 0.1221, 12: 0.1321, 13: 0.1337, 14: 0.1240, 15: 0.1064, 16: 0.0770, 17: 0.0433, 18: 0.0106, 19: 0.0001},
-            5: {6: 0.0044, 7: 0.0207, 8: 0.0512, 9: 0.0794, 10: 0.1016, 11: 0.1190, 12: 0.1302, 13: 0.1294, 14: 0.1209, 15: 0.1050, 16: 0.0782, 17: 0.0448, 18: 0.0133, 19: 0.0019},
-            6: {6: 0.0061, 7: 0.0207, 8: 0.0472, 9: 0.0743, 10: 0.0962, 11: 0.1156, 12: 0.1287, 13: 0.1304, 14: 0.1234, 15: 0.1072, 16: 0.0809, 17: 0.0477, 18: 0.0169, 19: 0.0045},
-            7: {6: 0.0041, 7: 0.0172, 8: 0.0429, 9: 0.0710, 10: 0.0939, 11: 0.1160, 12: 0.1296, 13: 0.1323, 14: 0.1261, 15: 0.1101, 16: 0.0842, 17: 0.0506, 18: 0.0178, 19: 0.0042},
-            8: {6: 0.0010, 7: 0.0142, 8: 0.0420, 9: 0.0714, 10: 0.0983, 11: 0.1202, 12: 0.1334, 13: 0.1365, 14: 0.1278, 15: 0.1096, 16: 0.0832, 17: 0.0476, 18: 0.0137, 19: 0.0011},
-            9: {7: 0.0121, 8: 0.0456, 9: 0.0770, 10: 0.1067, 11: 0.1276, 12: 0.1376, 13: 0.1402, 14: 0.1283, 15: 0.1080, 16: 0.0754, 17: 0.0372, 18: 0.0043},
-            10: {7: 0.0049, 8: 0.0468, 9: 0.0849, 10: 0.1193, 11: 0.1379, 12: 0.1458, 13: 0.1435, 14: 0.1262, 15: 0.1037, 16: 0.0669, 17: 0.0203},
-            11: {8: 0.0352, 9: 0.0859, 10: 0.1252, 11: 0.1508, 12: 0.1586, 13: 0.1541, 14: 0.1291, 15: 0.1032, 16: 0.0576, 17: 0.0005},
-            12: {8: 0.0065, 9: 0.0765, 10: 0.1232, 11: 0.1540, 12: 0.1677, 13: 0.1600, 14: 0.1394, 15: 0.1109, 16: 0.0617}
-        },
-        'Beja': {
-            1: {8: 0.0165, 9: 0.0739, 10: 0.1156, 11: 0.1404, 12: 0.1559, 13: 0.1518, 14: 0.1378, 15: 0.1136, 16: 0.0775, 17: 0.0172},
-            2: {8: 0.0281, 9: 0.0751, 10: 0.1121, 11: 0.1349, 12: 0.1415, 13: 0.1468, 14: 0.1341, 15: 0.1118, 16: 0.0789, 17: 0.0367},
-            3: {7: 0.0045, 8: 0.0407, 9: 0.0794, 10: 0.1091, 11: 0.1296, 12: 0.1357, 13: 0.1391, 14: 0.1263, 15: 0.1098, 16: 0.0797, 17: 0.0411, 18: 0.0050},
-            4: {6: 0.0006, 7: 0.0170, 8: 0.0534, 9: 0.0874, 10: 0.1096, 11: 0.1244, 12: 0.1319, 13: 0.1290, 14: 0.1196, 15: 0.1018, 16: 0.0748, 17: 0.0415, 18: 0.0090},
-            5: {6: 0.0044, 7: 0.0224, 8: 0.0570, 9: 0.0886, 10: 0.1073, 11: 0.1228, 12: 0.1298, 13: 0.1276, 14: 0.1149, 15: 0.0981, 16: 0.0730, 17: 0.0417, 18: 0.0113, 19: 0.0011},
-            6: {6: 0.0057, 7: 0.0214, 8: 0.0544, 9: 0.0837, 10: 0.1054, 11: 0.1193, 12: 0.1273, 13: 0.1262, 14: 0.1176, 15: 0.1013, 16: 0.0760, 17: 0.0448, 18: 0.0134, 19: 0.0035},
-            7: {6: 0.0038, 7: 0.0170, 8: 0.0493, 9: 0.0804, 10: 0.1047, 11: 0.1213, 12: 0.1299, 13: 0.1289, 14: 0.1202, 15: 0.1033, 16: 0.0781, 17: 0.0462, 18: 0.0137, 19: 0.0031},
-            8: {6: 0.0010, 7: 0.0152, 8: 0.0491, 9: 0.0816, 10: 0.1074, 11: 0.1238, 12: 0.1326, 13: 0.1311, 14: 0.1214, 15: 0.1035, 16: 0.0775, 17: 0.0441, 18: 0.0111, 19: 0.0006},
-            9: {7: 0.0147, 8: 0.0525, 9: 0.0858, 10: 0.1144, 11: 0.1303, 12: 0.1360, 13: 0.1353, 14: 0.1205, 15: 0.1016, 16: 0.0714, 17: 0.0343, 18: 0.0033},
-            10: {7: 0.0086, 8: 0.0537, 9: 0.0908, 10: 0.1221, 11: 0.1378, 12: 0.1426, 13: 0.1412, 14: 0.1238, 15: 0.0981, 16: 0.0624, 17: 0.0190},
-            11: {8: 0.0434, 9: 0.0912, 10: 0.1256, 11: 0.1518, 12: 0.1552, 13: 0.1479, 14: 0.1253, 15: 0.1003, 16: 0.0576, 17: 0.0016},
-            12: {8: 0.0219, 9: 0.0803, 10: 0.1199, 11: 0.1500, 12: 0.1581, 13: 0.1562, 14: 0.1364, 15: 0.1122, 16: 0.0650}
-        },
-        'Braga': {
-            1: {8: 0.0002, 9: 0.0705, 10: 0.1186, 11: 0.1497, 12: 0.1644, 13: 0.1509, 14: 0.1422, 15: 0.1171, 16: 0.0762, 17: 0.0102},
-            2: {8: 0.0191, 9: 0.0739, 10: 0.1133, 11: 0.1389, 12: 0.1459, 13: 0.1468, 14: 0.1315, 15: 0.1130, 16: 0.0809, 17: 0.0367},
-            3: {7: 0.0038, 8: 0.0406, 9: 0.0798, 10: 0.1107, 11: 0.1302, 12: 0.1363, 13: 0.1364, 14: 0.1245, 15: 0.1090, 16: 0.0807, 17: 0.0426, 18: 0.0055},
-            4: {6: 0.0008, 7: 0.0173, 8: 0.0528, 9: 0.0859, 10: 0.1079, 11: 0.1229, 12: 0.1315, 13: 0.1298, 14: 0.1171, 15: 0.1032, 16: 0.0767, 17: 0.0431, 18: 0.0109, 19: 0.0001},
-            5: {6: 0.0050, 7: 0.0230, 8: 0.0561, 9: 0.0851, 10: 0.1039, 11: 0.1196, 12: 0.1249, 13: 0.1250, 14: 0.1171, 15: 0.1023, 16: 0.0771, 17: 0.0451, 18: 0.0138, 19: 0.0021},
-            6: {6: 0.0067, 7: 0.0231, 8: 0.0530, 9: 0.0811, 10: 0.1011, 11: 0.1143, 12: 0.1236, 13: 0.1246, 14: 0.1185, 15: 0.1038, 16: 0.0794, 17: 0.0488, 18: 0.0171, 19: 0.0046},
-            7: {6: 0.0046, 7: 0.0187, 8: 0.0482, 9: 0.0764, 10: 0.0977, 11: 0.1156, 12: 0.1254, 13: 0.1265, 14: 0.1220, 15: 0.1078, 16: 0.0833, 17: 0.0513, 18: 0.0181, 19: 0.0043},
-            8: {6: 0.0013, 7: 0.0158, 8: 0.0472, 9: 0.0778, 10: 0.1025, 11: 0.1208, 12: 0.1296, 13: 0.1304, 14: 0.1224, 15: 0.1076, 16: 0.0817, 17: 0.0480, 18: 0.0137, 19: 0.0012},
-            9: {7: 0.0139, 8: 0.0512, 9: 0.0842, 10: 0.1116, 11: 0.1281, 12: 0.1340, 13: 0.1346, 14: 0.1223, 15: 0.1040, 16: 0.0749, 17: 0.0370, 18: 0.0043},
-            10: {7: 0.0044, 8: 0.0514, 9: 0.0897, 10: 0.1242, 11: 0.1385, 12: 0.1434, 13: 0.1418, 14: 0.1240, 15: 0.1006, 16: 0.0634, 17: 0.0188},
-            11: {8: 0.0315, 9: 0.0877, 10: 0.1316, 11: 0.1563, 12: 0.1593, 13: 0.1495, 14: 0.1266, 15: 0.1014, 16: 0.0560, 17: 0.0002},
-            12: {8: 0.0005, 9: 0.0782, 10: 0.1280, 11: 0.1573, 12: 0.1666, 13: 0.1603, 14: 0.1377, 15: 0.1112, 16: 0.0602}
-        },
-        'Bragança': {
-            1: {8: 0.0094, 9: 0.0730, 10: 0.1162, 11: 0.1449, 12: 0.1579, 13: 0.1598, 14: 0.1474, 15: 0.1185, 16: 0.0725, 17: 0.0005},
-            2: {8: 0.0286, 9: 0.0756, 10: 0.1140, 11: 0.1374, 12: 0.1440, 13: 0.1484, 14: 0.1348, 15: 0.1098, 16: 0.0774, 17: 0.0302},
-            3: {7: 0.0062, 8: 0.0446, 9: 0.0827, 10: 0.1120, 11: 0.1326, 12: 0.1373, 13: 0.1392, 14: 0.1241, 15: 0.1054, 16: 0.0762, 17: 0.0377, 18: 0.0021},
-            4: {6: 0.0013, 7: 0.0210, 8: 0.0565, 9: 0.0888, 10: 0.1115, 11: 0.1257, 12: 0.1302, 13: 0.1297, 14: 0.1198, 15: 0.0969, 16: 0.0720, 17: 0.0388, 18: 0.0078},
-            5: {6: 0.0056, 7: 0.0265, 8: 0.0606, 9: 0.0904, 10: 0.1100, 11: 0.1227, 12: 0.1288, 13: 0.1254, 14: 0.1116, 15: 0.0959, 16: 0.0706, 17: 0.0397, 18: 0.0107, 19: 0.0013},
-            6: {5: 0.0001, 6: 0.0070, 7: 0.0263, 8: 0.0594, 9: 0.0881, 10: 0.1077, 11: 0.1196, 12: 0.1255, 13: 0.1235, 14: 0.1133, 15: 0.0982, 16: 0.0726, 17: 0.0417, 18: 0.0134, 19: 0.0036},
-            7: {6: 0.0050, 7: 0.0216, 8: 0.0553, 9: 0.0850, 10: 0.1060, 11: 0.1212, 12: 0.1283, 13: 0.1262, 14: 0.1164, 15: 0.0999, 16: 0.0743, 17: 0.0439, 18: 0.0138, 19: 0.0032},
-            8: {6: 0.0020, 7: 0.0192, 8: 0.0542, 9: 0.0863, 10: 0.1092, 11: 0.1243, 12: 0.1302, 13: 0.1291, 14: 0.1188, 15: 0.1001, 16: 0.0742, 17: 0.0414, 18: 0.0103, 19: 0.0006},
-            9: {7: 0.0179, 8: 0.0563, 9: 0.0890, 10: 0.1165, 11: 0.1318, 12: 0.1362, 13: 0.1329, 14: 0.1182, 15: 0.0996, 16: 0.0682, 17: 0.0310, 18: 0.0024},
-            10: {7: 0.0100, 8: 0.0565, 9: 0.0922, 10: 0.1240, 11: 0.1377, 12: 0.1456, 13: 0.1420, 14: 0.1231, 15: 0.0984, 16: 0.0583, 17: 0.0121},
-            11: {8: 0.0432, 9: 0.0896, 10: 0.1246, 11: 0.1509, 12: 0.1569, 13: 0.1527, 14: 0.1295, 15: 0.1011, 16: 0.0515},
-            12: {8: 0.0126, 9: 0.0806, 10: 0.1185, 11: 0.1516, 12: 0.1632, 13: 0.1598, 14: 0.1416, 15: 0.1142, 16: 0.0578}
-        },
-        'Castelo Branco': {
-            1: {8: 0.0119, 9: 0.0741, 10: 0.1182, 11: 0.1431, 12: 0.1568, 13: 0.1523, 14: 0.1409, 15: 0.1164, 16: 0.0755, 17: 0.0107},
-            2: {8: 0.0273, 9: 0.0744, 10: 0.1099, 11: 0.1378, 12: 0.1447, 13: 0.1445, 14: 0.1342, 15: 0.1132, 16: 0.0794, 17: 0.0346},
-            3: {7: 0.0050, 8: 0.0417, 9: 0.0804, 10: 0.1118, 11: 0.1325, 12: 0.1377, 13: 0.1380, 14: 0.1257, 15: 0.1064, 16: 0.0773, 17: 0.0396, 18: 0.0038},
-            4: {6: 0.0008, 7: 0.0184, 8: 0.0550, 9: 0.0890, 10: 0.1121, 11: 0.1263, 12: 0.1304, 13: 0.1277, 14: 0.1172, 15: 0.1012, 16: 0.0729, 17: 0.0405, 18: 0.0086},
-            5: {6: 0.0048, 7: 0.0241, 8: 0.0595, 9: 0.0905, 10: 0.1116, 11: 0.1241, 12: 0.1273, 13: 0.1220, 14: 0.1136, 15: 0.0975, 16: 0.0716, 17: 0.0410, 18: 0.0112, 19: 0.0013},
-            6: {6: 0.0061, 7: 0.0230, 8: 0.0562, 9: 0.0856, 10: 0.1071, 11: 0.1209, 12: 0.1280, 13: 0.1245, 14: 0.1140, 15: 0.0987, 16: 0.0748, 17: 0.0438, 18: 0.0138, 19: 0.0035},
-            7: {6: 0.0043, 7: 0.0188, 8: 0.0525, 9: 0.0827, 10: 0.1058, 11: 0.1208, 12: 0.1280, 13: 0.1270, 14: 0.1184, 15: 0.1016, 16: 0.0770, 17: 0.0459, 18: 0.0141, 19: 0.0033},
-            8: {6: 0.0014, 7: 0.0168, 8: 0.0520, 9: 0.0844, 10: 0.1088, 11: 0.1241, 12: 0.1306, 13: 0.1296, 14: 0.1199, 15: 0.1021, 16: 0.0759, 17: 0.0430, 18: 0.0109, 19: 0.0007},
-            9: {7: 0.0158, 8: 0.0540, 9: 0.0880, 10: 0.1155, 11: 0.1300, 12: 0.1363, 13: 0.1335, 14: 0.1197, 15: 0.1002, 16: 0.0702, 17: 0.0338, 18: 0.0030},
-            10: {7: 0.0089, 8: 0.0547, 9: 0.0904, 10: 0.1220, 11: 0.1387, 12: 0.1427, 13: 0.1390, 14: 0.1245, 15: 0.0999, 16: 0.0620, 17: 0.0171},
-            11: {8: 0.0437, 9: 0.0912, 10: 0.1278, 11: 0.1493, 12: 0.1552, 13: 0.1481, 14: 0.1281, 15: 0.1009, 16: 0.0556, 17: 0.0002},
-            12: {8: 0.0195, 9: 0.0830, 10: 0.1237, 11: 0.1497, 12: 0.1587, 13: 0.1568, 14: 0.1389, 15: 0.1093, 16: 0.0604}
-        },
-        'Coimbra': {
-            1: {8: 0.0005, 9: 0.0122, 10: 0.1253, 11: 0.1549, 12: 0.1727, 13: 0.1655, 14: 0.1517, 15: 0.1214, 16: 0.0822, 17: 0.0135},
-            2: {8: 0.0047, 9: 0.0646, 10: 0.1153, 11: 0.1395, 12: 0.1526, 13: 0.1522, 14: 0.1361, 15: 0.1137, 16: 0.0832, 17: 0.0380},
-            3: {7: 0.0021, 8: 0.0322, 9: 0.0783, 10: 0.1100, 11: 0.1336, 12: 0.1370, 13: 0.1395, 14: 0.1279, 15: 0.1093, 16: 0.0811, 17: 0.0433, 18: 0.0057},
-            4: {6: 0.0006, 7: 0.0167, 8: 0.0530, 9: 0.0843, 10: 0.1084, 11: 0.1240, 12: 0.1305, 13: 0.1301, 14: 0.1193, 15: 0.1036, 16: 0.0757, 17: 0.0431, 18: 0.0108},
-            5: {6: 0.0049, 7: 0.0222, 8: 0.0537, 9: 0.0839, 10: 0.1041, 11: 0.1224, 12: 0.1286, 13: 0.1264, 14: 0.1166, 15: 0.1014, 16: 0.0757, 17: 0.0449, 18: 0.0132, 19: 0.0019},
-            6: {6: 0.0065, 7: 0.0222, 8: 0.0512, 9: 0.0792, 10: 0.0996, 11: 0.1164, 12: 0.1256, 13: 0.1261, 14: 0.1191, 15: 0.1031, 16: 0.0805, 17: 0.0489, 18: 0.0170, 19: 0.0045},
-            7: {6: 0.0043, 7: 0.0175, 8: 0.0446, 9: 0.0736, 10: 0.0978, 11: 0.1178, 12: 0.1296, 13: 0.1295, 14: 0.1230, 15: 0.1071, 16: 0.0830, 17: 0.0507, 18: 0.0173, 19: 0.0041},
-            8: {6: 0.0011, 7: 0.0147, 8: 0.0435, 9: 0.0747, 10: 0.1018, 11: 0.1217, 12: 0.1314, 13: 0.1327, 14: 0.1244, 15: 0.1093, 16: 0.0825, 17: 0.0478, 18: 0.0135, 19: 0.0010},
-            9: {7: 0.0102, 8: 0.0487, 9: 0.0815, 10: 0.1117, 11: 0.1295, 12: 0.1390, 13: 0.1361, 14: 0.1226, 15: 0.1044, 16: 0.0748, 17: 0.0373, 18: 0.0042},
-            10: {7: 0.0020, 8: 0.0356, 9: 0.0895, 10: 0.1262, 11: 0.1433, 12: 0.1490, 13: 0.1436, 14: 0.1254, 15: 0.1003, 16: 0.0651, 17: 0.0200},
-            11: {8: 0.0074, 9: 0.0786, 10: 0.1338, 11: 0.1588, 12: 0.1641, 13: 0.1602, 14: 0.1328, 15: 0.1042, 16: 0.0596, 17: 0.0004},
-            12: {8: 0.0010, 9: 0.0135, 10: 0.1365, 11: 0.1665, 12: 0.1773, 13: 0.1719, 14: 0.1472, 15: 0.1193, 16: 0.0668}
-        },
-        'Évora': {
-            1: {8: 0.0145, 9: 0.0729, 10: 0.1157, 11: 0.1426, 12: 0.1553, 13: 0.1506, 14: 0.1391, 15: 0.1173, 16: 0.0766, 17: 0.0153},
-            2: {8: 0.0267, 9: 0.0741, 10: 0.1127, 11: 0.1374, 12: 0.1440, 13: 0.1446, 14: 0.1321, 15: 0.1115, 16: 0.0797, 17: 0.0371},
-            3: {7: 0.0044, 8: 0.0406, 9: 0.0805, 10: 0.1101, 11: 0.1312, 12: 0.1375, 13: 0.1376, 14: 0.1265, 15: 0.1085, 16: 0.0769, 17: 0.0412, 18: 0.0048},
-            4: {6: 0.0006, 7: 0.0174, 8: 0.0544, 9: 0.0879, 10: 0.1112, 11: 0.1246, 12: 0.1306, 13: 0.1284, 14: 0.1177, 15: 0.1008, 16: 0.0751, 17: 0.0420, 18: 0.0093},
-            5: {6: 0.0045, 7: 0.0224, 8: 0.0571, 9: 0.0872, 10: 0.1078, 11: 0.1241, 12: 0.1289, 13: 0.1243, 14: 0.1150, 15: 0.1005, 16: 0.0733, 17: 0.0424, 18: 0.0115, 19: 0.0012},
-            6: {6: 0.0058, 7: 0.0217, 8: 0.0546, 9: 0.0831, 10: 0.1050, 11: 0.1195, 12: 0.1277, 13: 0.1264, 14: 0.1163, 15: 0.1002, 16: 0.0768, 17: 0.0452, 18: 0.0140, 19: 0.0036},
-            7: {6: 0.0039, 7: 0.0172, 8: 0.0491, 9: 0.0803, 10: 0.1043, 11: 0.1205, 12: 0.1290, 13: 0.1288, 14: 0.1206, 15: 0.1031, 16: 0.0789, 17: 0.0468, 18: 0.0142, 19: 0.0032},
-            8: {6: 0.0010, 7: 0.0154, 8: 0.0493, 9: 0.0822, 10: 0.1077, 11: 0.1243, 12: 0.1318, 13: 0.1302, 14: 0.1209, 15: 0.1033, 16: 0.0775, 17: 0.0445, 18: 0.0112, 19: 0.0006},
-            9: {7: 0.0145, 8: 0.0520, 9: 0.0867, 10: 0.1144, 11: 0.1302, 12: 0.1370, 13: 0.1341, 14: 0.1193, 15: 0.1020, 16: 0.0721, 17: 0.0344, 18: 0.0034},
-            10: {7: 0.0083, 8: 0.0529, 9: 0.0910, 10: 0.1226, 11: 0.1390, 12: 0.1432, 13: 0.1401, 14: 0.1221, 15: 0.0990, 16: 0.0628, 17: 0.0189},
-            11: {8: 0.0433, 9: 0.0908, 10: 0.1295, 11: 0.1493, 12: 0.1560, 13: 0.1496, 14: 0.1235, 15: 0.1000, 16: 0.0568, 17: 0.0011},
-            12: {8: 0.0200, 9: 0.0810, 10: 0.1238, 11: 0.1487, 12: 0.1603, 13: 0.1550, 14: 0.1356, 15: 0.1104, 16: 0.0652}
-        },
-        'Faro': {
-            1: {8: 0.0184, 9: 0.0738, 10: 0.1156, 11: 0.1449, 12: 0.1557, 13: 0.1475, 14: 0.1375, 15: 0.1123, 16: 0.0749, 17: 0.0194},
-            2: {8: 0.0271, 9: 0.0735, 10: 0.1100, 11: 0.1360, 12: 0.1442, 13: 0.1457, 14: 0.1350, 15: 0.1134, 16: 0.0786, 17: 0.0365},
-            3: {7: 0.0042, 8: 0.0401, 9: 0.0780, 10: 0.1077, 11: 0.1296, 12: 0.1359, 13: 0.1400, 14: 0.1294, 15: 0.1102, 16: 0.0785, 17: 0.0414, 18: 0.0049},
-            4: {6: 0.0004, 7: 0.0148, 8: 0.0491, 9: 0.0823, 10: 0.1071, 11: 0.1264, 12: 0.1333, 13: 0.1346, 14: 0.1223, 15: 0.1050, 16: 0.0761, 17: 0.0403, 18: 0.0083},
-            5: {6: 0.0037, 7: 0.0198, 8: 0.0531, 9: 0.0842, 10: 0.1059, 11: 0.1236, 12: 0.1315, 13: 0.1299, 14: 0.1210, 15: 0.1017, 16: 0.0743, 17: 0.0404, 18: 0.0102, 19: 0.0009,},
-            6: {6: 0.0049, 7: 0.0191, 8: 0.0513, 9: 0.0801, 10: 0.1037, 11: 0.1200, 12: 0.1300, 13: 0.1295, 14: 0.1210, 15: 0.1039, 16: 0.0769, 17: 0.0441, 18: 0.0125, 19: 0.0031},
-            7: {6: 0.0033, 7: 0.0154, 8: 0.0483, 9: 0.0790, 10: 0.1032, 11: 0.1199, 12: 0.1307, 13: 0.1305, 14: 0.1228, 15: 0.1056, 16: 0.0793, 17: 0.0460, 18: 0.0133, 19: 0.0028},
-            8: {6: 0.0008, 7: 0.0140, 8: 0.0477, 9: 0.0801, 10: 0.1052, 11: 0.1222, 12: 0.1326, 13: 0.1328, 14: 0.1236, 15: 0.1065, 16: 0.0791, 17: 0.0440, 18: 0.0108, 19: 0.0005},
-            9: {7: 0.0135, 8: 0.0498, 9: 0.0834, 10: 0.1096, 11: 0.1268, 12: 0.1377, 13: 0.1385, 14: 0.1238, 15: 0.1050, 16: 0.0733, 17: 0.0352, 18: 0.0033},
-            10: {7: 0.0083, 8: 0.0513, 9: 0.0892, 10: 0.1214, 11: 0.1359, 12: 0.1440, 13: 0.1414, 14: 0.1247, 15: 0.1001, 16: 0.0638, 17: 0.0198},
-            11: {8: 0.0434, 9: 0.0902, 10: 0.1275, 11: 0.1504, 12: 0.1548, 13: 0.1465, 14: 0.1262, 15: 0.1013, 16: 0.0570, 17: 0.0028},
-            12: {8: 0.0237, 9: 0.0829, 10: 0.1219, 11: 0.1484, 12: 0.1600, 13: 0.1566, 14: 0.1367, 15: 0.1073, 16: 0.0624, 17: 0.0001}
-        },
-        'Guarda': {
-            1: {8: 0.0100, 9: 0.0755, 10: 0.1165, 11: 0.1434, 12: 0.1616, 13: 0.1549, 14: 0.1424, 15: 0.1164, 16: 0.0744, 17: 0.0047},
-            2: {8: 0.0284, 9: 0.0774, 10: 0.1119, 11: 0.1361, 12: 0.1452, 13: 0.1455, 14: 0.1318, 15: 0.1117, 16: 0.0785, 17: 0.0335},
-            3: {7: 0.0054, 8: 0.0432, 9: 0.0818, 10: 0.1110, 11: 0.1328, 12: 0.1367, 13: 0.1376, 14: 0.1265, 15: 0.1057, 16: 0.0774, 17: 0.0395, 18: 0.0025},
-            4: {6: 0.0010, 7: 0.0192, 8: 0.0558, 9: 0.0879, 10: 0.1112, 11: 0.1276, 12: 0.1320, 13: 0.1276, 14: 0.1148, 15: 0.1008, 16: 0.0734, 17: 0.0403, 18: 0.0085},
-            5: {6: 0.0052, 7: 0.0256, 8: 0.0597, 9: 0.0905, 10: 0.1098, 11: 0.1234, 12: 0.1281, 13: 0.1230, 14: 0.1134, 15: 0.0969, 16: 0.0709, 17: 0.0407, 18: 0.0114, 19: 0.0013},
-            6: {6: 0.0065, 7: 0.0244, 8: 0.0569, 9: 0.0862, 10: 0.1071, 11: 0.1204, 12: 0.1264, 13: 0.1238, 14: 0.1153, 15: 0.0972, 16: 0.0740, 17: 0.0441, 18: 0.0140, 19: 0.0037},
-            7: {6: 0.0045, 7: 0.0197, 8: 0.0532, 9: 0.0835, 10: 0.1066, 11: 0.1218, 12: 0.1298, 13: 0.1258, 14: 0.1162, 15: 0.1010, 16: 0.0756, 17: 0.0449, 18: 0.0141, 19: 0.0033},
-            8: {6: 0.0016, 7: 0.0175, 8: 0.0526, 9: 0.0850, 10: 0.1098, 11: 0.1257, 12: 0.1315, 13: 0.1281, 14: 0.1182, 15: 0.1015, 16: 0.0749, 17: 0.0423, 18: 0.0107, 19: 0.0007},
-            9: {7: 0.0167, 8: 0.0557, 9: 0.0903, 10: 0.1158, 11: 0.1324, 12: 0.1378, 13: 0.1330, 14: 0.1167, 15: 0.0973, 16: 0.0689, 17: 0.0327, 18: 0.0027},
-            10: {7: 0.0093, 8: 0.0551, 9: 0.0907, 10: 0.1242, 11: 0.1394, 12: 0.1452, 13: 0.1408, 14: 0.1209, 15: 0.0990, 16: 0.0612, 17: 0.0142},
-            11: {8: 0.0436, 9: 0.0895, 10: 0.1258, 11: 0.1494, 12: 0.1569, 13: 0.1494, 14: 0.1282, 15: 0.1021, 16: 0.0552, 17: 0.0001},
-            12: {8: 0.0150, 9: 0.0803, 10: 0.1234, 11: 0.1509, 12: 0.1625, 13: 0.1576, 14: 0.1389, 15: 0.1113, 16: 0.0599}
-        },
-        'Leiria': {
-            1: {8: 0.0004, 9: 0.0714, 10: 0.1179, 11: 0.1492, 12: 0.1617, 13: 0.1529, 14: 0.1410, 15: 0.1180, 16: 0.0798, 17: 0.0076},
-            2: {8: 0.0212, 9: 0.0716, 10: 0.1107, 11: 0.1373, 12: 0.1472, 13: 0.1495, 14: 0.1327, 15: 0.1108, 16: 0.0797, 17: 0.0393},
-            3: {7: 0.0029, 8: 0.0372, 9: 0.0756, 10: 0.1060, 11: 0.1294, 12: 0.1365, 13: 0.1419, 14: 0.1272, 15: 0.1105, 16: 0.0827, 17: 0.0442, 18: 0.0059},
-            4: {6: 0.0005, 7: 0.0154, 8: 0.0497, 9: 0.0810, 10: 0.1046, 11: 0.1230, 12: 0.1302, 13: 0.1324, 14: 0.1230, 15: 0.1053, 16: 0.0777, 17: 0.0456, 18: 0.0114, 19: 0.0001},
-            5: {6: 0.0043, 7: 0.0207, 8: 0.0515, 9: 0.0820, 10: 0.1032, 11: 0.1202, 12: 0.1284, 13: 0.1274, 14: 0.1190, 15: 0.1027, 16: 0.0790, 17: 0.0458, 18: 0.0140, 19: 0.0019},
-            6: {6: 0.0060, 7: 0.0209, 8: 0.0483, 9: 0.0756, 10: 0.0975, 11: 0.1150, 12: 0.1277, 13: 0.1267, 14: 0.1214, 15: 0.1082, 16: 0.0820, 17: 0.0491, 18: 0.0174, 19: 0.0044},
-            7: {6: 0.0039, 7: 0.0165, 8: 0.0424, 9: 0.0704, 10: 0.0950, 11: 0.1160, 12: 0.1289, 13: 0.1320, 14: 0.1257, 15: 0.1105, 16: 0.0854, 17: 0.0515, 18: 0.0177, 19: 0.0041},
-            8: {6: 0.0008, 7: 0.0136, 8: 0.0414, 9: 0.0728, 10: 0.0996, 11: 0.1212, 12: 0.1317, 13: 0.1357, 14: 0.1269, 15: 0.1104, 16: 0.0828, 17: 0.0482, 18: 0.0138, 19: 0.0011},
-            9: {7: 0.0117, 8: 0.0450, 9: 0.0781, 10: 0.1089, 11: 0.1284, 12: 0.1380, 13: 0.1366, 14: 0.1245, 15: 0.1081, 16: 0.0774, 17: 0.0387, 18: 0.0046},
-            10: {7: 0.0044, 8: 0.0483, 9: 0.0858, 10: 0.1218, 11: 0.1383, 12: 0.1441, 13: 0.1414, 14: 0.1235, 15: 0.1040, 16: 0.0664, 17: 0.0218},
-            11: {8: 0.0327, 9: 0.0882, 10: 0.1293, 11: 0.1562, 12: 0.1571, 13: 0.1505, 14: 0.1265, 15: 0.0999, 16: 0.0592, 17: 0.0003},
-            12: {8: 0.0010, 9: 0.0777, 10: 0.1250, 11: 0.1547, 12: 0.1678, 13: 0.1585, 14: 0.1391, 15: 0.1112, 16: 0.0650}
-        },
-        'Lisboa': {
-            1: {8: 0.0006, 9: 0.0316, 10: 0.1197, 11: 0.1465, 12: 0.1645, 13: 0.1617, 14: 0.1529, 15: 0.1290, 16: 0.0887, 17: 0.0048},
-            2: {8: 0.0046, 9: 0.0700, 10: 0.1085, 11: 0.1340, 12: 0.1429, 13: 0.1493, 14: 0.1405, 15: 0.1225, 16: 0.0866, 17: 0.0410, 18: 0.0001},
-            3: {7: 0.0016, 8: 0.0327, 9: 0.0752, 10: 0.1055, 11: 0.1284, 12: 0.1370, 13: 0.1415, 14: 0.1315, 15: 0.1127, 16: 0.0838, 17: 0.0453, 18: 0.0047},
-            4: {6: 0.0003, 7: 0.0117, 8: 0.0490, 9: 0.0808, 10: 0.1058, 11: 0.1209, 12: 0.1294, 13: 0.1323, 14: 0.1245, 15: 0.1080, 16: 0.0802, 17: 0.0457, 18: 0.0113},
-            5: {6: 0.0036, 7: 0.0191, 8: 0.0515, 9: 0.0813, 10: 0.1020, 11: 0.1198, 12: 0.1284, 13: 0.1295, 14: 0.1215, 15: 0.1048, 16: 0.0783, 17: 0.0452, 18: 0.0134, 19: 0.0017},
-            6: {6: 0.0050, 7: 0.0189, 8: 0.0497, 9: 0.0768, 10: 0.0998, 11: 0.1167, 12: 0.1272, 13: 0.1278, 14: 0.1218, 15: 0.1064, 16: 0.0808, 17: 0.0488, 18: 0.0162, 19: 0.0042},
-            7: {6: 0.0032, 7: 0.0148, 8: 0.0450, 9: 0.0744, 10: 0.0995, 11: 0.1177, 12: 0.1284, 13: 0.1300, 14: 0.1241, 15: 0.1087, 16: 0.0832, 17: 0.0505, 18: 0.0168, 19: 0.0038},
-            8: {6: 0.0006, 7: 0.0117, 8: 0.0451, 9: 0.0766, 10: 0.1019, 11: 0.1212, 12: 0.1316, 13: 0.1330, 14: 0.1253, 15: 0.1088, 16: 0.0820, 17: 0.0477, 18: 0.0135, 19: 0.0010},
-            9: {7: 0.0051, 8: 0.0472, 9: 0.0826, 10: 0.1093, 11: 0.1272, 12: 0.1365, 13: 0.1389, 14: 0.1268, 15: 0.1075, 16: 0.0760, 17: 0.0385, 18: 0.0044},
-            10: {7: 0.0016, 8: 0.0423, 9: 0.0886, 10: 0.1184, 11: 0.1389, 12: 0.1436, 13: 0.1458, 14: 0.1282, 15: 0.1058, 16: 0.0679, 17: 0.0188},
-            11: {8: 0.0070, 9: 0.0887, 10: 0.1293, 11: 0.1517, 12: 0.1599, 13: 0.1538, 14: 0.1348, 15: 0.1100, 16: 0.0641, 17: 0.0006},
-            12: {8: 0.0012, 9: 0.0362, 10: 0.1257, 11: 0.1570, 12: 0.1718, 13: 0.1681, 14: 0.1489, 15: 0.1200, 16: 0.0708, 17: 0.0001}
-        },
-        'Portalegre': {
-            1: {8: 0.0020, 9: 0.0768, 10: 0.1194, 11: 0.1465, 12: 0.1592, 13: 0.1529, 14: 0.1403, 15: 0.1146, 16: 0.0757, 17: 0.0126},
-            2: {8: 0.0286, 9: 0.0752, 10: 0.1119, 11: 0.1356, 12: 0.1450, 13: 0.1449, 14: 0.1328, 15: 0.1116, 16: 0.0797, 17: 0.0348},
-            3: {7: 0.0038, 8: 0.0417, 9: 0.0811, 10: 0.1113, 11: 0.1297, 12: 0.1377, 13: 0.1385, 14: 0.1266, 15: 0.1067, 16: 0.0790, 17: 0.0399, 18: 0.0041},
-            4: {6: 0.0008, 7: 0.0185, 8: 0.0543, 9: 0.0876, 10: 0.1105, 11: 0.1259, 12: 0.1298, 13: 0.1291, 14: 0.1170, 15: 0.1014, 16: 0.0754, 17: 0.0408, 18: 0.0087},
-            5: {6: 0.0048, 7: 0.0240, 8: 0.0587, 9: 0.0891, 10: 0.1090, 11: 0.1223, 12: 0.1292, 13: 0.1253, 14: 0.1136, 15: 0.0985, 16: 0.0727, 17: 0.0409, 18: 0.0108, 19: 0.0012},
-            6: {6: 0.0062, 7: 0.0229, 8: 0.0553, 9: 0.0850, 10: 0.1063, 11: 0.1199, 12: 0.1275, 13: 0.1250, 14: 0.1152, 15: 0.1002, 16: 0.0756, 17: 0.0439, 18: 0.0136, 19: 0.0034},
-            7: {6: 0.0042, 7: 0.0184, 8: 0.0514, 9: 0.0818, 10: 0.1056, 11: 0.1207, 12: 0.1291, 13: 0.1282, 14: 0.1194, 15: 0.1020, 16: 0.0770, 17: 0.0455, 18: 0.0136, 19: 0.0030},
-            8: {6: 0.0013, 7: 0.0165, 8: 0.0510, 9: 0.0838, 10: 0.1086, 11: 0.1246, 12: 0.1315, 13: 0.1303, 14: 0.1198, 15: 0.1023, 16: 0.0760, 17: 0.0431, 18: 0.0106, 19: 0.0006},
-            9: {7: 0.0161, 8: 0.0543, 9: 0.0891, 10: 0.1155, 11: 0.1295, 12: 0.1354, 13: 0.1327, 14: 0.1185, 15: 0.1003, 16: 0.0714, 17: 0.0343, 18: 0.0030},
-            10: {7: 0.0076, 8: 0.0552, 9: 0.0914, 10: 0.1244, 11: 0.1389, 12: 0.1434, 13: 0.1388, 14: 0.1217, 15: 0.0978, 16: 0.0626, 17: 0.0180},
-            11: {8: 0.0454, 9: 0.0915, 10: 0.1282, 11: 0.1522, 12: 0.1557, 13: 0.1464, 14: 0.1246, 15: 0.0995, 16: 0.0562, 17: 0.0003},
-            12: {8: 0.0120, 9: 0.0856, 10: 0.1254, 11: 0.1535, 12: 0.1631, 13: 0.1565, 14: 0.1368, 15: 0.1068, 16: 0.0603}
-        },
-        'Porto': {
-            1: {8: 0.0021, 9: 0.0677, 10: 0.1154, 11: 0.1460, 12: 0.1668, 13: 0.1576, 14: 0.1439, 15: 0.1180, 16: 0.0775, 17: 0.0050},
-            2: {8: 0.0206, 9: 0.0707, 10: 0.1095, 11: 0.1378, 12: 0.1482, 13: 0.1465, 14: 0.1347, 15: 0.1130, 16: 0.0821, 17: 0.0369},
-            3: {7: 0.0035, 8: 0.0380, 9: 0.0769, 10: 0.1066, 11: 0.1309, 12: 0.1366, 13: 0.1407, 14: 0.1285, 15: 0.1105, 16: 0.0808, 17: 0.0423, 18: 0.0046},
-            4: {6: 0.0006, 7: 0.0152, 8: 0.0488, 9: 0.0802, 10: 0.1039, 11: 0.1229, 12: 0.1335, 13: 0.1352, 14: 0.1236, 15: 0.1057, 16: 0.0772, 17: 0.0427, 18: 0.0105, 19: 0.0001},
-            5: {6: 0.0044, 7: 0.0208, 8: 0.0514, 9: 0.0800, 10: 0.1006, 11: 0.1194, 12: 0.1295, 13: 0.1312, 14: 0.1220, 15: 0.1032, 16: 0.0775, 17: 0.0445, 18: 0.0134, 19: 0.0020},
-            6: {6: 0.0061, 7: 0.0214, 8: 0.0493, 9: 0.0767, 10: 0.0973, 11: 0.1160, 12: 0.1282, 13: 0.1307, 14: 0.1217, 15: 0.1055, 16: 0.0788, 17: 0.0473, 18: 0.0165, 19: 0.0044},
-            7: {6: 0.0043, 7: 0.0175, 8: 0.0457, 9: 0.0733, 10: 0.0956, 11: 0.1151, 12: 0.1279, 13: 0.1315, 14: 0.1247, 15: 0.1089, 16: 0.0832, 17: 0.0504, 18: 0.0178, 19: 0.0043},
-            8: {6: 0.0011, 7: 0.0147, 8: 0.0446, 9: 0.0749, 10: 0.0996, 11: 0.1198, 12: 0.1316, 13: 0.1339, 14: 0.1265, 15: 0.1087, 16: 0.0820, 17: 0.0475, 18: 0.0138, 19: 0.0012},
-            9: {7: 0.0124, 8: 0.0479, 9: 0.0813, 10: 0.1093, 11: 0.1276, 12: 0.1369, 13: 0.1378, 14: 0.1248, 15: 0.1062, 16: 0.0747, 17: 0.0370, 18: 0.0041},
-            10: {7: 0.0051, 8: 0.0479, 9: 0.0863, 10: 0.1213, 11: 0.1393, 12: 0.1462, 13: 0.1440, 14: 0.1265, 15: 0.1011, 16: 0.0647, 17: 0.0174},
-            11: {8: 0.0326, 9: 0.0838, 10: 0.1271, 11: 0.1553, 12: 0.1577, 13: 0.1527, 14: 0.1306, 15: 0.1036, 16: 0.0564, 17: 0.0002},
-            12: {8: 0.0053, 9: 0.0760, 10: 0.1244, 11: 0.1557, 12: 0.1683, 13: 0.1633, 14: 0.1374, 15: 0.1102, 16: 0.0594}
-        },
-        'Santarém': {
-            1: {8: 0.0061, 9: 0.0695, 10: 0.1149, 11: 0.1420, 12: 0.1584, 13: 0.1541, 14: 0.1415, 15: 0.1171, 16: 0.0793, 17: 0.0172},
-            2: {8: 0.0233, 9: 0.0712, 10: 0.1091, 11: 0.1348, 12: 0.1454, 13: 0.1473, 14: 0.1354, 15: 0.1130, 16: 0.0816, 17: 0.0387, 18: 0.0001},
-            3: {7: 0.0034, 8: 0.0378, 9: 0.0771, 10: 0.1081, 11: 0.1287, 12: 0.1340, 13: 0.1408, 14: 0.1307, 15: 0.1085, 16: 0.0813, 17: 0.0436, 18: 0.0061},
-            4: {6: 0.0005, 7: 0.0157, 8: 0.0525, 9: 0.0858, 10: 0.1078, 11: 0.1229, 12: 0.1296, 13: 0.1303, 14: 0.1202, 15: 0.1030, 16: 0.0774, 17: 0.0438, 18: 0.0106},
-            5: {6: 0.0042, 7: 0.0211, 8: 0.0553, 9: 0.0846, 10: 0.1042, 11: 0.1201, 12: 0.1276, 13: 0.1260, 14: 0.1181, 15: 0.1023, 16: 0.0774, 17: 0.0447, 18: 0.0128, 19: 0.0017},
-            6: {6: 0.0056, 7: 0.0208, 8: 0.0525, 9: 0.0813, 10: 0.1013, 11: 0.1169, 12: 0.1260, 13: 0.1267, 14: 0.1189, 15: 0.1034, 16: 0.0791, 17: 0.0475, 18: 0.0158, 19: 0.0042},
-            7: {6: 0.0037, 7: 0.0163, 8: 0.0477, 9: 0.0764, 10: 0.0990, 11: 0.1175, 12: 0.1282, 13: 0.1292, 14: 0.1224, 15: 0.1072, 16: 0.0823, 17: 0.0498, 18: 0.0164, 19: 0.0038},
-            8: {6: 0.0008, 7: 0.0141, 8: 0.0472, 9: 0.0792, 10: 0.1039, 11: 0.1224, 12: 0.1311, 13: 0.1311, 14: 0.1221, 15: 0.1065, 16: 0.0807, 17: 0.0469, 18: 0.0129, 19: 0.0010},
-            9: {7: 0.0126, 8: 0.0495, 9: 0.0833, 10: 0.1118, 11: 0.1280, 12: 0.1371, 13: 0.1364, 14: 0.1209, 15: 0.1041, 16: 0.0747, 17: 0.0373, 18: 0.0043},
-            10: {7: 0.0057, 8: 0.0495, 9: 0.0858, 10: 0.1205, 11: 0.1391, 12: 0.1414, 13: 0.1433, 14: 0.1253, 15: 0.1035, 16: 0.0649, 17: 0.0210},
-            11: {8: 0.0372, 9: 0.0876, 10: 0.1255, 11: 0.1532, 12: 0.1600, 13: 0.1478, 14: 0.1269, 15: 0.1011, 16: 0.0590, 17: 0.0018},
-            12: {8: 0.0114, 9: 0.0790, 10: 0.1204, 11: 0.1504, 12: 0.1613, 13: 0.1603, 14: 0.1408, 15: 0.1116, 16: 0.0648}
-        },
-        'Setúbal': {
-            1: {8: 0.0047, 9: 0.0708, 10: 0.1141, 11: 0.1425, 12: 0.1550, 13: 0.1532, 14: 0.1408, 15: 0.1197, 16: 0.0796, 17: 0.0196},
-            2: {8: 0.0231, 9: 0.0712, 10: 0.1080, 11: 0.1336, 12: 0.1444, 13: 0.1484, 14: 0.1349, 15: 0.1149, 16: 0.0827, 17: 0.0388, 18: 0.0001},
-            3: {7: 0.0030, 8: 0.0365, 9: 0.0746, 10: 0.1058, 11: 0.1283, 12: 0.1381, 13: 0.1420, 14: 0.1311, 15: 0.1103, 16: 0.0808, 17: 0.0432, 18: 0.0064},
-            4: {6: 0.0004, 7: 0.0142, 8: 0.0490, 9: 0.0827, 10: 0.1043, 11: 0.1219, 12: 0.1307, 13: 0.1326, 14: 0.1214, 15: 0.1062, 16: 0.0810, 17: 0.0452, 18: 0.0105},
-            5: {6: 0.0036, 7: 0.0197, 8: 0.0530, 9: 0.0817, 10: 0.1011, 11: 0.1203, 12: 0.1302, 13: 0.1292, 14: 0.1199, 15: 0.1045, 16: 0.0780, 17: 0.0445, 18: 0.0127, 19: 0.0016},
-            6: {6: 0.0050, 7: 0.0190, 8: 0.0492, 9: 0.0786, 10: 0.1003, 11: 0.1176, 12: 0.1280, 13: 0.1272, 14: 0.1212, 15: 0.1060, 16: 0.0806, 17: 0.0479, 18: 0.0155, 19: 0.0040},
-            7: {6: 0.0032, 7: 0.0151, 8: 0.0451, 9: 0.0747, 10: 0.0985, 11: 0.1183, 12: 0.1291, 13: 0.1311, 14: 0.1244, 15: 0.1083, 16: 0.0825, 17: 0.0500, 18: 0.0161, 19: 0.0036},
-            8: {6: 0.0007, 7: 0.0130, 8: 0.0450, 9: 0.0766, 10: 0.1021, 11: 0.1216, 12: 0.1321, 13: 0.1335, 14: 0.1249, 15: 0.1078, 16: 0.0816, 17: 0.0473, 18: 0.0130, 19: 0.0009},
-            9: {7: 0.0116, 8: 0.0465, 9: 0.0815, 10: 0.1082, 11: 0.1257, 12: 0.1365, 13: 0.1391, 14: 0.1257, 15: 0.1074, 16: 0.0761, 17: 0.0372, 18: 0.0044},
-            10: {7: 0.0051, 8: 0.0477, 9: 0.0864, 10: 0.1188, 11: 0.1379, 12: 0.1445, 13: 0.1409, 14: 0.1282, 15: 0.1030, 16: 0.0655, 17: 0.0217},
-            11: {8: 0.0387, 9: 0.0859, 10: 0.1258, 11: 0.1507, 12: 0.1552, 13: 0.1502, 14: 0.1301, 15: 0.1018, 16: 0.0590, 17: 0.0026},
-            12: {8: 0.0103, 9: 0.0762, 10: 0.1206, 11: 0.1526, 12: 0.1617, 13: 0.1601, 14: 0.1398, 15: 0.1137, 16: 0.0649, 17: 0.0001}
-        },
-        'Viana do Castelo': {
-            1: {8: 0.0004, 9: 0.0672, 10: 0.1149, 11: 0.1444, 12: 0.1603, 13: 0.1568, 14: 0.1458, 15: 0.1193, 16: 0.0797, 17: 0.0110},
-            2: {8: 0.0199, 9: 0.0697, 10: 0.1085, 11: 0.1356, 12: 0.1433, 13: 0.1511, 14: 0.1370, 15: 0.1164, 16: 0.0811, 17: 0.0374},
-            3: {7: 0.0032, 8: 0.0369, 9: 0.0768, 10: 0.1057, 11: 0.1282, 12: 0.1360, 13: 0.1391, 14: 0.1311, 15: 0.1121, 16: 0.0817, 17: 0.0434, 18: 0.0059},
-            4: {6: 0.0006, 7: 0.0151, 8: 0.0485, 9: 0.0789, 10: 0.1021, 11: 0.1234, 12: 0.1334, 13: 0.1346, 14: 0.1231, 15: 0.1068, 16: 0.0789, 17: 0.0437, 18: 0.0109, 19: 0.0001},
-            5: {6: 0.0043, 7: 0.0209, 8: 0.0519, 9: 0.0796, 10: 0.1003, 11: 0.1185, 12: 0.1300, 13: 0.1300, 14: 0.1221, 15: 0.1045, 16: 0.0771, 17: 0.0448, 18: 0.0138, 19: 0.0022},
-            6: {6: 0.0060, 7: 0.0210, 8: 0.0498, 9: 0.0771, 10: 0.0971, 11: 0.1162, 12: 0.1272, 13: 0.1299, 14: 0.1215, 15: 0.1051, 16: 0.0798, 17: 0.0476, 18: 0.0170, 19: 0.0045},
-            7: {6: 0.0042, 7: 0.0171, 8: 0.0454, 9: 0.0727, 10: 0.0947, 11: 0.1154, 12: 0.1283, 13: 0.1301, 14: 0.1249, 15: 0.1092, 16: 0.0841, 17: 0.0513, 18: 0.0183, 19: 0.0043},
-            8: {6: 0.0011, 7: 0.0145, 8: 0.0446, 9: 0.0739, 10: 0.0981, 11: 0.1193, 12: 0.1325, 13: 0.1343, 14: 0.1262, 15: 0.1090, 16: 0.0825, 17: 0.0484, 18: 0.0142, 19: 0.0013},
-            9: {7: 0.0122, 8: 0.0473, 9: 0.0800, 10: 0.1076, 11: 0.1260, 12: 0.1371, 13: 0.1379, 14: 0.1260, 15: 0.1082, 16: 0.0759, 17: 0.0372, 18: 0.0046},
-            10: {7: 0.0047, 8: 0.0472, 9: 0.0842, 10: 0.1195, 11: 0.1354, 12: 0.1484, 13: 0.1435, 14: 0.1265, 15: 0.1047, 16: 0.0665, 17: 0.0193},
-            11: {8: 0.0317, 9: 0.0841, 10: 0.1269, 11: 0.1557, 12: 0.1576, 13: 0.1543, 14: 0.1303, 15: 0.1030, 16: 0.0560, 17: 0.0003},
-            12: {8: 0.0041, 9: 0.0748, 10: 0.1239, 11: 0.1558, 12: 0.1670, 13: 0.1623, 14: 0.1399, 15: 0.1112, 16: 0.0609}
-        },
-        'Vila Real': {
-            1: {8: 0.0004, 9: 0.0732, 10: 0.1189, 11: 0.1453, 12: 0.1616, 13: 0.1572, 14: 0.1407, 15: 0.1193, 16: 0.0782, 17: 0.0051},
-            2: {8: 0.0194, 9: 0.0752, 10: 0.1128, 11: 0.1394, 12: 0.1420, 13: 0.1488, 14: 0.1358, 15: 0.1125, 16: 0.0797, 17: 0.0345},
-            3: {7: 0.0038, 8: 0.0419, 9: 0.0816, 10: 0.1119, 11: 0.1319, 12: 0.1345, 13: 0.1389, 14: 0.1247, 15: 0.1083, 16: 0.0780, 17: 0.0406, 18: 0.0039},
-            4: {6: 0.0010, 7: 0.0191, 8: 0.0554, 9: 0.0874, 10: 0.1100, 11: 0.1282, 12: 0.1314, 13: 0.1307, 14: 0.1141, 15: 0.0988, 16: 0.0731, 17: 0.0411, 18: 0.0096},
-            5: {6: 0.0051, 7: 0.0251, 8: 0.0600, 9: 0.0895, 10: 0.1081, 11: 0.1222, 12: 0.1268, 13: 0.1231, 14: 0.1138, 15: 0.0967, 16: 0.0734, 17: 0.0424, 18: 0.0123, 19: 0.0016},
-            6: {6: 0.0066, 7: 0.0245, 8: 0.0565, 9: 0.0849, 10: 0.1047, 11: 0.1198, 12: 0.1267, 13: 0.1238, 14: 0.1143, 15: 0.0996, 16: 0.0746, 17: 0.0447, 18: 0.0153, 19: 0.0040},
-            7: {6: 0.0045, 7: 0.0196, 8: 0.0530, 9: 0.0820, 10: 0.1049, 11: 0.1195, 12: 0.1269, 13: 0.1259, 14: 0.1174, 15: 0.1022, 16: 0.0778, 17: 0.0472, 18: 0.0156, 19: 0.0036},
-            8: {6: 0.0015, 7: 0.0171, 8: 0.0521, 9: 0.0841, 10: 0.1075, 11: 0.1241, 12: 0.1304, 13: 0.1295, 14: 0.1181, 15: 0.1017, 16: 0.0769, 17: 0.0443, 18: 0.0119, 19: 0.0009},
-            9: {7: 0.0157, 8: 0.0535, 9: 0.0875, 10: 0.1154, 11: 0.1314, 12: 0.1383, 13: 0.1339, 14: 0.1187, 15: 0.0992, 16: 0.0689, 17: 0.0341, 18: 0.0032},
-            10: {7: 0.0040, 8: 0.0547, 9: 0.0919, 10: 0.1242, 11: 0.1408, 12: 0.1464, 13: 0.1394, 14: 0.1220, 15: 0.0978, 16: 0.0620, 17: 0.0168},
-            11: {8: 0.0342, 9: 0.0934, 10: 0.1291, 11: 0.1533, 12: 0.1577, 13: 0.1488, 14: 0.1265, 15: 0.1010, 16: 0.0560, 17: 0.0001},
-            12: {8: 0.0009, 9: 0.0785, 10: 0.1228, 11: 0.1526, 12: 0.1643, 13: 0.1610, 14: 0.1410, 15: 0.1158, 16: 0.0632}
-        },
-        'Viseu': {
-            1: {8: 0.0072, 9: 0.0737, 10: 0.1186, 11: 0.1445, 12: 0.1604, 13: 0.1554, 14: 0.1405, 15: 0.1136, 16: 0.0760, 17: 0.0102},
-            2: {8: 0.0254, 9: 0.0746, 10: 0.1117, 11: 0.1375, 12: 0.1458, 13: 0.1471, 14: 0.1333, 15: 0.1111, 16: 0.0784, 17: 0.0350},
-            3: {7: 0.0045, 8: 0.0408, 9: 0.0804, 10: 0.1101, 11: 0.1302, 12: 0.1369, 13: 0.1377, 14: 0.1247, 15: 0.1100, 16: 0.0791, 17: 0.0410, 18: 0.0047},
-            4: {6: 0.0008, 7: 0.0180, 8: 0.0537, 9: 0.0851, 10: 0.1110, 11: 0.1274, 12: 0.1329, 13: 0.1289, 14: 0.1162, 15: 0.1005, 16: 0.0748, 17: 0.0411, 18: 0.0096},
-            5: {6: 0.0050, 7: 0.0237, 8: 0.0575, 9: 0.0876, 10: 0.1078, 11: 0.1237, 12: 0.1289, 13: 0.1248, 14: 0.1129, 15: 0.0976, 16: 0.0736, 17: 0.0429, 18: 0.0124, 19: 0.0017},
-            6: {6: 0.0064, 7: 0.0230, 8: 0.0535, 9: 0.0821, 10: 0.1027, 11: 0.1184, 12: 0.1271, 13: 0.1253, 14: 0.1167, 15: 0.1016, 16: 0.0770, 17: 0.0464, 18: 0.0157, 19: 0.0041},
-            7: {6: 0.0044, 7: 0.0185, 8: 0.0491, 9: 0.0792, 10: 0.1021, 11: 0.1199, 12: 0.1293, 13: 0.1284, 14: 0.1194, 15: 0.1033, 16: 0.0789, 17: 0.0480, 18: 0.0157, 19: 0.0037},
-            8: {6: 0.0013, 7: 0.0160, 8: 0.0486, 9: 0.0813, 10: 0.1064, 11: 0.1236, 12: 0.1317, 13: 0.1311, 14: 0.1211, 15: 0.1036, 16: 0.0774, 17: 0.0451, 18: 0.0121, 19: 0.0009},
-            9: {7: 0.0148, 8: 0.0528, 9: 0.0871, 10: 0.1138, 11: 0.1310, 12: 0.1378, 13: 0.1343, 14: 0.1199, 15: 0.0993, 16: 0.0712, 17: 0.0346, 18: 0.0035},
-            10: {7: 0.0073, 8: 0.0539, 9: 0.0918, 10: 0.1226, 11: 0.1399, 12: 0.1443, 13: 0.1391, 14: 0.1225, 15: 0.0978, 16: 0.0628, 17: 0.0181},
-            11: {8: 0.0403, 9: 0.0908, 10: 0.1293, 11: 0.1517, 12: 0.1565, 13: 0.1477, 14: 0.1285, 15: 0.1001, 16: 0.0548, 17: 0.0001},
-            12: {8: 0.0111, 9: 0.0819, 10: 0.1238, 11: 0.1541, 12: 0.1645, 13: 0.1603, 14: 0.1361, 15: 0.1086, 16: 0.0595}
-        },
-        'Açores (Ponta Delgada)': {
-            1: {8: 0.0015, 9: 0.0515, 10: 0.0973, 11: 0.1393, 12: 0.1565, 13: 0.1617, 14: 0.1575, 15: 0.1278, 16: 0.0812, 17: 0.0259},
-            2: {8: 0.0132, 9: 0.0549, 10: 0.0953, 11: 0.1215, 12: 0.1533, 13: 0.1565, 14: 0.1496, 15: 0.1270, 16: 0.0867, 17: 0.0411, 18: 0.0011},
-            3: {7: 0.0016, 8: 0.0275, 9: 0.0645, 10: 0.0994, 11: 0.1229, 12: 0.1431, 13: 0.1443, 14: 0.1420, 15: 0.1178, 16: 0.0844, 17: 0.0441, 18: 0.0086},
-            4: {6: 0.0001, 7: 0.0112, 8: 0.0402, 9: 0.0716, 10: 0.1025, 11: 0.1225, 12: 0.1351, 13: 0.1355, 14: 0.1301, 15: 0.1112, 16: 0.0815, 17: 0.0462, 18: 0.0122, 19: 0.0001},
-            5: {6: 0.0027, 7: 0.0177, 8: 0.0451, 9: 0.0745, 10: 0.1026, 11: 0.1212, 12: 0.1289, 13: 0.1324, 14: 0.1282, 15: 0.1075, 16: 0.0782, 17: 0.0448, 18: 0.0145, 19: 0.0017},
-            6: {6: 0.0043, 7: 0.0179, 8: 0.0454, 9: 0.0722, 10: 0.0977, 11: 0.1182, 12: 0.1290, 13: 0.1308, 14: 0.1272, 15: 0.1072, 16: 0.0810, 17: 0.0476, 18: 0.0177, 19: 0.0038},
-            7: {6: 0.0025, 7: 0.0150, 8: 0.0426, 9: 0.0688, 10: 0.0964, 11: 0.1163, 12: 0.1285, 13: 0.1319, 14: 0.1282, 15: 0.1111, 16: 0.0840, 17: 0.0511, 18: 0.0197, 19: 0.0039},
-            8: {6: 0.0002, 7: 0.0110, 8: 0.0414, 9: 0.0742, 10: 0.1023, 11: 0.1208, 12: 0.1311, 13: 0.1304, 14: 0.1281, 15: 0.1115, 16: 0.0837, 17: 0.0483, 18: 0.0157, 19: 0.0013},
-            9: {7: 0.0087, 8: 0.0405, 9: 0.0774, 10: 0.1087, 11: 0.1277, 12: 0.1378, 13: 0.1314, 14: 0.1324, 15: 0.1105, 16: 0.0789, 17: 0.0394, 18: 0.0066},
-            10: {7: 0.0023, 8: 0.0367, 9: 0.0797, 10: 0.1120, 11: 0.1367, 12: 0.1527, 13: 0.1465, 14: 0.1358, 15: 0.1064, 16: 0.0675, 17: 0.0237, 18: 0.0001},
-            11: {8: 0.0244, 9: 0.0740, 10: 0.1160, 11: 0.1463, 12: 0.1602, 13: 0.1477, 14: 0.1476, 15: 0.1105, 16: 0.0647, 17: 0.0084},
-            12: {8: 0.0047, 9: 0.0647, 10: 0.1079, 11: 0.1471, 12: 0.1691, 13: 0.1579, 14: 0.1563, 15: 0.1197, 16: 0.0691, 17: 0.0034}
-        },
-        'Madeira (Funchal)': {
-            1: {9: 0.0529, 10: 0.1059, 11: 0.1348, 12: 0.1474, 13: 0.1440, 14: 0.1343, 15: 0.1201, 16: 0.0989, 17: 0.0574, 18: 0.0045},
-            2: {8: 0.0047, 9: 0.0553, 10: 0.1017, 11: 0.1265, 12: 0.1289, 13: 0.1419, 14: 0.1332, 15: 0.1226, 16: 0.0994, 17: 0.0642, 18: 0.0216},
-            3: {8: 0.0198, 9: 0.0638, 10: 0.0997, 11: 0.1212, 12: 0.1263, 13: 0.1356, 14: 0.1296, 15: 0.1179, 16: 0.0945, 17: 0.0645, 18: 0.0270, 19: 0.0001},
-            4: {7: 0.0027, 8: 0.0334, 9: 0.0767, 10: 0.1047, 11: 0.1181, 12: 0.1252, 13: 0.1268, 14: 0.1195, 15: 0.1106, 16: 0.0904, 17: 0.0624, 18: 0.0270, 19: 0.0025},
-            5: {7: 0.0067, 8: 0.0387, 9: 0.0781, 10: 0.0986, 11: 0.1152, 12: 0.1232, 13: 0.1243, 14: 0.1207, 15: 0.1110, 16: 0.0884, 17: 0.0606, 18: 0.0282, 19: 0.0061},
-            6: {7: 0.0092, 8: 0.0381, 9: 0.0789, 10: 0.0981, 11: 0.1131, 12: 0.1233, 13: 0.1201, 14: 0.1162, 15: 0.1091, 16: 0.0901, 17: 0.0628, 18: 0.0315, 19: 0.0094, 20: 0.0001},
-            7: {7: 0.0068, 8: 0.0313, 9: 0.0721, 10: 0.0981, 11: 0.1158, 12: 0.1253, 13: 0.1253, 14: 0.1207, 15: 0.1109, 16: 0.0910, 17: 0.0627, 18: 0.0316, 19: 0.0083, 20: 0.0001},
-            8: {7: 0.0036, 8: 0.0305, 9: 0.0722, 10: 0.0998, 11: 0.1177, 12: 0.1263, 13: 0.1281, 14: 0.1222, 15: 0.1125, 16: 0.0908, 17: 0.0623, 18: 0.0293, 19: 0.0047},
-            9: {7: 0.0009, 8: 0.0368, 9: 0.0820, 10: 0.1120, 11: 0.1245, 12: 0.1278, 13: 0.1263, 14: 0.1177, 15: 0.1075, 16: 0.0861, 17: 0.0568, 18: 0.0213, 19: 0.0003},
-            10: {8: 0.0344, 9: 0.0830, 10: 0.1181, 11: 0.1313, 12: 0.1352, 13: 0.1345, 14: 0.1200, 15: 0.1079, 16: 0.0831, 17: 0.0463, 18: 0.0062},
-            11: {8: 0.0189, 9: 0.0748, 10: 0.1194, 11: 0.1418, 12: 0.1455, 13: 0.1415, 14: 0.1245, 15: 0.1103, 16: 0.0831, 17: 0.0401},
-            12: {8: 0.0001, 9: 0.0616, 10: 0.1121, 11: 0.1408, 12: 0.1477, 13: 0.1508, 14: 0.1310, 15: 0.1210, 16: 0.0899, 17: 0.0450}
-        },
-    }
-
     if df_consumos is None or df_consumos.empty:
         return df_consumos.copy()
 
-    # Garante que os dicionários de dados estão disponíveis no escopo desta função
-    # Se não estiverem globais, pode passá-los como parâmetros
-    dados_producao_distrito = DADOS_PVGIS_DISTRITO.get(distrito)
-    perfis_horarios_distrito = PERFIS_HORARIOS_MENSAIS_POR_DISTRITO.get(distrito)
-
-    if not dados_producao_distrito or not perfis_horarios_distrito:
-        # st.error(f"Não foram encontrados dados de backup para o distrito '{distrito}'.")
+    indice_distrito = INDICE_DISTRITO_SOLAR.get(distrito)
+    if indice_distrito is None or not PERFIS_SOLARES_QUARTO_HORARIOS[indice_distrito].any():
+        # emitir_aviso('erro', f"Não foram encontrados dados de backup para o distrito '{distrito}'.")
         # Retorna um DF vazio para não quebrar a aplicação
         return pd.DataFrame(columns=['DataHora', 'Consumo (kWh)', 'Producao_Solar_kWh', 'Autoconsumo_kWh', 'Excedente_kWh', 'Consumo_Rede_kWh'])
 
     df_resultado = df_consumos.copy()
-    
-    perfis_quarto_horarios = interpolar_perfis_para_quarto_horario({distrito: perfis_horarios_distrito})[distrito]
 
     # --- FATORES DE AJUSTE (Lógica da versão de referência) ---
     fator_inclinacao = 1.0 - (abs(inclinacao - 35) / 100) * 0.5
@@ -2030,26 +2949,22 @@ def simular_autoconsumo_completo(df_consumos, potencia_kwp, distrito, inclinacao
     system_loss = 14.0 
     fator_perdas_sistema = system_loss / 100.0
 
-    def calcular_producao_por_linha(row):
-        timestamp_inicio = row['DataHora'] - pd.Timedelta(minutes=15)
-        mes, hora, minuto = timestamp_inicio.month, timestamp_inicio.hour, timestamp_inicio.minute
-
-        energia_diaria_base = dados_producao_distrito.get(mes, 0)
-        
-        # Fórmula de cálculo alinhada com a versão de referência
-        energia_diaria_total_sistema = (
-            energia_diaria_base * potencia_kwp *
-            fator_inclinacao * fator_orientacao *
-            (1 - fator_perdas_sistema)
-        )
-        
-        perfil_mensal = perfis_quarto_horarios.get(mes, {})
-        fator_distribuicao = perfil_mensal.get((hora, minuto), 0)
-        
-        producao_kwh_intervalo = energia_diaria_total_sistema * fator_distribuicao
-        return producao_kwh_intervalo
-
-    df_resultado['Producao_Solar_kWh'] = df_resultado.apply(calcular_producao_por_linha, axis=1)
+    # Mês e quarto-hora do INÍCIO de cada intervalo (DataHora marca o fim), lidos das tabelas numa só indexação
+    inicio_intervalo = df_resultado['DataHora'] - pd.Timedelta(minutes=15)
+    valido = inicio_intervalo.notna().to_numpy()
+    meses = inicio_intervalo.dt.month.fillna(1).to_numpy(dtype=np.int64) - 1
+    minutos = inicio_intervalo.dt.minute.fillna(0).to_numpy(dtype=np.int64)
+    quartos_hora = inicio_intervalo.dt.hour.fillna(0).to_numpy(dtype=np.int64) * 4 + minutos // 15
+    valido &= (minutos % 15) == 0 # Minutos fora da grelha de 15 min não têm fator de distribuição
+
+    # Fórmula de cálculo alinhada com a versão de referência
+    energia_diaria_total_sistema = (
+        PRODUCAO_DIARIA_PVGIS[indice_distrito, meses] * potencia_kwp *
+        fator_inclinacao * fator_orientacao *
+        (1 - fator_perdas_sistema)
+    )
+    fator_distribuicao = PERFIS_SOLARES_QUARTO_HORARIOS[indice_distrito, meses, quartos_hora]
+    df_resultado['Producao_Solar_kWh'] = np.where(valido, energia_diaria_total_sistema * fator_distribuicao, 0.0)
 
     soma_original_precisa = df_resultado['Producao_Solar_kWh'].sum()
     df_resultado['Producao_Solar_kWh'] = df_resultado['Producao_Solar_kWh'].rolling(window=4, center=False, min_periods=1).mean()
@@ -2065,8 +2980,319 @@ def simular_autoconsumo_completo(df_consumos, potencia_kwp, distrito, inclinacao
 
     return df_resultado
 
+# --- Dimensionamento fotovoltaico: curvas para várias potências (kWp) numa só passagem ---
+# A produção é proporcional à potência: produção(kWp) = kWp x produção de 1 kWp. As K potências são
+# avaliadas como uma matriz kWp x intervalos, em blocos de até MAX_CELULAS_DIMENSIONAMENTO_PV valores.
+MAX_CELULAS_DIMENSIONAMENTO_PV = 2_000_000
+
+@dataclass(frozen=True)
+class CurvasDimensionamentoPV:
+    """
+    Totais do período para cada potência de simular_dimensionamento_pv (arrays de K, alinhados com potencias_kwp).
+    consumo_rede_por_ciclo: {coluna de ciclo: {período: kWh da rede}}, como agregar_consumos_por_periodo
+    consumo_rede_simples: kWh da rede de todos os intervalos (como 'Simples')
+    """
+    potencias_kwp: np.ndarray
+    producao_kwh: np.ndarray
+    autoconsumo_kwh: np.ndarray
+    excedente_kwh: np.ndarray
+    consumo_rede_simples: np.ndarray
+    consumo_rede_por_ciclo: Mapping
+
+    def consumos_rede_opcao_por_kwp(self, opcao_horaria):
+        """{período: array com os kWh da rede de cada potência} para a opção horária."""
+        oh_lower = opcao_horaria.lower()
+        if oh_lower == "simples":
+            return {'S': self.consumo_rede_simples}
+        diario = 'diário' in oh_lower
+        if oh_lower.startswith("bi"):
+            ciclo = 'BD' if diario else 'BS'
+        elif oh_lower.startswith("tri"):
+            ciclo = 'TD' if diario else 'TS'
+        else:
+            return {}
+        return dict(self.consumo_rede_por_ciclo.get(ciclo, {}))
+
+    def consumos_rede_opcao(self, opcao_horaria, i):
+        """{período: kWh da rede} da potência i para a opção horária (como os consumos repartidos da app)."""
+        return {periodo: float(valores[i]) for periodo, valores in self.consumos_rede_opcao_por_kwp(opcao_horaria).items()}
+
+def simular_dimensionamento_pv(df_consumos, potencias_kwp, distrito, inclinacao, orientacao_str, df_omie_ciclos=None):
+    """
+    Produção, autoconsumo, excedente e consumo da rede para cada potência de potencias_kwp.
+    Com df_omie_ciclos, o consumo da rede sai também repartido pelos períodos de cada ciclo horário.
+    Devolve CurvasDimensionamentoPV, ou None se não houver consumos ou dados solares para o distrito.
+    """
+    if df_consumos is None or df_consumos.empty:
+        return None
+    base = simular_autoconsumo_completo(df_consumos, 1.0, distrito, inclinacao, orientacao_str)
+    if base.empty:
+        return None
+
+    potencias = np.asarray(potencias_kwp, dtype=float).ravel()
+    consumo = base['Consumo (kWh)'].to_numpy(dtype=np.float64)
+    producao_1kwp = base['Producao_Solar_kWh'].to_numpy(dtype=np.float64)
+
+    # Matriz intervalos x períodos (0/1) de todos os ciclos: o consumo da rede por período sai de um produto matricial
+    colunas_periodos = []
+    if df_omie_ciclos is not None:
+        colunas_ciclo = [col for col in COLUNAS_CICLOS_DIAGRAMA if col in df_omie_ciclos.columns]
+        ciclos = pd.merge(base[['DataHora']], df_omie_ciclos[['DataHora', *colunas_ciclo]], on='DataHora', how='left')
+        for coluna_ciclo in colunas_ciclo:
+            valores_ciclo = ciclos[coluna_ciclo].to_numpy(dtype=object)
+            for periodo in pd.unique(ciclos[coluna_ciclo].dropna()):
+                colunas_periodos.append((coluna_ciclo, periodo, valores_ciclo == periodo))
+    pertenca = np.column_stack([col for _, _, col in colunas_periodos]).astype(np.float64) if colunas_periodos else None
+
+    k, n = len(potencias), len(consumo)
+    autoconsumo, excedente, rede = np.zeros(k), np.zeros(k), np.zeros(k)
+    rede_periodos = np.zeros((k, len(colunas_periodos)))
+    linhas_bloco = max(1, MAX_CELULAS_DIMENSIONAMENTO_PV // max(n, 1))
+    for inicio in range(0, k, linhas_bloco):
+        bloco = slice(inicio, inicio + linhas_bloco)
+        producao = potencias[bloco, None] * producao_1kwp
+        autoconsumo_bloco = np.minimum(consumo, producao)
+        excedente[bloco] = np.maximum(0.0, producao - consumo).sum(axis=1)
+        rede_bloco = np.maximum(0.0, consumo - autoconsumo_bloco)
+        autoconsumo[bloco] = autoconsumo_bloco.sum(axis=1)
+        rede[bloco] = rede_bloco.sum(axis=1)
+        if pertenca is not None:
+            rede_periodos[bloco] = rede_bloco @ pertenca
+
+    consumo_rede_por_ciclo = {}
+    for j, (coluna_ciclo, periodo, _) in enumerate(colunas_periodos):
+        consumo_rede_por_ciclo.setdefault(coluna_ciclo, {})[periodo] = rede_periodos[:, j]
+    return CurvasDimensionamentoPV(
+        potencias_kwp=potencias,
+        producao_kwh=potencias * producao_1kwp.sum(),
+        autoconsumo_kwh=autoconsumo,
+        excedente_kwh=excedente,
+        consumo_rede_simples=rede,
+        consumo_rede_por_ciclo=MappingProxyType(consumo_rede_por_ciclo),
+    )
+
+# --- Bateria: despacho sequencial (carrega com o excedente, descarrega para o consumo da rede) ---
+DURACAO_INTERVALO_H = 0.25 # Quarto-horário
+
+def _despacho_bateria(excedente, rede, capacidade_kwh, energia_max_intervalo, raiz_eficiencia, soc_inicial_kwh, carga, descarga, soc):
+    """
+    Núcleo do despacho, intervalo a intervalo (o estado de carga depende do anterior). Escreve em carga/descarga/soc
+    (kWh: retirado do excedente, entregue ao consumo, armazenado no fim do intervalo). Metade das perdas
+    (raiz da eficiência ida e volta) na carga, metade na descarga. Só usa indexação e aritmética, para correr
+    compilado com numba (arrays) ou em Python puro (listas).
+    """
+    estado = soc_inicial_kwh
+    for t in range(len(excedente)):
+        entrada = min(excedente[t], energia_max_intervalo, (capacidade_kwh - estado) / raiz_eficiencia)
+        if entrada < 0.0:
+            entrada = 0.0
+        estado += entrada * raiz_eficiencia
+        saida = min(rede[t], energia_max_intervalo, estado * raiz_eficiencia)
+        if saida < 0.0:
+            saida = 0.0
+        estado -= saida / raiz_eficiencia
+        if estado < 0.0: # Arredondamentos
+            estado = 0.0
+        carga[t] = entrada
+        descarga[t] = saida
+        soc[t] = estado
+
+_despacho_bateria_compilado = njit(cache=True)(_despacho_bateria) if njit is not None else None
+
+def executar_despacho_bateria(excedente_kwh, consumo_rede_kwh, capacidade_kwh, potencia_kw, eficiencia_ida_volta=0.9, soc_inicial_kwh=0.0):
+    """
+    Despacho de uma bateria sobre séries quarto-horárias de excedente e consumo da rede (kWh).
+    Devolve (carga, descarga, soc) em arrays alinhados com as séries; ver _despacho_bateria.
+    """
+    excedente = np.ascontiguousarray(excedente_kwh, dtype=np.float64)
+    rede = np.ascontiguousarray(consumo_rede_kwh, dtype=np.float64)
+    n = len(excedente)
+    parametros = (
+        float(capacidade_kwh), float(potencia_kw) * DURACAO_INTERVALO_H,
+        float(np.sqrt(eficiencia_ida_volta)), max(0.0, min(float(soc_inicial_kwh), float(capacidade_kwh))),
+    )
+    if parametros[0] <= 0 or parametros[1] <= 0 or parametros[2] <= 0:
+        return np.zeros(n), np.zeros(n), np.full(n, parametros[3])
+    if _despacho_bateria_compilado is not None:
+        carga, descarga, soc = np.zeros(n), np.zeros(n), np.zeros(n)
+        _despacho_bateria_compilado(excedente, rede, *parametros, carga, descarga, soc)
+        return carga, descarga, soc
+    # Em Python puro, listas são bastante mais rápidas do que indexar arrays elemento a elemento
+    carga, descarga, soc = [0.0] * n, [0.0] * n, [0.0] * n
+    _despacho_bateria(excedente.tolist(), rede.tolist(), *parametros, carga, descarga, soc)
+    return np.array(carga), np.array(descarga), np.array(soc)
+
+def simular_bateria(df_autoconsumo, capacidade_kwh, potencia_kw, eficiencia_ida_volta=0.9, soc_inicial_kwh=0.0):
+    """
+    Acrescenta uma bateria ao resultado de simular_autoconsumo_completo: guarda o excedente e descarrega-o
+    para o consumo da rede. Devolve uma cópia com 'Carga_Bateria_kWh', 'Descarga_Bateria_kWh' e 'SOC_Bateria_kWh',
+    e com 'Excedente_kWh' e 'Consumo_Rede_kWh' já depois da bateria (o consumo da rede segue para os cálculos de custo).
+    """
+    df_resultado = df_autoconsumo.copy()
+    if df_resultado.empty:
+        return df_resultado
+    carga, descarga, soc = executar_despacho_bateria(
+        df_resultado['Excedente_kWh'], df_resultado['Consumo_Rede_kWh'],
+        capacidade_kwh, potencia_kw, eficiencia_ida_volta, soc_inicial_kwh
+    )
+    df_resultado['Carga_Bateria_kWh'] = carga
+    df_resultado['Descarga_Bateria_kWh'] = descarga
+    df_resultado['SOC_Bateria_kWh'] = soc
+    df_resultado['Excedente_kWh'] = np.maximum(0.0, df_resultado['Excedente_kWh'].to_numpy() - carga)
+    df_resultado['Consumo_Rede_kWh'] = np.maximum(0.0, df_resultado['Consumo_Rede_kWh'].to_numpy() - descarga)
+    return df_resultado
+
+def comparar_capacidades_bateria(df_autoconsumo, capacidades_kwh, potencia_kw, eficiencia_ida_volta=0.9):
+    """
+    Totais do período para cada capacidade de capacidades_kwh (mesma potência e eficiência): um DataFrame
+    com 'Capacidade (kWh)', 'Descarga (kWh)', 'Consumo da Rede (kWh)', 'Excedente (kWh)' e 'Ciclos Equivalentes'.
+    """
+    excedente = df_autoconsumo['Excedente_kWh'].to_numpy(dtype=np.float64)
+    rede = df_autoconsumo['Consumo_Rede_kWh'].to_numpy(dtype=np.float64)
+    linhas = []
+    for capacidade in capacidades_kwh:
+        carga, descarga, _ = executar_despacho_bateria(excedente, rede, capacidade, potencia_kw, eficiencia_ida_volta)
+        total_descarga = descarga.sum()
+        linhas.append({
+            'Capacidade (kWh)': capacidade,
+            'Descarga (kWh)': total_descarga,
+            'Consumo da Rede (kWh)': np.maximum(0.0, rede - descarga).sum(),
+            'Excedente (kWh)': np.maximum(0.0, excedente - carga).sum(),
+            'Ciclos Equivalentes': total_descarga / capacidade if capacidade > 0 else 0.0,
+        })
+    return pd.DataFrame(linhas)
+
+# --- Venda do excedente a preços indexados ao OMIE ---
+# Contratos de venda {nome: fórmula do preço de venda em €/kWh}, com as variáveis das fórmulas dos indexados
+# (OMIE em €/MWh e PERDAS do intervalo) e constantes pelo nome. Tipicamente OMIE x fator - taxa.
+CONTRATOS_VENDA_EXCEDENTE = {
+    "OMIE x 0.90": "OMIE/1000*0.90",
+    "OMIE x 0.80": "OMIE/1000*0.80",
+    "OMIE - 10 €/MWh": "(OMIE-10)/1000",
+}
+
+def formula_venda_excedente(fator_omie, taxa_eur_mwh):
+    """Fórmula 'OMIE x fator - taxa' (taxa em €/MWh) no formato de CONTRATOS_VENDA_EXCEDENTE."""
+    return f"OMIE/1000*{float(fator_omie)!r}-{float(taxa_eur_mwh)!r}/1000"
+
+def calcular_receitas_venda_excedente(df_autoconsumo, df_omie_ciclos, contratos, constantes_dict=None):
+    """
+    Receita (€) da venda do 'Excedente_kWh' de cada intervalo ao preço quarto-horário de cada contrato
+    ({nome: fórmula}). As fórmulas são avaliadas sobre os arrays OMIE/PERDAS e todas as receitas saem de um
+    só produto matricial (contratos x intervalos) @ excedente. Intervalos sem OMIE não contam.
+    Devolve {nome: receita}; contratos com fórmula inválida ficam de fora (com aviso).
+    """
+    if df_autoconsumo is None or df_autoconsumo.empty or 'Excedente_kWh' not in df_autoconsumo.columns:
+        return {}
+    alinhado = pd.merge(
+        df_autoconsumo[['DataHora', 'Excedente_kWh']], df_omie_ciclos[['DataHora', 'OMIE', 'Perdas']],
+        on='DataHora', how='inner'
+    ).dropna(subset=['OMIE', 'Perdas'])
+    excedente = alinhado['Excedente_kWh'].to_numpy(dtype=np.float64)
+    omie = alinhado['OMIE'].to_numpy(dtype=np.float64)
+    perdas = alinhado['Perdas'].to_numpy(dtype=np.float64)
+
+    nomes, precos = [], []
+    for nome, formula in contratos.items():
+        try:
+            kernel = ligar_formula_indexado(formula, constantes_dict or {})
+        except ValueError as e:
+            emitir_aviso('aviso', f"Contrato de venda '{nome}' ignorado: {e}", 'calcular_receitas_venda_excedente')
+            continue
+        nomes.append(nome)
+        precos.append(np.broadcast_to(kernel(omie, perdas), omie.shape))
+    if not nomes:
+        return {}
+    receitas = np.vstack(precos) @ excedente
+    return {nome: float(receita) for nome, receita in zip(nomes, receitas)}
+
+def custos_dimensionamento_pv(
+    curvas, tarifarios_fixos_df, opcao_horaria, dias_calculo, tarifa_social_ativa, familia_numerosa_ativa,
+    valor_dgeg_user_input, valor_cav_user_input, incluir_quota_acp_input, desconto_continente_input,
+    CONSTANTES_df, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL, num_melhores=3
+):
+    """
+    Fatura de cada potência de 'curvas' nos tarifários fixos de tarifarios_fixos_df (já filtrados pela potência
+    contratada) da opção horária, com calcular_custos_fixos_em_lote. Devolve um DataFrame com uma linha por kWp:
+    energia ('Produção (kWh)', ...), 'Melhor Tarifário Fixo', 'Custo Melhor Fixo (€)' e o custo dos num_melhores tarifários
+    mais baratos na potência mais baixa da lista (colunas com o nome de cada um).
+    """
+    df_opcao = tarifarios_fixos_df[tarifarios_fixos_df['opcao_horaria_e_ciclo'] == opcao_horaria]
+    # Uma só chamada ao lote: cada tarifário repetido uma vez por kWp, com os consumos dessa potência (K x linhas)
+    num_kwp, num_linhas = len(curvas.potencias_kwp), len(df_opcao)
+    totais = None
+    if num_kwp and num_linhas:
+        df_por_kwp = df_opcao.iloc[np.tile(np.arange(num_linhas), num_kwp)].reset_index(drop=True)
+        consumos_por_kwp = {
+            periodo: np.repeat(np.asarray(valores, dtype=float), num_linhas)
+            for periodo, valores in curvas.consumos_rede_opcao_por_kwp(opcao_horaria).items()
+        }
+        resultado = calcular_custos_fixos_em_lote(
+            df_por_kwp, {opcao_horaria: consumos_por_kwp}, dias_calculo,
+            tarifa_social_ativa, familia_numerosa_ativa, valor_dgeg_user_input, valor_cav_user_input,
+            incluir_quota_acp_input, desconto_continente_input, CONSTANTES_df, FINANCIAMENTO_TSE_VAL, VALOR_QUOTA_ACP_MENSAL
+        )
+        totais = resultado['Total (€)'].reindex(df_por_kwp.index).to_numpy(dtype=float).reshape(num_kwp, num_linhas)
+
+    curvas_df = pd.DataFrame({
+        'Potência (kWp)': curvas.potencias_kwp,
+        'Produção (kWh)': curvas.producao_kwh,
+        'Autoconsumo (kWh)': curvas.autoconsumo_kwh,
+        'Excedente (kWh)': curvas.excedente_kwh,
+        'Consumo da Rede (kWh)': curvas.consumo_rede_simples,
+    })
+    if totais is None:
+        return curvas_df
+    custos = pd.DataFrame(totais, columns=df_opcao.index) # kWp x linha de df_opcao
+    custos = custos.loc[:, custos.notna().any()]
+    if custos.empty:
+        return curvas_df
+    nomes = df_opcao['nome']
+    curvas_df['Melhor Tarifário Fixo'] = nomes.loc[custos.idxmin(axis=1)].to_numpy()
+    curvas_df['Custo Melhor Fixo (€)'] = custos.min(axis=1).to_numpy()
+    for indice_linha in custos.iloc[0].nsmallest(num_melhores).index:
+        if nomes.loc[indice_linha] not in curvas_df.columns:
+            curvas_df[nomes.loc[indice_linha]] = custos[indice_linha].to_numpy()
+    return curvas_df
+
+# --- Inputs de "O Meu Tarifário" (eletricidade) ---
+@dataclass(frozen=True)
+class EntradasMeuTarifario:
+    energia_s: float = 0.0
+    potencia: float = 0.0
+    energia_v: float = 0.0
+    energia_f: float = 0.0
+    energia_c: float = 0.0
+    energia_p: float = 0.0
+    tar_incluida_energia: bool = True
+    tar_incluida_potencia: bool = True
+    tse_incluido: bool = True
+    desconto_energia_perc: float = 0.0
+    desconto_potencia_perc: float = 0.0
+    desconto_fatura_eur: float = 0.0
+    acrescimo_fatura_eur: float = 0.0
+
+    @classmethod
+    def a_partir_de_estado(cls, estado):
+        """Lê os inputs de um mapeamento com as chaves dos widgets da app (ex: st.session_state)."""
+        return cls(
+            energia_s=estado.get("energia_meu_s_input_val", 0.0),
+            potencia=estado.get("potencia_meu_input_val", 0.0),
+            energia_v=estado.get("energia_meu_v_input_val", 0.0),
+            energia_f=estado.get("energia_meu_f_input_val", 0.0),
+            energia_c=estado.get("energia_meu_c_input_val", 0.0),
+            energia_p=estado.get("energia_meu_p_input_val", 0.0),
+            tar_incluida_energia=estado.get("meu_tar_energia_val", True),
+            tar_incluida_potencia=estado.get("meu_tar_potencia_val", True),
+            tse_incluido=estado.get("meu_fin_tse_incluido_val", True),
+            desconto_energia_perc=estado.get("meu_desconto_energia_val", 0.0),
+            desconto_potencia_perc=estado.get("meu_desconto_potencia_val", 0.0),
+            desconto_fatura_eur=estado.get("meu_desconto_fatura_val", 0.0),
+            acrescimo_fatura_eur=estado.get("meu_acrescimo_fatura_val", 0.0),
+        )
+
 def calcular_detalhes_custo_meu_tarifario(
-    st_session_state,
+    entradas_meu_tarifario,
     opcao_horaria,
     consumos_para_calculo,
     potencia,
@@ -2080,27 +3306,27 @@ def calcular_detalhes_custo_meu_tarifario(
 ):
     """
     Calcula o custo completo para a funcionalidade "O Meu Tarifário",
-    usando os inputs guardados no st.session_state.
+    a partir dos inputs em entradas_meu_tarifario (EntradasMeuTarifario).
     """
     try:
-        # --- PASSO 1: EXTRAIR INPUTS DO st.session_state ---
+        # --- PASSO 1: INPUTS DO UTILIZADOR ---
+        entradas = entradas_meu_tarifario
         # Preços de Energia e Potência
-        energia_meu_s = st_session_state.get("energia_meu_s_input_val", 0.0)
-        potencia_meu = st_session_state.get("potencia_meu_input_val", 0.0)
-        energia_meu_v = st_session_state.get("energia_meu_v_input_val", 0.0)
-        energia_meu_f = st_session_state.get("energia_meu_f_input_val", 0.0)
-        energia_meu_c = st_session_state.get("energia_meu_c_input_val", 0.0)
-        energia_meu_p = st_session_state.get("energia_meu_p_input_val", 0.0)
+        energia_meu_s = entradas.energia_s
+        potencia_meu = entradas.potencia
+        energia_meu_v = entradas.energia_v
+        energia_meu_f = entradas.energia_f
+        energia_meu_c = entradas.energia_c
+        energia_meu_p = entradas.energia_p
         # Checkboxes TAR/TSE
-        tar_incluida_energia_meu = st_session_state.get("meu_tar_energia_val", True)
-        tar_incluida_potencia_meu = st_session_state.get("meu_tar_potencia_val", True)
-        checkbox_tse_incluido_estado = st_session_state.get("meu_fin_tse_incluido_val", True)
-        adicionar_financiamento_tse_meu = not checkbox_tse_incluido_estado
+        tar_incluida_energia_meu = entradas.tar_incluida_energia
+        tar_incluida_potencia_meu = entradas.tar_incluida_potencia
+        adicionar_financiamento_tse_meu = not entradas.tse_incluido
         # Descontos e Acréscimos
-        desconto_energia = st_session_state.get("meu_desconto_energia_val", 0.0)
-        desconto_potencia = st_session_state.get("meu_desconto_potencia_val", 0.0)
-        desconto_fatura_input_meu = st_session_state.get("meu_desconto_fatura_val", 0.0)
-        acrescimo_fatura_input_meu = st_session_state.get("meu_acrescimo_fatura_val", 0.0)
+        desconto_energia = entradas.desconto_energia_perc
+        desconto_potencia = entradas.desconto_potencia_perc
+        desconto_fatura_input_meu = entradas.desconto_fatura_eur
+        acrescimo_fatura_input_meu = entradas.acrescimo_fatura_eur
 
         # --- PASSO 2: PREPARAR DICIONÁRIOS DE PREÇOS E CONSUMOS ---
         is_billing_month = 28 <= dias <= 31
@@ -2142,7 +3368,7 @@ def calcular_detalhes_custo_meu_tarifario(
             apos_desc_comerc = base_desc_perc * (1 - (desconto_energia or 0.0) / 100.0)
             preco_energia_final_unitario_sem_iva[p_key] = apos_desc_comerc - desconto_monetario_ts_energia if tarifa_social else apos_desc_comerc
             
-        desconto_monetario_ts_potencia = obter_constante(f'Desconto TS Potencia {potencia}', CONSTANTES) if tarifa_social else 0.0
+        desconto_monetario_ts_potencia = obter_desconto_ts_potencia(potencia, CONSTANTES) if tarifa_social else 0.0
         base_desc_pot_perc = potencia_meu_comercializador_base + tar_potencia_regulada_meu_base
         apos_desc_pot_comerc = base_desc_pot_perc * (1 - (desconto_potencia or 0.0) / 100.0)
         preco_potencia_final_unitario_sem_iva = apos_desc_pot_comerc - desconto_monetario_ts_potencia if tarifa_social else apos_desc_pot_comerc
@@ -2174,7 +3400,7 @@ def calcular_detalhes_custo_meu_tarifario(
         return { 'Total (€)': custo_final, 'NomeParaExibir': nome_para_exibir }
 
     except Exception as e:
-        st.error(f"Erro ao calcular 'O Meu Tarifário': {e}")
+        emitir_aviso('erro', f"Erro ao calcular 'O Meu Tarifário': {e}", 'calcular_detalhes_custo_meu_tarifario')
         return None
 
 
@@ -2287,7 +3513,7 @@ def calcular_custo_gas_completo(
                 margem_generica = float(dados_tarifa_gas_linha.get('Margem_Index', 0.0))
                 preco_energia_comerc_input = mibgas_kwh + margem_generica
                 if margem_generica == 0.0:
-                    st.warning(f"Aviso: Tarifário indexado '{nome_original_tarifario}' não tem fórmula dedicada nem Margem_Index no Excel. Custo de energia pode ser zero.")
+                    emitir_aviso('aviso', f"Aviso: Tarifário indexado '{nome_original_tarifario}' não tem fórmula dedicada nem Margem_Index no Excel. Custo de energia pode ser zero.", 'calcular_custo_gas_completo')
             
             # --- FIM DA LÓGICA DE FÓRMULAS ---
 
@@ -2300,8 +3526,9 @@ def calcular_custo_gas_completo(
         )
 
         # 3. Obter TARs Reguladas (Base)
-        tar_fixo_regulada_base = obter_tar_gas_fixo(escalao_num, constantes_df)
-        tar_energia_regulada_base = obter_tar_gas_energia(escalao_num, constantes_df)
+        indice_constantes = obter_indice_constantes(constantes_df)
+        tar_fixo_regulada_base = obter_tar_gas_fixo(escalao_num, indice_constantes)
+        tar_energia_regulada_base = obter_tar_gas_energia(escalao_num, indice_constantes)
         
         # 4. Obter ISP (do input manual)
         isp_gas_kwh = isp_gas_valor_manual 
@@ -2321,8 +3548,8 @@ def calcular_custo_gas_completo(
         desconto_ts_energia_valor_aplicado = 0.0
 
         if tarifa_social_ativa and escalao_num in [1, 2]: 
-            desconto_ts_fixo_bruto = obter_desconto_ts_gas_fixo(escalao_num, constantes_df)
-            desconto_ts_energia_bruto = obter_desconto_ts_gas_energia(escalao_num, constantes_df)
+            desconto_ts_fixo_bruto = obter_desconto_ts_gas_fixo(escalao_num, indice_constantes)
+            desconto_ts_energia_bruto = obter_desconto_ts_gas_energia(escalao_num, indice_constantes)
             
             tar_fixo_final_a_pagar = max(0.0, tar_fixo_regulada_base - desconto_ts_fixo_bruto)
             tar_energia_final_a_pagar = max(0.0, tar_energia_regulada_base - desconto_ts_energia_bruto)
@@ -2471,14 +3698,41 @@ def calcular_custo_gas_completo(
         }
         
     except Exception as e:
-        st.error(f"Erro ao calcular custo de gás (V15) para {dados_tarifa_gas_linha.get('Nome_Tarifa_G', 'Desconhecido')}: {e}")
-        import traceback
-        st.text(traceback.format_exc()) # Para debug detalhado
+        emitir_aviso(
+            'erro', f"Erro ao calcular custo de gás (V15) para {dados_tarifa_gas_linha.get('Nome_Tarifa_G', 'Desconhecido')}: {e}",
+            'calcular_custo_gas_completo', traceback.format_exc() # Para debug detalhado
+        )
         return None
     
 # --- Calcular "O Meu Tarifário" de Gás ---
+# --- Inputs de "O Meu Tarifário" de Gás ---
+@dataclass(frozen=True)
+class EntradasMeuTarifarioGas:
+    termo_fixo_dia: float = 0.0
+    termo_energia_kwh: float = 0.0
+    tar_fixo_incluida: bool = True
+    tar_energia_incluida: bool = True
+    desconto_fixo_perc: float = 0.0
+    desconto_energia_perc: float = 0.0
+    desconto_fatura_eur: float = 0.0
+    acrescimo_fatura_eur: float = 0.0
+
+    @classmethod
+    def a_partir_de_estado(cls, estado):
+        """Lê os inputs de um mapeamento com as chaves dos widgets da app (ex: st.session_state)."""
+        return cls(
+            termo_fixo_dia=float(estado.get('meu_termo_fixo_gas', 0.0) or 0.0),
+            termo_energia_kwh=float(estado.get('meu_termo_energia_gas', 0.0) or 0.0),
+            tar_fixo_incluida=estado.get("meu_gas_tar_fixo_incluida", True),
+            tar_energia_incluida=estado.get("meu_gas_tar_energia_incluida", True),
+            desconto_fixo_perc=float(estado.get('meu_gas_desconto_fixo_perc', 0.0) or 0.0),
+            desconto_energia_perc=float(estado.get('meu_gas_desconto_energia_perc', 0.0) or 0.0),
+            desconto_fatura_eur=float(estado.get('meu_gas_desconto_fatura_eur', 0.0) or 0.0),
+            acrescimo_fatura_eur=float(estado.get('meu_gas_acrescimo_fatura_eur', 0.0) or 0.0),
+        )
+
 def calcular_custo_meu_tarifario_gas(
-    st_session_state,
+    entradas_meu_tarifario_gas,
     consumo_kwh_periodo,
     dias_periodo,
     escalao_num,
@@ -2497,20 +3751,22 @@ def calcular_custo_meu_tarifario_gas(
         IVA_NORMAL_PERC = 0.23
         IVA_REDUZIDO_PERC = 0.06
 
-        # 1. Obter inputs do utilizador
-        preco_fixo_input_dia = float(st_session_state.get('meu_termo_fixo_gas', 0.0) or 0.0)
-        preco_energia_input_kwh = float(st_session_state.get('meu_termo_energia_gas', 0.0) or 0.0)
-        tar_fixo_incluida_flag = st_session_state.get("meu_gas_tar_fixo_incluida", True)
-        tar_energia_incluida_flag = st_session_state.get("meu_gas_tar_energia_incluida", True)
+        # 1. Obter inputs do utilizador (EntradasMeuTarifarioGas)
+        entradas = entradas_meu_tarifario_gas
+        preco_fixo_input_dia = entradas.termo_fixo_dia
+        preco_energia_input_kwh = entradas.termo_energia_kwh
+        tar_fixo_incluida_flag = entradas.tar_fixo_incluida
+        tar_energia_incluida_flag = entradas.tar_energia_incluida
 
-        desc_fixo_perc = float(st_session_state.get('meu_gas_desconto_fixo_perc', 0.0) or 0.0)
-        desc_energia_perc = float(st_session_state.get('meu_gas_desconto_energia_perc', 0.0) or 0.0)
-        desc_fatura_eur_periodo = float(st_session_state.get('meu_gas_desconto_fatura_eur', 0.0) or 0.0)
-        acresc_fatura_eur_periodo = float(st_session_state.get('meu_gas_acrescimo_fatura_eur', 0.0) or 0.0)
+        desc_fixo_perc = entradas.desconto_fixo_perc
+        desc_energia_perc = entradas.desconto_energia_perc
+        desc_fatura_eur_periodo = entradas.desconto_fatura_eur
+        acresc_fatura_eur_periodo = entradas.acrescimo_fatura_eur
 
         # 2. Obter Constantes (TARs base, ISP)
-        tar_fixo_regulada_base_dia = obter_tar_gas_fixo(escalao_num, constantes_df)
-        tar_energia_regulada_base_kwh = obter_tar_gas_energia(escalao_num, constantes_df)
+        indice_constantes = obter_indice_constantes(constantes_df)
+        tar_fixo_regulada_base_dia = obter_tar_gas_fixo(escalao_num, indice_constantes)
+        tar_energia_regulada_base_kwh = obter_tar_gas_energia(escalao_num, indice_constantes)
         isp_gas_kwh = isp_gas_valor_manual
 
         # 3. Calcular Valor Monetário do Desconto TS (se aplicável)
@@ -2519,8 +3775,8 @@ def calcular_custo_meu_tarifario_gas(
         isp_total_s_iva_periodo = consumo_kwh_periodo * isp_gas_kwh # ISP base
 
         if tarifa_social_ativa and escalao_num in [1, 2]:
-            desconto_ts_fixo_bruto = obter_desconto_ts_gas_fixo(escalao_num, constantes_df)
-            desconto_ts_energia_bruto = obter_desconto_ts_gas_energia(escalao_num, constantes_df)
+            desconto_ts_fixo_bruto = obter_desconto_ts_gas_fixo(escalao_num, indice_constantes)
+            desconto_ts_energia_bruto = obter_desconto_ts_gas_energia(escalao_num, indice_constantes)
             # O valor a subtrair mais tarde é o menor entre o desconto bruto e a TAR base
             desconto_ts_fixo_valor_aplicado = min(tar_fixo_regulada_base_dia, desconto_ts_fixo_bruto)
             desconto_ts_energia_valor_aplicado = min(tar_energia_regulada_base_kwh, desconto_ts_energia_bruto)
@@ -2645,13 +3901,12 @@ def calcular_custo_meu_tarifario_gas(
         }
 
     except Exception as e:
-        st.error(f"Erro ao calcular 'O Meu Tarifário Gás' (V2): {e}")
-        # import traceback # Descomentar para debug mais detalhado se necessário
-        # st.error(traceback.format_exc())
+        emitir_aviso('erro', f"Erro ao calcular 'O Meu Tarifário Gás' (V2): {e}", 'calcular_custo_meu_tarifario_gas')
+        # emitir_aviso('erro', traceback.format_exc()) # Descomentar para debug mais detalhado se necessário
         return None
     
 def calcular_custo_personalizado_gas(
-    st_session_state_inputs, # Dicionário de inputs do st.session_state
+    inputs_utilizador, # Dicionário de inputs do utilizador (chaves 'pers_gas_*')
     consumo_kwh_periodo,    
     dias_periodo,           
     escalao_num,
@@ -2669,17 +3924,18 @@ def calcular_custo_personalizado_gas(
         IVA_NORMAL_PERC = 0.23
         IVA_REDUZIDO_PERC = 0.06
 
-        # 1. Obter inputs do utilizador (via st.session_state_inputs)
-        preco_fixo_input_dia = float(st_session_state_inputs.get('pers_gas_fixo', 0.0) or 0.0)
-        preco_energia_input_kwh = float(st_session_state_inputs.get('pers_gas_energia', 0.0) or 0.0)
+        # 1. Obter inputs do utilizador
+        preco_fixo_input_dia = float(inputs_utilizador.get('pers_gas_fixo', 0.0) or 0.0)
+        preco_energia_input_kwh = float(inputs_utilizador.get('pers_gas_energia', 0.0) or 0.0)
         
         # Flags
-        tar_fixo_incluida_flag = st_session_state_inputs.get('pers_gas_tar_fixo', True)
-        tar_energia_incluida_flag = st_session_state_inputs.get('pers_gas_tar_energia', True)
+        tar_fixo_incluida_flag = inputs_utilizador.get('pers_gas_tar_fixo', True)
+        tar_energia_incluida_flag = inputs_utilizador.get('pers_gas_tar_energia', True)
 
         # 2. Obter TARs Reguladas (Base)
-        tar_fixo_regulada_base = obter_tar_gas_fixo(escalao_num, constantes_df)
-        tar_energia_regulada_base = obter_tar_gas_energia(escalao_num, constantes_df)
+        indice_constantes = obter_indice_constantes(constantes_df)
+        tar_fixo_regulada_base = obter_tar_gas_fixo(escalao_num, indice_constantes)
+        tar_energia_regulada_base = obter_tar_gas_energia(escalao_num, indice_constantes)
         
         # 3. Obter ISP
         isp_gas_kwh = isp_gas_valor_manual 
@@ -2697,8 +3953,8 @@ def calcular_custo_personalizado_gas(
         desconto_ts_energia_valor_aplicado = 0.0
 
         if tarifa_social_ativa and escalao_num in [1, 2]: 
-            desconto_ts_fixo_bruto = obter_desconto_ts_gas_fixo(escalao_num, constantes_df)
-            desconto_ts_energia_bruto = obter_desconto_ts_gas_energia(escalao_num, constantes_df)
+            desconto_ts_fixo_bruto = obter_desconto_ts_gas_fixo(escalao_num, indice_constantes)
+            desconto_ts_energia_bruto = obter_desconto_ts_gas_energia(escalao_num, indice_constantes)
             
             tar_fixo_final_a_pagar = max(0.0, tar_fixo_regulada_base - desconto_ts_fixo_bruto)
             tar_energia_final_a_pagar = max(0.0, tar_energia_regulada_base - desconto_ts_energia_bruto)
@@ -2787,7 +4043,7 @@ def calcular_custo_personalizado_gas(
         }
         
     except Exception as e:
-        st.error(f"Erro ao calcular 'Tarifário Personalizado Gás': {e}")
+        emitir_aviso('erro', f"Erro ao calcular 'Tarifário Personalizado Gás': {e}", 'calcular_custo_personalizado_gas')
         return None
     
 def calcular_media_mibgas_datas(df_gwdes, data_inicio, data_fim):
@@ -2795,10 +4051,10 @@ def calcular_media_mibgas_datas(df_gwdes, data_inicio, data_fim):
     Calcula o preço médio do MIBGAS (€/MWh) de um DataFrame GWDES para um período específico.
     VERSÃO ATUALIZADA: Assume que a aba GWDES tem preços DIÁRIOS (coluna 'Data') e não horários ('DataHora').
     
-    data_inicio e data_fim SÃO objetos datetime.date (vindos do st.date_input).
+    data_inicio e data_fim SÃO objetos datetime.date (na app, vindos do st.date_input).
     """
     if df_gwdes.empty:
-        st.warning("A aba 'GWDES' (MIBGAS) está vazia ou não foi carregada.")
+        emitir_aviso('aviso', "A aba 'GWDES' (MIBGAS) está vazia ou não foi carregada.", 'calcular_media_mibgas_datas')
         return 0.0
 
     # --- DEFINIR NOMES DAS COLUNAS ESPERADAS NO EXCEL (NA ABA GWDES) ---
@@ -2808,11 +4064,11 @@ def calcular_media_mibgas_datas(df_gwdes, data_inicio, data_fim):
 
     # Verificar se as colunas necessárias existem
     if coluna_data not in df_gwdes.columns:
-        st.error(f"Erro Crítico: A sua aba 'GWDES' no Excel não tem uma coluna chamada '{coluna_data}'. Não é possível calcular a média MIBGAS.")
+        emitir_aviso('erro', f"Erro Crítico: A sua aba 'GWDES' no Excel não tem uma coluna chamada '{coluna_data}'. Não é possível calcular a média MIBGAS.", 'calcular_media_mibgas_datas')
         return 0.0
     
     if coluna_preco_mibgas not in df_gwdes.columns:
-        st.error(f"Erro Crítico: A sua aba 'GWDES' no Excel não tem uma coluna chamada '{coluna_preco_mibgas}'.")
+        emitir_aviso('erro', f"Erro Crítico: A sua aba 'GWDES' no Excel não tem uma coluna chamada '{coluna_preco_mibgas}'.", 'calcular_media_mibgas_datas')
         return 0.0
 
     try:
@@ -2827,11 +4083,11 @@ def calcular_media_mibgas_datas(df_gwdes, data_inicio, data_fim):
         # 3. Remover linhas onde a conversão falhou
         df_gwdes.dropna(subset=[coluna_data, coluna_preco_mibgas], inplace=True)
         if df_gwdes.empty:
-            st.error("Aba GWDES processada está vazia (verifique formato de datas e preços).")
+            emitir_aviso('erro', "Aba GWDES processada está vazia (verifique formato de datas e preços).", 'calcular_media_mibgas_datas')
             return 0.0
 
     except Exception as e:
-        st.error(f"Erro ao processar dados da aba GWDES: {e}")
+        emitir_aviso('erro', f"Erro ao processar dados da aba GWDES: {e}", 'calcular_media_mibgas_datas')
         return 0.0
 
     # 4. Filtrar o DataFrame. Agora comparamos data com data (ambos são datetime.date).
@@ -2842,14 +4098,14 @@ def calcular_media_mibgas_datas(df_gwdes, data_inicio, data_fim):
     ].copy()
 
     if df_periodo.empty:
-        st.warning(f"Não foram encontrados dados MIBGAS (na aba GWDES) para o período de {data_inicio.strftime('%Y-%m-%d')} a {data_fim.strftime('%Y-%m-%d')}.")
+        emitir_aviso('aviso', f"Não foram encontrados dados MIBGAS (na aba GWDES) para o período de {data_inicio.strftime('%Y-%m-%d')} a {data_fim.strftime('%Y-%m-%d')}.", 'calcular_media_mibgas_datas')
         return 0.0
 
     # 5. Calcular a média e devolver
     media_mibgas = df_periodo[coluna_preco_mibgas].mean()
     
     if pd.isna(media_mibgas) or media_mibgas == 0.0:
-        st.warning("A média MIBGAS calculada é zero ou inválida para o período.")
+        emitir_aviso('aviso', "A média MIBGAS calculada é zero ou inválida para o período.", 'calcular_media_mibgas_datas')
         return 0.0  # Retorna 0.0 para acionar o fallback (Default das Constantes) no script principal
         
     return round(media_mibgas, 2)
\ No newline at end of file
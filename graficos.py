@@ -285,11 +285,14 @@ def gerar_grafico_solar(chart_id, chart_data):
     """
     Gera o código HTML/JS para um gráfico Highcharts de Consumo vs. Produção Solar.
     Usa o tipo 'area' para uma melhor visualização da sobreposição.
+    Opcional: 'rotulo_x' (cabeçalho do tooltip, 'Hora' por omissão) e 'unidade' ('kWh' por omissão).
     """
     # Conversão dos dados Python para JSON, que o JavaScript consegue ler
     categorias_json = json.dumps(chart_data['categorias'])
     series_json = json.dumps(chart_data['series'])
     titulo_grafico = chart_data['titulo']
+    rotulo_x = chart_data.get('rotulo_x', 'Hora')
+    unidade = chart_data.get('unidade', 'kWh')
 
     # Código HTML e JavaScript para o gráfico
     html_code = f"""
@@ -311,13 +314,13 @@ def gerar_grafico_solar(chart_id, chart_data):
                     crosshair: true 
                 }},
                 yAxis: {{
-                    title: {{ text: '(kWh)' }},
+                    title: {{ text: '({unidade})' }},
                     min: 0
                 }},
                 tooltip: {{
                     shared: true,
-                    headerFormat: '<b>Hora: {{point.key}}</b><br>',
-                    pointFormat: '<span style="color:{{series.color}}">●</span> {{series.name}}: <b>{{point.y:.3f}} kWh</b><br/>'
+                    headerFormat: '<b>{rotulo_x}: {{point.key}}</b><br>',
+                    pointFormat: '<span style="color:{{series.color}}">●</span> {{series.name}}: <b>{{point.y:.3f}} {unidade}</b><br/>'
                 }},
                 plotOptions: {{
                     area: {{
@@ -4,17 +4,151 @@ import datetime
 from calendar import monthrange
 import requests
 import io
+import os
+import json
+import threading
+import multiprocessing
+import time
+import logging
+import contextvars
+import contextlib
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+from pandas.tseries.api import guess_datetime_format
+import calculos as calc
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # pyarrow é opcional: sem ele usa-se apenas o CSV
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# --- Avisos dos loaders ---
+# Na thread do script vão diretamente para o Streamlit. Durante uma carga do AtualizadorDados (que pode
+# correr numa thread sem contexto de execução do script) são recolhidos e mostrados depois pela app.
+_avisos_recolhidos = contextvars.ContextVar('avisos_recolhidos', default=None)
+
+def _avisar(nivel, mensagem):
+    """Mostra (st.error/st.warning) ou recolhe um aviso de carregamento de dados."""
+    destino = _avisos_recolhidos.get()
+    if destino is None:
+        getattr(st, nivel)(mensagem)
+        return
+    destino.append((nivel, mensagem))
+    logger.log(logging.ERROR if nivel == 'error' else logging.WARNING, mensagem)
+
+# --- Download condicional (ETag/Last-Modified) com cache em disco ---
+# O último ficheiro descarregado fica guardado em disco com os respetivos validadores HTTP.
+# Nos pedidos seguintes envia-se If-None-Match/If-Modified-Since e, se o servidor responder 304,
+# reutiliza-se o ficheiro local (e o resultado já lido em memória, sem novo parse).
+PASTA_CACHE_HTTP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cache")
+
+# Resultado já lido de cada livro: {(tipo, url): (versao, resultado)}
+_cache_livros_lidos = {}
+_lock_cache_livros_lidos = threading.Lock()
+
+def _caminhos_cache_http(url, pasta_cache):
+    nome_base = hashlib.md5(url.encode('utf-8')).hexdigest()[:16]
+    extensao = os.path.splitext(url.split('?')[0])[1] or '.bin'
+    return os.path.join(pasta_cache, nome_base + extensao), os.path.join(pasta_cache, nome_base + '.json')
+
+def obter_ficheiro_remoto(url, pasta_cache=PASTA_CACHE_HTTP, timeout=60):
+    """
+    Descarrega 'url' de forma condicional e devolve (caminho_local, versao).
+    'versao' é o ETag (ou Last-Modified, ou o hash do conteúdo) e serve de chave para evitar voltar a ler o ficheiro.
+    Se o servidor não estiver acessível mas existir uma cópia local, usa essa cópia (arranque offline).
+    Lança requests.exceptions.RequestException se não houver rede nem cópia local.
+    """
+    caminho_ficheiro, caminho_meta = _caminhos_cache_http(url, pasta_cache)
+    meta = {}
+    if os.path.exists(caminho_ficheiro) and os.path.exists(caminho_meta):
+        try:
+            with open(caminho_meta, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+
+    cabecalhos = {}
+    if meta.get('etag'):
+        cabecalhos['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        cabecalhos['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = requests.get(url, headers=cabecalhos, timeout=timeout)
+        if response.status_code == 304 and meta:
+            return caminho_ficheiro, meta['versao']
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        if meta:
+            # Sem rede: serve a última cópia descarregada
+            return caminho_ficheiro, meta['versao']
+        raise
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    versao = etag or last_modified or hashlib.md5(response.content).hexdigest()
+
+    # Escrita atómica, para que outro processo nunca leia um ficheiro a meio
+    os.makedirs(pasta_cache, exist_ok=True)
+    caminho_temp = f"{caminho_ficheiro}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(caminho_temp, 'wb') as f:
+        f.write(response.content)
+    os.replace(caminho_temp, caminho_ficheiro)
+    caminho_meta_temp = f"{caminho_meta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(caminho_meta_temp, 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'etag': etag, 'last_modified': last_modified, 'versao': versao}, f)
+    os.replace(caminho_meta_temp, caminho_meta)
+
+    return caminho_ficheiro, versao
+
+def _ler_livro_com_cache(tipo, url, ler_livro):
+    """
+    Obtém o livro Excel via obter_ficheiro_remoto e lê-o com 'ler_livro(xls)'.
+    Se a versão não mudou desde a última leitura, devolve o resultado anterior sem novo parse.
+    Caminhos locais (sem http) são lidos diretamente.
+    """
+    if not str(url).lower().startswith(('http://', 'https://')):
+        return ler_livro(pd.ExcelFile(url, engine='calamine'))
+
+    caminho, versao = obter_ficheiro_remoto(url)
+    with _lock_cache_livros_lidos:
+        em_cache = _cache_livros_lidos.get((tipo, url))
+        if em_cache is not None and em_cache[0] == versao:
+            return em_cache[1]
+
+    resultado = ler_livro(pd.ExcelFile(caminho, engine='calamine'))
+    with _lock_cache_livros_lidos:
+        _cache_livros_lidos[(tipo, url)] = (versao, resultado)
+    return resultado
 
 # --- Carregar ficheiro Excel do GitHub ---
 # --- Para simulador de gás
 @st.cache_data(ttl=1800, show_spinner=False) # Cache por 30 minutos (1800 segundos)
 def carregar_dados_excel_gas(url):
-    xls = pd.ExcelFile(url)
+    return ler_dados_excel_gas(url)
+
+def ler_dados_excel_gas(url):
+    """
+    Lê as abas do Excel de gás (sem cache do Streamlit), com o motor 'calamine' e download condicional.
+    """
+    return _ler_livro_com_cache('gas', url, _ler_abas_gas)
+
+def _ler_abas_gas(xls):
     try:
         tarifas_gas_master = xls.parse("Tarifas_Gas_Master")
     except Exception as e:
         # Se a aba não existir, criamos um DataFrame vazio para não quebrar a app
-        st.error(f"Atenção: A aba 'Tarifas_Gas_Master' não foi encontrada no Excel. {e}")
+        _avisar('error', f"Atenção: A aba 'Tarifas_Gas_Master' não foi encontrada no Excel. {e}")
         tarifas_gas_master = pd.DataFrame()
     try:
         tos_municipios = xls.parse("TOS")
@@ -22,17 +156,17 @@ def carregar_dados_excel_gas(url):
         if not tos_municipios.empty:
              tos_municipios.columns = [str(c).strip() for c in tos_municipios.columns]
     except Exception:
-        st.error("Aviso: A aba 'TOS' (Taxa Ocupação Subsolo) não foi encontrada no Excel.")
+        _avisar('error', "Aviso: A aba 'TOS' (Taxa Ocupação Subsolo) não foi encontrada no Excel.")
         tos_municipios = pd.DataFrame()
     try:
         mibgas_df = xls.parse("MIBGAS")
     except Exception:
-        st.warning("Aviso: A aba 'MIBGAS' não foi encontrada no Excel.")
+        _avisar('warning', "Aviso: A aba 'MIBGAS' não foi encontrada no Excel.")
         mibgas_df = pd.DataFrame()
     try:
         info_tab = xls.parse("Info")
     except Exception:
-        st.warning("Aviso: A aba 'Info' não foi encontrada no Excel.")
+        _avisar('warning', "Aviso: A aba 'Info' não foi encontrada no Excel.")
         info_tab = pd.DataFrame()
 
     constantes = xls.parse("Constantes")
@@ -44,22 +178,28 @@ def carregar_dados_excel_gas(url):
 def carregar_dados_excel_elec(url):
     """
     Carrega os dados do ficheiro Excel de eletricidade a partir de um URL.
-    Usa 'requests' para descarregar e o motor 'calamine' para ler de forma robusta.
+    O download é condicional (ETag/Last-Modified) com cópia em disco, e o motor 'calamine' lê o ficheiro.
+    Se o livro não mudou desde a última leitura, reutiliza as tabelas já lidas.
     """
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        excel_file_in_memory = io.BytesIO(response.content)
-        xls = pd.ExcelFile(excel_file_in_memory, engine='calamine')
-        
+        return _ler_livro_com_cache('elec', url, _ler_abas_elec)
     except requests.exceptions.RequestException as e:
-        st.error(f"Erro ao descarregar o ficheiro Excel do GitHub: {e}")
+        _avisar('error', f"Erro ao descarregar o ficheiro Excel do GitHub: {e}")
         return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
 
+def _ler_abas_elec(xls):
     tarifarios_fixos = xls.parse("Tarifarios_fixos")
     tarifarios_indexados = xls.parse("Indexados")
-    omie_perdas_ciclos = xls.parse("OMIE_PERDAS_CICLOS")
+    omie_perdas_ciclos = normalizar_omie_perdas_ciclos(xls.parse("OMIE_PERDAS_CICLOS"))
 
+    constantes = xls.parse("Constantes")
+    return tarifarios_fixos, tarifarios_indexados, omie_perdas_ciclos, constantes
+
+def normalizar_omie_perdas_ciclos(omie_perdas_ciclos):
+    """
+    Limpa os nomes das colunas da aba OMIE_PERDAS_CICLOS e constrói a coluna 'DataHora'
+    a partir de 'Data' + 'Hora' (formato '%m/%d/%Y %H:%M'), removendo linhas inválidas e duplicadas.
+    """
     omie_perdas_ciclos.columns = [str(c).strip() for c in omie_perdas_ciclos.columns]
     
     if 'Data' not in omie_perdas_ciclos.columns and 'DataHora' in omie_perdas_ciclos.columns:
@@ -77,47 +217,609 @@ def carregar_dados_excel_elec(url):
         omie_perdas_ciclos.dropna(subset=['DataHora'], inplace=True)
         omie_perdas_ciclos.drop_duplicates(subset=['DataHora'], keep='first', inplace=True)
     else:
-        st.error("Colunas 'Data' e 'Hora' não encontradas na aba OMIE_PERDAS_CICLOS.")
+        _avisar('error', "Colunas 'Data' e 'Hora' não encontradas na aba OMIE_PERDAS_CICLOS.")
+        return omie_perdas_ciclos
 
-    constantes = xls.parse("Constantes")
-    return tarifarios_fixos, tarifarios_indexados, omie_perdas_ciclos, constantes
+    return compactar_tipos_omie(omie_perdas_ciclos)
+
+def compactar_tipos_omie(omie_perdas_ciclos):
+    """
+    Reduz a memória da tabela OMIE_PERDAS_CICLOS (e de todas as cópias feitas na app):
+    - colunas de ciclo (BD/BS/TD/TS) como categóricas;
+    - 'Perdas' e perfis 'BTN_*' em float32 (o 'OMIE' mantém-se em float64);
+    - remove as colunas de texto 'Data' e 'Hora', redundantes com 'DataHora' (timestamp int64).
+    """
+    if 'DataHora' not in omie_perdas_ciclos.columns:
+        return omie_perdas_ciclos
+
+    # Só converte o que for preciso, para não copiar colunas já compactas (ex.: vistas do memory-map Arrow)
+    df = omie_perdas_ciclos
+    colunas_texto = [c for c in ('Data', 'Hora') if c in df.columns]
+    if colunas_texto:
+        df = df.drop(columns=colunas_texto)
+    if df['DataHora'].dtype != 'datetime64[ns]':
+        df['DataHora'] = df['DataHora'].astype('datetime64[ns]')
+    for coluna in COLUNAS_CICLOS_OMIE:
+        if coluna in df.columns and not isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = df[coluna].astype('category')
+    for coluna in df.columns:
+        if (coluna == 'Perdas' or coluna.startswith('BTN')) and df[coluna].dtype != np.float32:
+            df[coluna] = pd.to_numeric(df[coluna], errors='coerce').astype(np.float32)
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        df = df.reset_index(drop=True)
+    return df
+
+# --- Carregar snapshot local em CSV (data/csv) ---
+# O script 'atualizar_MIBEL_tarifarios.py' exporta cada aba do Excel para data/csv
+# e escreve um manifest.json com o hash do conteúdo de cada CSV.
+PASTA_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "csv")
+ABAS_CSV_ELEC = ["Tarifarios_fixos", "Indexados", "OMIE_PERDAS_CICLOS", "Constantes"]
+# Snapshot Arrow (IPC, sem compressão) da aba OMIE_PERDAS_CICLOS, gerado pelo mesmo script
+FICHEIRO_OMIE_ARROW = "OMIE_PERDAS_CICLOS.arrow"
+COLUNAS_CICLOS_OMIE = ['BD', 'BS', 'TD', 'TS']
+
+# Cache por aba: {aba: (versao, DataFrame, copiar)}. Partilhada entre sessões do mesmo processo.
+_cache_abas_csv = {}
+_lock_cache_abas_csv = threading.Lock()
+
+def ler_manifest_csv(pasta_csv=PASTA_CSV):
+    """
+    Lê o manifest.json da pasta de CSVs e devolve {aba: hash}.
+    Devolve um dicionário vazio se o ficheiro não existir ou for inválido.
+    """
+    caminho_manifest = os.path.join(pasta_csv, "manifest.json")
+    try:
+        with open(caminho_manifest, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _ler_aba_csv(aba, caminho_csv):
+    df = pd.read_csv(caminho_csv, encoding='utf-8-sig')
+    if aba == "OMIE_PERDAS_CICLOS":
+        df.columns = [str(c).strip() for c in df.columns]
+        # O pandas/openpyxl pode exportar 'Data' como '2026-01-31 00:00:00' e 'Hora' como '00:15:00'.
+        # Converte para o formato do Excel ('%m/%d/%Y' e '%H:%M') antes da normalização comum.
+        if 'Data' in df.columns and not df.empty and '/' not in str(df['Data'].iloc[0]):
+            df['Data'] = pd.to_datetime(df['Data'], errors='coerce').dt.strftime('%m/%d/%Y')
+        if 'Hora' in df.columns:
+            df['Hora'] = df['Hora'].astype(str).str.slice(0, 5)
+        df = normalizar_omie_perdas_ciclos(df)
+    elif aba == "Constantes" and 'valor_unitário' in df.columns:
+        # No CSV a coluna mistura números e datas em texto, pelo que é lida toda como texto.
+        # Tal como no Excel, os valores numéricos passam a float e os restantes ficam como estão.
+        valores_numericos = pd.to_numeric(df['valor_unitário'], errors='coerce')
+        df['valor_unitário'] = valores_numericos.astype(object).where(valores_numericos.notna(), df['valor_unitário'])
+    return df
+
+def ler_omie_arrow(caminho_arrow):
+    """
+    Lê o snapshot Arrow da aba OMIE_PERDAS_CICLOS através de memory-map.
+    As colunas numéricas e 'DataHora' (timestamp int64) ficam apontadas para as páginas do ficheiro,
+    que são partilhadas entre todos os processos que o abrem. O resultado é só de leitura.
+    """
+    with pa.memory_map(caminho_arrow, 'r') as origem:
+        tabela = pa_ipc.open_file(origem).read_all()
+    df = tabela.to_pandas(split_blocks=True)
+    del tabela
+    # Ficheiros gerados antes da compactação podem ainda trazer 'Data'/'Hora' ou perfis em float64
+    return compactar_tipos_omie(df)
+
+def _fonte_aba_local(aba, pasta_csv, manifest):
+    """Devolve (caminho, versao, leitor, copiar) para a aba, ou None se não existir localmente."""
+    if aba == "OMIE_PERDAS_CICLOS" and pa is not None:
+        caminho_arrow = os.path.join(pasta_csv, FICHEIRO_OMIE_ARROW)
+        if os.path.exists(caminho_arrow):
+            chave = f"{aba}_arrow"
+            versao = manifest.get(chave) or f"mtime:{os.path.getmtime(caminho_arrow)}"
+            # Sem cópia: os dados são só de leitura e partilhados via memory-map
+            return caminho_arrow, f"arrow:{versao}", ler_omie_arrow, False
+
+    caminho_csv = os.path.join(pasta_csv, f"{aba}.csv")
+    if not os.path.exists(caminho_csv):
+        return None
+    # Sem hash no manifest, usa a data de modificação do ficheiro como versão
+    versao = manifest.get(aba) or f"mtime:{os.path.getmtime(caminho_csv)}"
+    return caminho_csv, f"csv:{versao}", lambda caminho: _ler_aba_csv(aba, caminho), True
+
+def carregar_dados_csv_elec(url_fallback, pasta_csv=PASTA_CSV):
+    """
+    Carrega os dados de eletricidade a partir do snapshot local em CSV (data/csv).
+    Só volta a ler do disco as abas cujo hash no manifest.json mudou desde a última leitura.
+    A aba OMIE_PERDAS_CICLOS é lida do snapshot Arrow (memory-map) quando existe e o pyarrow está instalado.
+    As abas que não existam localmente são obtidas do Excel remoto (carregar_dados_excel_elec).
+    Devolve (tarifarios_fixos, tarifarios_indexados, omie_perdas_ciclos, constantes), tal como o loader do Excel.
+    """
+    manifest = ler_manifest_csv(pasta_csv)
+    dados = {}
+    abas_em_falta = []
+
+    with _lock_cache_abas_csv:
+        for aba in ABAS_CSV_ELEC:
+            fonte = _fonte_aba_local(aba, pasta_csv, manifest)
+            if fonte is None:
+                abas_em_falta.append(aba)
+                continue
+
+            caminho, versao, leitor, copiar = fonte
+            em_cache = _cache_abas_csv.get(aba)
+            if em_cache is None or em_cache[0] != versao:
+                try:
+                    _cache_abas_csv[aba] = (versao, leitor(caminho), copiar)
+                except Exception as e:
+                    nome_ficheiro = os.path.basename(caminho)
+                    if em_cache is None:
+                        _avisar('warning', f"Não foi possível ler '{nome_ficheiro}' ({e}). A usar o ficheiro Excel.")
+                        abas_em_falta.append(aba)
+                        continue
+                    # Mantém a última versão válida em memória
+                    _avisar('warning', f"Não foi possível atualizar '{nome_ficheiro}' ({e}). A usar a versão anterior.")
+            _, df_aba, copiar_aba = _cache_abas_csv[aba]
+            # Cópias, para que alterações feitas pela app não contaminem a cache partilhada
+            dados[aba] = df_aba.copy() if copiar_aba else df_aba
+
+    if abas_em_falta:
+        fixos_xlsx, indexados_xlsx, omie_xlsx, constantes_xlsx = carregar_dados_excel_elec(url_fallback)
+        dados_xlsx = {
+            "Tarifarios_fixos": fixos_xlsx,
+            "Indexados": indexados_xlsx,
+            "OMIE_PERDAS_CICLOS": omie_xlsx,
+            "Constantes": constantes_xlsx,
+        }
+        for aba in abas_em_falta:
+            dados[aba] = dados_xlsx[aba]
+
+    return tuple(dados[aba] for aba in ABAS_CSV_ELEC)
+
+
+
+# --- Índice de somas acumuladas dos dados de mercado (médias de qualquer intervalo de datas) ---
+PERIODOS_CICLOS_OMIE = {'BD': ('V', 'F'), 'BS': ('V', 'F'), 'TD': ('V', 'C', 'P'), 'TS': ('V', 'C', 'P')}
+NS_POR_DIA = 86_400_000_000_000
+
+@dataclass(frozen=True)
+class IndiceMercado:
+    """
+    Somas acumuladas, dia a dia, de OMIE, Perdas e OMIE ponderado por cada perfil BTN, para o total ('S')
+    e para cada ciclo/período ('BD_V', 'TS_P', ...), sobre o eixo de DataHora ordenado.
+    A média de qualquer intervalo sai de dois searchsorted: os dias completos vêm das somas acumuladas
+    e só as horas dos dias das pontas (se o intervalo não começar/acabar à meia-noite) são somadas diretamente.
+    Construído uma vez por versão dos dados (ver DadosElecPartilhados).
+
+    tempos: DataHora em int64 (ns), ordenado; inicios_dias: posição da primeira linha de cada dia (+ total de linhas)
+    valores: série -> valores pela ordem de 'tempos'; mascaras: chave -> linhas desse ciclo/período
+    linhas/somas/validos: chave -> (série ->) acumulados por dia, com len(inicios_dias) posições
+    """
+    tempos: np.ndarray
+    inicios_dias: np.ndarray
+    valores: Mapping
+    mascaras: Mapping
+    linhas: Mapping
+    somas: Mapping
+    validos: Mapping
+    perfis: tuple
+
+    def _direto(self, chave, serie, inicio, fim):
+        valores = self.valores[serie][inicio:fim]
+        mascara = self.mascaras.get(chave)
+        if mascara is not None:
+            valores = valores[mascara[inicio:fim]]
+        validos = ~np.isnan(valores)
+        return len(valores), float(valores[validos].sum()), int(validos.sum())
+
+    def posicoes(self, inicio, fim):
+        """
+        (i, j) tais que as linhas i:j de 'tempos' estão entre inicio e fim (inclusive).
+        A tabela partilhada está pela mesma ordem (ver obter_dados_elec_partilhados): OMIE_PERDAS_CICLOS.iloc[i:j]
+        recorta o período sem máscara nem cópia.
+        """
+        i = int(np.searchsorted(self.tempos, pd.Timestamp(inicio).value, 'left'))
+        j = int(np.searchsorted(self.tempos, pd.Timestamp(fim).value, 'right'))
+        return i, max(i, j)
+
+    def _somas(self, chave, serie, inicio, fim):
+        """(linhas no intervalo, soma, número de valores válidos) de 'serie' nas linhas de 'chave', entre inicio e fim (inclusive)."""
+        if chave not in self.linhas or serie not in self.valores:
+            return 0, 0.0, 0
+        i, j = self.posicoes(inicio, fim)
+        if j <= i:
+            return 0, 0.0, 0
+        dia_i = int(np.searchsorted(self.inicios_dias, i, 'left'))       # primeiro dia que começa dentro do intervalo
+        dia_j = int(np.searchsorted(self.inicios_dias, j, 'right')) - 1  # último dia que começa dentro do intervalo
+        if dia_i >= dia_j:
+            return self._direto(chave, serie, i, j)
+        linhas = int(self.linhas[chave][dia_j] - self.linhas[chave][dia_i])
+        soma = float(self.somas[chave][serie][dia_j] - self.somas[chave][serie][dia_i])
+        validos = int(self.validos[chave][serie][dia_j] - self.validos[chave][serie][dia_i])
+        for a, b in ((i, int(self.inicios_dias[dia_i])), (int(self.inicios_dias[dia_j]), j)):
+            if b > a:
+                linhas_ponta, soma_ponta, validos_ponta = self._direto(chave, serie, a, b)
+                linhas, soma, validos = linhas + linhas_ponta, soma + soma_ponta, validos + validos_ponta
+        return linhas, soma, validos
+
+    def media(self, coluna, inicio, fim, chave='S'):
+        """
+        Média de 'coluna' ('OMIE' ou 'Perdas') entre inicio e fim (inclusive) nas linhas de 'chave'.
+        None se não houver linhas no intervalo; NaN se houver linhas mas nenhum valor (como o .mean() do pandas).
+        """
+        linhas, soma, validos = self._somas(chave, coluna, inicio, fim)
+        if linhas == 0:
+            return None
+        return soma / validos if validos > 0 else np.nan
+
+    def medias_por_ciclo(self, coluna, inicio, fim):
+        """
+        {'S': média, 'BD_V': média, ...} tal como o .mean() total e o groupby(ciclo, observed=True):
+        os períodos sem linhas no intervalo ficam de fora.
+        """
+        medias = {}
+        for chave in self.linhas:
+            media = self.media(coluna, inicio, fim, chave)
+            if media is not None:
+                medias[chave] = media
+        return medias
+
+    def media_omie_ponderada(self, perfil, inicio, fim, chave='S'):
+        """Média do OMIE ponderada pelo perfil BTN indicado (ex: 'BTN_A'); None se não houver pesos no intervalo."""
+        _, soma_omie, _ = self._somas(chave, f"OMIE*{perfil}", inicio, fim)
+        _, soma_pesos, validos = self._somas(chave, f"peso_{perfil}", inicio, fim)
+        if validos == 0 or soma_pesos == 0:
+            return None
+        return soma_omie / soma_pesos
+
+def construir_indice_mercado(omie_perdas_ciclos):
+    """Constrói o IndiceMercado a partir da tabela OMIE_PERDAS_CICLOS (tipicamente já compactada)."""
+    vazio = np.zeros(0, dtype=np.int64)
+    if omie_perdas_ciclos is None or omie_perdas_ciclos.empty or 'DataHora' not in omie_perdas_ciclos.columns:
+        return IndiceMercado(vazio, vazio, MappingProxyType({}), MappingProxyType({}), MappingProxyType({}), MappingProxyType({}), MappingProxyType({}), ())
+
+    df = omie_perdas_ciclos[omie_perdas_ciclos['DataHora'].notna()]
+    tempos = df['DataHora'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    ordem = np.argsort(tempos, kind='stable')
+    tempos = tempos[ordem]
+    dias = tempos // NS_POR_DIA
+    inicios_dias = np.concatenate(([0], np.flatnonzero(np.diff(dias)) + 1, [len(tempos)])) if len(tempos) else np.zeros(1, dtype=np.int64)
+
+    valores = {}
+    for coluna in ('OMIE', 'Perdas'):
+        if coluna in df.columns:
+            valores[coluna] = pd.to_numeric(df[coluna], errors='coerce').to_numpy(dtype=np.float64)[ordem]
+    perfis = tuple(str(c) for c in df.columns if str(c).startswith('BTN'))
+    if 'OMIE' in valores:
+        for perfil in perfis:
+            pesos = pd.to_numeric(df[perfil], errors='coerce').to_numpy(dtype=np.float64)[ordem]
+            pesos = np.where(np.isnan(valores['OMIE']), np.nan, pesos) # Só pesam as horas com OMIE
+            valores[f"peso_{perfil}"] = pesos
+            valores[f"OMIE*{perfil}"] = valores['OMIE'] * pesos
+
+    mascaras = {'S': None}
+    for ciclo, periodos in PERIODOS_CICLOS_OMIE.items():
+        if ciclo not in df.columns:
+            continue
+        valores_ciclo = df[ciclo].astype(object).to_numpy()[ordem]
+        for periodo in periodos:
+            mascara = valores_ciclo == periodo
+            if mascara.any():
+                mascara.setflags(write=False)
+                mascaras[f"{ciclo}_{periodo}"] = mascara
+
+    def acumulado_por_dia(valores_linha):
+        por_dia = np.add.reduceat(valores_linha, inicios_dias[:-1]) if len(valores_linha) else np.zeros(0)
+        return np.concatenate(([0], np.cumsum(por_dia)))
+
+    linhas, somas, validos = {}, {}, {}
+    for chave, mascara in mascaras.items():
+        pertence = np.ones(len(tempos), dtype=bool) if mascara is None else mascara
+        linhas[chave] = acumulado_por_dia(pertence.astype(np.int64))
+        somas[chave], validos[chave] = {}, {}
+        for serie, valores_serie in valores.items():
+            conta = pertence & ~np.isnan(valores_serie)
+            somas[chave][serie] = acumulado_por_dia(np.where(conta, valores_serie, 0.0))
+            validos[chave][serie] = acumulado_por_dia(conta.astype(np.int64))
+        somas[chave], validos[chave] = MappingProxyType(somas[chave]), MappingProxyType(validos[chave])
+
+    for valores_serie in valores.values():
+        valores_serie.setflags(write=False)
+    return IndiceMercado(
+        tempos=tempos, inicios_dias=inicios_dias,
+        valores=MappingProxyType(valores), mascaras=MappingProxyType(mascaras),
+        linhas=MappingProxyType(linhas), somas=MappingProxyType(somas), validos=MappingProxyType(validos),
+        perfis=perfis,
+    )
+
+# --- Conjunto de dados partilhado (só de leitura) por todo o processo ---
+@dataclass(frozen=True)
+class DadosElecPartilhados:
+    """
+    Tabelas de eletricidade construídas uma vez por processo e por versão dos dados.
+    Os arrays NumPy subjacentes estão marcados como só de leitura; 'vistas()' devolve
+    DataFrames novos (cópias superficiais) que partilham esses arrays sem os copiar.
+    'indice_mercado' guarda as somas acumuladas da tabela OMIE_PERDAS_CICLOS (ver IndiceMercado) e
+    'indice_constantes' as Constantes já convertidas (ver calculos.IndiceConstantes).
+    """
+    versao: str
+    tarifarios_fixos: pd.DataFrame
+    tarifarios_indexados: pd.DataFrame
+    omie_perdas_ciclos: pd.DataFrame
+    constantes: pd.DataFrame
+    indice_mercado: IndiceMercado
+    indice_constantes: calc.IndiceConstantes
+
+    def vistas(self):
+        """Devolve (tarifarios_fixos, tarifarios_indexados, omie_perdas_ciclos, constantes) sem copiar os dados."""
+        return (
+            self.tarifarios_fixos.copy(deep=False),
+            self.tarifarios_indexados.copy(deep=False),
+            self.omie_perdas_ciclos.copy(deep=False),
+            self.constantes.copy(deep=False),
+        )
+
+def _ordenar_por_datahora(df):
+    """Sem linhas sem DataHora e ordenado por DataHora (ordem estável), como os 'tempos' do IndiceMercado."""
+    if df is None or 'DataHora' not in df.columns:
+        return df
+    if df['DataHora'].isna().any():
+        df = df[df['DataHora'].notna()]
+    if not df['DataHora'].is_monotonic_increasing:
+        df = df.sort_values('DataHora', kind='stable')
+    return df
+
+def _congelar_dataframe(df):
+    """
+    Reconstrói o DataFrame a partir de arrays NumPy só de leitura (um bloco por coluna).
+    Qualquer escrita acidental nos dados partilhados passa a dar erro em vez de afetar outras sessões.
+    """
+    colunas = {}
+    for coluna in df.columns:
+        valores = df[coluna].to_numpy()
+        if not isinstance(valores, np.ndarray) or not isinstance(df[coluna].dtype, np.dtype):
+            # Tipos de extensão (ex.: categóricos) ficam como estão
+            colunas[coluna] = df[coluna]
+            continue
+        # Os DataFrames recebidos já são cópias próprias (ou vistas do memory-map), por isso não é preciso copiar
+        valores.setflags(write=False)
+        colunas[coluna] = valores
+    return pd.DataFrame(colunas, index=df.index, copy=False)
+
+def versao_dados_elec(pasta_csv=PASTA_CSV):
+    """
+    Token de versão dos dados de eletricidade, derivado do manifest.json.
+    Se alguma aba não existir localmente (e tiver de vir do Excel remoto), o token inclui
+    também a janela de 30 minutos atual, para respeitar o mesmo TTL do loader do Excel.
+    """
+    manifest = ler_manifest_csv(pasta_csv)
+    partes = [f"{aba}={manifest.get(aba, '')}" for aba in sorted(manifest)]
+    if any(_fonte_aba_local(aba, pasta_csv, manifest) is None for aba in ABAS_CSV_ELEC):
+        partes.append(f"xlsx@{int(time.time() // 1800)}")
+    return "|".join(partes)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def obter_dados_elec_partilhados(versao, url_fallback, pasta_csv=PASTA_CSV):
+    """
+    Constrói (uma vez por processo e por 'versao') o conjunto de dados de eletricidade partilhado.
+    O argumento 'versao' (ver versao_dados_elec) serve apenas de chave da cache: quando o manifest muda, é criado um novo conjunto.
+    """
+    tarifarios_fixos, tarifarios_indexados, omie_perdas_ciclos, constantes = carregar_dados_csv_elec(url_fallback, pasta_csv)
+    # Linhas pela ordem do IndiceMercado: os recortes por período são IndiceMercado.posicoes + iloc
+    omie_perdas_ciclos = _ordenar_por_datahora(omie_perdas_ciclos)
+    return DadosElecPartilhados(
+        versao=versao,
+        tarifarios_fixos=_congelar_dataframe(tarifarios_fixos),
+        tarifarios_indexados=_congelar_dataframe(tarifarios_indexados),
+        omie_perdas_ciclos=_congelar_dataframe(omie_perdas_ciclos),
+        constantes=_congelar_dataframe(constantes),
+        indice_mercado=construir_indice_mercado(omie_perdas_ciclos),
+        indice_constantes=calc.construir_indice_constantes(constantes),
+    )
+
+
+# --- Atualização em segundo plano (stale-while-revalidate) ---
+class AtualizadorDados:
+    """
+    Mantém em memória o último conjunto de dados válido e renova-o numa thread em segundo plano.
+    Os pedidos recebem sempre o último snapshot válido ('obter'), sem nunca esperarem por um download
+    ou parse, exceto na primeira carga do processo. A troca do snapshot é atómica.
+
+    carregar(versao) -> conjunto de dados; obter_versao() -> token barato que indica se há dados novos.
+    Os avisos emitidos durante a carga (ver _avisar) ficam em 'avisos', junto com o snapshot, e o erro
+    da última tentativa falhada em 'ultimo_erro': a thread em segundo plano não mostra nada e
+    cabe à app apresentá-los na thread do script.
+    """
+
+    def __init__(self, nome, carregar, obter_versao, intervalo_segundos=300):
+        self.nome = nome
+        self._carregar = carregar
+        self._obter_versao = obter_versao
+        self.intervalo_segundos = intervalo_segundos
+        self._snapshot = None
+        self._versao = None
+        self.avisos = ()
+        self._lock_atualizacao = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        # Métricas para monitorização
+        self.ultima_atualizacao = None
+        self.duracao_ultima_atualizacao = None
+        self.ultima_verificacao = None
+        self.ultimo_erro = None
+        self.numero_atualizacoes = 0
+
+    def obter(self):
+        """
+        Devolve o último snapshot válido. Só bloqueia se ainda não existir nenhum; nesse caso carrega-o sem
+        forçar, para que os pedidos que esperavam pelo mesmo lock reutilizem a carga já feita.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.atualizar()
+            snapshot = self._snapshot
+        return snapshot
+
+    def atualizar(self, forcar=False):
+        """
+        Verifica a versão e, se mudou (ou se 'forcar'), constrói o novo conjunto e troca-o.
+        Em caso de erro mantém o snapshot anterior. Devolve True se o snapshot foi trocado.
+        """
+        with self._lock_atualizacao:
+            self.ultima_verificacao = datetime.datetime.now()
+            try:
+                versao = self._obter_versao()
+                if not forcar and self._snapshot is not None and versao == self._versao:
+                    return False
+                inicio = time.perf_counter()
+                avisos = []
+                token_avisos = _avisos_recolhidos.set(avisos)
+                try:
+                    novo_snapshot = self._carregar(versao)
+                finally:
+                    _avisos_recolhidos.reset(token_avisos)
+                duracao = time.perf_counter() - inicio
+            except Exception as e:
+                self.ultimo_erro = f"{datetime.datetime.now():%d/%m/%Y %H:%M:%S}: {e}"
+                logger.exception("Falha ao atualizar os dados '%s'", self.nome)
+                return False
+
+            # Troca atómica: uma única atribuição de referência
+            self._snapshot = novo_snapshot
+            self._versao = versao
+            self.avisos = tuple(avisos)
+            self.ultima_atualizacao = datetime.datetime.now()
+            self.duracao_ultima_atualizacao = duracao
+            self.ultimo_erro = None
+            self.numero_atualizacoes += 1
+            return True
+
+    def iniciar(self):
+        """Arranca a thread de verificação periódica (uma vez)."""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._ciclo, name=f"atualizador-{self.nome}", daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+
+    def _ciclo(self):
+        while not self._parar.wait(self.intervalo_segundos):
+            self.atualizar()
+
+    def estado(self):
+        """Métricas do atualizador: versão, hora e duração da última atualização, último erro."""
+        return {
+            'nome': self.nome,
+            'versao': self._versao,
+            'ultima_atualizacao': self.ultima_atualizacao,
+            'duracao_ultima_atualizacao_s': self.duracao_ultima_atualizacao,
+            'ultima_verificacao': self.ultima_verificacao,
+            'numero_atualizacoes': self.numero_atualizacoes,
+            'ultimo_erro': self.ultimo_erro,
+        }
+
+@st.cache_resource(show_spinner=False)
+def obter_atualizador_elec(url_fallback, pasta_csv=PASTA_CSV, intervalo_segundos=300):
+    """
+    Atualizador (um por processo) do conjunto de eletricidade partilhado.
+    Verifica o manifest a cada 'intervalo_segundos' e constrói a nova versão fora do caminho dos pedidos.
+    """
+    atualizador = AtualizadorDados(
+        "eletricidade",
+        carregar=lambda versao: obter_dados_elec_partilhados(versao, url_fallback, pasta_csv),
+        obter_versao=lambda: versao_dados_elec(pasta_csv),
+        intervalo_segundos=intervalo_segundos,
+    )
+    return atualizador.iniciar()
 
 
+# --- Colunas de consumo procuradas no cabeçalho dos ficheiros da E-Redes, por ordem de preferência ---
+COLUNAS_PROCURAR_CONSUMO = [
+    'Consumo Simulado (kW)',
+    "Consumo medido na IC, Ativa (kW)",
+    "Consumo registado (kW)",
+    "Consumo registado, Ativa (kW)"
+]
+LINHAS_PROCURA_CABECALHO = 20
 
-def processar_ficheiro_consumos(ficheiro_excel):
+def detetar_cabecalho_consumos(df_bruto, linhas_procura=LINHAS_PROCURA_CABECALHO):
+    """
+    Procura, nas primeiras linhas de uma folha lida sem cabeçalho, a linha que contém uma das
+    COLUNAS_PROCURAR_CONSUMO. Devolve (indice_linha, nome_coluna_consumo) ou (-1, "").
+    """
+    for i, valores in enumerate(df_bruto.head(linhas_procura).itertuples(index=False, name=None)):
+        valores_linha = {str(v).strip() for v in valores}
+        for nome_coluna in COLUNAS_PROCURAR_CONSUMO:
+            if nome_coluna in valores_linha:
+                return i, nome_coluna
+    return -1, ""
+
+def _nomes_colunas_cabecalho(valores_cabecalho):
+    """Nomes de colunas a partir da linha de cabeçalho, com as mesmas regras do read_excel (vazias e duplicadas)."""
+    nomes = []
+    contagem = {}
+    for j, valor in enumerate(valores_cabecalho):
+        nome = str(valor).strip() if pd.notna(valor) else f"Unnamed: {j}"
+        if nome in contagem:
+            contagem[nome] += 1
+            nome = f"{nome}.{contagem[nome]}"
+        else:
+            contagem[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+def construir_datahora_consumos(serie_data, serie_hora):
+    """
+    Constrói o 'DataHora' dos ficheiros da E-Redes de forma vetorizada e aplica a regra de negócio
+    para 00:00 (recua 1 minuto, para o registo ficar no dia a que pertence).
+    - Caminho rápido: 'Data' já é datetime e 'Hora' é convertida diretamente para timedelta.
+    - Caso geral: o formato do texto 'Data Hora' é detetado uma vez (a partir do primeiro valor) e aplicado a toda a coluna.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie_data):
+        datas = serie_data.dt.tz_localize(None) if serie_data.dt.tz is not None else serie_data
+        horas_texto = serie_hora.astype(str).str.strip()
+        # '00:15' -> '00:15:00' para o to_timedelta
+        horas_texto = horas_texto.where(horas_texto.str.len() != 5, horas_texto + ':00')
+        horas = pd.to_timedelta(horas_texto, errors='coerce')
+        # Datas com componente horária não são válidas (como na concatenação de texto original)
+        data_hora = (datas + horas).where(datas == datas.dt.normalize())
+    else:
+        texto = serie_data.astype(str) + ' ' + serie_hora.astype(str)
+        primeiro_valor = texto[serie_data.notna() & serie_hora.notna()].head(1)
+        formato = guess_datetime_format(primeiro_valor.iloc[0]) if not primeiro_valor.empty else None
+        if formato:
+            data_hora = pd.to_datetime(texto, format=formato, errors='coerce')
+        else:
+            data_hora = pd.to_datetime(texto, errors='coerce')
+        if data_hora.dt.tz is not None:
+            data_hora = data_hora.dt.tz_localize(None)
+
+    # Ajuste para o timestamp 00:00 (lógica existente mantida), com máscara em vez de apply por linha
+    mascara_meia_noite = data_hora == data_hora.dt.normalize()
+    return data_hora.mask(mascara_meia_noite, data_hora - pd.Timedelta(minutes=1))
+
+def processar_ficheiro_consumos(ficheiro_excel, max_registos=None):
     """
     Lê um ficheiro Excel da E-Redes, com deteção de cabeçalho e ajuste de tempo preciso
     para alinhar com os timestamps do ficheiro OMIE, aplicando a regra de negócio para 00:00.
     Agora suporta múltiplos nomes para a coluna de consumo e potência.
+    O livro é lido uma única vez (motor 'calamine'): o cabeçalho é detetado nas primeiras linhas
+    dessa mesma leitura e os dados são recortados da folha já em memória.
+    Com 'max_registos', uma folha com mais linhas de dados é rejeitada logo após a leitura, antes do tratamento.
     """
     try:
-        df_temp = pd.read_excel(ficheiro_excel, header=None, nrows=20)
-        header_row_index = -1
-        coluna_consumo_kw = ""
-        
-        # --- Procurar por uma lista de colunas na ordem desejada ---
-        colunas_procurar_consumo = [
-            'Consumo Simulado (kW)',
-            "Consumo medido na IC, Ativa (kW)",
-            "Consumo registado (kW)",
-            "Consumo registado, Ativa (kW)"
-        ]
-
-        for i, row in df_temp.iterrows():
-            row_values = [str(v).strip() for v in row.values]
-            for nome_coluna in colunas_procurar_consumo:
-                if nome_coluna in row_values:
-                    header_row_index = i
-                    coluna_consumo_kw = nome_coluna
-                    break  # Sai do loop interno assim que encontra uma correspondência
-            if coluna_consumo_kw:
-                break # Sai do loop externo se já encontrou a coluna
+        df_bruto = pd.read_excel(ficheiro_excel, header=None, engine='calamine')
+        header_row_index, coluna_consumo_kw = detetar_cabecalho_consumos(df_bruto)
 
         if header_row_index == -1:
             return None, "Não foi possível encontrar uma linha de cabeçalho com colunas de consumo conhecidas."
+        if max_registos is not None and len(df_bruto) - header_row_index - 1 > max_registos:
+            return None, mensagem_excesso_registos(max_registos)
 
-        df = pd.read_excel(ficheiro_excel, header=header_row_index)
-        df.columns = [str(c).strip() for c in df.columns]
+        df = df_bruto.iloc[header_row_index + 1:].reset_index(drop=True)
+        df.columns = _nomes_colunas_cabecalho(df_bruto.iloc[header_row_index].values)
+        # Sem cabeçalho, as colunas vêm como 'object'; recupera os tipos (datas, números) como o read_excel faria
+        df = df.infer_objects()
         
         df['Consumo (kWh)'] = pd.to_numeric(df[coluna_consumo_kw], errors='coerce') / 4.0
 
@@ -132,15 +834,7 @@ def processar_ficheiro_consumos(ficheiro_excel):
 
         df.dropna(subset=[coluna_consumo_kw], inplace=True)
 
-        df['DataHora'] = pd.to_datetime(
-            df['Data'].astype(str) + ' ' + df['Hora'].astype(str),
-            errors='coerce'
-        ).dt.tz_localize(None)
-
-        # Ajuste para o timestamp 00:00 (lógica existente mantida)
-        df['DataHora'] = df['DataHora'].apply(
-            lambda ts: ts - pd.Timedelta(minutes=1) if ts.time() == datetime.time(0, 0) else ts
-        )
+        df['DataHora'] = construir_datahora_consumos(df['Data'], df['Hora'])
         
         df.dropna(subset=['DataHora', 'Consumo (kWh)'], inplace=True)
 
@@ -148,11 +842,84 @@ def processar_ficheiro_consumos(ficheiro_excel):
     except Exception as e:
         return None, f"Erro ao processar ficheiro: {e}"
 
-def validar_e_juntar_ficheiros(lista_de_ficheiros):
+# --- Leitura paralela de vários ficheiros da E-Redes ---
+# Número máximo de processos usados para ler ficheiros em simultâneo, em TODO o processo do servidor
+# (partilhado por todas as sessões e ingestões), para não esgotar a memória
+MAX_PROCESSOS_FICHEIROS = max(1, min(4, os.cpu_count() or 1))
+
+def _contexto_processos_ficheiros():
+    """
+    'forkserver' (ou 'spawn' onde não existe): o servidor do Streamlit tem várias threads,
+    e um 'fork' copiaria o estado delas (incluindo locks ocupados) para os processos auxiliares.
+    """
+    metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(metodo)
+
+@st.cache_resource(show_spinner=False)
+def obter_pool_processos_ficheiros():
+    """Pool de processos único por processo do servidor, com MAX_PROCESSOS_FICHEIROS workers no total."""
+    return ProcessPoolExecutor(max_workers=MAX_PROCESSOS_FICHEIROS, mp_context=_contexto_processos_ficheiros())
+
+def _processar_conteudo_ficheiro(conteudo, max_registos=None):
+    """Função executada nos processos auxiliares: lê o ficheiro a partir dos bytes."""
+    return processar_ficheiro_consumos(io.BytesIO(conteudo), max_registos)
+
+def _ler_conteudo_ficheiro(ficheiro):
+    """Bytes do ficheiro; os ficheiros já em memória (UploadedFile, FicheiroEmMemoria) não são copiados."""
+    if isinstance(ficheiro, (bytes, bytearray)):
+        return bytes(ficheiro)
+    if hasattr(ficheiro, 'getvalue'):
+        return ficheiro.getvalue()
+    if hasattr(ficheiro, 'read'):
+        ficheiro.seek(0)
+        return ficheiro.read()
+    with open(ficheiro, 'rb') as f:
+        return f.read()
+
+def iterar_ficheiros_consumos(lista_de_ficheiros, paralelo=None, max_registos=None):
+    """
+    Lê vários ficheiros da E-Redes e produz (df, erro) para cada um, pela ordem recebida.
+    Com mais de um ficheiro (ou 'paralelo=True'), as leituras são submetidas ao pool partilhado
+    (obter_pool_processos_ficheiros); se o pool não puder ser usado, faz a leitura sequencial
+    e o pool é recriado no pedido seguinte. Fechar o gerador cancela as leituras ainda por começar.
+    """
+    if paralelo is None:
+        paralelo = len(lista_de_ficheiros) > 1 and MAX_PROCESSOS_FICHEIROS > 1
+    conteudos = [_ler_conteudo_ficheiro(ficheiro) for ficheiro in lista_de_ficheiros]
+    if not paralelo:
+        for conteudo in conteudos:
+            yield _processar_conteudo_ficheiro(conteudo, max_registos)
+        return
+
+    try:
+        futures = [obter_pool_processos_ficheiros().submit(_processar_conteudo_ficheiro, conteudo, max_registos) for conteudo in conteudos]
+    except (BrokenProcessPool, OSError, RuntimeError):
+        obter_pool_processos_ficheiros.clear()
+        futures = []
+    try:
+        for i, conteudo in enumerate(conteudos):
+            try:
+                resultado = futures[i].result() if futures else None
+            except (BrokenProcessPool, OSError, pickle.PicklingError):
+                obter_pool_processos_ficheiros.clear()
+                futures = []
+                resultado = None
+            yield resultado if resultado is not None else _processar_conteudo_ficheiro(conteudo, max_registos)
+    finally:
+        for future in futures:
+            future.cancel()
+
+def processar_varios_ficheiros_consumos(lista_de_ficheiros, paralelo=None):
+    """Lê vários ficheiros da E-Redes e devolve a lista [(df, erro), ...] pela ordem recebida."""
+    return list(iterar_ficheiros_consumos(lista_de_ficheiros, paralelo=paralelo))
+
+def validar_e_juntar_ficheiros(lista_de_ficheiros, paralelo=None, max_registos=None):
     """
     Processa uma lista de ficheiros da E-Redes, junta os dados, e filtra para incluir
     apenas registos a partir de 01/10/2024, alertando o utilizador se dados mais
     antigos foram ignorados (Lógica Robusta).
+    Com vários ficheiros, a leitura é feita em paralelo (ver iterar_ficheiros_consumos).
+    Com 'max_registos', a leitura pára (e as restantes são canceladas) assim que o total o ultrapassa.
     """
     if not lista_de_ficheiros:
         return None, "Nenhum ficheiro carregado."
@@ -162,39 +929,46 @@ def validar_e_juntar_ficheiros(lista_de_ficheiros):
     
     data_limite_dt = pd.to_datetime('2024-10-01')
     dados_antigos_encontrados = False # Flag para o aviso
+    total_registos = 0
 
-    for ficheiro in lista_de_ficheiros:
-        df_individual, erro = processar_ficheiro_consumos(ficheiro)
-        if erro:
-            return None, f"Erro ao processar o ficheiro '{ficheiro.name}': {erro}"
-        
-        if df_individual.empty:
-            continue
+    resultados_leitura = iterar_ficheiros_consumos(lista_de_ficheiros, paralelo=paralelo, max_registos=max_registos)
+    with contextlib.closing(resultados_leitura):
+        for ficheiro, (df_individual, erro) in zip(lista_de_ficheiros, resultados_leitura):
+            if erro:
+                return None, f"Erro ao processar o ficheiro '{ficheiro.name}': {erro}"
+            
+            if df_individual.empty:
+                continue
 
-        # --- ALTERAÇÃO PRINCIPAL: Lógica de deteção por contagem de linhas ---
-        
-        # 1. Contar linhas ANTES de filtrar
-        linhas_antes = len(df_individual)
-        
-        # 2. Aplicar o filtro de data
-        df_filtrado = df_individual[df_individual['DataHora'] >= data_limite_dt].copy()
-        
-        # 3. Contar linhas DEPOIS de filtrar
-        linhas_depois = len(df_filtrado)
-        
-        # 4. Se o número de linhas diminuiu, sabemos que dados antigos foram ignorados.
-        if linhas_antes > linhas_depois:
-            dados_antigos_encontrados = True
+            # --- ALTERAÇÃO PRINCIPAL: Lógica de deteção por contagem de linhas ---
+            
+            # 1. Contar linhas ANTES de filtrar
+            linhas_antes = len(df_individual)
+            
+            # 2. Aplicar o filtro de data
+            df_filtrado = df_individual[df_individual['DataHora'] >= data_limite_dt].copy()
+            
+            # 3. Contar linhas DEPOIS de filtrar
+            linhas_depois = len(df_filtrado)
+            
+            # 4. Se o número de linhas diminuiu, sabemos que dados antigos foram ignorados.
+            if linhas_antes > linhas_depois:
+                dados_antigos_encontrados = True
 
-        # Se o ficheiro ficar vazio após a filtragem, simplesmente ignoramo-lo.
-        if df_filtrado.empty:
-            continue
+            # Se o ficheiro ficar vazio após a filtragem, simplesmente ignoramo-lo.
+            if df_filtrado.empty:
+                continue
+
+            # Limite de registos: pára a leitura sem esperar pelos restantes ficheiros
+            total_registos += linhas_depois
+            if max_registos is not None and total_registos > max_registos:
+                return None, mensagem_excesso_registos(max_registos)
 
-        # A partir daqui, trabalhamos apenas com o df_filtrado
-        dataframes_processados.append(df_filtrado)
-        min_data = df_filtrado['DataHora'].min()
-        max_data = df_filtrado['DataHora'].max()
-        intervalos_de_datas.append((min_data, max_data))
+            # A partir daqui, trabalhamos apenas com o df_filtrado
+            dataframes_processados.append(df_filtrado)
+            min_data = df_filtrado['DataHora'].min()
+            max_data = df_filtrado['DataHora'].max()
+            intervalos_de_datas.append((min_data, max_data))
 
     if not dataframes_processados:
         return None, "Nenhum dos ficheiros continha dados válidos a partir de 01/10/2024."
@@ -217,6 +991,115 @@ def validar_e_juntar_ficheiros(lista_de_ficheiros):
 
     return df_final_combinado, mensagem_retorno
 
+# --- Pipeline de ingestão dos diagramas de carga (uploads) ---
+# Limites por carregamento: ficheiros maiores são rejeitados antes de serem lidos,
+# e a leitura pára assim que o número de registos ultrapassa MAX_REGISTOS_DIAGRAMA.
+TAMANHO_MAXIMO_FICHEIRO_MB = 10
+TAMANHO_MAXIMO_TOTAL_MB = 30
+MAX_REGISTOS_DIAGRAMA = 4 * 24 * 366 * 3  # ~3 anos de registos quarto-horários
+MAX_INGESTOES_SIMULTANEAS = 2
+
+def mensagem_excesso_registos(max_registos):
+    return f"O diagrama carregado tem demasiados registos (mais de {max_registos}). Carregue no máximo 3 anos de dados."
+
+class FicheiroEmMemoria:
+    """Conteúdo de um ficheiro carregado, com o nome original; guarda a referência aos bytes, sem os copiar."""
+    __slots__ = ('name', 'size', '_conteudo')
+
+    def __init__(self, nome, conteudo):
+        self.name = nome
+        self.size = len(conteudo)
+        self._conteudo = conteudo
+
+    def getvalue(self):
+        return self._conteudo
+
+def validar_tamanho_ficheiros(lista_de_ficheiros):
+    """Devolve uma mensagem de erro se algum ficheiro (ou o total) exceder os limites; caso contrário None."""
+    tamanho_total = 0
+    for ficheiro in lista_de_ficheiros:
+        tamanho = getattr(ficheiro, 'size', None)
+        if tamanho is None:
+            tamanho = len(ficheiro.getvalue())
+        if tamanho > TAMANHO_MAXIMO_FICHEIRO_MB * 1024 * 1024:
+            return f"O ficheiro '{ficheiro.name}' excede o tamanho máximo de {TAMANHO_MAXIMO_FICHEIRO_MB} MB."
+        tamanho_total += tamanho
+    if tamanho_total > TAMANHO_MAXIMO_TOTAL_MB * 1024 * 1024:
+        return f"O conjunto de ficheiros excede o tamanho máximo de {TAMANHO_MAXIMO_TOTAL_MB} MB."
+    return None
+
+def ler_ficheiros_com_chave(lista_de_ficheiros):
+    """
+    Lê cada ficheiro uma única vez e, na mesma passagem, calcula a chave (SHA-256) do conjunto,
+    independente dos nomes. Devolve ([FicheiroEmMemoria, ...], chave).
+    """
+    h = hashlib.sha256()
+    ficheiros = []
+    for ficheiro in lista_de_ficheiros:
+        conteudo = _ler_conteudo_ficheiro(ficheiro)
+        h.update(len(conteudo).to_bytes(8, 'little'))
+        h.update(conteudo)
+        ficheiros.append(FicheiroEmMemoria(ficheiro.name, conteudo))
+    return ficheiros, h.hexdigest()
+
+class PipelineIngestaoDiagramas:
+    """
+    Processa os diagramas de carga fora da thread do script, num número limitado de workers
+    (MAX_INGESTOES_SIMULTANEAS), para que um carregamento grande não bloqueie as outras sessões.
+    Os resultados ficam em cache (LRU) pela chave do conteúdo, e pedidos iguais em curso são partilhados.
+    """
+
+    def __init__(self, max_ingestoes_simultaneas=MAX_INGESTOES_SIMULTANEAS, max_resultados_cache=16):
+        self._executor = ThreadPoolExecutor(max_workers=max_ingestoes_simultaneas, thread_name_prefix="ingestao-diagramas")
+        self._max_resultados_cache = max_resultados_cache
+        self._resultados = OrderedDict()
+        self._em_curso = {}
+        self._lock = threading.Lock()
+
+    def submeter(self, lista_de_ficheiros):
+        """
+        Valida os limites, calcula a chave do conteúdo e agenda a leitura.
+        Devolve (chave, future); o future tem como resultado (df_combinado, mensagem) tal como validar_e_juntar_ficheiros.
+        """
+        erro_tamanho = validar_tamanho_ficheiros(lista_de_ficheiros)
+        if erro_tamanho:
+            return None, _future_concluido((None, erro_tamanho))
+
+        ficheiros, chave = ler_ficheiros_com_chave(lista_de_ficheiros)
+
+        with self._lock:
+            if chave in self._resultados:
+                self._resultados.move_to_end(chave)
+                return chave, _future_concluido(self._resultados[chave])
+            if chave in self._em_curso:
+                return chave, self._em_curso[chave]
+            future = self._executor.submit(self._processar, chave, ficheiros)
+            self._em_curso[chave] = future
+            return chave, future
+
+    def _processar(self, chave, ficheiros):
+        try:
+            resultado = validar_e_juntar_ficheiros(ficheiros, max_registos=MAX_REGISTOS_DIAGRAMA)
+            with self._lock:
+                self._resultados[chave] = resultado
+                self._resultados.move_to_end(chave)
+                while len(self._resultados) > self._max_resultados_cache:
+                    self._resultados.popitem(last=False)
+            return resultado
+        finally:
+            with self._lock:
+                self._em_curso.pop(chave, None)
+
+def _future_concluido(resultado):
+    future = Future()
+    future.set_result(resultado)
+    return future
+
+@st.cache_resource(show_spinner=False)
+def obter_pipeline_ingestao_diagramas():
+    """Pipeline de ingestão partilhado por todas as sessões do processo."""
+    return PipelineIngestaoDiagramas()
+
 def agregar_consumos_por_periodo(df_consumos, df_omie_ciclos):
     if df_consumos is None or df_consumos.empty: return {}
 
@@ -226,16 +1109,19 @@ def agregar_consumos_por_periodo(df_consumos, df_omie_ciclos):
     
     for ciclo in ['BD', 'BS', 'TD', 'TS']:
         if ciclo in df_merged.columns:
+            if isinstance(df_merged[ciclo].dtype, pd.CategoricalDtype):
+                df_merged[ciclo] = df_merged[ciclo].cat.add_categories('Desconhecido')
             df_merged[ciclo] = df_merged[ciclo].fillna('Desconhecido')
-            soma_por_periodo = df_merged.groupby(ciclo)['Consumo (kWh)'].sum().to_dict()
+            soma_por_periodo = df_merged.groupby(ciclo, observed=True)['Consumo (kWh)'].sum().to_dict()
             consumos_agregados[ciclo] = soma_por_periodo
             
     return consumos_agregados
 
-def calcular_medias_omie_para_todos_ciclos(df_consumos_periodo, df_omie_completo):
+def calcular_medias_omie_para_todos_ciclos(df_consumos_periodo, df_omie_completo, indice_mercado=None):
     """
     Calcula as médias OMIE para todos os ciclos, com base no intervalo de datas
     do dataframe de consumos fornecido.
+    Com o IndiceMercado dos mesmos dados, as médias saem das somas acumuladas sem filtrar a tabela.
     """
     if df_consumos_periodo.empty:
         return {}
@@ -243,6 +1129,9 @@ def calcular_medias_omie_para_todos_ciclos(df_consumos_periodo, df_omie_completo
     min_date = df_consumos_periodo['DataHora'].min()
     max_date = df_consumos_periodo['DataHora'].max()
     
+    if indice_mercado is not None:
+        return indice_mercado.medias_por_ciclo('OMIE', min_date, max_date)
+
     df_omie_filtrado = df_omie_completo[
         (df_omie_completo['DataHora'] >= min_date) & 
         (df_omie_completo['DataHora'] <= max_date)
@@ -254,7 +1143,7 @@ def calcular_medias_omie_para_todos_ciclos(df_consumos_periodo, df_omie_completo
     omie_medios = {'S': df_omie_filtrado['OMIE'].mean()}
     for ciclo in ['BD', 'BS', 'TD', 'TS']:
         if ciclo in df_omie_filtrado.columns:
-            agrupado = df_omie_filtrado.groupby(ciclo)['OMIE'].mean()
+            agrupado = df_omie_filtrado.groupby(ciclo, observed=True)['OMIE'].mean()
             for periodo, media in agrupado.items():
                 omie_medios[f"{ciclo}_{periodo}"] = media
     return omie_medios
@@ -24,10 +24,53 @@ FICHEIRO_MIBEL_CSV = "data/MIBEL_ano_atual_ACUM.csv"
 PASTA_CSV = "data/csv"
 ABAS_PARA_CSV = ["Constantes", "Tarifarios_fixos", "Indexados", "OMIE_PERDAS_CICLOS"]
 
+# Snapshot binário (Arrow IPC, sem compressão) da aba OMIE_PERDAS_CICLOS, para memory-map no simulador
+FICHEIRO_OMIE_ARROW = "OMIE_PERDAS_CICLOS.arrow"
+COLUNAS_CICLOS_OMIE = ["BD", "BS", "TD", "TS"]
+
 print(f"ℹ️ Fonte de dados: '{FICHEIRO_MIBEL_CSV}'")
 print("⚠️ Dados OMIE e futuros")
 # ===================================================================
 
+def exportar_omie_arrow(df_omie, caminho_arrow):
+    """
+    Exporta a aba OMIE_PERDAS_CICLOS para um ficheiro Arrow IPC tipado:
+    'DataHora' como timestamp int64, colunas de ciclo (BD/BS/TD/TS) como categóricas e 'Perdas'/'BTN_*' em float32
+    (os mesmos tipos que o simulador usa em memória). As colunas de texto 'Data'/'Hora' não são exportadas.
+    O ficheiro é escrito sem compressão para poder ser mapeado em memória pelo simulador.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    df = df_omie.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+
+    if 'Data' in df.columns and 'Hora' in df.columns:
+        # 'Data' pode vir como texto '%m/%d/%Y' ou já como datetime; 'Hora' como '00:15' ou time(0, 15)
+        datas = pd.to_datetime(df['Data'], format='mixed', errors='coerce')
+        horas = df['Hora'].astype(str).str.slice(0, 5)
+        df['Data'] = datas.dt.strftime('%m/%d/%Y')
+        df['Hora'] = horas
+        df['DataHora'] = pd.to_datetime(df['Data'] + ' ' + horas, format='%m/%d/%Y %H:%M', errors='coerce')
+    else:
+        df['DataHora'] = pd.to_datetime(df['DataHora'], errors='coerce')
+        df['Data'] = df['DataHora'].dt.strftime('%m/%d/%Y')
+        df['Hora'] = df['DataHora'].dt.strftime('%H:%M')
+
+    df = df.dropna(subset=['DataHora']).drop_duplicates(subset=['DataHora'], keep='first')
+    df = df.drop(columns=['Data', 'Hora'])
+    df['DataHora'] = df['DataHora'].astype('datetime64[ns]')
+    for coluna in COLUNAS_CICLOS_OMIE:
+        if coluna in df.columns:
+            df[coluna] = df[coluna].astype('category')
+    for coluna in df.columns:
+        if coluna == 'Perdas' or coluna.startswith('BTN'):
+            df[coluna] = pd.to_numeric(df[coluna], errors='coerce').astype(np.float32)
+
+    tabela = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    feather.write_feather(tabela, caminho_arrow, compression='uncompressed')
+    return len(df)
+
 def run_update_process():
     """
     Função principal que encapsula todo o processo de ETL.
@@ -348,6 +391,17 @@ def run_update_process():
                 print(f"   ✅ {aba}.csv ({len(df_aba)} registos) [{manifest[aba]}]")
             except Exception as e:
                 print(f"   ❌ Falha ao exportar '{aba}': {e}")
+                continue
+
+            if aba == "OMIE_PERDAS_CICLOS":
+                try:
+                    arrow_path = os.path.join(PASTA_CSV, FICHEIRO_OMIE_ARROW)
+                    n_registos = exportar_omie_arrow(df_aba, arrow_path)
+                    with open(arrow_path, 'rb') as f:
+                        manifest[f"{aba}_arrow"] = hashlib.md5(f.read()).hexdigest()[:8]
+                    print(f"   ✅ {FICHEIRO_OMIE_ARROW} ({n_registos} registos) [{manifest[f'{aba}_arrow']}]")
+                except Exception as e:
+                    print(f"   ❌ Falha ao exportar '{FICHEIRO_OMIE_ARROW}': {e}")
 
         # Gerar manifest.json para validação de cache no simulador
         manifest_path = os.path.join(PASTA_CSV, "manifest.json")